@@ -0,0 +1,310 @@
+"""
+Analytic model of the MAIA tracker barrels for fast layout scans.
+
+A layout is a list of doublets, the equivalent of the barrel layers in the k4geo
+InnerTracker/OuterTracker xmls:
+    system: 3 (inner tracker) or 5 (outer tracker)
+    radius: radius of the lower (even) modules of the first layer of the doublet [mm]
+    nphi: number of module pairs in phi. Modules alternate between radius and radius + stagger,
+          like -_-_-_- in phi, so each layer has 2 * nphi modules
+    stagger: radial offset of the odd modules [mm]
+    module_width: width of a module in r-phi [mm]
+    sensor_length: length of a sensor along z [mm]
+    n_sensors: number of sensors along z per module
+    doublet_gap: radial distance between the two layers of the doublet [mm]
+    phi0: phi of module 0 [rad]
+
+Every sensor is generated vectorized, with its origin, u (r-phi), v (z) and normal
+vectors, corners and cellID, in the format of geometry_table.py.
+Tracks are intersected with the sensors in batches: for every track and layer, only the
+modules and sensors next to the crossing point are tested, and helices are intersected
+with the sensor planes analytically (circle-line intersection in x-y).
+
+Usage:
+    geo = BarrelGeometry(LAYOUTS["v07"]["inner"], tag="v07")
+    tracks = make_tracks(10000, pt=(1.0, 10.0), eta=(-0.5, 0.5))
+    hits = geo.intersect(tracks)
+    print(hermeticity(hits, len(tracks["pt"])), doublet_acceptance(hits, len(tracks["pt"])))
+"""
+
+import numpy as np
+import pandas as pd
+
+from cellid import get_codec
+from geometry_table import CM_TO_MM, geometry_frame
+
+INNER_TRACKER_BARREL = 3
+OUTER_TRACKER_BARREL = 5
+BFIELD = 5.0 # T
+GEV_TO_MM = 1000.0 / 0.299792458 # R [mm] = pt [GeV] / B [T] * GEV_TO_MM
+TWOPI = 2.0 * np.pi
+LAYOUT_KEYS = ["system", "radius", "nphi", "stagger", "module_width", "sensor_length", "n_sensors", "doublet_gap", "phi0"]
+
+
+def doublet(system: int, radius: float, nphi: int, stagger: float, module_width: float,
+            sensor_length: float = None, n_sensors: int = 1, doublet_gap: float = 2.0, phi0: float = 0.0) -> dict:
+    return {
+        "system": system,
+        "radius": radius,
+        "nphi": nphi,
+        "stagger": stagger,
+        "module_width": module_width,
+        "sensor_length": module_width if sensor_length is None else sensor_length,
+        "n_sensors": n_sensors,
+        "doublet_gap": doublet_gap,
+        "phi0": phi0,
+    }
+
+
+# radii, nphi and staggers of n_phi_modules. z extents are approximate: square sensors,
+# covering about |z| < 480 mm (inner tracker) and |z| < 1260 mm (outer tracker)
+LAYOUTS = {
+    version: {
+        "inner": [doublet(INNER_TRACKER_BARREL, radius, nphi, stagger, 30.1, n_sensors=32)
+                  for radius, nphi in zip(inner_radii, [15, 30, 46, 62])],
+        "outer": [doublet(OUTER_TRACKER_BARREL, radius, nphi, stagger, 60.2, n_sensors=42)
+                  for radius, nphi in zip(outer_radii, [48, 60, 72, 84])],
+    }
+    for version, inner_radii, outer_radii, stagger in [
+        ("v05", [127.0, 268.0, 409.0, 550.0], [819.0, 1028.0, 1237.0, 1446.0], 4.0),
+        ("v07", [127.0, 265.333, 403.666, 550.0], [819.0, 1025.333, 1231.666, 1438.0], 8.0),
+    ]
+}
+
+
+class BarrelGeometry:
+
+    def __init__(self, layout: list[dict], tag: str = "v07"):
+        self.layout = pd.DataFrame(layout, columns=LAYOUT_KEYS)
+        self.tag = tag
+        self.make_layers()
+        self.make_sensors()
+
+
+    def __len__(self):
+        return len(self.sensor_id)
+
+
+    def make_layers(self):
+        """One row per layer: the two layers of every doublet, numbered 0, 1, 2, ... per system."""
+        doublets = self.layout.loc[self.layout.index.repeat(2)].reset_index(drop=True)
+        doublets["upper"] = np.tile([0, 1], len(self.layout))
+        doublets["layer"] = doublets.groupby("system").cumcount()
+        doublets["radius"] = doublets["radius"] + doublets["upper"] * doublets["doublet_gap"]
+        doublets["n_modules"] = 2 * doublets["nphi"]
+        doublets["dphi"] = TWOPI / doublets["n_modules"]
+        doublets["half_length"] = doublets["n_sensors"] * doublets["sensor_length"] / 2.0
+        # the first sensor of each layer, in the flat sensor arrays
+        doublets["offset"] = np.concatenate([[0], np.cumsum(doublets["n_modules"] * doublets["n_sensors"])[:-1]])
+        self.layers = doublets
+
+
+    def make_sensors(self):
+        layers = self.layers
+        n_per_layer = (layers["n_modules"] * layers["n_sensors"]).to_numpy()
+        i_layer = np.repeat(np.arange(len(layers)), n_per_layer)
+        local = np.arange(n_per_layer.sum()) - np.repeat(layers["offset"].to_numpy(), n_per_layer)
+        n_sensors = layers["n_sensors"].to_numpy()[i_layer]
+        module = local // n_sensors
+        sensor = local % n_sensors
+
+        def per_sensor(col):
+            return layers[col].to_numpy()[i_layer]
+
+        phi = per_sensor("phi0") + module * per_sensor("dphi")
+        radius = per_sensor("radius") + (module % 2) * per_sensor("stagger")
+        z = (sensor - (n_sensors - 1) / 2.0) * per_sensor("sensor_length")
+
+        self.i_layer = i_layer
+        self.system = per_sensor("system")
+        self.layer = per_sensor("layer")
+        self.module = module
+        self.sensor = sensor
+        self.normal = np.stack([np.cos(phi), np.sin(phi), np.zeros_like(phi)], axis=1)
+        self.u = np.stack([-np.sin(phi), np.cos(phi), np.zeros_like(phi)], axis=1)
+        self.v = np.tile([0.0, 0.0, 1.0], (len(phi), 1))
+        self.origin = radius[:, None] * self.normal + z[:, None] * self.v
+        self.width = per_sensor("module_width")
+        self.length = per_sensor("sensor_length")
+        self.sensor_id = get_codec(self.tag).encode(system=self.system, side=0, layer=self.layer, module=module, sensor=sensor)
+
+
+    def frame(self) -> pd.DataFrame:
+        """Geometry table with the columns of geometry_table.py."""
+        surfaces = {
+            "id": self.sensor_id,
+            "origin": self.origin / CM_TO_MM,
+            "u": self.u,
+            "v": self.v,
+            "normal": self.normal,
+            "length_u": self.width / CM_TO_MM,
+            "length_v": self.length / CM_TO_MM,
+        }
+        return geometry_frame(surfaces, self.tag)
+
+
+    def phi_coverage(self) -> pd.Series:
+        """Fraction of 2pi covered by each layer, counting overlaps twice."""
+        layers = self.layers
+        coverage = 2 * np.arctan2(layers["module_width"] / 2.0, layers["radius"]) * layers["n_modules"] / TWOPI
+        return pd.Series(coverage.to_numpy(), index=pd.MultiIndex.from_frame(layers[["system", "layer"]]))
+
+
+    def intersect(self, tracks: dict[str, np.ndarray], bfield: float = BFIELD) -> pd.DataFrame:
+        """
+        Crossings of every track with the sensors it passes through on its way out.
+        tracks: arrays of pt [GeV], phi, eta, charge (0 for straight lines), and optionally vx, vy, vz [mm].
+        """
+        n_tracks = len(tracks["pt"])
+        vertex = np.stack([tracks.get(f"v{dim}", np.zeros(n_tracks)) for dim in "xyz"], axis=1)
+        charge = np.asarray(tracks["charge"], dtype=np.float64)
+        curved = charge != 0
+        radius = np.where(curved, np.asarray(tracks["pt"], dtype=np.float64) * GEV_TO_MM / bfield, np.inf)
+        phi = np.asarray(tracks["phi"], dtype=np.float64)
+        cot_theta = np.sinh(np.asarray(tracks["eta"], dtype=np.float64))
+        center = vertex[:, :2] + (charge * np.where(curved, radius, 0.0))[:, None] * np.stack([np.sin(phi), -np.cos(phi)], axis=1)
+
+        # candidate sensors: next to the crossing of each layer radius
+        layers = self.layers
+        track, i_layer = [a.ravel() for a in np.meshgrid(np.arange(n_tracks), np.arange(len(layers)), indexing="ij")]
+        layer_radius = layers["radius"].to_numpy()[i_layer]
+        reaches = layer_radius <= 2.0 * radius[track]
+        ratio = np.clip(layer_radius / (2.0 * radius[track]), -1.0, 1.0)
+        # transverse path to the layer radius, from the beamline
+        arc = np.where(curved[track], 2.0 * np.where(curved[track], radius[track], 0.0) * np.arcsin(ratio), layer_radius)
+        phi_at_r = phi[track] - charge[track] * np.arcsin(ratio)
+        z_at_r = vertex[track, 2] + arc * cot_theta[track]
+        track, i_layer, phi_at_r, z_at_r = track[reaches], i_layer[reaches], phi_at_r[reaches], z_at_r[reaches]
+
+        def per_candidate(col):
+            return layers[col].to_numpy()[i_layer]
+
+        n_modules = per_candidate("n_modules")
+        n_sensors = per_candidate("n_sensors")
+        nearest_module = np.round((phi_at_r - per_candidate("phi0")) / per_candidate("dphi")).astype(np.int64)
+        nearest_sensor = np.floor((z_at_r + per_candidate("half_length")) / per_candidate("sensor_length")).astype(np.int64)
+        candidates = []
+        for d_module in [-1, 0, 1]:
+            for d_sensor in [-1, 0, 1]:
+                sensor = nearest_sensor + d_sensor
+                ok = (sensor >= 0) & (sensor < n_sensors)
+                module = (nearest_module + d_module) % n_modules
+                index = per_candidate("offset") + module * n_sensors + sensor
+                candidates.append((track[ok], index[ok]))
+        track = np.concatenate([c[0] for c in candidates])
+        index = np.concatenate([c[1] for c in candidates])
+
+        point, path = self.cross(track, index, vertex, phi, cot_theta, charge, radius, center)
+        inside = np.isfinite(path)
+        track, index, point, path = track[inside], index[inside], point[inside], path[inside]
+        local = point - self.origin[index]
+        local_u = np.einsum("ij,ij->i", local, self.u[index])
+        local_v = np.einsum("ij,ij->i", local, self.v[index])
+
+        hits = pd.DataFrame({
+            "i_track": track,
+            "i_sensor": index,
+            "system": self.system[index],
+            "layer": self.layer[index],
+            "module": self.module[index],
+            "sensor": self.sensor[index],
+            "cellid0": self.sensor_id[index],
+            "x": point[:, 0],
+            "y": point[:, 1],
+            "z": point[:, 2],
+            "local_u": local_u,
+            "local_v": local_v,
+            "path_xy": path,
+        })
+        # neighboring candidates can share a sensor
+        hits = hits.drop_duplicates(["i_track", "i_sensor"])
+        return hits.sort_values(["i_track", "path_xy"]).reset_index(drop=True)
+
+
+    def cross(self, track, index, vertex, phi, cot_theta, charge, radius, center) -> tuple[np.ndarray, np.ndarray]:
+        """
+        First crossing of each (track, sensor) inside the sensor, and the transverse path length to it.
+        Helices are followed for their outgoing half turn. The path is NaN where the track does not pass through the sensor.
+        """
+        normal = self.normal[index, :2]
+        offset = np.einsum("ij,ij->i", self.origin[index, :2], normal)
+        start = vertex[track, :2]
+
+        # crossings of the line of the sensor plane in x-y: one for straight lines, two for helices
+        crossings = []
+        line = charge[track] == 0
+        direction = np.stack([np.cos(phi[track]), np.sin(phi[track])], axis=1)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            t = (offset - np.einsum("ij,ij->i", start, normal)) / np.einsum("ij,ij->i", direction, normal)
+        t = np.where(line & (t > 0), t, np.nan)
+        crossings.append((start + t[:, None] * direction, t))
+
+        # straight lines have infinite radius, and get NaN paths here
+        r = np.where(line, np.nan, radius[track])
+        c = center[track]
+        distance = offset - np.einsum("ij,ij->i", c, normal)
+        half_chord = np.sqrt(np.clip(r**2 - distance**2, 0.0, None))
+        along = np.stack([-normal[:, 1], normal[:, 0]], axis=1)
+        a0 = np.arctan2(start[:, 1] - c[:, 1], start[:, 0] - c[:, 0])
+        for sign in [-1.0, 1.0]:
+            candidate = c + distance[:, None] * normal + (sign * half_chord)[:, None] * along
+            a = np.arctan2(candidate[:, 1] - c[:, 1], candidate[:, 0] - c[:, 0])
+            turn = np.mod(charge[track] * (a0 - a), TWOPI)
+            path = np.where(~line & (np.abs(distance) <= r) & (turn <= np.pi), turn * r, np.nan)
+            crossings.append((candidate, path))
+
+        best_point = np.zeros((len(track), 3))
+        best_path = np.full(len(track), np.nan)
+        for xy, path in crossings:
+            point = np.column_stack([xy, vertex[track, 2] + path * cot_theta[track]])
+            local = point - self.origin[index]
+            inside = ((np.abs(np.einsum("ij,ij->i", local, self.u[index])) <= self.width[index] / 2.0)
+                      & (np.abs(np.einsum("ij,ij->i", local, self.v[index])) <= self.length[index] / 2.0))
+            better = inside & np.isfinite(path) & ~(path >= best_path)
+            best_point[better] = point[better]
+            best_path[better] = path[better]
+        return best_point, best_path
+
+
+def make_tracks(n: int, pt: tuple[float, float] = (1.0, 10.0), eta: tuple[float, float] = (-1.0, 1.0),
+                phi: tuple[float, float] = (0.0, TWOPI), charge: list[int] = [-1, 1], seed: int = 0) -> dict[str, np.ndarray]:
+    """Tracks from the origin, uniform in pt, eta and phi."""
+    rng = np.random.default_rng(seed)
+    return {
+        "pt": rng.uniform(*pt, n),
+        "eta": rng.uniform(*eta, n),
+        "phi": rng.uniform(*phi, n),
+        "charge": rng.choice(charge, n),
+    }
+
+
+def hermeticity(hits: pd.DataFrame, n_tracks: int) -> pd.Series:
+    """Fraction of tracks with at least one hit in each (system, layer)."""
+    return hits.groupby(["system", "layer"])["i_track"].nunique() / n_tracks
+
+
+def doublet_acceptance(hits: pd.DataFrame, n_tracks: int) -> pd.Series:
+    """Fraction of tracks with hits in the same module of both layers of each (system, doublet)."""
+    df = hits[["i_track", "system", "layer", "module"]].drop_duplicates().copy()
+    df["doublet"] = df["layer"] // 2
+    n_layers = df.groupby(["i_track", "system", "doublet", "module"])["layer"].nunique()
+    both = n_layers[n_layers == 2].reset_index()
+    return both.groupby(["system", "doublet"])["i_track"].nunique() / n_tracks
+
+
+def scan(layouts: dict[str, list[dict]], tracks: dict[str, np.ndarray], tag: str = "v07", bfield: float = BFIELD) -> pd.DataFrame:
+    """Hermeticity and doublet acceptance of many candidate layouts for the same tracks."""
+    n_tracks = len(tracks["pt"])
+    rows = []
+    for name, layout in layouts.items():
+        hits = BarrelGeometry(layout, tag=tag).intersect(tracks, bfield=bfield)
+        herm = hermeticity(hits, n_tracks)
+        acc = doublet_acceptance(hits, n_tracks)
+        rows.append({
+            "layout": name,
+            "min_hermeticity": herm.min() if len(herm) else 0.0,
+            "mean_hermeticity": herm.mean() if len(herm) else 0.0,
+            "min_doublet_acceptance": acc.min() if len(acc) else 0.0,
+            "mean_doublet_acceptance": acc.mean() if len(acc) else 0.0,
+        })
+    return pd.DataFrame(rows)
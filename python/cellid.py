@@ -0,0 +1,142 @@
+"""
+CellID codecs for the MAIA tracker readouts.
+
+A codec is built from a DD4hep BitField encoding string such as
+"system:5,side:-2,layer:6,module:11,sensor:8" (a negative width marks a signed field),
+and decodes uint64 arrays of cellid0 into one compact array per field.
+Codecs are registered per geometry version, or can be built from the CellIDEncoding
+parameter of an LCIO collection.
+
+Usage:
+    codec = get_codec("v07")
+    fields = codec.decode(df["simhit_cellid0"])
+    cellid0 = codec.encode(system=3, layer=2, module=10, sensor=0)
+"""
+
+import functools
+import numpy as np
+
+GLOBAL_TRACKER_READOUT = "system:5,side:-2,layer:6,module:11,sensor:8"
+
+# Actual StaggeredTrackerReadoutID: system:5,side:-2,layer:13,module:11,sensor:1
+# The 13-bit layer field packs the sensor below the layer, so we decode the effective layout
+STAGGERED_TRACKER_READOUT = "system:5,side:-2,layer:13,module:11,sensor:1"
+STAGGERED_TRACKER_READOUT_EFFECTIVE = "system:5,side:-2,sensor:8,layer:5,module:11,ignore:1"
+
+FIELDS = ["system", "side", "layer", "module", "sensor"]
+
+
+class CellIDCodec:
+
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        self.fields = {}
+        offset = 0
+        for token in encoding.split(","):
+            parts = token.strip().split(":")
+            if len(parts) == 3:
+                name, offset, width = parts[0], int(parts[1]), int(parts[2])
+            elif len(parts) == 2:
+                name, width = parts[0], int(parts[1])
+            else:
+                raise ValueError(f"Cannot parse CellID field '{token}' in '{encoding}'")
+            signed = width < 0
+            width = abs(width)
+            self.fields[name] = (offset, width, signed)
+            offset += width
+        if offset > 64:
+            raise ValueError(f"CellID encoding '{encoding}' needs {offset} bits")
+
+
+    def __repr__(self):
+        return f"CellIDCodec('{self.encoding}')"
+
+
+    def get(self, cellid, name: str, signed: bool = False):
+        """Decode one field from a scalar or array cellid, as raw bits unless signed."""
+        offset, width, is_signed = self.fields[name]
+        value = (np.asarray(cellid).astype(np.uint64) >> np.uint64(offset)) & np.uint64((1 << width) - 1)
+        dtype = compact_dtype(width, signed and is_signed)
+        if signed and is_signed:
+            value = value.astype(np.int64)
+            value = np.where(value >= (1 << (width - 1)), value - (1 << width), value)
+        return value.astype(dtype) if value.ndim else dtype.type(value)
+
+
+    def decode(self, cellids, fields: list[str] = None, prefix: str = "", signed: bool = False) -> dict:
+        """
+        Decode all (or the requested) fields of an array of cellids in one pass.
+
+        Returns:
+            dict of f"{prefix}{field}" -> compact uint8/uint16 arrays
+        """
+        cellids = np.asarray(cellids).astype(np.uint64)
+        return {
+            f"{prefix}{name}": self.get(cellids, name, signed)
+            for name in (fields or self.fields)
+        }
+
+
+    def encode(self, **values) -> np.ndarray:
+        """Build uint64 cellids from field arrays or scalars. Missing fields are 0."""
+        unknown = set(values) - set(self.fields)
+        if unknown:
+            raise ValueError(f"Unknown CellID fields {sorted(unknown)} for '{self.encoding}'")
+        cellid = np.uint64(0)
+        for name, value in values.items():
+            offset, width, _ = self.fields[name]
+            value = np.asarray(value).astype(np.int64) & ((1 << width) - 1)
+            cellid = cellid | (value.astype(np.uint64) << np.uint64(offset))
+        return cellid
+
+
+def compact_dtype(width: int, signed: bool) -> np.dtype:
+    for bits in [8, 16, 32, 64]:
+        if width <= bits:
+            return np.dtype(f"int{bits}" if signed else f"uint{bits}")
+    raise ValueError(f"CellID field width {width} is too large")
+
+
+CODECS = {
+    "v00": CellIDCodec(GLOBAL_TRACKER_READOUT),
+    "v01": CellIDCodec(GLOBAL_TRACKER_READOUT),
+    "v04": CellIDCodec(GLOBAL_TRACKER_READOUT),
+    "v05": CellIDCodec(GLOBAL_TRACKER_READOUT),
+    "v06": CellIDCodec(STAGGERED_TRACKER_READOUT_EFFECTIVE),
+    "v07": CellIDCodec(STAGGERED_TRACKER_READOUT_EFFECTIVE),
+}
+DEFAULT_CODEC = CODECS["v01"]
+
+ENCODING_ALIASES = {
+    STAGGERED_TRACKER_READOUT: STAGGERED_TRACKER_READOUT_EFFECTIVE,
+}
+
+
+def get_codec(version: str = None, encoding: str = None) -> CellIDCodec:
+    """
+    Codec for an encoding string if given (e.g. from CellIDEncoding),
+    otherwise for a geometry version, otherwise the global tracker readout.
+    """
+    if encoding:
+        return codec_for_encoding(encoding.replace(" ", ""))
+    if version is None:
+        return DEFAULT_CODEC
+    if version not in CODECS:
+        raise ValueError(f"Unknown geometry version for CellID decoding: {version}")
+    return CODECS[version]
+
+
+@functools.lru_cache
+def codec_for_encoding(encoding: str) -> CellIDCodec:
+    return CellIDCodec(ENCODING_ALIASES.get(encoding, encoding))
+
+
+def codec_from_collection(collection, fallback: CellIDCodec = None) -> CellIDCodec:
+    """
+    Codec from the CellIDEncoding parameter of an LCIO collection.
+    Collections without one (e.g. LCRelations) get the fallback codec.
+    """
+    encoding = collection.getParameters().getStringVal("CellIDEncoding")
+    if encoding:
+        return get_codec(encoding=encoding)
+    return fallback or DEFAULT_CODEC
@@ -3,6 +3,8 @@ check_dataset.py - a script to make plots from a slcio file for dataset quality
 
 Run like:
 > python check_dataset.py -i my_data.slcio
+or, for a quick deterministic subsample of events and hits:
+> python check_dataset.py -i my_data.slcio --fast --seed 1
 """
 import pyLCIO
 
@@ -12,9 +14,14 @@ import os
 import numpy as np
 import pandas as pd
 import time
+import zlib
 import logging
 logger = logging.getLogger(__name__)
 
+from cellid import FIELDS, codec_from_collection, get_codec
+from hitcache import HitCache
+from slcio_reader import add_reader_arguments, cache_from_options, read_slcio_files
+
 import matplotlib.pyplot as plt
 from matplotlib.backends.backend_pdf import PdfPages
 from matplotlib import rcParams
@@ -67,6 +74,8 @@ CMAP = {
 
 SPEED_OF_LIGHT = 299.792458  # mm/ns
 MM_TO_UM = 1000.0
+RANDOM_SAMPLE_FRACTION = 0.1
+FAST_SAMPLING = {"event_fraction": 0.2, "hit_fraction": 0.05, "max_events": 20}
 
 
 def main():
@@ -76,12 +85,20 @@ def main():
     ops = options()
     if not ops.i:
         raise ValueError("Provide input file(s) with -i")
-    randomly_sample = ops.r
-    if randomly_sample:
-        logger.info(f"Randomly sampling only 10 percent of hits ...")
+    sampling = Sampling(
+        event_fraction=ops.sample_events,
+        hit_fraction=ops.sample_hits,
+        max_events=ops.max_events,
+        seed=ops.seed,
+    )
+    if ops.r:
+        sampling.hit_fraction = min(sampling.hit_fraction, RANDOM_SAMPLE_FRACTION)
+    if ops.fast:
+        sampling = Sampling(**{**FAST_SAMPLING, "seed": ops.seed})
+    logger.info(f"Sampling: {sampling}")
     file_paths = parse_file_paths(ops.i.split(","))
 
-    hits = parse_lcio_files(file_paths, randomly_sample)
+    hits = parse_lcio_files(file_paths, sampling, jobs=ops.jobs, cache=cache_from_options(ops))
 
     with PdfPages(ops.pdf) as pdf:
         plot_hits(hits, pdf)
@@ -91,7 +108,13 @@ def options():
     parser = argparse.ArgumentParser(usage=__doc__, formatter_class=argparse.ArgumentDefaultsHelpFormatter)
     parser.add_argument("-i", required=True, help="Input slcio file or glob pattern")
     parser.add_argument("-r", action="store_true", help="Randomly samples only 10 percent of hits")
+    parser.add_argument("--sample-events", type=float, default=1.0, help="Fraction of events to read in each file")
+    parser.add_argument("--sample-hits", type=float, default=1.0, help="Fraction of hits to read in each collection")
+    parser.add_argument("--max-events", type=int, default=None, help="Maximum number of sampled events per file")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed for event and hit sampling")
+    parser.add_argument("--fast", action="store_true", help=f"Quick QA pass, equivalent to {FAST_SAMPLING}")
     parser.add_argument("--pdf", default="check_dataset.pdf", help="Output pdf file")
+    add_reader_arguments(parser)
     return parser.parse_args()
 
 
@@ -106,127 +129,164 @@ def parse_file_paths(
     return names
 
 
-def parse_lcio_files(file_paths, randomly_sample: bool) -> tuple[pd.DataFrame,
-                                                                 pd.DataFrame]:
+class Sampling:
+    """
+    Deterministic event- and hit-level subsampling.
+    Every (file, event, collection) gets its own random stream derived from the seed,
+    so the selection does not depend on which other files or collections are read.
+    """
+
+    def __init__(self, event_fraction: float = 1.0, hit_fraction: float = 1.0, max_events: int = None, seed: int = 0):
+        self.event_fraction = event_fraction
+        self.hit_fraction = hit_fraction
+        self.max_events = max_events
+        self.seed = seed
+
+
+    def __repr__(self):
+        return (f"Sampling(event_fraction={self.event_fraction}, hit_fraction={self.hit_fraction}, "
+                f"max_events={self.max_events}, seed={self.seed})")
+
+
+    def weight(self, n_events: int, n_sampled: int) -> float:
+        """Weight per sampled hit, to keep histogram normalizations comparable to a full pass."""
+        return n_events / max(n_sampled, 1) / min(self.hit_fraction, 1.0)
+
+
+    def events(self, file_key: int, n_events: int) -> np.ndarray:
+        indices = self.choose(n_events, self.event_fraction, file_key)
+        return indices[:self.max_events]
+
+
+    def hits(self, file_key: int, i_event: int, i_collection: int, n_hits: int) -> np.ndarray:
+        return self.choose(n_hits, self.hit_fraction, file_key, i_event, i_collection)
 
-    hits = []
 
-    for i_fp, file_path in enumerate(file_paths):
+    def choose(self, n: int, fraction: float, *key) -> np.ndarray:
+        if fraction >= 1.0:
+            return np.arange(n)
+        rng = np.random.default_rng([self.seed, *key])
+        return np.flatnonzero(rng.random(n) < fraction)
 
+
+def read_sampled_events(reader, sampled: np.ndarray):
+    """Yield (i_event, event) for the sampled event indices, skipping the rest unread."""
+    position = 0
+    for i_event in sampled:
+        if i_event > position:
+            reader.skipNEvents(int(i_event - position))
+        event = reader.readNextEvent()
+        if not event:
+            break
+        position = i_event + 1
+        yield int(i_event), event
+
+
+def parse_lcio_files(file_paths, sampling: Sampling = None, jobs: int = None, cache: HitCache = None) -> pd.DataFrame:
+    for file_path in file_paths:
         if not os.path.isfile(file_path):
             msg = f"File {file_path} does not exist"
             raise FileNotFoundError(msg)
+    hits = read_slcio_files(file_paths, parse_lcio_file, jobs=jobs, cache=cache,
+                            sampling=sampling or Sampling())
+    logger.info(f"Made a dataframe out of {len(hits)} hits ...")
+    return hits
 
-        # open the SLCIO file
-        logger.info(f"Processing file {file_path} ...")
-        reader = pyLCIO.IOIMPL.LCFactory.getInstance().createLCReader()
-        reader.open(file_path)
-
-        # event loop
-        for i_event, event in enumerate(reader):
-
-            # inspect sim hits
-            for collection in SIM_COLLECTIONS:
-
-                if collection not in event.getCollectionNames():
-                    if i_fp == 0 and i_event == 0:
-                        logger.warning(f"{collection} not found in {file_path}")
-                    continue
-                col = event.getCollection(collection)
-                n_obj = len(col)
-
-                for i_obj, obj in enumerate(col):
-
-                    if i_obj > 0 and i_obj % 1e5 == 0:
-                        msg = f"Processing {i_fp}, event {i_event}, {collection}, {i_obj}/{n_obj} ..."
-                        logger.info(msg)
-
-                    if randomly_sample and np.random.rand() > 0.1:
-                        continue
-
-                    position = obj.getPosition()
-                    sim_position = position
-                    time = obj.getTime()
-                    correction = np.sqrt(position[0]**2 + position[1]**2 + position[2]**2) / SPEED_OF_LIGHT
-                    cellid0 = obj.getCellID0()
-
-                    hits.append({
-                        'sim': True,
-                        'file': i_fp,
-                        'i_event': i_event,
-                        'hit_x': position[0],
-                        'hit_y': position[1],
-                        'hit_z': position[2],
-                        'hit_sim_x': sim_position[0],
-                        'hit_sim_y': sim_position[1],
-                        'hit_sim_z': sim_position[2],
-                        'hit_sim_t': time,
-                        'hit_cellid0': cellid0,
-                        'hit_t': time,
-                        'hit_t_correction': correction,
-                    })
-
-            # inspect digi hits
-            for collection, relation in zip(DIGI_COLLECTIONS, DIGI_RELATIONS):
-
-                use_relation = relation in event.getCollectionNames()
-                col = event.getCollection(relation if use_relation else collection)
-                n_obj = len(col)
-
-                for i_obj, obj in enumerate(col):
-
-                    if i_obj > 0 and i_obj % 1e6 == 0:
-                        msg = f"Processing {i_fp}, event {i_event}, {collection}, {i_obj}/{n_obj} ..."
-                        logger.info(msg)
-                    # if i_obj > 1e5:
-                    #     break
-
-                    if randomly_sample and np.random.rand() > 0.1:
-                        continue
-
-                    if use_relation:
-                        simhit, hit = obj.getTo(), obj.getFrom()
-                        sim_position = simhit.getPosition()
-                        sim_t = simhit.getTime()
-                    else:
-                        hit = obj
-                        sim_position = hit.getPosition()
-                        sim_t = hit.getTime()
-
-                    position = hit.getPosition()
-                    time = hit.getTime()
-                    cellid0 = hit.getCellID0()
-                    correction = np.sqrt(sim_position[0]**2 + sim_position[1]**2 + sim_position[2]**2) / SPEED_OF_LIGHT
-                    hits.append({
-                        'sim': False,
-                        'file': i_fp,
-                        'i_event': i_event,
-                        'hit_x': position[0],
-                        'hit_y': position[1],
-                        'hit_z': position[2],
-                        'hit_sim_x': sim_position[0],
-                        'hit_sim_y': sim_position[1],
-                        'hit_sim_z': sim_position[2],
-                        'hit_sim_t': sim_t,
-                        'hit_cellid0': cellid0,
-                        'hit_t': time,
-                        'hit_t_correction': correction,
-                    })
-
-    logger.info(f"Making a dataframe out of {len(hits)} hits ...")
-    hits = pd.DataFrame(hits)
-    hits = postprocess(hits)
 
-    return hits
+def parse_lcio_file(file_path: str, sampling: Sampling) -> pd.DataFrame:
 
+    hits = []
+    codec = get_codec()
+    file_key = zlib.crc32(os.path.basename(file_path).encode())
 
-def postprocess(df):
-    logger.info(f"Decoding cellid ...")
-    df["hit_system"] = np.right_shift(df["hit_cellid0"], 0) & 0b1_1111
-    df["hit_side"] = np.right_shift(df["hit_cellid0"], 5) & 0b11
-    df["hit_layer"] = np.right_shift(df["hit_cellid0"], 7) & 0b11_1111
-    df["hit_module"] = np.right_shift(df["hit_cellid0"], 13) & 0b111_1111_1111
-    df["hit_sensor"] = np.right_shift(df["hit_cellid0"], 24) & 0b1111_1111
+    # open the SLCIO file
+    logger.info(f"Processing file {file_path} ...")
+    reader = pyLCIO.IOIMPL.LCFactory.getInstance().createLCReader()
+    reader.open(file_path)
+    n_events = reader.getNumberOfEvents()
+    sampled = sampling.events(file_key, n_events)
+    logger.info(f"Reading {len(sampled)} / {n_events} events ...")
+
+    # event loop
+    for i_event, event in read_sampled_events(reader, sampled):
+
+        names = event.getCollectionNames()
+
+        # inspect sim hits
+        for i_col, collection in enumerate(SIM_COLLECTIONS):
+
+            if collection not in names:
+                if i_event == sampled[0]:
+                    logger.warning(f"{collection} not found in {file_path}")
+                continue
+            col = event.getCollection(collection)
+            codec = codec_from_collection(col, codec)
+            indices = sampling.hits(file_key, i_event, i_col, len(col))
+            sim = extract_hits([col.getElementAt(int(i)) for i in indices])
+            hits.append(hits_frame(True, i_event, sim, sim))
+
+        # inspect digi hits
+        for i_col, (collection, relation) in enumerate(zip(DIGI_COLLECTIONS, DIGI_RELATIONS)):
+
+            use_relation = relation in names
+            col = event.getCollection(relation if use_relation else collection)
+            codec = codec_from_collection(col, codec)
+            indices = sampling.hits(file_key, i_event, len(SIM_COLLECTIONS) + i_col, len(col))
+            objs = [col.getElementAt(int(i)) for i in indices]
+
+            # only resolve the relations of sampled hits
+            if use_relation:
+                digi = extract_hits([obj.getFrom() for obj in objs])
+                sim = extract_hits([obj.getTo() for obj in objs])
+            else:
+                digi = sim = extract_hits(objs)
+            hits.append(hits_frame(False, i_event, digi, sim))
+
+    reader.close()
+
+    hits = pd.concat(hits, ignore_index=True) if hits else hits_frame(True, 0, extract_hits([]), extract_hits([]))
+    hits["weight"] = sampling.weight(n_events, len(sampled))
+    return postprocess(hits, codec)
+
+
+def extract_hits(objs: list) -> dict[str, np.ndarray]:
+    """Positions, times, and cellid0 of sim or digi hits, as arrays."""
+    n = len(objs)
+    position = np.fromiter(
+        (coord for obj in objs for coord in tuple(obj.getPosition())[:3]),
+        dtype=np.float64,
+        count=3 * n,
+    ).reshape(n, 3)
+    return {
+        "position": position,
+        "t": np.fromiter((obj.getTime() for obj in objs), dtype=np.float64, count=n),
+        "cellid0": np.fromiter((obj.getCellID0() for obj in objs), dtype=np.int64, count=n),
+    }
+
+
+def hits_frame(sim: bool, i_event: int, hit: dict, simhit: dict) -> pd.DataFrame:
+    position, sim_position = hit["position"], simhit["position"]
+    return pd.DataFrame({
+        'sim': sim,
+        'i_event': i_event,
+        'hit_x': position[:, 0],
+        'hit_y': position[:, 1],
+        'hit_z': position[:, 2],
+        'hit_sim_x': sim_position[:, 0],
+        'hit_sim_y': sim_position[:, 1],
+        'hit_sim_z': sim_position[:, 2],
+        'hit_sim_t': simhit["t"],
+        'hit_cellid0': hit["cellid0"],
+        'hit_t': hit["t"],
+        'hit_t_correction': np.linalg.norm(sim_position, axis=1) / SPEED_OF_LIGHT,
+    })
+
+
+def postprocess(df, codec=None):
+    logger.info(f"Decoding cellid with {codec} ...")
+    codec = codec or get_codec()
+    for name, values in codec.decode(df["hit_cellid0"], fields=FIELDS, prefix="hit_").items():
+        df[name] = values
     df["hit_r"] = np.sqrt(df["hit_x"]**2 + df["hit_y"]**2)
     df["hit_t_corrected"] = df["hit_t"] - df["hit_t_correction"]
     df["hit_dx"] = df["hit_x"] - df["hit_sim_x"]
@@ -286,6 +346,7 @@ def plot_time(df, pdf, sim):
             ax.hist(
                 hits[col],
                 bins=bins,
+                weights=hits["weight"],
                 histtype="stepfilled",
                 color=COLOR[sim],
                 edgecolor="black",
@@ -322,6 +383,7 @@ def plot_xy(df, pdf, sim, zoom_inner=False, zoom_outer=False):
         df["hit_x"],
         df["hit_y"],
         bins=bins,
+        weights=df["weight"],
         cmap=CMAP[sim],
         cmin=0.5,
     )
@@ -358,6 +420,7 @@ def plot_rz(df, pdf, sim, zoom_inner=False, zoom_outer=False):
         df["hit_z"],
         df["hit_r"],
         bins=bins,
+        weights=df["weight"],
         cmap=CMAP[sim],
         cmin=0.5,
     )
@@ -0,0 +1,310 @@
+"""
+Throughput, resource usage and ETA of a Condor production.
+
+Parses the Condor user logs (log = logs/condor.$(ClusterId).$(ProcId).log) and the
+stderr of the jobs (error = logs/<name>_$(FILENUM).$(ClusterId).$(ProcId).err).
+From the user logs: submission, execution, eviction, hold and termination of each job,
+its return value, and its peak memory, disk and CPU usage versus its requests.
+From the stderr: the wall time and number of events of each stage of digitize_muons.py,
+as logged by its workflow, and the wall time of any other `time`d command.
+
+Everything is kept in an SQLite store, and each update only reads the new part of
+the user logs and the stderr files which changed, so it is cheap to run every minute.
+
+Usage:
+    python condor_monitor.py logs/
+    python condor_monitor.py logs/ --total 1000 --watch 60
+"""
+
+import argparse
+import glob
+import os
+import re
+import sqlite3
+import time
+from datetime import datetime
+import numpy as np
+import pandas as pd
+
+DEFAULT_STORE = "condor_monitor.sqlite"
+WINDOW_HOURS = 1.0
+
+# condor user log event codes
+SUBMIT = 0
+EXECUTE = 1
+EVICTED = 4
+TERMINATED = 5
+IMAGE_SIZE = 6
+SHADOW_EXCEPTION = 7
+ABORTED = 9
+HELD = 12
+RELEASED = 13
+
+EVENT_END = "...\n"
+HEADER = re.compile(r"^(\d{3}) \((\d+)\.(\d+)\.\d+\) (\S+ \S+) ")
+RETURN_VALUE = re.compile(r"\(return value (\d+)\)")
+SIGNAL = re.compile(r"\(signal (\d+)\)")
+MEMORY_USAGE = re.compile(r"^\s*(\d+)\s+-\s+MemoryUsage of job \(MB\)")
+RESOURCE = re.compile(r"^\s*(Cpus|Disk \(KB\)|Memory \(MB\))\s*:\s*([\d.]+)\s+([\d.]+)")
+RESOURCE_COLUMNS = {"Cpus": "cpus", "Disk (KB)": "disk_kb", "Memory (MB)": "memory_mb"}
+
+# stderr of the jobs
+ERR_NAME = re.compile(r"(?P<name>.+)_(?P<filenum>[^_]+)\.(?P<cluster>\d+)\.(?P<proc>\d+)\.err$")
+REAL = re.compile(r"^real\s+(?:(\d+)m)?([\d.]+)s")
+RUNNING = re.compile(r"Running (\w+?)_(\d+): (.*)$")
+FINISHED = re.compile(r"Task (\w+?)_(\d+) (finished|failed)\b.*?(?:after (\d+)s)?$")
+N_EVENTS = re.compile(r"(?:--numberOfEvents|(?<!\S)-n|(?<!\S)-e)\s+(\d+)")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, size INTEGER, mtime REAL, offset INTEGER);
+CREATE TABLE IF NOT EXISTS events (
+    cluster INTEGER, proc INTEGER, code INTEGER, time REAL,
+    return_value INTEGER, memory_mb REAL, request_memory_mb REAL,
+    cpus REAL, request_cpus REAL, disk_kb REAL, request_disk_kb REAL,
+    PRIMARY KEY (cluster, proc, code, time)
+);
+CREATE TABLE IF NOT EXISTS stages (
+    path TEXT, name TEXT, filenum TEXT, cluster INTEGER, proc INTEGER,
+    stage TEXT, seconds REAL, events INTEGER, failed INTEGER, cmd TEXT
+);
+"""
+EVENT_COLUMNS = ["cluster", "proc", "code", "time", "return_value", "memory_mb", "request_memory_mb",
+                 "cpus", "request_cpus", "disk_kb", "request_disk_kb"]
+STAGE_COLUMNS = ["path", "name", "filenum", "cluster", "proc", "stage", "seconds", "events", "failed", "cmd"]
+
+
+def options():
+    parser = argparse.ArgumentParser(usage=__doc__, formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("logs", type=str, help="Directory of the Condor logs and job stderr")
+    parser.add_argument("--store", type=str, default=None, help=f"SQLite store. Default: <logs>/{DEFAULT_STORE}")
+    parser.add_argument("--total", type=int, default=None, help="Total number of jobs. Default: number of submitted jobs")
+    parser.add_argument("--window", type=float, default=WINDOW_HOURS, help="Hours of recent completions for the throughput")
+    parser.add_argument("--watch", type=float, default=None, help="Update every this many seconds")
+    return parser.parse_args()
+
+
+def main():
+    ops = options()
+    store = ops.store or os.path.join(ops.logs, DEFAULT_STORE)
+    while True:
+        with connect(store) as con:
+            update(con, ops.logs)
+            print(report(con, total=ops.total, window=ops.window))
+        if ops.watch is None:
+            break
+        time.sleep(ops.watch)
+
+
+def connect(store: str) -> sqlite3.Connection:
+    con = sqlite3.connect(store)
+    con.executescript(SCHEMA)
+    return con
+
+
+def update(con: sqlite3.Connection, logs: str):
+    """Add the new events of the user logs, and reparse the stderr files which changed."""
+    known = {path: (size, mtime, offset) for path, size, mtime, offset in con.execute("SELECT * FROM files")}
+    for path in sorted(glob.glob(os.path.join(logs, "*.log"))):
+        stat = os.stat(path)
+        size, mtime, offset = known.get(path, (0, 0.0, 0))
+        if (stat.st_size, stat.st_mtime) == (size, mtime):
+            continue
+        # a log which shrank was rewritten
+        offset = offset if stat.st_size >= offset else 0
+        events, offset = read_user_log(path, offset, year=datetime.fromtimestamp(stat.st_mtime).year)
+        con.executemany(f"INSERT OR IGNORE INTO events VALUES ({','.join('?' * len(EVENT_COLUMNS))})",
+                        [[event.get(col) for col in EVENT_COLUMNS] for event in events])
+        con.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)", (path, stat.st_size, stat.st_mtime, offset))
+
+    for path in sorted(glob.glob(os.path.join(logs, "*.err"))):
+        stat = os.stat(path)
+        if known.get(path, (None, None, None))[:2] == (stat.st_size, stat.st_mtime):
+            continue
+        stages = read_stderr(path)
+        con.execute("DELETE FROM stages WHERE path = ?", (path,))
+        con.executemany(f"INSERT INTO stages VALUES ({','.join('?' * len(STAGE_COLUMNS))})",
+                        [[stage.get(col) for col in STAGE_COLUMNS] for stage in stages])
+        con.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)", (path, stat.st_size, stat.st_mtime, stat.st_size))
+    con.commit()
+
+
+def read_user_log(path: str, offset: int = 0, year: int = None) -> tuple[list[dict], int]:
+    """Complete events of a Condor user log after a byte offset, and the offset after the last of them."""
+    with open(path) as fi:
+        fi.seek(offset)
+        text = fi.read()
+    end = text.rfind(EVENT_END)
+    if end < 0:
+        return [], offset
+    complete = text[:end + len(EVENT_END)]
+    events = [parse_event(block, year) for block in complete.split(EVENT_END)]
+    return [event for event in events if event is not None], offset + len(complete.encode())
+
+
+def parse_event(block: str, year: int = None) -> dict:
+    lines = block.strip("\n").splitlines()
+    match = HEADER.match(lines[0]) if lines else None
+    if match is None:
+        return None
+    code, cluster, proc, stamp = match.groups()
+    event = {"code": int(code), "cluster": int(cluster), "proc": int(proc), "time": parse_time(stamp, year)}
+    for line in lines[1:]:
+        if (m := RETURN_VALUE.search(line)):
+            event["return_value"] = int(m.group(1))
+        elif (m := SIGNAL.search(line)):
+            event["return_value"] = 128 + int(m.group(1))
+        elif (m := MEMORY_USAGE.match(line)):
+            event["memory_mb"] = float(m.group(1))
+        elif (m := RESOURCE.match(line)):
+            column = RESOURCE_COLUMNS[m.group(1)]
+            event[column] = float(m.group(2))
+            event[f"request_{column}"] = float(m.group(3))
+    return event
+
+
+def parse_time(stamp: str, year: int = None) -> float:
+    """Seconds since the epoch of '2025-10-08 15:19:46', or of '10/08 15:19:46' from older versions of Condor."""
+    if "/" in stamp:
+        stamp = f"{year or datetime.now().year}/{stamp}"
+        return datetime.strptime(stamp, "%Y/%m/%d %H:%M:%S").timestamp()
+    return datetime.fromisoformat(stamp).timestamp()
+
+
+def read_stderr(path: str) -> list[dict]:
+    """
+    Wall time of each stage in the stderr of a job. Stages run by the workflow of
+    digitize_muons.py take the time it logs, and other `time`d commands are step0, step1, ...
+    """
+    match = ERR_NAME.match(os.path.basename(path))
+    job = {"path": path, "name": None, "filenum": None, "cluster": None, "proc": None}
+    if match:
+        job.update(name=match["name"], filenum=match["filenum"], cluster=int(match["cluster"]), proc=int(match["proc"]))
+
+    # the workflow runs the job indices concurrently, so stages are keyed by (stage, index),
+    # and their wall time is the one it logs when they end, since `real` lines of concurrent commands interleave
+    stages, running, n_steps = [], {}, 0
+    with open(path, errors="replace") as fi:
+        for line in fi:
+            if (m := RUNNING.search(line)):
+                events = N_EVENTS.search(m.group(3))
+                stage = {**job, "stage": m.group(1), "seconds": None, "events": int(events.group(1)) if events else None,
+                         "failed": 0, "cmd": m.group(3).strip()}
+                running[m.group(1), m.group(2)] = stage
+                stages.append(stage)
+            elif (m := FINISHED.search(line)) and (m.group(1), m.group(2)) in running:
+                stage = running.pop((m.group(1), m.group(2)))
+                stage["failed"] = int(m.group(3) == "failed")
+                stage["seconds"] = float(m.group(4)) if m.group(4) else None
+            elif (m := REAL.match(line)) and not running:
+                seconds = 60 * int(m.group(1) or 0) + float(m.group(2))
+                stages.append({**job, "stage": f"step{n_steps}", "seconds": seconds, "events": None, "failed": 0, "cmd": None})
+                n_steps += 1
+    return stages
+
+
+def read_events(con: sqlite3.Connection) -> pd.DataFrame:
+    return pd.read_sql("SELECT * FROM events ORDER BY time", con)
+
+
+def read_stages(con: sqlite3.Connection) -> pd.DataFrame:
+    return pd.read_sql("SELECT * FROM stages", con)
+
+
+def jobs(events: pd.DataFrame) -> pd.DataFrame:
+    """One row per Condor job, with its status, retries and peak usage versus requests."""
+    if len(events) == 0:
+        return pd.DataFrame()
+    grouped = events.groupby(["cluster", "proc"])
+    code = events["code"]
+    count = lambda c: (code == c).groupby([events["cluster"], events["proc"]]).sum()
+    first = lambda c: events[code == c].groupby(["cluster", "proc"])["time"].min()
+    terminated = events[code == TERMINATED].groupby(["cluster", "proc"]).last()
+
+    df = pd.DataFrame({
+        "submitted": first(SUBMIT),
+        "started": first(EXECUTE),
+        "executions": count(EXECUTE),
+        "evictions": count(EVICTED),
+        "holds": count(HELD),
+        "aborted": count(ABORTED) > 0,
+        "memory_mb": grouped["memory_mb"].max(),
+        "disk_kb": grouped["disk_kb"].max(),
+        "cpus": grouped["cpus"].max(),
+        "request_memory_mb": grouped["request_memory_mb"].max(),
+        "request_disk_kb": grouped["request_disk_kb"].max(),
+        "request_cpus": grouped["request_cpus"].max(),
+    })
+    df["ended"] = terminated["time"]
+    df["return_value"] = terminated["return_value"]
+    df["retries"] = np.maximum(df["executions"] - 1, 0)
+    df["status"] = "idle"
+    df.loc[df["started"].notna(), "status"] = "running"
+    df.loc[df["ended"].notna() & (df["return_value"] == 0), "status"] = "done"
+    df.loc[(df["ended"].notna() & (df["return_value"] != 0)) | df["aborted"], "status"] = "failed"
+    df.loc[df["ended"].isna() & (df["holds"] > count(RELEASED)), "status"] = "held"
+    return df.reset_index()
+
+
+def stage_summary(stages: pd.DataFrame) -> pd.DataFrame:
+    """Wall time and throughput of each stage over the jobs."""
+    if len(stages) == 0:
+        return pd.DataFrame()
+    ok = stages[(stages["failed"] == 0) & stages["seconds"].notna()]
+    grouped = ok.groupby("stage")
+    df = pd.DataFrame({
+        "jobs": grouped.size(),
+        "failed": stages.groupby("stage")["failed"].sum(),
+        "median_s": grouped["seconds"].median(),
+        "p90_s": grouped["seconds"].quantile(0.9),
+        "max_s": grouped["seconds"].max(),
+        "events": grouped["events"].sum(),
+    })
+    seconds = ok[ok["events"].notna()].groupby("stage")["seconds"].sum()
+    df["events_per_s"] = df["events"] / seconds
+    return df
+
+
+def eta(df: pd.DataFrame, total: int = None, window: float = WINDOW_HOURS, now: float = None) -> dict:
+    """Remaining jobs and the projected seconds to finish them, from the completions of the last window hours."""
+    now = now or time.time()
+    total = total or len(df)
+    ended = df["ended"][df["status"] == "done"] if len(df) else pd.Series(dtype=float)
+    remaining = total - len(ended)
+    recent = int(np.sum(ended > now - window * 3600))
+    rate = recent / (window * 3600)
+    return {
+        "total": total,
+        "done": len(ended),
+        "remaining": remaining,
+        "jobs_per_hour": rate * 3600,
+        "eta_s": remaining / rate if rate > 0 else np.inf,
+    }
+
+
+def report(con: sqlite3.Connection, total: int = None, window: float = WINDOW_HOURS) -> str:
+    df = jobs(read_events(con))
+    lines = [f"Condor production at {datetime.now():%Y-%m-%d %H:%M:%S}"]
+    if len(df):
+        lines.append(f"Jobs: {df['status'].value_counts().to_dict()}")
+        lines.append(f"Retries: {int(df['retries'].sum())}, evictions: {int(df['evictions'].sum())}, holds: {int(df['holds'].sum())}")
+        progress = eta(df, total=total, window=window)
+        finish = "never at this rate" if np.isinf(progress["eta_s"]) else f"{progress['eta_s'] / 3600:.1f} h"
+        lines.append(f"Done {progress['done']} / {progress['total']}, {progress['jobs_per_hour']:.1f} jobs/h "
+                     f"over the last {window:g} h, ETA {finish}")
+        for usage, request, unit, scale in [("memory_mb", "request_memory_mb", "MB", 1),
+                                            ("disk_kb", "request_disk_kb", "MB", 1 / 1024),
+                                            ("cpus", "request_cpus", "CPUs", 1)]:
+            used = df[usage].dropna() * scale
+            if len(used):
+                requested = df[request].dropna() * scale
+                over = int(np.sum(df[usage] > df[request]))
+                lines.append(f"Peak {usage.split('_')[0]}: median {used.median():.1f}, p95 {used.quantile(0.95):.1f}, "
+                             f"max {used.max():.1f} {unit}, requested {requested.max():.1f} {unit}, {over} jobs over request")
+    summary = stage_summary(read_stages(con))
+    if len(summary):
+        lines.append(summary.to_string(float_format=lambda x: f"{x:.2f}"))
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    main()
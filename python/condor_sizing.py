@@ -0,0 +1,206 @@
+"""
+Right-size the requests of Condor submit files from the usage of past productions.
+
+The Condor logs of past productions (experiments/*/logs) are harvested with
+condor_monitor.py into one row per job: peak memory, disk and CPUs, wall time of
+each stage, and the settings of the job (number of events, --overlayMixNumberBackground,
+--enableBIB, --enableIP) from the commands of digitize_muons.py.
+
+Per-job peak memory and disk, and the wall time of each stage, are fit with a linear
+model of these settings. The request is the prediction plus the 95% quantile of the
+residuals, times a safety factor. With --min-hours, several job indices are packed
+into each Condor job, so that short jobs do not spend most of their time in the queue.
+
+Usage:
+    python condor_sizing.py ../experiments/simulate_muonGun.* --sub ../condor/muons_with_bib.sub --events 1000 --bib
+    python condor_sizing.py ../experiments/simulate_muonGun.* --sub ../condor/muons_with_bib.sub --events 100 --min-hours 1 -o muons_packed.sub
+"""
+
+import argparse
+import math
+import os
+import re
+import numpy as np
+import pandas as pd
+
+import condor_monitor
+from workflow import write_condor_submit
+
+FEATURES = ["events", "mix", "bib", "ip"]
+QUANTILE = 0.95
+SAFETY = 1.2
+MEMORY_STEP_MB = 256
+MIN_MEMORY_MB = 1024
+MIN_DISK_GB = 1
+MAX_PACK = 50
+MIX = re.compile(r"--overlayMixNumberBackground\s+(\d+)")
+SUB_FIELDS = {
+    "executable": re.compile(r"^executable\s*=\s*(\S+)", re.M),
+    "image": re.compile(r'^\+SingularityImage\s*=\s*"(.*)"', re.M),
+    "sites": re.compile(r'^\+DESIRED_Sites\s*=\s*"(.*)"', re.M),
+    "queue": re.compile(r"^queue\s+.*\s+from\s+(\S+)", re.M),
+}
+
+
+def options():
+    parser = argparse.ArgumentParser(usage=__doc__, formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("experiments", type=str, nargs="+", help="Directories of past productions, with their Condor logs in logs/")
+    parser.add_argument("--sub", type=str, required=True, help="Condor submit file to resize")
+    parser.add_argument("-o", "--output", type=str, default=None, help="Output submit file. Default: overwrite --sub")
+    parser.add_argument("--events", type=int, default=None, help="Events per job index of the new production")
+    parser.add_argument("--overlayMixNumberBackground", type=int, default=0, help="Overlay mix number of the new production")
+    parser.add_argument("--bib", action="store_true", help="The new production overlays BIB")
+    parser.add_argument("--ip", action="store_true", help="The new production overlays incoherent pairs")
+    parser.add_argument("--safety", type=float, default=SAFETY, help="Factor on the predicted usage")
+    parser.add_argument("--min-hours", type=float, default=None, help="Pack job indices into Condor jobs of at least this many hours. "
+                        "The executable has to accept several indices, like shell/digitize_muons.sh")
+    return parser.parse_args()
+
+
+def main():
+    ops = options()
+    df = harvest(ops.experiments)
+    print(f"Harvested {len(df)} finished jobs from {len(ops.experiments)} productions")
+    if len(df) == 0:
+        raise ValueError("No finished jobs to fit")
+
+    setting = {"events": ops.events, "mix": ops.overlayMixNumberBackground, "bib": int(ops.bib), "ip": int(ops.ip)}
+    requests = size(df, setting, safety=ops.safety, min_hours=ops.min_hours)
+    for key, value in requests.items():
+        print(f"{key}: {value}")
+
+    template = read_submit(ops.sub)
+    paths = write_condor_submit(ops.output or ops.sub,
+                                executable=template["executable"],
+                                nums=template["nums"],
+                                cpus=requests["cpus"],
+                                memory_gb=requests["memory_mb"] / 1024,
+                                disk_gb=requests["disk_gb"],
+                                pack=requests["pack"],
+                                image=template["image"],
+                                sites=template["sites"],
+                                )
+    print(f"Wrote {paths}")
+
+
+def logs_dir(experiment: str) -> str:
+    logs = os.path.join(experiment, "logs")
+    return logs if os.path.isdir(logs) else experiment
+
+
+def harvest(experiments: list[str]) -> pd.DataFrame:
+    """One row per successful job of the productions, with its usage, stage wall times and settings."""
+    frames = []
+    for experiment in experiments:
+        logs = logs_dir(experiment)
+        with condor_monitor.connect(os.path.join(logs, condor_monitor.DEFAULT_STORE)) as con:
+            condor_monitor.update(con, logs)
+            jobs = condor_monitor.jobs(condor_monitor.read_events(con))
+            stages = condor_monitor.read_stages(con)
+        if len(jobs) == 0:
+            continue
+        jobs = jobs[jobs["status"] == "done"].set_index(["cluster", "proc"])
+        jobs = jobs.join(job_settings(stages), how="left").join(stage_seconds(stages), how="left")
+        jobs["experiment"] = os.path.basename(os.path.normpath(experiment))
+        frames.append(jobs.reset_index())
+    if not frames:
+        return pd.DataFrame()
+    df = pd.concat(frames, ignore_index=True)
+    for feature in ["mix", "bib", "ip"]:
+        df[feature] = df[feature].fillna(0) if feature in df else 0
+    if "events" not in df:
+        df["events"] = np.nan
+    return df
+
+
+def job_settings(stages: pd.DataFrame) -> pd.DataFrame:
+    """Events and overlay settings of each job, from the commands of its stages."""
+    if len(stages) == 0:
+        return pd.DataFrame()
+    cmd = stages["cmd"].fillna("")
+    settings = pd.DataFrame({
+        "cluster": stages["cluster"],
+        "proc": stages["proc"],
+        "events": stages["events"],
+        "mix": cmd.str.extract(MIX, expand=False).astype(float),
+        "bib": cmd.str.contains("--enableBIB").astype(int),
+        "ip": cmd.str.contains("--enableIP").astype(int),
+    })
+    return settings.groupby(["cluster", "proc"]).max()
+
+
+def stage_seconds(stages: pd.DataFrame) -> pd.DataFrame:
+    """Wall time of each stage of each job, as columns seconds_<stage>."""
+    if len(stages) == 0:
+        return pd.DataFrame()
+    ok = stages[stages["failed"] == 0]
+    seconds = ok.pivot_table(index=["cluster", "proc"], columns="stage", values="seconds", aggfunc="sum")
+    seconds.columns = [f"seconds_{stage}" for stage in seconds.columns]
+    return seconds
+
+
+def fit(df: pd.DataFrame, target: str, features: list[str] = FEATURES, quantile: float = QUANTILE):
+    """
+    Least-squares linear model of a target against the features which vary over the jobs.
+    Returns (features, coefficients, margin, medians), where the margin is the quantile of the
+    residuals, and the medians of the features stand in for settings which are not given.
+    """
+    data = df[df[target].notna()]
+    features = [f for f in features if data[f].notna().all() and data[f].nunique() > 1]
+    X = np.column_stack([np.ones(len(data))] + [data[f].to_numpy(dtype=float) for f in features])
+    y = data[target].to_numpy(dtype=float)
+    coefficients, *_ = np.linalg.lstsq(X, y, rcond=None)
+    residuals = y - X @ coefficients
+    margin = max(float(np.quantile(residuals, quantile)), 0.0) if len(y) else 0.0
+    return features, coefficients, margin, data[features].median().to_dict()
+
+
+def predict(model, setting: dict) -> float:
+    features, coefficients, margin, medians = model
+    x = [1.0] + [setting[f] if setting.get(f) is not None else medians[f] for f in features]
+    return float(np.dot(coefficients, x)) + margin
+
+
+def size(df: pd.DataFrame, setting: dict, safety: float = SAFETY, min_hours: float = None) -> dict:
+    """Requests of CPUs, memory and disk for a setting, and the number of job indices per Condor job."""
+    memory = predict(fit(df, "memory_mb"), setting) * safety
+    disk = predict(fit(df, "disk_kb"), setting) * safety / 1024**2
+    cpus = df["cpus"].dropna().quantile(QUANTILE) if df["cpus"].notna().any() else 1
+    stages = {col.removeprefix("seconds_"): predict(fit(df, col), setting)
+              for col in df.columns if col.startswith("seconds_") and df[col].notna().any()}
+    # steps are the `time`d commands outside of stages, like the time of the whole digitize_muons.py
+    named = {stage: value for stage, value in stages.items() if not stage.startswith("step")}
+    seconds = sum((named or stages).values()) if stages else float((df["ended"] - df["started"]).median())
+
+    pack = 1
+    if min_hours is not None and seconds > 0:
+        pack = int(np.clip(math.ceil(min_hours * 3600 / seconds), 1, MAX_PACK))
+    return {
+        "stage_seconds": {stage: round(value) for stage, value in stages.items()},
+        "job_seconds": round(seconds * pack),
+        "pack": pack,
+        "cpus": max(1, math.ceil(round(cpus, 1))),
+        "memory_mb": max(MIN_MEMORY_MB, MEMORY_STEP_MB * math.ceil(memory / MEMORY_STEP_MB)),
+        "disk_gb": max(MIN_DISK_GB, math.ceil(disk * pack)),
+    }
+
+
+def read_submit(path: str) -> dict:
+    """Executable, container, sites and job indices of a Condor submit file."""
+    with open(path) as fi:
+        text = fi.read()
+    template = {}
+    for key, pattern in SUB_FIELDS.items():
+        match = pattern.search(text)
+        if match is None:
+            raise ValueError(f"No {key} in {path}")
+        template[key] = match.group(1)
+    queue = os.path.join(os.path.dirname(path), template.pop("queue"))
+    with open(queue) as fi:
+        # packed queue files have lines like "JOB, FILENUM FILENUM ..."
+        template["nums"] = [int(num) for line in fi for num in line.split(",")[-1].split()]
+    return template
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""
+Hierarchical eta/phi binning of MDs and T2s, and the cell -> object index of the neighbour searches.
+
+Each object gets its fine eta/phi bins once, as uint16 codes on a grid of
+N_FINE_ETA_BINS x N_FINE_PHI_BINS (500 eta x 372 phi bins).
+The slices of the MD -> T2 search (N_LS_*_SLICES) and of the T2 -> T4 search (N_T4_*_SLICES)
+are integer divisions of the fine bins.
+
+Within a group, a CellIndex sorts the upper objects by (eta slice, phi slice) cell once,
+and keeps the offset of each cell into that order (CSR). The candidates around a lower
+cell are then a few contiguous runs of the order, instead of an isin over every upper object.
+"""
+
+import numpy as np
+
+from constants import DETECTOR_MAX_ETA, DETECTOR_MAX_PHI
+from constants import N_FINE_ETA_BINS, N_FINE_PHI_BINS
+
+
+def fine_bins(eta, phi) -> tuple[np.ndarray, np.ndarray]:
+    """Fine eta and phi bins, clipped to the detector"""
+    eta_bin = np.floor((np.asarray(eta) + DETECTOR_MAX_ETA) / (2 * DETECTOR_MAX_ETA) * N_FINE_ETA_BINS)
+    phi_bin = np.floor((np.asarray(phi) + DETECTOR_MAX_PHI) / (2 * DETECTOR_MAX_PHI) * N_FINE_PHI_BINS)
+    return (
+        np.clip(eta_bin, 0, N_FINE_ETA_BINS - 1).astype(np.uint16),
+        np.clip(phi_bin, 0, N_FINE_PHI_BINS - 1).astype(np.uint16),
+    )
+
+
+def coarse_bins(fine: np.ndarray, n_fine: int, n_slices: int) -> np.ndarray:
+    """Slices of a coarser grid, which has to divide the fine grid"""
+    if n_fine % n_slices != 0:
+        raise ValueError(f"{n_slices} slices do not divide {n_fine} fine bins")
+    return (np.asarray(fine) // (n_fine // n_slices)).astype(np.uint16)
+
+
+class CellIndex:
+    """Positions of objects by (eta slice, phi slice) cell, in CSR form"""
+
+    def __init__(self, eta_slice: np.ndarray, phi_slice: np.ndarray, n_eta: int, n_phi: int):
+        self.n_eta = n_eta
+        self.n_phi = n_phi
+        cells = np.asarray(eta_slice).astype(np.int64) * n_phi + np.asarray(phi_slice)
+        self.order = np.argsort(cells, kind="stable")
+        self.offsets = np.zeros(n_eta * n_phi + 1, dtype=np.int64)
+        np.cumsum(np.bincount(cells, minlength=n_eta * n_phi), out=self.offsets[1:])
+
+
+    def neighbours(self, eta_slice: int, phi_slice: int) -> np.ndarray:
+        """Sorted positions of the objects in the same or a neighbouring cell. Phi wraps around"""
+        eta_slice, phi_slice = int(eta_slice), int(phi_slice)
+        etas = np.arange(max(eta_slice - 1, 0), min(eta_slice + 2, self.n_eta))
+        phis = np.unique(np.arange(phi_slice - 1, phi_slice + 2) % self.n_phi)
+        cells = (etas[:, None] * self.n_phi + phis[None, :]).ravel()
+        return np.sort(np.concatenate([self.order[self.offsets[cell]:self.offsets[cell + 1]] for cell in cells]))
@@ -16,6 +16,10 @@ from constants import XML, CM_TO_MM
 from constants import MUON, ONE_POINT_FIVE_GEV, ZERO_POINT_ZERO_ONE_MM, BARREL_TRACKER_MAX_ETA
 from constants import INNER_TRACKER_BARREL, OUTER_TRACKER_BARREL, NICKNAMES
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from samples import add_sample_arguments, files_from_options
+from cellid import FIELDS, get_codec
+
 FNAMES = [
     # muonGun, 2 GeV
     "/ceph/users/atuna/work/maia/maia_noodling/samples/v01/muonGun_pT_2p0_2p1/muonGun_pT_2p0_2p1_sim_300.slcio",
@@ -35,7 +39,7 @@ def main():
     logging.basicConfig(level=logging.INFO,
                         format="%(asctime)s [%(levelname)s] %(message)s")
     ops = options()
-    fnames = FNAMES
+    fnames = files_from_options(ops) or FNAMES
     geometry = ops.geometry
     signal = True
     if not ops.inner and not ops.outer:
@@ -59,7 +63,7 @@ def main():
 
     # get detector areas
     logger.info("Getting detector elements ...")
-    elements = get_detector_elements(detnames)
+    elements = get_detector_elements(detnames, ops.geo)
     print(elements.head())
 
     # convert slcio to hits dataframe
@@ -69,6 +73,7 @@ def main():
                                      inner=ops.inner,
                                      outer=ops.outer,
                                      layers=ops.layers,
+                                     geometry_version=ops.geo,
                                      )
     mcps, _ = converter.convert()
 
@@ -102,12 +107,14 @@ def options():
     parser.add_argument("-i", default=FNAMES, help="Input slcio file or glob pattern")
     parser.add_argument("--layers", nargs="+", type=int, default=[0, 1, 2, 3, 4, 5, 6, 7], help="List of layers to consider")
     parser.add_argument("--geometry", action="store_true", help="Load compact geometry from xml")
+    parser.add_argument("--geo", type=str, default="v00", help="Geometry version of the xml, for CellID decoding")
     parser.add_argument("--inner", action="store_true", help="Include inner tracker hits in the analysis")
     parser.add_argument("--outer", action="store_true", help="Include outer tracker hits in the analysis")
+    add_sample_arguments(parser)
     return parser.parse_args()
 
 
-def get_detector_elements(detnames: list[str]) -> pd.DataFrame:
+def get_detector_elements(detnames: list[str], geometry_version: str = None) -> pd.DataFrame:
     import dd4hep, DDRec
     dd4hep.setPrintLevel(dd4hep.PrintLevel.WARNING)
     with silence_c_stdout_stderr():
@@ -116,17 +123,14 @@ def get_detector_elements(detnames: list[str]) -> pd.DataFrame:
         detector.fromCompact(XML)
         surfman = DDRec.SurfaceManager(detector)
         maps = [surfman.map(detname) for detname in detnames]
+    codec = get_codec(geometry_version)
     rows = []
     for themap in maps:
         for it, (cellid0, surface) in enumerate(themap):
             origin = surface.origin()
             area = surface.length_along_u() * CM_TO_MM * surface.length_along_v() * CM_TO_MM
             rows.append({
-                "system": np.right_shift(cellid0, 0) & 0b1_1111,
-                "side": np.right_shift(cellid0, 5) & 0b11,
-                "layer": np.right_shift(cellid0, 7) & 0b11_1111,
-                "module": np.right_shift(cellid0, 13) & 0b111_1111_1111,
-                "sensor": np.right_shift(cellid0, 24) & 0b1111_1111,
+                "cellid0": cellid0,
                 "x": origin.x() * CM_TO_MM,
                 "y": origin.y() * CM_TO_MM,
                 "z": origin.z() * CM_TO_MM,
@@ -134,6 +138,9 @@ def get_detector_elements(detnames: list[str]) -> pd.DataFrame:
             })
 
     df = pd.DataFrame(rows)
+    for name, values in codec.decode(df["cellid0"], fields=FIELDS).items():
+        df[name] = values
+    df = df.drop(columns=["cellid0"])
     df["r"] = np.sqrt(df["x"]**2 + df["y"]**2)
     df["theta"] = np.arctan2(df["r"], df["z"])
     df["eta"] = -np.log(np.tan(df["theta"] / 2))
@@ -0,0 +1,170 @@
+"""
+This module provides batched algebraic circle fits in the transverse (x, y) plane.
+Hits of many track candidates are passed as flat arrays plus CSR offsets:
+candidate i owns hits offsets[i]:offsets[i+1].
+Every fit is vectorized over all candidates, so there is no python loop per candidate.
+
+Run this module directly to benchmark against a per-candidate fit.
+"""
+
+import time
+import numpy as np
+
+SPEED_OF_LIGHT = 299.792458  # mm/ns
+MAGNETIC_FIELD = 5.0 # Tesla
+BAD_CHI2 = 1e6
+TAUBIN_ITERATIONS = 20
+
+
+def circle_from_three_points(x0, y0, x1, y1, x2, y2):
+    """
+    Circle through three points, column-wise.
+
+    Returns:
+        xc, yc, R, ok  (ok is False for collinear points)
+    """
+    r0, r1, r2 = x0**2 + y0**2, x1**2 + y1**2, x2**2 + y2**2
+    d = 2 * (x0 * (y1 - y2) + x1 * (y2 - y0) + x2 * (y0 - y1))
+    xc = np.divide(r0 * (y1 - y2) + r1 * (y2 - y0) + r2 * (y0 - y1), d)
+    yc = np.divide(r0 * (x2 - x1) + r1 * (x0 - x2) + r2 * (x1 - x0), d)
+    radius = np.sqrt((x0 - xc)**2 + (y0 - yc)**2)
+    return xc, yc, radius, d != 0
+
+
+def circle_residual2(x, y, xc, yc, radius):
+    """Squared distance from (x, y) to the circle."""
+    return (np.sqrt((x - xc)**2 + (y - yc)**2) - radius)**2
+
+
+def pt_from_radius(radius, magnetic_field=MAGNETIC_FIELD):
+    """Transverse momentum [GeV] of a unit-charge track with radius [mm]."""
+    return SPEED_OF_LIGHT * magnetic_field * radius * 1e-6
+
+
+def fit_circles(x, y, offsets, method="kasa", magnetic_field=MAGNETIC_FIELD):
+    """
+    Fit one circle per candidate to ragged hit arrays.
+
+    Args:
+        x, y: flat hit coordinates [mm]
+        offsets: CSR offsets of length n_candidates + 1
+        method: "kasa" or "taubin"
+
+    Returns:
+        xc, yc, R, pT, chi2  (one entry per candidate; chi2 is the sum of
+        squared radial residuals, and BAD_CHI2 for candidates with < 3 hits)
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    offsets = np.asarray(offsets)
+    n_hits = np.diff(offsets)
+    n_cand = len(n_hits)
+    seg = np.repeat(np.arange(n_cand), n_hits)
+
+    def mean(values):
+        return np.bincount(seg, weights=values, minlength=n_cand) / np.maximum(n_hits, 1)
+
+    # center each candidate for numerical stability
+    x_mean, y_mean = mean(x), mean(y)
+    u = x - x_mean[seg]
+    v = y - y_mean[seg]
+    z = u**2 + v**2
+    muu, mvv, muv = mean(u * u), mean(v * v), mean(u * v)
+    muz, mvz = mean(u * z), mean(v * z)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        if method == "kasa":
+            det = muu * mvv - muv**2
+            a = 0.5 * (muz * mvv - mvz * muv) / det
+            b = 0.5 * (mvz * muu - muz * muv) / det
+            radius = np.sqrt(a**2 + b**2 + muu + mvv)
+        elif method == "taubin":
+            a, b, radius = _taubin(muu, mvv, muv, muz, mvz, mean(z * z))
+        else:
+            raise ValueError(f"Unknown circle fit method: {method}")
+
+    xc = a + x_mean
+    yc = b + y_mean
+    ok = (n_hits >= 3) & np.isfinite(radius)
+    chi2 = np.bincount(seg, weights=circle_residual2(x, y, xc[seg], yc[seg], radius[seg]), minlength=n_cand)
+    chi2 = np.where(ok, chi2, BAD_CHI2)
+    return xc, yc, radius, pt_from_radius(radius, magnetic_field), chi2
+
+
+def _taubin(muu, mvv, muv, muz, mvz, mzz):
+    """
+    Taubin fit on centered moments, following Chernov's Newton iteration
+    on the characteristic polynomial, run for all candidates at once.
+    """
+    mz = muu + mvv
+    cov_uv = muu * mvv - muv**2
+    var_z = mzz - mz**2
+    a3 = 4 * mz
+    a2 = -3 * mz**2 - mzz
+    a1 = var_z * mz + 4 * cov_uv * mz - muz**2 - mvz**2
+    a0 = muz * (muz * mvv - mvz * muv) + mvz * (mvz * muu - muz * muv) - var_z * cov_uv
+
+    root = np.zeros_like(mz)
+    poly = a0.copy()
+    active = np.isfinite(poly)
+    for _ in range(TAUBIN_ITERATIONS):
+        dpoly = a1 + root * (2 * a2 + 3 * a3 * root)
+        step = np.where(active, poly / dpoly, 0.0)
+        new_root = root - step
+        new_poly = a0 + new_root * (a1 + new_root * (a2 + new_root * a3))
+        improved = active & np.isfinite(new_root) & (np.abs(new_poly) < np.abs(poly))
+        root = np.where(improved, new_root, root)
+        poly = np.where(improved, new_poly, poly)
+        active = improved & (step != 0)
+        if not active.any():
+            break
+
+    det = root**2 - root * mz + cov_uv
+    a = (muz * (mvv - root) - mvz * muv) / det / 2
+    b = (mvz * (muu - root) - muz * muv) / det / 2
+    return a, b, np.sqrt(a**2 + b**2 + mz)
+
+
+def benchmark(n_cand=20_000, hits_per_cand=(4, 16), seed=0):
+    rng = np.random.default_rng(seed)
+    n_hits = rng.integers(*hits_per_cand, size=n_cand)
+    offsets = np.concatenate([[0], np.cumsum(n_hits)])
+    seg = np.repeat(np.arange(n_cand), n_hits)
+    radius = rng.uniform(800, 20_000, size=n_cand)
+    phi0 = rng.uniform(0, 2 * np.pi, size=n_cand)
+    xc, yc = radius * np.cos(phi0), radius * np.sin(phi0)
+    hit_r = rng.uniform(30, 1500, size=len(seg))
+    angle = phi0[seg] + np.pi - 2 * np.arcsin(hit_r / (2 * radius[seg]))
+    x = xc[seg] + radius[seg] * np.cos(angle) + rng.normal(0, 0.01, size=len(seg))
+    y = yc[seg] + radius[seg] * np.sin(angle) + rng.normal(0, 0.01, size=len(seg))
+
+    start = time.perf_counter()
+    loop_r = np.empty(n_cand)
+    for i in range(n_cand):
+        sl = slice(offsets[i], offsets[i + 1])
+        A = np.column_stack([x[sl], y[sl], np.ones(n_hits[i])])
+        D, E, F = np.linalg.lstsq(A, -(x[sl]**2 + y[sl]**2), rcond=None)[0]
+        loop_r[i] = np.sqrt((D**2 + E**2) / 4.0 - F)
+    t_loop = time.perf_counter() - start
+    print(f"per-candidate lstsq: {t_loop:.3f} s for {n_cand} candidates")
+
+    for method in ["kasa", "taubin"]:
+        start = time.perf_counter()
+        _, _, fit_r, _, chi2 = fit_circles(x, y, offsets, method=method)
+        t_fit = time.perf_counter() - start
+        rel = np.median(np.abs(fit_r / radius - 1))
+        print(f"batched {method}: {t_fit:.3f} s ({t_loop / t_fit:.0f}x), median |dR/R| = {rel:.2e}, "
+              f"mean chi2 = {chi2.mean():.2e} mm^2")
+        if method == "kasa":
+            # same algebraic objective as the per-candidate lstsq
+            print(f"  max |R - R_lstsq| / R = {np.max(np.abs(fit_r - loop_r) / loop_r):.2e}")
+
+    start = time.perf_counter()
+    for _ in range(n_cand // 1000):
+        circle_from_three_points(x[offsets[:-1]], y[offsets[:-1]], x[offsets[:-1] + 1],
+                                 y[offsets[:-1] + 1], x[offsets[:-1] + 2], y[offsets[:-1] + 2])
+    print(f"three-point circles: {(time.perf_counter() - start) / (n_cand // 1000):.4f} s per {n_cand} candidates")
+
+
+if __name__ == "__main__":
+    benchmark()
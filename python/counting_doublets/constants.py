@@ -279,3 +279,6 @@ MAX_T4_DPHI = 0.25 * 2
 MAX_T4_DETA = 0.025 * 2
 N_T4_PHI_SLICES = int(2 * DETECTOR_MAX_PHI / MAX_T4_DPHI)
 N_T4_ETA_SLICES = int(2 * DETECTOR_MAX_ETA / MAX_T4_DETA)
+# Fine eta/phi bins of MDs and T2s. The slices of both stages are integer divisions of them
+N_FINE_PHI_BINS = int(np.lcm(N_LS_PHI_SLICES, N_T4_PHI_SLICES))
+N_FINE_ETA_BINS = int(np.lcm(N_LS_ETA_SLICES, N_T4_ETA_SLICES))
@@ -0,0 +1,211 @@
+"""
+Scan MD and T2 cut working points without rebuilding the objects.
+
+main.py --cut-scale 3 --write-cut-vars FILE builds MDs and T2s once, with every cut
+loosened by the scale, and stores only the cut variables of each object (and the
+MD variables of the two MDs of each T2) in a compressed npz file.
+
+Here, the cut variables of a signal and a background run are scanned over working
+points. For an object, the ratio of each |variable| to its nominal cut in constants.py
+is computed once. The object passes the working point "all cuts scaled by s" if the
+largest ratio is below s, and passes "one cut scaled by s, others nominal" if the other
+ratios are below 1 and that ratio is below s. Pass counts over the whole grid are
+therefore one sort and one searchsorted per doublelayer.
+
+Signal efficiency is over the first-exit MDs (doublet_first_exit) and T2s (ls_first_exit),
+and the background rate is per BIB event. Scales above the build scale are not valid.
+
+Run me like:
+> python main.py --signal --sim --outer --geo v05 --cut-scale 3 --write-cut-vars signal.npz
+> python main.py --background10 --sim --outer --geo v05 --cut-scale 3 --write-cut-vars bib.npz
+> python cutscan.py --signal signal.npz --background bib.npz --geo v05 --sim
+"""
+import argparse
+import json
+import numpy as np
+import pandas as pd
+import logging
+logger = logging.getLogger(__name__)
+
+import matplotlib.pyplot as plt
+from matplotlib.backends.backend_pdf import PdfPages
+
+from constants import MD_DZ_CUT, MD_DR_CUT
+from constants import LS_DZ_CUT, LS_DR_CUT, LS_DTHETA_RZ_CUT, LS_CHI2_XY_CUT
+
+SCALES = np.round(np.arange(0.1, 3.01, 0.1), 2)
+ALL = "all"
+
+# cut variable: (column of the objects, nominal cuts, doublelayer of the cut)
+MD_VARIABLES = {
+    "md_dz": ("doublet_dz", MD_DZ_CUT),
+    "md_dr": ("doublet_dr", MD_DR_CUT),
+}
+T2_VARIABLES = {
+    "ls_dz": ("ls_dz", LS_DZ_CUT),
+    "ls_dr": ("ls_dr", LS_DR_CUT),
+    "ls_dtheta_rz": ("ls_dtheta_rz", LS_DTHETA_RZ_CUT),
+    "ls_chi2_xy": ("ls_chi2_012", LS_CHI2_XY_CUT),
+}
+# the MDs of a T2 have to pass the MD cuts of their own doublelayers
+T2_MD_VARIABLES = {
+    "md_dz_lower": ("ls_dz_lower", MD_DZ_CUT, "ls_doublelayer_lower"),
+    "md_dr_lower": ("ls_dr_lower", MD_DR_CUT, "ls_doublelayer_lower"),
+    "md_dz_upper": ("ls_dz_upper", MD_DZ_CUT, "ls_doublelayer_upper"),
+    "md_dr_upper": ("ls_dr_upper", MD_DR_CUT, "ls_doublelayer_upper"),
+}
+
+
+def options():
+    parser = argparse.ArgumentParser(usage=__doc__, formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--signal", type=str, required=True, help="Cut variables of signal, from main.py --write-cut-vars")
+    parser.add_argument("--background", type=str, required=True, help="Cut variables of background, from main.py --write-cut-vars")
+    parser.add_argument("--geo", type=str, required=True, help="Geometry version of the nominal cuts (e.g. v01, v05)")
+    parser.add_argument("--sim", action="store_true", help="Nominal cuts for sim hits")
+    parser.add_argument("--smear", type=str, default="00um", help="Nominal cuts for digi hits with this smear")
+    parser.add_argument("--scales", type=float, nargs="+", default=list(SCALES), help="Scales of the nominal cuts to scan")
+    parser.add_argument("--pdf", type=str, default="cutscan.pdf", help="Output pdf of the ROC curves")
+    parser.add_argument("--csv", type=str, default="cutscan.csv", help="Output csv of the working points")
+    return parser.parse_args()
+
+
+def main():
+    logging.basicConfig(level=logging.INFO,
+                        format="%(asctime)s [%(levelname)s] %(message)s")
+    ops = options()
+    key = (ops.geo, "sim") if ops.sim else (ops.geo, "digi", ops.smear)
+    signal = read_cut_variables(ops.signal)
+    background = read_cut_variables(ops.background)
+    scales = np.array(ops.scales)
+    build_scale = min(signal["cut_scale"], background["cut_scale"])
+    if np.any(scales > build_scale):
+        logger.warning(f"Dropping scales above {build_scale}, the loosest cuts of the inputs")
+        scales = scales[scales <= build_scale]
+
+    results = scan(signal, background, key, scales)
+    results.to_csv(ops.csv, index=False)
+    logger.info(f"Wrote {len(results)} working points to {ops.csv}")
+    plot_roc(results, ops.pdf)
+    logger.info(f"Wrote ROC curves to {ops.pdf}")
+
+
+def cut_variables(doublets: pd.DataFrame, t2s: pd.DataFrame, signal: bool) -> dict[str, np.ndarray]:
+    """The columns of MDs and T2s which the cuts act on, as compact arrays."""
+    arrays = {}
+    for prefix, df, columns, truth in [
+        ("md", doublets, ["doublet_doublelayer", "doublet_dz", "doublet_dr"], "doublet_first_exit"),
+        ("t2", t2s, ["ls_doublelayer", "ls_doublelayer_lower", "ls_doublelayer_upper", "ls_ok_dphi"]
+                    + [col for col, _ in T2_VARIABLES.values()]
+                    + [col for col, _, _ in T2_MD_VARIABLES.values()], "ls_first_exit"),
+    ]:
+        for col in columns:
+            values = df[col].to_numpy()
+            if values.dtype.kind == "f":
+                values = np.abs(values).astype(np.float32)
+            elif values.dtype.kind in "iu":
+                values = values.astype(np.int8)
+            arrays[f"{prefix}/{col}"] = values
+        if signal:
+            arrays[f"{prefix}/first_exit"] = df[truth].to_numpy(dtype=bool)
+    return arrays
+
+
+def write_cut_variables(path: str, doublets: pd.DataFrame, t2s: pd.DataFrame, signal: bool, n_events: int, cut_scale: float):
+    metadata = json.dumps({"signal": signal, "n_events": n_events, "cut_scale": cut_scale})
+    np.savez_compressed(path, __metadata__=np.array(metadata), **cut_variables(doublets, t2s, signal))
+
+
+def read_cut_variables(path: str) -> dict:
+    with np.load(path) as npz:
+        data = json.loads(str(npz["__metadata__"]))
+        for obj in ["md", "t2"]:
+            data[obj] = {name.split("/", 1)[1]: npz[name] for name in npz.files if name.startswith(f"{obj}/")}
+    return data
+
+
+def ratios(arrays: dict[str, np.ndarray], variables: dict, key: tuple, doublelayer: str) -> dict[str, np.ndarray]:
+    """|variable| / nominal cut of each object, with nominal cuts of 0 (disabled) failing everything."""
+    out = {}
+    for name, (col, cuts, *dl_col) in variables.items():
+        nominal = cuts[key][arrays[dl_col[0] if dl_col else doublelayer]].astype(np.float64)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            out[name] = np.where(nominal > 0, arrays[col] / nominal, np.inf)
+    return out
+
+
+def n_passing(values: np.ndarray, scales: np.ndarray) -> np.ndarray:
+    """Number of values below each scale."""
+    return np.searchsorted(np.sort(values), scales, side="left")
+
+
+def scan_object(arrays: dict[str, np.ndarray], variables: dict, key: tuple, doublelayer: str, scales: np.ndarray, extra: np.ndarray = None):
+    """
+    Pass counts of each doublelayer, for all cuts scaled together ("all"),
+    and for each cut scaled alone. Returns {(doublelayer, variable): counts per scale}.
+    extra are fixed requirements, like the dphi requirement of T2s.
+    """
+    ratio = ratios(arrays, variables, key, doublelayer)
+    names = list(ratio)
+    matrix = np.column_stack([ratio[name] for name in names]) if len(arrays[doublelayer]) else np.zeros((0, len(names)))
+    if extra is not None:
+        matrix = np.where(extra[:, None], matrix, np.inf)
+    counts = {}
+    dls = arrays[doublelayer]
+    for dl in np.unique(dls):
+        rows = matrix[dls == dl]
+        counts[(dl, ALL)] = n_passing(rows.max(axis=1), scales)
+        for i_name, name in enumerate(names):
+            others = np.delete(rows, i_name, axis=1).max(axis=1, initial=0)
+            counts[(dl, name)] = n_passing(rows[others < 1, i_name], scales)
+    return counts
+
+
+def scan(signal: dict, background: dict, key: tuple, scales: np.ndarray = SCALES) -> pd.DataFrame:
+    """Signal efficiency and background rate of every working point, for MDs and T2s of each doublelayer."""
+    rows = []
+    for obj, variables in [("md", MD_VARIABLES), ("t2", {**T2_VARIABLES, **T2_MD_VARIABLES})]:
+        doublelayer = "doublet_doublelayer" if obj == "md" else "ls_doublelayer"
+        sig = {col: values[signal[obj]["first_exit"]] for col, values in signal[obj].items()}
+        bkg = background[obj]
+        extra = lambda arrays: arrays["ls_ok_dphi"].astype(bool) if obj == "t2" else None
+        n_sig = scan_object(sig, variables, key, doublelayer, scales, extra(sig))
+        n_bkg = scan_object(bkg, variables, key, doublelayer, scales, extra(bkg))
+        totals = dict(zip(*np.unique(sig[doublelayer], return_counts=True)))
+        for (dl, name), counts in n_sig.items():
+            background_counts = n_bkg.get((dl, name), np.zeros(len(scales), dtype=np.int64))
+            for scale, n_s, n_b in zip(scales, counts, background_counts):
+                rows.append({
+                    "object": obj,
+                    "doublelayer": int(dl),
+                    "variable": name,
+                    "scale": scale,
+                    "n_signal": int(n_s),
+                    "efficiency": n_s / totals[dl],
+                    "n_background": int(n_b),
+                    "rate": n_b / background["n_events"],
+                })
+    return pd.DataFrame(rows)
+
+
+def plot_roc(results: pd.DataFrame, pdf: str):
+    """Efficiency versus background rate per object and doublelayer, one curve per scanned variable."""
+    with PdfPages(pdf) as fout:
+        for (obj, dl), df in results.groupby(["object", "doublelayer"]):
+            fig, ax = plt.subplots(figsize=(8, 8))
+            for name, curve in df.groupby("variable", sort=False):
+                lw = 2 if name == ALL else 1
+                ax.plot(curve["rate"], curve["efficiency"], marker=".", linewidth=lw, label=name)
+                nominal = curve[np.isclose(curve["scale"], 1.0)]
+                ax.scatter(nominal["rate"], nominal["efficiency"], marker="*", s=150, color="black", zorder=3)
+            ax.set_xscale("symlog", linthresh=1)
+            ax.set_xlabel(f"Background {obj.upper()}s per event")
+            ax.set_ylabel(f"Signal {obj.upper()} efficiency")
+            ax.set_title(f"{obj.upper()}s, doublelayer {dl} (star: nominal cuts)")
+            ax.legend(fontsize=10)
+            ax.grid()
+            fout.savefig()
+            plt.close()
+
+
+if __name__ == "__main__":
+    main()
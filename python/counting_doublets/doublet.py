@@ -7,17 +7,19 @@ logger = logging.getLogger(__name__)
 from constants import MD_DZ_CUT, MD_DR_CUT
 from constants import MAGNETIC_FIELD, SPEED_OF_LIGHT
 from constants import BYTE_TO_MB, MEV_TO_GEV, NO_MCP
-from constants import N_LS_PHI_SLICES, N_LS_ETA_SLICES, DETECTOR_MAX_ETA, DETECTOR_MAX_PHI
+from constants import N_LS_PHI_SLICES, N_LS_ETA_SLICES, N_FINE_PHI_BINS, N_FINE_ETA_BINS
+from binning import fine_bins, coarse_bins
 
 class DoubletMaker:
 
 
-    def __init__(self, geometry_version: str, sim: bool, smear: str, signal: bool, cut_doublets: bool, simhits: pd.DataFrame):
+    def __init__(self, geometry_version: str, sim: bool, smear: str, signal: bool, cut_doublets: bool, simhits: pd.DataFrame, cut_scale: float = 1.0):
         self.signal = signal
         self.cut_doublets = cut_doublets
         key = (geometry_version, "sim") if sim else (geometry_version, "digi", smear)
-        self.MD_DZ_CUT = MD_DZ_CUT[key]
-        self.MD_DR_CUT = MD_DR_CUT[key]
+        # cut_scale > 1 loosens the cuts, e.g. to scan working points afterwards (see cutscan.py)
+        self.MD_DZ_CUT = MD_DZ_CUT[key] * cut_scale
+        self.MD_DR_CUT = MD_DR_CUT[key] * cut_scale
         self.df = self.make_doublets(simhits)
 
 
@@ -114,8 +116,11 @@ class DoubletMaker:
             doublets["doublet_phi"] = np.arctan2(doublets["doublet_y"], doublets["doublet_x"])
             doublets["doublet_theta"] = np.arctan2(doublets["doublet_r"], doublets["doublet_z"])
             doublets["doublet_eta"] = -np.log(np.tan(doublets["doublet_theta"] / 2))
-            doublets["doublet_phi_slice"] = np.floor((doublets["doublet_phi"] + DETECTOR_MAX_PHI) / (2 * DETECTOR_MAX_PHI) * N_LS_PHI_SLICES).astype(np.int16)
-            doublets["doublet_eta_slice"] = np.floor((doublets["doublet_eta"] + DETECTOR_MAX_ETA) / (2 * DETECTOR_MAX_ETA) * N_LS_ETA_SLICES).astype(np.int16)
+            eta_bin, phi_bin = fine_bins(doublets["doublet_eta"], doublets["doublet_phi"])
+            doublets["doublet_eta_bin"] = eta_bin
+            doublets["doublet_phi_bin"] = phi_bin
+            doublets["doublet_eta_slice"] = coarse_bins(eta_bin, N_FINE_ETA_BINS, N_LS_ETA_SLICES)
+            doublets["doublet_phi_slice"] = coarse_bins(phi_bin, N_FINE_PHI_BINS, N_LS_PHI_SLICES)
 
             # guess charge from dphi:
             # positively charged particles have negative dphi, and vice versa
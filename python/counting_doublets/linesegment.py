@@ -6,9 +6,11 @@ logger = logging.getLogger(__name__)
 from constants import LS_DZ_CUT, LS_DR_CUT
 from constants import LS_DTHETA_RZ_CUT, LS_DTHETA_XY_CUT, LS_CHI2_XY_CUT
 from constants import BYTE_TO_MB, NO_MCP
-from constants import N_LS_PHI_SLICES
-from constants import DETECTOR_MAX_PHI, DETECTOR_MAX_ETA
+from constants import N_LS_PHI_SLICES, N_LS_ETA_SLICES
 from constants import N_T4_PHI_SLICES, N_T4_ETA_SLICES
+from constants import N_FINE_PHI_BINS, N_FINE_ETA_BINS
+from binning import CellIndex, fine_bins, coarse_bins
+from circlefit import circle_from_three_points, circle_residual2
 
 class LineSegment:
 
@@ -18,7 +20,7 @@ class LineSegment:
     #  Layers 12, 34, ... grouped by doublet_doublelayer_plus_1_mod_2
     #
 
-    def __init__(self, geometry_version: str, sim: bool, smear: str, doublets: pd.DataFrame, signal: bool, cut_line_segments: bool):
+    def __init__(self, geometry_version: str, sim: bool, smear: str, doublets: pd.DataFrame, signal: bool, cut_line_segments: bool, cut_scale: float = 1.0):
         self.df = None
         self.signal = signal
         self.cut_line_segments = cut_line_segments
@@ -28,11 +30,11 @@ class LineSegment:
         logger.info(f"Making linesegments with doublets memory {memory:.1f} MB ...")
 
         key = (geometry_version, "sim") if sim else (geometry_version, "digi", smear)
-        self.LS_DZ_CUT = LS_DZ_CUT[key]
-        self.LS_DR_CUT = LS_DR_CUT[key]
-        self.LS_DTHETA_RZ_CUT = LS_DTHETA_RZ_CUT[key]
-        self.LS_DTHETA_XY_CUT = LS_DTHETA_XY_CUT[key]
-        self.LS_CHI2_XY_CUT = LS_CHI2_XY_CUT[key]
+        self.LS_DZ_CUT = LS_DZ_CUT[key] * cut_scale
+        self.LS_DR_CUT = LS_DR_CUT[key] * cut_scale
+        self.LS_DTHETA_RZ_CUT = LS_DTHETA_RZ_CUT[key] * cut_scale
+        self.LS_DTHETA_XY_CUT = LS_DTHETA_XY_CUT[key] * cut_scale
+        self.LS_CHI2_XY_CUT = LS_CHI2_XY_CUT[key] * cut_scale
 
         self.doublets = doublets.copy()
         self.prep_doublets()
@@ -164,14 +166,19 @@ class LineSegment:
                 entire_lower = df[ df[lower_vs_upper[start]] == 0 ]
                 entire_upper = df[ df[lower_vs_upper[start]] != 0 ]
 
-                # get lower data for each eta,phi slice
+                # index upper data by eta,phi slice, and get lower data for each eta,phi slice
+                if self.cut_line_segments:
+                    cells = CellIndex(entire_upper["doublet_eta_slice"].to_numpy(),
+                                      entire_upper["doublet_phi_slice"].to_numpy(),
+                                      N_LS_ETA_SLICES,
+                                      N_LS_PHI_SLICES)
                 subgroups = entire_lower.groupby(subgroup_cols)
                 n_subgroup = len(subgroups)
                 for i_subgroup, (subcols, lower) in enumerate(subgroups):
 
                     # if not cutting line segments, then take all upper doublets for this group
                     if not self.cut_line_segments:
-                        ok = np.ones(len(entire_upper), dtype=bool)
+                        upper = entire_upper
 
                     # else, only consider upper in the same (or neighbor) eta/phi slice as lower
                     else:
@@ -180,16 +187,8 @@ class LineSegment:
                         else:
                             [_, _, eta_slice, phi_slice] = subcols
 
-                        # get upper data for the same phi slice
-                        eta_ok = np.array([eta_slice-1, eta_slice, eta_slice+1]).astype(np.int16)
-                        phi_ok = np.array([phi_slice-1, phi_slice, phi_slice+1]).astype(np.int16)
-                        phi_ok = phi_ok % N_LS_PHI_SLICES
-                        ok = (
-                            entire_upper["doublet_eta_slice"].isin(eta_ok) &
-                            entire_upper["doublet_phi_slice"].isin(phi_ok)
-                        )
-
-                    upper = entire_upper[ok]
+                        # get upper data for the same (or neighbor) eta/phi slice
+                        upper = entire_upper.iloc[cells.neighbours(eta_slice, phi_slice)]
 
                     # get all combinations of lower and upper
                     segments = lower.merge(
@@ -246,8 +245,9 @@ class LineSegment:
                     segments["ls_phi"] = np.arctan2(segments["ls_y"], segments["ls_x"])
                     segments["ls_theta"] = np.arctan2(segments["ls_r"], segments["ls_z"])
                     segments["ls_eta"] = -np.log(np.tan(segments["ls_theta"] / 2))
-                    segments["ls_phi_slice"] = np.floor((segments["ls_phi"] + DETECTOR_MAX_PHI) / (2 * DETECTOR_MAX_PHI) * N_T4_PHI_SLICES).astype(np.int16)
-                    segments["ls_eta_slice"] = np.floor((segments["ls_eta"] + DETECTOR_MAX_ETA) / (2 * DETECTOR_MAX_ETA) * N_T4_ETA_SLICES).astype(np.int16)
+                    eta_bin, phi_bin = fine_bins(segments["ls_eta"], segments["ls_phi"])
+                    segments["ls_eta_slice"] = coarse_bins(eta_bin, N_FINE_ETA_BINS, N_T4_ETA_SLICES)
+                    segments["ls_phi_slice"] = coarse_bins(phi_bin, N_FINE_PHI_BINS, N_T4_PHI_SLICES)
 
                     # assign more features
                     segments["ls_ddr"] = segments["doublet_dr_upper"] - segments["doublet_dr_lower"]
@@ -275,25 +275,17 @@ class LineSegment:
 
                     # find the circle (radius, x_center, y_center) formed from the first three hits
                     BAD_CHI2 = 1e6
-                    circle_d = 2 * (segments["ls_x_0"] * (segments["ls_y_1"] - segments["ls_y_2"]) +
-                                    segments["ls_x_1"] * (segments["ls_y_2"] - segments["ls_y_0"]) +
-                                    segments["ls_x_2"] * (segments["ls_y_0"] - segments["ls_y_1"]))
-                    circle_x = np.divide(segments["ls_r_0"]**2 * (segments["ls_y_1"] - segments["ls_y_2"]) +
-                                         segments["ls_r_1"]**2 * (segments["ls_y_2"] - segments["ls_y_0"]) +
-                                         segments["ls_r_2"]**2 * (segments["ls_y_0"] - segments["ls_y_1"]),
-                                         circle_d)
-                    circle_y = np.divide(segments["ls_r_0"]**2 * (segments["ls_x_2"] - segments["ls_x_1"]) +
-                                         segments["ls_r_1"]**2 * (segments["ls_x_0"] - segments["ls_x_2"]) +
-                                         segments["ls_r_2"]**2 * (segments["ls_x_1"] - segments["ls_x_0"]),
-                                         circle_d)
-                    circle_r = np.sqrt((segments["ls_x_0"] - circle_x)**2 + (segments["ls_y_0"] - circle_y)**2)
-                    circle_ok = circle_d != 0
+                    circle_x, circle_y, circle_r, circle_ok = circle_from_three_points(
+                        segments["ls_x_0"], segments["ls_y_0"],
+                        segments["ls_x_1"], segments["ls_y_1"],
+                        segments["ls_x_2"], segments["ls_y_2"],
+                    )
                     if np.any(~circle_ok):
                         logger.warning(f"Found {np.sum(~circle_ok)} invalid circles with circle_d = 0")
-                    circle_diff = np.sqrt((segments["ls_x_3"] - circle_x)**2 + (segments["ls_y_3"] - circle_y)**2) - circle_r
 
                     # calculate the distance from (x_3, y_3) to the circle
-                    segments["ls_chi2_012"] = np.where(circle_ok, circle_diff**2, BAD_CHI2)
+                    circle_diff2 = circle_residual2(segments["ls_x_3"], segments["ls_y_3"], circle_x, circle_y, circle_r)
+                    segments["ls_chi2_012"] = np.where(circle_ok, circle_diff2, BAD_CHI2)
 
                     # rename some things
                     rename = {
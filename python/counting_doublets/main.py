@@ -4,6 +4,7 @@ Steering file for counting doublets in a LST-friendly MAIA detector
 import argparse
 from glob import glob
 import os
+import sys
 import pandas as pd
 import time
 import logging
@@ -11,14 +12,19 @@ logger = logging.getLogger(__name__)
 
 from datasets import get_filepaths, parse_filepaths
 from slcio import HitMaker
-from timelapse import Timelapse
+from timelapse import Timelapse, N_FRAMES, DELTA_T
 from doublet import DoubletMaker
 from plot import Plotter
 from modulemap import ModuleMap
 from linesegment import LineSegment
 from t4 import T4Maker
+from cutscan import write_cut_variables
 from constants import SIGNAL, NO_MCP
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from samples import add_sample_arguments, files_from_options
+from slcio_reader import add_cache_arguments, cache_from_options
+
 
 def main():
     logging.basicConfig(level=logging.INFO,
@@ -35,6 +41,8 @@ def main():
     if ops.i:
         fnames = parse_filepaths(ops.i)
     else:
+        fnames = files_from_options(ops)
+    if fnames is None:
         fnames = get_filepaths(
             geometry_version=ops.geo,
             signal=ops.signal,
@@ -57,6 +65,8 @@ def main():
         raise ValueError("At least one of --sim or --digi must be specified")
     if ops.sim and ops.digi:
         raise ValueError("Only one of --sim or --digi can be specified, not both")
+    if ops.write_cut_vars and (ops.read_mds or ops.read_t2s):
+        raise ValueError("--write-cut-vars needs MDs and T2s built with --cut-scale, not read with --read-mds or --read-t2s")
 
     # log some info
     logger.info(f"Detected {'signal' if signal else 'background'} files")
@@ -93,6 +103,8 @@ def main():
                                 inner=ops.inner,
                                 outer=ops.outer,
                                 layers=ops.layers,
+                                geometry_version=ops.geo,
+                                cache=cache_from_options(ops),
                                 )
             mcps, simhits = converter.convert()
 
@@ -118,6 +130,7 @@ def main():
                 smear=ops.smear,
                 cut_doublets=cut_mds,
                 simhits=simhits,
+                cut_scale=ops.cut_scale,
             ).df
 
     # writing mini-doublets to pickle file
@@ -139,6 +152,7 @@ def main():
                 signal=signal,
                 cut_line_segments=cut_t2s,
                 doublets=doublets,
+                cut_scale=ops.cut_scale,
             ).df
 
     # writing T2s (line segments) to pickle file
@@ -146,6 +160,17 @@ def main():
         logger.info("Saving T2s (line segments) as pickle file ...")
         t2s.to_pickle(ops.write_t2s)
 
+    # cut variables for scanning working points with cutscan.py
+    if ops.write_cut_vars:
+        logger.info(f"Saving cut variables of MDs and T2s to {ops.write_cut_vars} ...")
+        write_cut_variables(ops.write_cut_vars,
+                            doublets=doublets,
+                            t2s=t2s,
+                            signal=signal,
+                            n_events=len(simhits[["file", "i_event"]].drop_duplicates()),
+                            cut_scale=ops.cut_scale,
+                            )
+
     # make t4s
     with Timer() as t4_time:
         t4s = None
@@ -178,7 +203,14 @@ def main():
 
     if ops.timelapse:
         logger.info("Creating timelapse gif ...")
-        tl = Timelapse(df=simhits, event=0, gif="event.gif")
+        tl = Timelapse(
+            df=simhits,
+            event=None,
+            gif="event.gif",
+            cumulative=ops.timelapse_cumulative,
+            delta_t=ops.timelapse_step,
+            n_frames=round(N_FRAMES * DELTA_T / ops.timelapse_step),
+        )
 
     # log timing info
     logger.info(f"Timing info (in seconds):")
@@ -204,6 +236,8 @@ def options():
     parser.add_argument("--layers", nargs="+", type=int, default=[0, 1, 2, 3, 4, 5, 6, 7], help="List of layers to consider")
     parser.add_argument("--geometry", action="store_true", help="Load compact geometry from xml")
     parser.add_argument("--timelapse", action="store_true", help="Create timelapse gif")
+    parser.add_argument("--timelapse-cumulative", action="store_true", help="Show all hits up to the end of each timelapse frame")
+    parser.add_argument("--timelapse-step", type=float, default=DELTA_T, help="Time step of the timelapse frames [ns]")
     parser.add_argument("--inner", action="store_true", help="Include inner tracker hits in the analysis")
     parser.add_argument("--outer", action="store_true", help="Include outer tracker hits in the analysis")
     parser.add_argument("--sim", action="store_true", help="Use sim hits in the analysis")
@@ -221,12 +255,16 @@ def options():
     parser.add_argument("--write-mds", type=str, help="Write mini-doublets to pickle file")
     parser.add_argument("--read-t2s", type=str, help="Read T2s (line segments) from pickle file")
     parser.add_argument("--write-t2s", type=str, help="Write T2s (line segments) to pickle file")
+    parser.add_argument("--cut-scale", type=float, default=1.0, help="Scale all MD and T2 cuts, e.g. 3 to build loose objects for cutscan.py")
+    parser.add_argument("--write-cut-vars", type=str, help="Write the cut variables of MDs and T2s to npz file, for cutscan.py (not with --read-mds/--read-t2s)")
     parser.add_argument("--geo", type=str, help="Version of geometry to use for cuts (e.g. v01, v04)", required=True)
     parser.add_argument("--smear", type=str, default="00um", help="Smear value to use for digi hits (e.g. 10um)")
     parser.add_argument("--signal", action="store_true", help="Use signal files in the analysis")
     parser.add_argument("--background10", action="store_true", help="Use background files (10 percent) in the analysis")
     parser.add_argument("--background100", action="store_true", help="Use background files (100 percent) in the analysis")
     parser.add_argument("--debug", action="store_true", help="Print some debug information")
+    add_sample_arguments(parser)
+    add_cache_arguments(parser)
     return parser.parse_args()
 
 
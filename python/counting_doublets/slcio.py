@@ -1,6 +1,7 @@
 import contextlib
 import os
 import sys
+import time
 import numpy as np
 import pandas as pd
 import multiprocessing as mp
@@ -19,10 +20,55 @@ from constants import MIN_COSTHETA, MIN_SIMHIT_PT_FRACTION, MAX_TIME
 from constants import INNER_TRACKER_BARREL, OUTER_TRACKER_BARREL
 from constants import NICKNAMES
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from cellid import FIELDS, codec_from_collection, get_codec
+from hitcache import HitCache
+from samples import Registry, read_header
+from slcio_reader import cache_entries, read_cached_tables, write_cached_tables
+
 _detector = None
 _surfman = None
 _maps = None
 
+TASKS_PER_PROCESS = 4
+# bump when the conversion changes, to invalidate the cached tables
+CACHE_VERSION = 1
+CACHE_TABLES = ["mcps", "simhits"]
+MIN_EVENTS_PER_TASK = 50
+MCP_ORDER = [
+    "file",
+    "i_event",
+    "i_mcp",
+]
+SIMHIT_ORDER = [
+    "file",
+    "i_event",
+    "i_mcp",
+    "simhit_system",
+    "simhit_layer",
+    "simhit_module",
+    "simhit_sensor",
+]
+# dtypes of the raw simhit table, for event ranges without any simhit
+SIMHIT_DTYPES = {
+    "file": np.int64,
+    "i_event": np.int64,
+    "i_mcp": np.int64,
+    "simhit_x": np.float64,
+    "simhit_y": np.float64,
+    "simhit_z": np.float64,
+    "simhit_cellid0": np.int64,
+    "simhit_inside_bounds": np.int64,
+    "simhit_t_corrected": np.float64,
+}
+SIGNAL_SIMHIT_DTYPES = {
+    **SIMHIT_DTYPES,
+    **{name: np.float64 for name in ["simhit_px", "simhit_py", "simhit_pz", "simhit_pathlength", "simhit_distance", "simhit_t", "simhit_e"]},
+    **{name: np.float64 for name in ["mcp_px", "mcp_py", "mcp_pz", "mcp_q"]},
+    "mcp_pdg": np.int64,
+    **{f"mcp_{point}_{axis}": np.float64 for point in ["vertex", "endpoint"] for axis in "xyz"},
+}
+
 class HitMaker:
 
     def __init__(
@@ -34,6 +80,8 @@ class HitMaker:
             inner: bool,
             outer: bool,
             layers: list[int],
+            geometry_version: str = None,
+            cache: HitCache = None,
         ):
         self.slcio_file_paths = slcio_file_paths
         self.load_geometry = load_geometry
@@ -42,12 +90,12 @@ class HitMaker:
         self.inner = inner
         self.outer = outer
         self.layers = layers
+        self.geometry_version = geometry_version
+        self.cache = cache
 
 
     def convert(self) -> pd.DataFrame:
         mcps, simhits = self.convert_all_files()
-        mcps = sort_mcps(mcps)
-        simhits = sort_simhits(simhits)
         announce_inside_bounds(simhits)
         memory_usage = simhits.memory_usage(deep=True).sum() * BYTE_TO_MB
         logger.info(f"simhits.memory_usage: {memory_usage:.1f} MB")
@@ -61,36 +109,204 @@ class HitMaker:
 
 
     def convert_all_files(self) -> pd.DataFrame:
+        """
+        Whole files are cached, so the cache does not depend on how the files are split into tasks.
+        Files missing from the cache are converted, and the event ranges of each are merged before caching.
+        """
         logger.info(f"Converting {len(self.slcio_file_paths)} slcio files to a DataFrame ...")
-        initializer = init_worker if self.load_geometry else init_dummy
-        processes = min(mp.cpu_count(), len(self.slcio_file_paths))
-        logger.info(f"Using {processes} processes for conversion ...")
-        with mp.Pool(processes=processes, initializer=initializer) as pool:
-            n_map = len(self.slcio_file_paths)
-            file_numbers = list(range(n_map))
-            load_geometry = [self.load_geometry]*n_map
-            signal = [self.signal]*n_map
-            sim = [self.sim]*n_map
-            inner = [self.inner]*n_map
-            outer = [self.outer]*n_map
-            layers = [self.layers]*n_map
-            results = pool.starmap(
-                convert_one_file,
-                zip(self.slcio_file_paths,
-                    file_numbers,
-                    load_geometry,
-                    signal,
-                    sim,
-                    inner,
-                    outer,
-                    layers,
-                )
-            )
+        entries = self.cache_entries()
+        tables = {}
+        for i_file, paths in entries.items():
+            if (cached := read_cached_tables(self.cache, paths, file=i_file)) is not None:
+                tables[i_file] = cached
+        missing = [i_file for i_file in range(len(self.slcio_file_paths)) if i_file not in tables]
+        if self.cache is not None:
+            logger.info(f"Found {len(tables)} files in the hit cache, converting {len(missing)} ...")
+        if missing:
+            converted = self.convert_files(missing)
+            if self.cache is not None:
+                for i_file, file_tables in converted.items():
+                    write_cached_tables(self.cache, entries[i_file], file_tables)
+            tables.update(converted)
+        if self.cache is not None:
+            self.cache.evict(keep={path for paths in entries.values() for path in paths.values()})
+
         logger.info("Merging DataFrames ...")
+        files = sorted(tables)
         return [
-            pd.concat([mcps for (mcps, simhits) in results], ignore_index=True),
-            pd.concat([simhits for (mcps, simhits) in results], ignore_index=True),
+            concat_sorted([tables[i_file]["mcps"] for i_file in files], MCP_ORDER),
+            concat_sorted([tables[i_file]["simhits"] for i_file in files], SIMHIT_ORDER),
+        ]
+
+
+    def cache_entries(self) -> dict[int, dict[str, str]]:
+        """Cache entries of the tables of each file, keyed by the geometry and the hit selection"""
+        if self.cache is None:
+            return {}
+        kwargs = {
+            "load_geometry": self.load_geometry,
+            "xml": XML if self.load_geometry else None,
+            "geometry_version": self.geometry_version,
+            "signal": self.signal,
+            "sim": self.sim,
+            "inner": self.inner,
+            "outer": self.outer,
+            "layers": list(self.layers),
+        }
+        return {
+            i_file: cache_entries(self.cache, path, "counting_doublets_hits", CACHE_VERSION, CACHE_TABLES, kwargs)
+            for i_file, path in enumerate(self.slcio_file_paths)
+        }
+
+
+    def convert_files(self, file_numbers: list[int]) -> dict[int, dict[str, pd.DataFrame]]:
+        """Tables of each file, converted in event ranges balanced over the workers"""
+        initializer = init_worker if self.load_geometry else init_dummy
+        file_paths = [self.slcio_file_paths[i_file] for i_file in file_numbers]
+        n_events, weights = estimate_work(file_paths)
+        tasks = partition_events(n_events, weights, n_tasks=TASKS_PER_PROCESS * mp.cpu_count())
+        processes = min(mp.cpu_count(), len(tasks))
+        logger.info(f"Using {processes} processes for {len(tasks)} tasks ...")
+        args = [
+            (file_paths[i_path],
+             file_numbers[i_path],
+             self.load_geometry,
+             self.signal,
+             self.sim,
+             self.inner,
+             self.outer,
+             self.layers,
+             self.geometry_version,
+             first_event,
+             count,
+            )
+            for i_path, first_event, count, _ in tasks
         ]
+        with mp.Pool(processes=processes, initializer=initializer) as pool:
+            start = time.time()
+            # tasks are sorted longest first, and chunksize=1 hands them out one at a time
+            results = list(pool.imap_unordered(convert_task, args, chunksize=1))
+            stop = time.time()
+        log_utilization(results, processes, start, stop)
+
+        results = sorted([result for result in results if result["mcps"] is not None],
+                         key=lambda result: (result["file"], result["first_event"]))
+        converted = {result["file"] for result in results if len(result["simhits"]) > 0}
+        for i_file in file_numbers:
+            if i_file not in converted:
+                msg = f"No MCParticles or simhits found in file {os.path.basename(self.slcio_file_paths[i_file])}"
+                logger.error(msg)
+                raise RuntimeError(msg)
+        return {
+            i_file: {
+                "mcps": concat_sorted([result["mcps"] for result in results if result["file"] == i_file], MCP_ORDER),
+                "simhits": concat_sorted([result["simhits"] for result in results if result["file"] == i_file], SIMHIT_ORDER),
+            }
+            for i_file in file_numbers
+        }
+
+
+def estimate_work(slcio_file_paths: list[str]) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Number of events and bytes of each file. The bytes stand in for the number of hits,
+    which is what the conversion time scales with: BIB files are far heavier per event than signal.
+    Event counts come from the sample registry if its size and mtime still match the file,
+    or else from the LCIO headers.
+    """
+    registry = Registry().df
+    stamps = {
+        os.path.realpath(path): (size, mtime, events)
+        for path, size, mtime, events in zip(registry["path"], registry["size"], registry["mtime"], registry["events"])
+    }
+    paths = [os.path.realpath(path) for path in slcio_file_paths]
+    known = {}
+    for path in paths:
+        if path in stamps and os.path.isfile(path):
+            stat = os.stat(path)
+            size, mtime, events = stamps[path]
+            if (size, mtime) == (stat.st_size, stat.st_mtime):
+                known[path] = events
+    missing = [path for path in paths if path not in known and os.path.isfile(path)]
+    if missing:
+        logger.info(f"Reading the number of events of {len(missing)} files not in the sample registry, or changed since ...")
+        with mp.Pool(processes=min(mp.cpu_count(), len(missing))) as pool:
+            headers = pool.map(read_header, missing)
+        known.update({path: header["events"] for path, header in zip(missing, headers)})
+    n_events = np.array([known.get(path, 0) for path in paths], dtype=np.int64)
+    weights = np.array([os.path.getsize(path) if os.path.isfile(path) else 0 for path in paths], dtype=np.float64)
+    return n_events, weights
+
+
+def partition_events(n_events: np.ndarray, weights: np.ndarray, n_tasks: int) -> list[tuple[int, int, int | None, float]]:
+    """
+    Tasks of (file number, first event, number of events, weight), sorted longest first.
+    Files heavier than 1/n_tasks of the total are split into event ranges of about that weight,
+    and lighter files are one task each (with None events, i.e. the whole file).
+    The last range of a split file also has None events, and reads to the end of the file.
+    """
+    target = max(weights.sum() / n_tasks, 1.0)
+    tasks = []
+    for i_file, (events, weight) in enumerate(zip(n_events, weights)):
+        n_split = min(int(np.ceil(weight / target)), events // MIN_EVENTS_PER_TASK)
+        if n_split <= 1:
+            tasks.append((i_file, 0, None, weight))
+            continue
+        edges = np.round(np.linspace(0, events, n_split + 1)).astype(np.int64)
+        for first_event, stop_event in zip(edges[:-1], edges[1:]):
+            count = int(stop_event - first_event)
+            tasks.append((i_file, int(first_event), count if stop_event < events else None, weight * count / events))
+    return sorted(tasks, key=lambda task: task[3], reverse=True)
+
+
+def read_events(reader, first_event: int = 0, n_events: int = None):
+    """
+    (event number, event) of the events [first_event, first_event + n_events) of an open reader,
+    or of all events from first_event, without reading the event after the range.
+    skipNEvents steps over the records of the skipped events without unpacking their collections,
+    so each task of a split file still scans its file from the start, but only reads its own events.
+    """
+    if first_event > 0:
+        reader.skipNEvents(first_event)
+    if n_events is None:
+        yield from enumerate(reader, start=first_event)
+        return
+    for i_event in range(first_event, first_event + n_events):
+        event = reader.readNextEvent()
+        if not event:
+            return
+        yield i_event, event
+
+
+def convert_task(args: tuple) -> dict:
+    """convert_one_file, with the worker and the start and stop times of the task"""
+    start = time.time()
+    result = convert_one_file(*args)
+    mcps, simhits = result if result is not None else (None, None)
+    return {
+        "file": args[1],
+        "first_event": args[9],
+        "pid": os.getpid(),
+        "start": start,
+        "stop": time.time(),
+        "mcps": mcps,
+        "simhits": simhits,
+    }
+
+
+def log_utilization(results: list[dict], processes: int, start: float, stop: float):
+    """Busy fraction of each worker, and how long the pool waited on its last tasks"""
+    wall = max(stop - start, EPSILON)
+    df = pd.DataFrame({
+        "pid": [result["pid"] for result in results],
+        "seconds": [result["stop"] - result["start"] for result in results],
+        "stop": [result["stop"] for result in results],
+    })
+    workers = df.groupby("pid").agg(tasks=("seconds", "size"), busy=("seconds", "sum"), last=("stop", "max"))
+    for worker in workers.itertuples():
+        logger.info(f"Worker {worker.Index}: {worker.tasks} tasks, busy {worker.busy:.1f}s of {wall:.1f}s ({worker.busy / wall:.0%})")
+    first_idle = workers["last"].min() if len(workers) == processes else start
+    logger.info(f"Pool utilization: {df['seconds'].sum() / (wall * processes):.0%} of {processes} workers over {wall:.1f}s, "
+                f"with idle workers for the last {stop - first_idle:.1f}s")
 
 
 def init_dummy():
@@ -123,7 +339,10 @@ def convert_one_file(
         inner: bool,
         outer: bool,
         layers: list[int],
-    ) -> tuple[pd.DataFrame, pd.DataFrame]:
+        geometry_version: str = None,
+        first_event: int = 0,
+        n_events: int = None,
+    ) -> tuple[pd.DataFrame, pd.DataFrame] | None:
 
     # import here to avoid:
     #  - unnecessary imports if not used
@@ -141,16 +360,19 @@ def convert_one_file(
         raise FileNotFoundError(msg)
 
     # open the SLCIO file
-    logger.info(f"Processing file {slcio_file_path} ...")
+    whole_file = first_event == 0 and n_events is None
+    events = "" if whole_file else f" events {first_event}-{'end' if n_events is None else first_event + n_events}"
+    logger.info(f"Processing file {slcio_file_path}{events} ...")
     reader = pyLCIO.IOIMPL.LCFactory.getInstance().createLCReader()
     reader.open(slcio_file_path)
 
     # list for holding all hits
     mcps = []
     simhits = []
+    codec = get_codec(geometry_version)
 
     # loop over all events in the slcio file
-    for i_event, event in enumerate(reader):
+    for i_event, event in read_events(reader, first_event, n_events):
 
         # if i_event > 0:
         #     break
@@ -218,6 +440,7 @@ def convert_one_file(
 
             col = event.getCollection(collection)
             n_obj = len(col)
+            codec = codec_from_collection(col, get_codec(geometry_version))
 
             for i_obj, obj in enumerate(col):
 
@@ -238,7 +461,7 @@ def convert_one_file(
 
                 # consider a particular set of layers
                 cellid0 = simhit.getCellID0() if use_sim else hit.getCellID0()
-                layer = np.right_shift(cellid0, 7) & 0b11_1111
+                layer = codec.get(cellid0, "layer")
                 if layer not in layers:
                     continue
                 # module 0 only, sensor 20 only?
@@ -319,24 +542,22 @@ def convert_one_file(
     # Convert the list of hits to a pandas DataFrame and postprocess
     logger.info("Creating DataFrames ...")
     mcps = pd.DataFrame(mcps)
-    simhits = pd.DataFrame(simhits)
+    simhits = to_dataframe(simhits, SIGNAL_SIMHIT_DTYPES if signal else SIMHIT_DTYPES)
 
-    # sanity check
-    if len(mcps) == 0:
-        msg = f"No MCParticles found in file {os.path.basename(slcio_file_path)}"
-        logger.error(msg)
-        raise RuntimeError(msg)
-    if len(simhits) == 0:
-        msg = f"No simhits found in file {os.path.basename(slcio_file_path)}"
-        logger.error(msg)
-        raise RuntimeError(msg)
+    # sanity check. An event range may be empty, and convert_all_files checks the whole file
+    if len(mcps) == 0 or len(simhits) == 0:
+        msg = f"No {'MCParticles' if len(mcps) == 0 else 'simhits'} found in file {os.path.basename(slcio_file_path)}{events}"
+        if whole_file:
+            logger.error(msg)
+            raise RuntimeError(msg)
+        logger.warning(msg)
+        if len(mcps) == 0:
+            return None
 
     # And postprocess
     logger.info("Postprocessing DataFrames ...")
-    mcps = postprocess_mcps(mcps)
-    if signal:
-        simhits = postprocess_mcps(simhits)
-    simhits = postprocess_simhits(simhits, signal)
+    mcps = sort_mcps(postprocess_mcps(mcps))
+    simhits = sort_simhits(postprocess_simhits(simhits, signal, codec))
 
     # Bonus features: define if a mcp is "detectable" or not
     if signal:
@@ -345,160 +566,167 @@ def convert_one_file(
     return mcps, simhits
 
 
+def to_dataframe(rows: list[dict], dtypes: dict) -> pd.DataFrame:
+    """DataFrame of the rows, or an empty one with the columns and dtypes of the table."""
+    if not rows:
+        return pd.DataFrame({col: pd.Series(dtype=dtype) for col, dtype in dtypes.items()})
+    return pd.DataFrame(rows)
+
+
 def postprocess_mcps(df: pd.DataFrame) -> pd.DataFrame:
-    df["mcp_p"] = np.sqrt(df["mcp_px"]**2 + df["mcp_py"]**2 + df["mcp_pz"]**2)
-    df["mcp_pt"] = np.sqrt(df["mcp_px"]**2 + df["mcp_py"]**2)
-    df["mcp_theta"] = np.arctan2(df["mcp_pt"], df["mcp_pz"])
-    df["mcp_eta"] = -np.log(np.tan(df["mcp_theta"] / 2))
-    df["mcp_phi"] = np.arctan2(df["mcp_py"], df["mcp_px"])
-    df["mcp_qoverpt"] = df["mcp_q"] / df["mcp_pt"]
-    df["mcp_vertex_r"] = np.sqrt(df["mcp_vertex_x"]**2 + df["mcp_vertex_y"]**2)
-    df["mcp_endpoint_r"] = np.sqrt(df["mcp_endpoint_x"]**2 + df["mcp_endpoint_y"]**2)
+    return pd.DataFrame(sorted_columns(mcp_columns(df)))
+
+
+def mcp_columns(df: pd.DataFrame) -> dict[str, np.ndarray]:
+    """The columns of df with derived mcp columns added, redundant ones removed, and indices downcast"""
+    px, py, pz = df["mcp_px"].to_numpy(), df["mcp_py"].to_numpy(), df["mcp_pz"].to_numpy()
+    pt2 = px**2 + py**2
+    pt = np.sqrt(pt2)
+    theta = np.arctan2(pt, pz)
+    vertex_x, vertex_y = df["mcp_vertex_x"].to_numpy(), df["mcp_vertex_y"].to_numpy()
+    endpoint_x, endpoint_y = df["mcp_endpoint_x"].to_numpy(), df["mcp_endpoint_y"].to_numpy()
 
     # remove redundant columns
-    df.drop(columns=[
+    redundant = {
         "mcp_px",
         "mcp_py",
-        "mcp_theta",
         "mcp_vertex_x",
         "mcp_vertex_y",
         "mcp_endpoint_x",
         "mcp_endpoint_y",
-    ], inplace=True)
+    }
+    columns = {name: df[name].to_numpy() for name in df.columns if name not in redundant}
+    columns.update({
+        "mcp_p": np.sqrt(pt2 + pz**2),
+        "mcp_pt": pt,
+        "mcp_eta": -np.log(np.tan(theta / 2)),
+        "mcp_phi": np.arctan2(py, px),
+        "mcp_qoverpt": columns["mcp_q"] / pt,
+        "mcp_vertex_r": np.sqrt(vertex_x**2 + vertex_y**2),
+        "mcp_endpoint_r": np.sqrt(endpoint_x**2 + endpoint_y**2),
+    })
 
     # downcast to save memory
-    df["file"] = df["file"].astype(np.uint32)
-    df["i_event"] = df["i_event"].astype(np.uint32)
-    df["i_mcp"] = df["i_mcp"].astype(np.uint32)
-
-    # sort columns alphabetically
-    return df[sorted(df.columns)]
+    for name in ["file", "i_event", "i_mcp"]:
+        columns[name] = columns[name].astype(np.uint32)
+    return columns
 
 
-def postprocess_simhits(df: pd.DataFrame, signal: bool) -> pd.DataFrame:
+def postprocess_simhits(df: pd.DataFrame, signal: bool, codec=None) -> pd.DataFrame:
+    """
+    Derived simhit columns (and for signal, derived mcp columns) in one pass over numpy arrays,
+    building the DataFrame once with its columns in alphabetical order.
+    """
     logger.info(f"Postprocessing DataFrame, signal={signal} ...")
-    df["simhit_r"] = np.sqrt(df["simhit_x"]**2 + df["simhit_y"]**2)
-    df["simhit_system"] = np.right_shift(df["simhit_cellid0"], 0) & 0b1_1111
-    df["simhit_side"] = np.right_shift(df["simhit_cellid0"], 5) & 0b11
-    df["simhit_layer"] = np.right_shift(df["simhit_cellid0"], 7) & 0b11_1111
-    df["simhit_module"] = np.right_shift(df["simhit_cellid0"], 13) & 0b111_1111_1111
-    df["simhit_sensor"] = np.right_shift(df["simhit_cellid0"], 24) & 0b1111_1111
-    df["simhit_layer_div_2"] = df["simhit_layer"] // 2
-    df["simhit_layer_mod_2"] = df["simhit_layer"] % 2
-    # df["simhit_theta"] = np.maximum(np.arctan2(df["simhit_r"], df["simhit_z"]), EPSILON)
-    # df["simhit_eta"] = -np.log(np.tan(df["simhit_theta"] / 2))
-    # df["simhit_phi"] = np.arctan2(df["simhit_y"], df["simhit_x"])
-    # df["simhit_pt"] = np.sqrt(df["simhit_px"]**2 + df["simhit_py"]**2)
-    # df["simhit_R"] = np.sqrt(df["simhit_x"]**2 + df["simhit_y"]**2 + df["simhit_z"]**2)
-    # df["simhit_t_corrected"] = df["simhit_t"] - (df["simhit_R"] / SPEED_OF_LIGHT)
+    codec = codec or get_codec()
+    columns = mcp_columns(df) if signal else {name: df[name].to_numpy() for name in df.columns}
+    x, y, z = columns["simhit_x"], columns["simhit_y"], columns["simhit_z"]
+    r2 = x**2 + y**2
+    columns["simhit_r"] = np.sqrt(r2)
+    columns.update(codec.decode(columns["simhit_cellid0"], fields=FIELDS, prefix="simhit_"))
+    columns["simhit_layer_div_2"] = columns["simhit_layer"] // 2
+    columns["simhit_layer_mod_2"] = columns["simhit_layer"] % 2
     if signal:
-        df["simhit_R"] = np.sqrt(df["simhit_x"]**2 + df["simhit_y"]**2 + df["simhit_z"]**2)
-        df["simhit_p"] = np.sqrt(df["simhit_px"]**2 + df["simhit_py"]**2 + df["simhit_pz"]**2)
-        df["simhit_costheta"] = (df["simhit_x"] * df["simhit_px"] +
-                                 df["simhit_y"] * df["simhit_py"] +
-                                 df["simhit_z"] * df["simhit_pz"]) / (df["simhit_R"] * df["simhit_p"])
-        df["simhit_first_exit"] = (
-            (df["simhit_t_corrected"] < MAX_TIME) &
-            (df["simhit_costheta"] > MIN_COSTHETA) &
-            (df["simhit_p"] / df["mcp_p"] > MIN_SIMHIT_PT_FRACTION)
+        # remove unused columns
+        px, py, pz = columns.pop("simhit_px"), columns.pop("simhit_py"), columns.pop("simhit_pz")
+        R = np.sqrt(r2 + z**2)
+        p = np.sqrt(px**2 + py**2 + pz**2)
+        columns["simhit_p"] = p
+        columns["simhit_costheta"] = (x * px + y * py + z * pz) / (R * p)
+        columns["simhit_first_exit"] = (
+            (columns["simhit_t_corrected"] < MAX_TIME) &
+            (columns["simhit_costheta"] > MIN_COSTHETA) &
+            (p / columns["mcp_p"] > MIN_SIMHIT_PT_FRACTION)
         )
 
-    # remove unused columns
-    if signal:
-        drop_cols = [
-            "simhit_px",
-            "simhit_py",
-            "simhit_pz",
-            "simhit_R",
-        ]
-        df.drop(columns=drop_cols, inplace=True)
-
     # downcast to save memory
-    df["file"] = df["file"].astype(np.uint32)
-    df["i_event"] = df["i_event"].astype(np.uint32)
-    df["i_mcp"] = df["i_mcp"].astype(np.uint32)
-    df["simhit_cellid0"] = df["simhit_cellid0"].astype(np.uint32)
-    df["simhit_inside_bounds"] = df["simhit_inside_bounds"].astype(np.uint8)
-    df["simhit_side"] = df["simhit_side"].astype(np.uint8)
-    df["simhit_system"] = df["simhit_system"].astype(np.uint8)
-    df["simhit_layer"] = df["simhit_layer"].astype(np.uint8)
-    df["simhit_layer_div_2"] = df["simhit_layer_div_2"].astype(np.uint8)
-    df["simhit_layer_mod_2"] = df["simhit_layer_mod_2"].astype(np.uint8)
-    df["simhit_module"] = df["simhit_module"].astype(np.uint16)
-    df["simhit_sensor"] = df["simhit_sensor"].astype(np.uint16)
-    if signal:
-        df["simhit_first_exit"] = df["simhit_first_exit"].astype(bool)
-
+    dtypes = {
+        "file": np.uint32,
+        "i_event": np.uint32,
+        "i_mcp": np.uint32,
+        "simhit_cellid0": np.uint32,
+        "simhit_inside_bounds": np.uint8,
+        "simhit_side": np.uint8,
+        "simhit_system": np.uint8,
+        "simhit_layer": np.uint8,
+        "simhit_layer_div_2": np.uint8,
+        "simhit_layer_mod_2": np.uint8,
+        "simhit_module": np.uint16,
+        "simhit_sensor": np.uint16,
+    }
+    for name, dtype in dtypes.items():
+        columns[name] = columns[name].astype(dtype, copy=False)
+    return pd.DataFrame(sorted_columns(columns))
+
+
+def sorted_columns(columns: dict[str, np.ndarray]) -> dict[str, np.ndarray]:
     # sort columns alphabetically
-    return df[sorted(df.columns)]
+    return {name: columns[name] for name in sorted(columns)}
 
 
 def sort_mcps(df: pd.DataFrame) -> pd.DataFrame:
-    logger.info("Sorting DataFrame ...")
-    columns = [
-        "file",
-        "i_event",
-        "i_mcp",
-    ]
-    return df.sort_values(by=columns).reset_index(drop=True)
+    return df.sort_values(by=MCP_ORDER).reset_index(drop=True)
 
 
 def sort_simhits(df: pd.DataFrame) -> pd.DataFrame:
-    logger.info("Sorting DataFrame ...")
-    columns = [
-        "file",
-        "i_event",
-        "i_mcp",
-        "simhit_system",
-        "simhit_layer",
-        "simhit_module",
-        "simhit_sensor",
-    ]
-    return df.sort_values(by=columns).reset_index(drop=True)
+    return df.sort_values(by=SIMHIT_ORDER).reset_index(drop=True)
+
+
+def concat_sorted(frames: list[pd.DataFrame], columns: list[str]) -> pd.DataFrame:
+    """
+    Merge frames which are each sorted by columns. The frames of convert_all_files cover
+    disjoint (file, event range)s in order, so the merge is a concatenation, and only the
+    boundaries between frames need checking. Overlapping frames fall back to a full sort.
+    """
+    frames = [df for df in frames if len(df) > 0]
+    df = pd.concat(frames, ignore_index=True)
+    for before, after in zip(frames[:-1], frames[1:]):
+        if tuple(before[columns].iloc[-1]) > tuple(after[columns].iloc[0]):
+            logger.warning("Converted frames overlap, sorting the merged DataFrame ...")
+            return df.sort_values(by=columns).reset_index(drop=True)
+    return df
 
 
 def add_detectable_columns(mcps: pd.DataFrame, simhits: pd.DataFrame) -> pd.DataFrame:
+    """
+    An mcp is detectable in a doublelayer if it has first-exit simhits in both of its layers
+    on the same (module, sensor). Each first-exit simhit is packed into one integer key of
+    (mcp, doublelayer, module, sensor, layer parity). In the sorted unique keys, both parities
+    of a (mcp, doublelayer, module, sensor) are neighbours, which sets bit `doublelayer` of the
+    uint8 column mcp_detectable_<system>_mask. The boolean columns are derived from the mask.
+    """
 
     GROUP_COLS = ["file", "i_event", "i_mcp"]
-    MATCH_COLS = GROUP_COLS + ["simhit_module", "simhit_sensor"]
     SYSTEMS = [INNER_TRACKER_BARREL, OUTER_TRACKER_BARREL]
     LAYER_PAIRS = [(0, 1), (2, 3), (4, 5), (6, 7)]
+    ALL_DOUBLELAYERS = (1 << len(LAYER_PAIRS)) - 1
 
-    def get_detectable_mcps(
-        simhits_system: pd.DataFrame,
-        layer_lower: int,
-        layer_upper: int,
-    ) -> pd.DataFrame:
-        """
-        Returns a DataFrame of GROUP_COLS rows for every MCP that has at least
-        one (module, sensor) pair with hits in both layer_lower and layer_upper.
-        """
-        lo = simhits_system[simhits_system["simhit_layer"] == layer_lower][MATCH_COLS]
-        hi = simhits_system[simhits_system["simhit_layer"] == layer_upper][MATCH_COLS]
-        return lo.merge(hi, on=MATCH_COLS)[GROUP_COLS].drop_duplicates()
+    # row of the mcp of each simhit, or -1 for simhits of other particles
+    rows = pd.MultiIndex.from_frame(mcps[GROUP_COLS]).get_indexer(pd.MultiIndex.from_frame(simhits[GROUP_COLS]))
+    first_exit = simhits["simhit_first_exit"].to_numpy() & (rows >= 0)
+    first_exit &= simhits["simhit_layer"].to_numpy() < 2 * len(LAYER_PAIRS)
 
     for system in SYSTEMS:
 
         nickname = NICKNAMES[system]
-        sysdf = simhits[ simhits["simhit_first_exit"] & (simhits["simhit_system"] == system) ]
-
-        for lo, hi in LAYER_PAIRS:
-
-            column = f"mcp_detectable_{nickname}_{lo}{hi}"
-
-            # get mcps that are detectable in each double layer
-            detectable_mcps = get_detectable_mcps(sysdf, lo, hi).assign(**{column: True})
-
-            # merge detectable mcps with the main mcp df
-            mcps = mcps.merge(detectable_mcps, on=GROUP_COLS, how="left")
-
-            # fill nan with False (not detectable)
-            mcps[column] = mcps[column].fillna(False).astype(bool)
-
-        # combine all double layers to get overall detectable status
-        mcps[f"mcp_detectable_{nickname}"] = np.logical_and.reduce([
-            mcps[f"mcp_detectable_{nickname}_{lo}{hi}"] for (lo, hi) in LAYER_PAIRS
-        ])
+        mask = first_exit & (simhits["simhit_system"].to_numpy() == system)
+        keys = (
+            (rows[mask].astype(np.int64) << 35)
+            | (simhits["simhit_layer_div_2"].to_numpy()[mask].astype(np.int64) << 33)
+            | (simhits["simhit_module"].to_numpy()[mask].astype(np.int64) << 17)
+            | (simhits["simhit_sensor"].to_numpy()[mask].astype(np.int64) << 1)
+            | simhits["simhit_layer_mod_2"].to_numpy()[mask].astype(np.int64)
+        )
+        keys.sort()
+        pairs = keys[np.diff(keys, prepend=-1) != 0] >> 1
+        both = pairs[1:][pairs[1:] == pairs[:-1]] >> 32
+
+        bitmask = np.zeros(len(mcps), dtype=np.uint8)
+        np.bitwise_or.at(bitmask, both >> 2, (1 << (both & 0b11)).astype(np.uint8))
+        mcps[f"mcp_detectable_{nickname}_mask"] = bitmask
+        for doublelayer, (lo, hi) in enumerate(LAYER_PAIRS):
+            mcps[f"mcp_detectable_{nickname}_{lo}{hi}"] = (bitmask & (1 << doublelayer)) > 0
+        mcps[f"mcp_detectable_{nickname}"] = bitmask == ALL_DOUBLELAYERS
 
     return mcps
 
@@ -13,7 +13,9 @@ logger = logging.getLogger(__name__)
 
 from constants import BYTE_TO_MB, NO_MCP
 from constants import T4_DZ_CUT, T4_DR_CUT, T4_DTHETA_RZ_CUT, T4_CHI2_XY_CUT
-from constants import N_T4_PHI_SLICES
+from constants import N_T4_PHI_SLICES, N_T4_ETA_SLICES
+from binning import CellIndex
+from circlefit import circle_from_three_points, circle_residual2
 
 class T4Maker:
 
@@ -109,6 +111,11 @@ class T4Maker:
 
             entire_lower = df[ df["ls_doublelayer_mod_4"] == 0 ]
             entire_upper = df[ df["ls_doublelayer_mod_4"] != 0 ]
+            if self.cut_t4s:
+                cells = CellIndex(entire_upper["ls_eta_slice"].to_numpy(),
+                                  entire_upper["ls_phi_slice"].to_numpy(),
+                                  N_T4_ETA_SLICES,
+                                  N_T4_PHI_SLICES)
             subgroups = entire_lower.groupby(subgroup_cols)
             n_subgroup = len(subgroups)
 
@@ -117,22 +124,15 @@ class T4Maker:
                 # if not cutting, then take all upper
                 # else, only consider upper in the same (or neighbor) eta/phi slice as lower
                 if not self.cut_t4s:
-                    ok = np.ones(len(entire_upper), dtype=bool)
+                    upper = entire_upper
                 else:
                     if self.signal:
                         [eta_slice, phi_slice] = subcols
                     else:
                         [_, _, eta_slice, phi_slice] = subcols
 
-                    # get upper data for the same phi slice
-                    eta_ok = np.array([eta_slice-1, eta_slice, eta_slice+1]).astype(np.int16)
-                    phi_ok = np.array([phi_slice-1, phi_slice, phi_slice+1]).astype(np.int16)
-                    phi_ok = phi_ok % N_T4_PHI_SLICES
-                    ok = (
-                        entire_upper["ls_eta_slice"].isin(eta_ok) &
-                        entire_upper["ls_phi_slice"].isin(phi_ok)
-                    )
-                upper = entire_upper[ok]
+                    # get upper data for the same (or neighbor) eta/phi slice
+                    upper = entire_upper.iloc[cells.neighbours(eta_slice, phi_slice)]
 
                 # get all combinations of lower and upper
                 t4s = lower.merge(
@@ -198,24 +198,16 @@ class T4Maker:
                 BAD_CHI2 = 1e6
                 i0, i1, i2 = 0, 4, 7
                 ixs = [1, 2, 3, 5, 6]
-                circle_d = 2 * (t4s[f"t4_x_{i0}"] * (t4s[f"t4_y_{i1}"] - t4s[f"t4_y_{i2}"]) +
-                                t4s[f"t4_x_{i1}"] * (t4s[f"t4_y_{i2}"] - t4s[f"t4_y_{i0}"]) +
-                                t4s[f"t4_x_{i2}"] * (t4s[f"t4_y_{i0}"] - t4s[f"t4_y_{i1}"]))
-                circle_x = np.divide(t4s[f"t4_r_{i0}"]**2 * (t4s[f"t4_y_{i1}"] - t4s[f"t4_y_{i2}"]) +
-                                     t4s[f"t4_r_{i1}"]**2 * (t4s[f"t4_y_{i2}"] - t4s[f"t4_y_{i0}"]) +
-                                     t4s[f"t4_r_{i2}"]**2 * (t4s[f"t4_y_{i0}"] - t4s[f"t4_y_{i1}"]),
-                                     circle_d)
-                circle_y = np.divide(t4s[f"t4_r_{i0}"]**2 * (t4s[f"t4_x_{i2}"] - t4s[f"t4_x_{i1}"]) +
-                                     t4s[f"t4_r_{i1}"]**2 * (t4s[f"t4_x_{i0}"] - t4s[f"t4_x_{i2}"]) +
-                                     t4s[f"t4_r_{i2}"]**2 * (t4s[f"t4_x_{i1}"] - t4s[f"t4_x_{i0}"]),
-                                     circle_d)
-                circle_r = np.sqrt((t4s[f"t4_x_{i0}"] - circle_x)**2 + (t4s[f"t4_y_{i0}"] - circle_y)**2)
-                circle_ok = circle_d != 0
+                circle_x, circle_y, circle_r, circle_ok = circle_from_three_points(
+                    t4s[f"t4_x_{i0}"], t4s[f"t4_y_{i0}"],
+                    t4s[f"t4_x_{i1}"], t4s[f"t4_y_{i1}"],
+                    t4s[f"t4_x_{i2}"], t4s[f"t4_y_{i2}"],
+                )
                 if np.any(~circle_ok):
                     logger.warning(f"Found {np.sum(~circle_ok)} invalid circles with circle_d = 0")
                 for ix in ixs:
-                    circle_diff = np.sqrt((t4s[f"t4_x_{ix}"] - circle_x)**2 + (t4s[f"t4_y_{ix}"] - circle_y)**2) - circle_r
-                    t4s[f"t4_chi2_{i0}{i1}{i2}_vs_{ix}"] = np.where(circle_ok, circle_diff**2, BAD_CHI2)
+                    circle_diff2 = circle_residual2(t4s[f"t4_x_{ix}"], t4s[f"t4_y_{ix}"], circle_x, circle_y, circle_r)
+                    t4s[f"t4_chi2_{i0}{i1}{i2}_vs_{ix}"] = np.where(circle_ok, circle_diff2, BAD_CHI2)
 
                 # calculate the average diff
                 chi2cols = [f"t4_chi2_{i0}{i1}{i2}_vs_{ix}" for ix in ixs]
@@ -1,107 +1,207 @@
+import io
+import multiprocessing as mp
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 from matplotlib.colors import Normalize
-from matplotlib.animation import FuncAnimation, PillowWriter
 from matplotlib import rcParams
+from PIL import Image
+import logging
+logger = logging.getLogger(__name__)
 
 MUON = 13
+START_T = -5 # ns
+DELTA_T = 1 # ns
+N_FRAMES = 26
+FPS = 5
+CMIN, VMAX = 0.5, 10
+BINS = [
+    # np.linspace(-1600, 1600, 320),
+    # np.linspace(0, 1600, 320)
+    # np.linspace(-1600, 1600, 320),
+    # np.linspace(-1600, 1600, 320),
+    np.linspace(810, 830, 320),
+    np.linspace(-40, 40, 320),
+]
+RCPARAMS = {
+    "font.size": 16,
+    "figure.figsize": (8, 8),
+    "xtick.direction": "in",
+    "ytick.direction": "in",
+    "xtick.top": True,
+    "ytick.right": True,
+    "xtick.minor.visible": True,
+    "ytick.minor.visible": True,
+    "axes.grid": True,
+    "axes.grid.which": "both",
+    "axes.axisbelow": True,
+    "grid.linewidth": 0.5,
+    "grid.alpha": 0.1,
+    "grid.color": "gray",
+    "figure.subplot.left": 0.14,
+    "figure.subplot.bottom": 0.09,
+    "figure.subplot.right": 0.97,
+    "figure.subplot.top": 0.95,
+}
 
 class Timelapse:
+    """
+    Animation of the sim hits in time slices.
 
-    def __init__(self, df: pd.DataFrame, event: int, gif: str):
+    Hits are sorted by time once, and each frame is a contiguous slice found with
+    np.searchsorted. All frame histograms are filled in one pass into a preallocated
+    (frame, x, y) array, and cumulative mode is a running sum over frames.
+    Frames are rendered in parallel and assembled into a gif.
+    """
+
+    def __init__(
+            self,
+            df: pd.DataFrame,
+            event: int,
+            gif: str,
+            cumulative: bool = False,
+            start_t: float = START_T,
+            delta_t: float = DELTA_T,
+            n_frames: int = N_FRAMES,
+            hist2d: bool = True,
+            processes: int = None,
+        ):
         self.df = df
         self.event = event
         self.gif = gif
-        self.cumulative = False
+        self.cumulative = cumulative
+        self.start_t = start_t
+        self.delta_t = delta_t
+        self.n_frames = n_frames
+        self.hist2d = hist2d
+        self.processes = processes
         self.update_rcparams()
+        self.sort_hits()
         self.make_gif()
 
 
     def update_rcparams(self):
-        rcParams.update({
-            "font.size": 16,
-            "figure.figsize": (8, 8),
-            "xtick.direction": "in",
-            "ytick.direction": "in",
-            "xtick.top": True,
-            "ytick.right": True,
-            "xtick.minor.visible": True,
-            "ytick.minor.visible": True,
-            "axes.grid": True,
-            "axes.grid.which": "both",
-            "axes.axisbelow": True,
-            "grid.linewidth": 0.5,
-            "grid.alpha": 0.1,
-            "grid.color": "gray",
-            "figure.subplot.left": 0.14,
-            "figure.subplot.bottom": 0.09,
-            "figure.subplot.right": 0.97,
-            "figure.subplot.top": 0.95,
-        })
+        rcParams.update(RCPARAMS)
+
+
+    def sort_hits(self):
+        """Select the hits to show, and sort them by time."""
+        # background hits only have the corrected time, and no mcparticle
+        time = "simhit_t" if "simhit_t" in self.df else "simhit_t_corrected"
+        mask = np.ones(len(self.df), dtype=bool)
+        if "mcp_pdg" in self.df:
+            mask &= np.abs(self.df["mcp_pdg"].to_numpy()) != MUON
+        if self.event is not None:
+            mask &= self.df["i_event"].to_numpy() == self.event
+        t = self.df[time].to_numpy()[mask]
+        order = np.argsort(t, kind="stable")
+        self.t = t[order]
+        # self.x = self.df["simhit_z"].to_numpy()[mask][order]
+        # self.y = self.df["simhit_r"].to_numpy()[mask][order]
+        self.x = self.df["simhit_x"].to_numpy()[mask][order]
+        self.y = self.df["simhit_y"].to_numpy()[mask][order]
+
+
+    def frame_edges(self) -> np.ndarray:
+        return self.start_t + self.delta_t * np.arange(self.n_frames + 1)
+
+
+    def frame_bounds(self) -> np.ndarray:
+        """Hits of frame i are [bounds[i], bounds[i + 1]) of the sorted hits."""
+        return np.searchsorted(self.t, self.frame_edges(), side="left")
+
+
+    def histograms(self, bins: list[np.ndarray] = BINS) -> np.ndarray:
+        """(frame, x, y) histograms of all frames, like np.histogram2d per frame."""
+        bounds = self.frame_bounds()
+        lo, hi = bounds[0], bounds[-1]
+        frame = np.repeat(np.arange(self.n_frames), np.diff(bounds))
+        ix, ok_x = bin_index(self.x[lo:hi], bins[0])
+        iy, ok_y = bin_index(self.y[lo:hi], bins[1])
+        ok = ok_x & ok_y
+        nx, ny = len(bins[0]) - 1, len(bins[1]) - 1
+        flat = (frame[ok] * nx + ix[ok]) * ny + iy[ok]
+        H = np.bincount(flat, minlength=self.n_frames * nx * ny).reshape(self.n_frames, nx, ny).astype(np.float64)
+        if self.cumulative:
+            np.cumsum(H, axis=0, out=H)
+        return H
 
 
     def make_gif(self):
-        start_t = -5
-        delta_t = 1 # ns
-        fig, ax = plt.subplots(figsize=(8,8))
-        # ax.set_xlabel("Sim. hit z (mm)")
-        # ax.set_ylabel("Sim. hit r (mm)")
-        ax.set_xlabel("Sim. hit x (mm)")
-        ax.set_ylabel("Sim. hit y (mm)")
-        ax.grid()
-        hist2d = True
+        edges = self.frame_edges()
+        bounds = self.frame_bounds()
+        if self.hist2d:
+            H = self.histograms()
+        jobs = []
+        for frame in range(self.n_frames):
+            tmin = edges[0] if self.cumulative else edges[frame]
+            tmax = edges[frame + 1]
+            title = f"Hits with time in [{tmin:g}, {tmax:g}] ns"
+            if self.hist2d:
+                jobs.append((title, H[frame], None, None))
+            else:
+                lo = bounds[0] if self.cumulative else bounds[frame]
+                hi = bounds[frame + 1]
+                jobs.append((title, None, self.x[lo:hi], self.y[lo:hi]))
+
+        logger.info(f"Rendering {self.n_frames} timelapse frames ...")
+        processes = min(self.processes or mp.cpu_count(), self.n_frames)
+        # contiguous chunks of frames, so that each worker draws its figure once
+        chunks = [list(chunk) for chunk in np.array_split(np.arange(self.n_frames), processes)]
+        chunks = [[jobs[frame] for frame in chunk] for chunk in chunks]
+        if processes <= 1:
+            pngs = [render_frames(chunk) for chunk in chunks]
+        else:
+            with mp.Pool(processes=processes) as pool:
+                pngs = pool.map(render_frames, chunks)
+        pngs = [png for chunk in pngs for png in chunk]
+
+        images = [Image.open(io.BytesIO(png)) for png in pngs]
+        images[0].save(self.gif, save_all=True, append_images=images[1:], duration=int(1000 / FPS), loop=0)
+
 
+def bin_index(values: np.ndarray, edges: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Bin of each value and whether it is inside the edges, with the last edge inclusive like np.histogram."""
+    n = len(edges) - 1
+    index = np.searchsorted(edges, values, side="right") - 1
+    index[values == edges[-1]] = n - 1
+    return index, (index >= 0) & (index < n)
+
+
+def render_frames(jobs: list[tuple]) -> list[bytes]:
+    """
+    Frames as png bytes. Each job is (title, H, x, y): a 2D histogram if H is given,
+    otherwise a scatter of x and y. The figure is drawn once and updated per frame.
+    """
+    rcParams.update(RCPARAMS)
+    fig, ax = plt.subplots(figsize=(8,8))
+    # ax.set_xlabel("Sim. hit z (mm)")
+    # ax.set_ylabel("Sim. hit r (mm)")
+    ax.set_xlabel("Sim. hit x (mm)")
+    ax.set_ylabel("Sim. hit y (mm)")
+    ax.grid()
+    ax.set_axisbelow(True)
+    hist2d = jobs[0][1] is not None
+    if hist2d:
+        norm = Normalize(vmin=CMIN, vmax=VMAX)
+        quad = ax.pcolormesh(BINS[0], BINS[1], np.ma.masked_all((len(BINS[1]) - 1, len(BINS[0]) - 1)), cmap="gist_rainbow", norm=norm)
+        fig.colorbar(quad, ax=ax, pad=0.01, label="Sim. hits")
+    else:
+        # ax.set_xlim([-1600, 1600])
+        # ax.set_ylim([0, 1600])
+        ax.set_xlim([-1600, 1600])
+        ax.set_ylim([-1600, 1600])
+        scat = ax.scatter([], [])
+
+    pngs = []
+    for title, H, x, y in jobs:
+        ax.set_title(title)
         if hist2d:
-            bins = [
-                # np.linspace(-1600, 1600, 320),
-                # np.linspace(0, 1600, 320)
-                # np.linspace(-1600, 1600, 320),
-                # np.linspace(-1600, 1600, 320),
-                np.linspace(810, 830, 320),
-                np.linspace(-40, 40, 320),
-            ]
-            cmin, vmax = 0.5, 10
-            norm = Normalize(vmin=cmin, vmax=vmax)
-            _, xedges, yedges, quad = ax.hist2d([], [], bins=bins, cmap="gist_rainbow", norm=norm)
-            fig.colorbar(quad, ax=ax, pad=0.01, label="Sim. hits")
+            quad.set_array(np.ma.masked_less(H, CMIN).T.ravel())
         else:
-            # ax.set_xlim([-1600, 1600])
-            # ax.set_ylim([0, 1600])
-            ax.set_xlim([-1600, 1600])
-            ax.set_ylim([-1600, 1600])
-            scat = ax.scatter([], [])
-
-        def update(frame):
-            tmin = start_t + frame
-            tmax = tmin + delta_t
-            ax.set_title(f"Hits with time in [{tmin}, {tmax}] ns")
-            ax.set_axisbelow(True)
-            mask = (self.df["simhit_t"] >= tmin) & (self.df["simhit_t"] < tmax)
-            mask &= (np.abs(self.df["simhit_pdg"]) != MUON)
-            subset = self.df[mask]
-            if hist2d:
-                # x = subset["simhit_z"].to_numpy()
-                # y = subset["simhit_r"].to_numpy()
-                x = subset["simhit_x"].to_numpy()
-                y = subset["simhit_y"].to_numpy()
-                H, _, _ = np.histogram2d(x, y, bins=[xedges, yedges])
-                H_masked = np.ma.masked_less(H, cmin)
-                if frame == 10:
-                    print("H:")
-                    print(H)
-                    print("H ma:")
-                    print(np.ma.masked_less(H, cmin))
-                quad.set_array(H_masked.T.ravel())
-                # optional: keep colors sensible as occupancy changes
-                # quad.set_clim(vmin=0, vmax=max(1, H.max()))
-                return (quad,)
-            else:
-                # scat.set_offsets(subset[["simhit_z", "simhit_r"]].values)
-                scat.set_offsets(subset[["simhit_x", "simhit_y"]].values)
-                return (scat, )
-
-        ani = FuncAnimation(fig, update, frames=26, blit=True)
-        writer = PillowWriter(fps=5)
-        ani.save(self.gif, writer=writer)
-        plt.close()        
\ No newline at end of file
+            scat.set_offsets(np.column_stack([x, y]))
+        buffer = io.BytesIO()
+        fig.savefig(buffer, format="png")
+        pngs.append(buffer.getvalue())
+    plt.close(fig)
+    return pngs
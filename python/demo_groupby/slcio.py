@@ -7,6 +7,9 @@ import multiprocessing as mp
 import logging
 logger = logging.getLogger(__name__)
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from cellid import FIELDS, codec_from_collection, get_codec
+
 BYTE_TO_MB = 1e-6
 LAYERS = [0, 1]
 OUTER_TRACKER_BARREL_COLLECTION = "OuterTrackerBarrelCollection"
@@ -72,6 +75,7 @@ def convert_one_file(
 
     # list for holding all hits
     simhits = []
+    codec = get_codec()
 
     # loop over all events in the slcio file
     for i_event, event in enumerate(reader):
@@ -81,6 +85,7 @@ def convert_one_file(
 
             col = event.getCollection(collection)
             n_hit = len(col)
+            codec = codec_from_collection(col, codec)
 
             for i_hit, hit in enumerate(col):
 
@@ -90,7 +95,7 @@ def convert_one_file(
                                 f"hit {i_hit}/{n_hit} ...")
 
                 # consider a particular set of layers
-                layer = np.right_shift(hit.getCellID0(), 7) & 0b11_1111
+                layer = codec.get(hit.getCellID0(), "layer")
                 if layer not in LAYERS:
                     continue
 
@@ -118,19 +123,17 @@ def convert_one_file(
     # And postprocess
     if not signal:
         logger.info("Postprocessing DataFrames ...")
-    simhits = postprocess_simhits(simhits, signal)
+    simhits = postprocess_simhits(simhits, signal, codec)
 
     return simhits
 
 
-def postprocess_simhits(df: pd.DataFrame, signal: bool) -> pd.DataFrame:
+def postprocess_simhits(df: pd.DataFrame, signal: bool, codec=None) -> pd.DataFrame:
     logger.info(f"Postprocessing DataFrame, signal={signal} ...")
 
-    df["simhit_system"] = np.right_shift(df["simhit_cellid0"], 0) & 0b1_1111
-    df["simhit_side"] = np.right_shift(df["simhit_cellid0"], 5) & 0b11
-    df["simhit_layer"] = np.right_shift(df["simhit_cellid0"], 7) & 0b11_1111
-    df["simhit_module"] = np.right_shift(df["simhit_cellid0"], 13) & 0b111_1111_1111
-    df["simhit_sensor"] = np.right_shift(df["simhit_cellid0"], 24) & 0b1111_1111
+    codec = codec or get_codec()
+    for name, values in codec.decode(df["simhit_cellid0"], fields=FIELDS, prefix="simhit_").items():
+        df[name] = values
     df["simhit_layer_div_2"] = df["simhit_layer"] // 2
     df["simhit_layer_mod_2"] = df["simhit_layer"] % 2
 
@@ -1,11 +1,25 @@
 """
 A script to bundle generation, simulation, and digitization of datasets for MAIA LST studies.
+
+Each stage of each job index is a task of the workflow engine, with the files it
+reads and writes. Stages whose outputs are newer than their inputs are skipped,
+and the settings of each stage are stamped into a file which is only rewritten
+when they change, so e.g. a new ResolutionUV reruns only the digitization.
+Job indices are independent and run concurrently within the CPUs and memory of the node.
+
+Usage:
+    python digitize_muons.py --gen --sim --digi --nums 0-9 --data /path/to/bib --ResolutionUV 0.005 --cpus 8
+    python digitize_muons.py --gen --sim --digi --nums 0-99 --condor ../condor/muons_with_bib.sub
 """
 
 import argparse
+import logging
 import os
+import sys
 from pathlib import Path
 
+from workflow import Task, Scheduler, write_if_changed, write_condor_submit
+
 CODE = "/ceph/users/atuna/work/maia"
 K4GEO_DIR = f"{CODE}/k4geo"
 COMPACT = f"{K4GEO_DIR}/MuColl/MAIA/compact/MAIA_v0/MAIA_v0.xml"
@@ -13,6 +27,11 @@ STEER_SIM = f"{CODE}/SteeringMacrosTuna/Sim/sim_steer_GEN_CONDOR.py"
 STEER_RECO = f"{CODE}/SteeringMacrosTuna/k4Reco/steer_reco.py"
 STEER_WHIZARD_HBB = f"{CODE}/mucoll-benchmarks/generation/signal/whizard/mumu_H_bb_10TeV.sin"
 os.environ["k4geo_DIR"] = K4GEO_DIR
+CONDOR_EXECUTABLE = "../shell/digitize_muons.sh"
+
+# resources of each stage, per job index
+STAGE_CPUS = {"gen": 1, "sim": 1, "digi": 2}
+STAGE_MEMORY_GB = {"gen": 1, "sim": 3, "digi": 5}
 
 def arguments():
     parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
@@ -22,57 +41,124 @@ def arguments():
     parser.add_argument("--bib", action="store_true", help="Overlay beam-induced background (BIB) at digitization")
     parser.add_argument("--ip", action="store_true", help="Overlay incoherent pairs (IP) at digitization")
     parser.add_argument("--num", type=int, default=0, help="Job index")
+    parser.add_argument("--nums", type=str, nargs="+", default=None, help="Job indices, like 0 1 2 or 0-99. Overrides --num")
     parser.add_argument("--events", type=int, default=1, help="Number of events")
     parser.add_argument("--typeevent", type=str, default="muonGun_pT_0_10", help="Type of event")
     parser.add_argument("--data", type=str, default="", help="Directory where data files are expected")
     parser.add_argument("--uncompressed", action="store_true", help="Use uncompressed output files at digitization")
     parser.add_argument("--ResolutionUV", default="", help="Position resolution for digitization")
     parser.add_argument("--overlayMixNumberBackground", default="", help="Overlay mix number for background at digitization")
+    parser.add_argument("--cpus", type=int, default=os.environ.get("MAIA_CPUS"), help="CPUs for concurrent jobs on this node (env: MAIA_CPUS). Default: all")
+    parser.add_argument("--memory", type=float, default=os.environ.get("MAIA_MEMORY_GB"), help="Memory (GB) for concurrent jobs on this node (env: MAIA_MEMORY_GB). Default: all")
+    parser.add_argument("--force", action="store_true", help="Rerun stages even if their outputs are up to date")
+    parser.add_argument("--dry-run", action="store_true", help="Print the stages which would run, without running them")
+    parser.add_argument("--condor", type=str, default=None, help="Write a Condor submit file for the job indices to this path, instead of running")
+    parser.add_argument("--condor-executable", type=str, default=CONDOR_EXECUTABLE, help="Executable of the Condor jobs")
+    parser.add_argument("--condor-pack", type=int, default=1, help="Job indices per Condor job")
     return parser.parse_args()
 
 def main():
     args = arguments()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    nums = parse_nums(args.nums) if args.nums else [args.num]
+    stages = [stage for stage in STAGE_CPUS if getattr(args, stage)]
+
+    if args.condor:
+        paths = write_condor_submit(args.condor,
+                                    executable=args.condor_executable,
+                                    nums=nums,
+                                    cpus=max(STAGE_CPUS[stage] for stage in stages),
+                                    memory_gb=max(STAGE_MEMORY_GB[stage] for stage in stages),
+                                    pack=args.condor_pack,
+                                    )
+        print(f"Wrote {paths}")
+        return
+
+    if args.digi and not os.path.isdir(args.data):
+        raise ValueError(f"Data directory {args.data} does not exist.")
+
+    tasks = []
+    for num in nums:
+        tasks.extend(job_tasks(args, num))
+    scheduler = Scheduler(cpus=args.cpus, memory_gb=args.memory, force=args.force, dry_run=args.dry_run)
+    if not scheduler.run(tasks):
+        sys.exit(1)
+
+
+def parse_nums(nums: list[str]) -> list[int]:
+    """Job indices from a list like ["0", "3-5"], with inclusive ranges."""
+    parsed = []
+    for num in nums:
+        if "-" in num:
+            first, last = num.split("-")
+            parsed.extend(range(int(first), int(last) + 1))
+        else:
+            parsed.append(int(num))
+    return parsed
+
+
+def job_tasks(args: argparse.Namespace, num: int) -> list[Task]:
+    """The requested stages of one job index, each depending on the previous one."""
+    tasks = []
     if args.gen:
-        gen(events=args.events,
-            num=args.num,
-            typeevent=args.typeevent,
-            )
+        tasks.append(gen(events=args.events,
+                         num=num,
+                         typeevent=args.typeevent,
+                         ))
     if args.sim:
-        sim(events=args.events,
-            num=args.num,
-            typeevent=args.typeevent,
-            )
+        tasks.append(sim(events=args.events,
+                         num=num,
+                         typeevent=args.typeevent,
+                         deps=tasks[-1:],
+                         ))
     if args.digi:
-        if not os.path.isdir(args.data):
-            raise ValueError(f"Data directory {args.data} does not exist.")
-        digi(events=args.events,
-             num=args.num,
-             typeevent=args.typeevent,
-             data=args.data,
-             bib=args.bib,
-             ip=args.ip,
-             uncompressed=args.uncompressed,
-             ResolutionUV=args.ResolutionUV,
-             overlayMixNumberBackground=args.overlayMixNumberBackground,
-             )
-
-
-def run(cmd):
-    print(cmd)
-    os.system(cmd)
-
-
-def gen(events: int, num: int, typeevent: str):
+        tasks.append(digi(events=args.events,
+                          num=num,
+                          typeevent=args.typeevent,
+                          data=args.data,
+                          bib=args.bib,
+                          ip=args.ip,
+                          uncompressed=args.uncompressed,
+                          ResolutionUV=args.ResolutionUV,
+                          overlayMixNumberBackground=args.overlayMixNumberBackground,
+                          deps=tasks[-1:],
+                          ))
+    return tasks
+
+
+def stamp(path: str, cmd: str) -> str:
+    """A file with the command of a stage, which is newer than its outputs only if the command changed."""
+    write_if_changed(path, cmd + "\n")
+    return path
+
+
+def gen(events: int, num: int, typeevent: str) -> Task:
     cmd = gen_command(events, num, typeevent)
-    run(cmd)
-
-
-def sim(events: int, num: int, typeevent: str):
+    inputs = [stamp(f"{typeevent}_gen_{num}.cmd", cmd)]
+    if typeevent == "mumu_H_bb_10TeV":
+        inputs.append(f"mumu_H_bb_10TeV_{num}.sin")
+    return Task(f"gen_{num}",
+                cmd,
+                inputs=inputs,
+                outputs=[f"{typeevent}_gen_{num}.{get_suffix(typeevent)}"],
+                cpus=STAGE_CPUS["gen"],
+                memory_gb=STAGE_MEMORY_GB["gen"],
+                )
+
+
+def sim(events: int, num: int, typeevent: str, deps: list[Task] = None) -> Task:
     cmd = sim_command(events, num, typeevent)
-    run(cmd)
+    return Task(f"sim_{num}",
+                cmd,
+                inputs=[f"{typeevent}_gen_{num}.{get_suffix(typeevent)}", STEER_SIM, COMPACT, stamp(f"{typeevent}_sim_{num}.cmd", cmd)],
+                outputs=[f"{typeevent}_sim_{num}.slcio"],
+                deps=deps,
+                cpus=STAGE_CPUS["sim"],
+                memory_gb=STAGE_MEMORY_GB["sim"],
+                )
 
 
-def digi(events: int, num: int, typeevent: str, data: str, bib: bool, ip: bool, uncompressed: bool, ResolutionUV: str, overlayMixNumberBackground: str):
+def digi(events: int, num: int, typeevent: str, data: str, bib: bool, ip: bool, uncompressed: bool, ResolutionUV: str, overlayMixNumberBackground: str, deps: list[Task] = None) -> Task:
     steer = f"{typeevent}_steer_digi_{num}.py"
     write_local_digi_steer(steer)
     cmd = digi_command(events=events,
@@ -88,7 +174,14 @@ def digi(events: int, num: int, typeevent: str, data: str, bib: bool, ip: bool,
                        )
     if "k4geo_DIR" not in os.environ:
         raise EnvironmentError("k4geo_DIR is not set")
-    run(cmd)
+    return Task(f"digi_{num}",
+                cmd,
+                inputs=[f"{typeevent}_sim_{num}.slcio", steer, stamp(f"{typeevent}_digi_{num}.cmd", cmd)],
+                outputs=[f"{typeevent}_digi_{num}.slcio"],
+                deps=deps,
+                cpus=STAGE_CPUS["digi"],
+                memory_gb=STAGE_MEMORY_GB["digi"],
+                )
 
 
 def gen_command(events: int, num: int, typeevent: str):
@@ -168,8 +261,12 @@ def gen_command_hbb(events: int, num: int, typeevent: str):
                             events=events,
                             typeevent=typeevent,
                             num=num)
-    rm = remove_whizard_output()
-    cmd = f"time whizard {local_filename} && {rm}"
+    # whizard writes fixed-name scratch files (default*, opr*, whizard.log) to its working directory,
+    # so each index runs in a directory of its own and only moves its event file out of it
+    workdir = f"whizard_{num}"
+    output = f"{typeevent}_gen_{num}.{get_suffix(typeevent)}"
+    rm = remove_whizard_output(workdir)
+    cmd = f"{rm} && mkdir {workdir} && cd {workdir} && time whizard ../{local_filename} && mv {output} .. && cd .. && {rm}"
     return cmd
 
 
@@ -235,9 +332,8 @@ def write_local_digi_steer(local_filename: str):
     # apply substitutions if necessary
     # steer_text = steer_text.replace("1666", "166")
 
-    # write the local steering file
-    local_path = Path(local_filename)
-    local_path.write_text(steer_text)
+    # write the local steering file, keeping its mtime if nothing changed
+    write_if_changed(local_filename, steer_text)
 
 
 def write_local_whizard_hbb(local_filename: str, events: int, typeevent: str, num: int):
@@ -251,13 +347,12 @@ def write_local_whizard_hbb(local_filename: str, events: int, typeevent: str, nu
     steer_text = steer_text.replace("mumu_H_bb_10TeV", f"{typeevent}_gen_{num}")
     steer_text = steer_text.replace("n_events=100", f"n_events={events}")
 
-    # write the local steering file
-    local_path = Path(local_filename)
-    local_path.write_text(steer_text)
+    # write the local steering file, keeping its mtime if nothing changed
+    write_if_changed(local_filename, steer_text)
 
 
-def remove_whizard_output():
-    cmd = "rm -f default* hbb* hdec* opr* whizard.log"
+def remove_whizard_output(workdir: str):
+    cmd = f"rm -rf {workdir}"
     return cmd
 
 
@@ -0,0 +1,158 @@
+"""
+Reader for the binary FLUKA BIB summary files (summary*_DET_IP.dat).
+
+Each file is a flat array of fixed-size records (LINE_DT), so we memory-map it
+and work on record batches instead of unpacking one record at a time.
+Chunks can be projected onto a subset of columns and filtered on time and energy
+before anything is copied out of the map.
+
+Run like:
+> python fluka.py -i summary1_DET_IP.dat -o summary1_DET_IP.filtered.dat --time-window -1 15
+which writes the surviving records in the same binary format, so that
+fluka_remix.py can read the filtered file before simulation.
+"""
+
+import argparse
+import os
+from glob import glob
+import numpy as np
+import pandas as pd
+import logging
+logger = logging.getLogger(__name__)
+
+# https://github.com/madbaron/detector-simulation/blob/KITP_10TeV/utils/fluka_remix.py
+LINE_DT = np.dtype([
+    ('fid',  np.int32),
+    ('fid_mo',  np.int32),
+    ('E', np.float64),
+    ('x', np.float64),
+    ('y', np.float64),
+    ('z', np.float64),
+    ('cx', np.float64),
+    ('cy', np.float64),
+    ('cz', np.float64),
+    ('time', np.float64),
+    ('x_mu', np.float64),
+    ('y_mu', np.float64),
+    ('z_mu', np.float64)
+])
+S_TO_NS = 1e9
+CHUNK_SIZE = 1_000_000
+
+# dataframe column -> record field
+COLUMNS = {
+    "fid": "fid",
+    "fid_mo": "fid_mo",
+    "e_kin": "E",
+    "x": "x",
+    "y": "y",
+    "z": "z",
+    "cx": "cx",
+    "cy": "cy",
+    "cz": "cz",
+    "time": "time",
+    "x_mu": "x_mu",
+    "y_mu": "y_mu",
+    "z_mu": "z_mu",
+}
+DEFAULT_COLUMNS = ["fid", "e_kin", "x", "y", "z", "cx", "cy", "cz", "time", "z_mu"]
+
+
+def main():
+    logging.basicConfig(level=logging.INFO,
+                        format="%(asctime)s [%(levelname)s] %(message)s")
+    ops = options()
+    n_in, n_out = 0, 0
+    with open(ops.o, "wb") as fi:
+        for path in parse_filepaths(ops.i):
+            all_records = open_fluka(path)
+            n_in += len(all_records)
+            for records in iter_records(all_records, time_window=ops.time_window,
+                                        min_energy=ops.min_energy, max_energy=ops.max_energy):
+                records.tofile(fi)
+                n_out += len(records)
+    logger.info(f"Kept {n_out} / {n_in} FLUKA particles in {ops.o}")
+
+
+def options():
+    parser = argparse.ArgumentParser(usage=__doc__, formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("-i", required=True, nargs="+", help="Input FLUKA file(s) or glob pattern(s)")
+    parser.add_argument("-o", required=True, help="Output FLUKA file with the surviving records")
+    parser.add_argument("--time-window", type=float, nargs=2, default=None, metavar=("LO", "HI"), help="Keep particles with LO <= time < HI [ns]")
+    parser.add_argument("--min-energy", type=float, default=None, help="Keep particles with E >= this [GeV]")
+    parser.add_argument("--max-energy", type=float, default=None, help="Keep particles with E < this [GeV]")
+    return parser.parse_args()
+
+
+def parse_filepaths(fnames: list[str]) -> list[str]:
+    names = []
+    if isinstance(fnames, str):
+        fnames = [fnames]
+    for fname in fnames:
+        names.extend(sorted(glob(fname)))
+    return names
+
+
+def open_fluka(path: str) -> np.memmap:
+    """Structured, read-only view of all records in a FLUKA file."""
+    n_records, remainder = divmod(os.path.getsize(path), LINE_DT.itemsize)
+    if remainder:
+        logger.warning(f"{path} has {remainder} trailing bytes, ignoring them")
+    if n_records == 0:
+        return np.empty(0, dtype=LINE_DT)
+    return np.memmap(path, dtype=LINE_DT, mode="r", shape=(n_records,))
+
+
+def iter_records(
+        path: str | np.ndarray,
+        chunk_size: int = CHUNK_SIZE,
+        time_window: tuple[float, float] = None,
+        min_energy: float = None,
+        max_energy: float = None,
+    ):
+    """
+    Yield structured record batches of one file, or of its records from open_fluka, which pass the filters.
+    The time window is in ns, while the records store seconds.
+    """
+    records = open_fluka(path) if isinstance(path, str) else path
+    for start in range(0, len(records), chunk_size):
+        chunk = records[start : start + chunk_size]
+        mask = np.ones(len(chunk), dtype=bool)
+        if time_window is not None:
+            lo, hi = time_window
+            mask &= (chunk["time"] >= lo / S_TO_NS) & (chunk["time"] < hi / S_TO_NS)
+        if min_energy is not None:
+            mask &= chunk["E"] >= min_energy
+        if max_energy is not None:
+            mask &= chunk["E"] < max_energy
+        yield chunk if mask.all() else chunk[mask]
+
+
+def iter_fluka(
+        fluka_file_paths: list[str],
+        columns: list[str] = None,
+        **kwargs,
+    ):
+    """Yield one DataFrame per record batch, with only the requested columns."""
+    columns = columns or DEFAULT_COLUMNS
+    for path in fluka_file_paths:
+        for records in iter_records(path, **kwargs):
+            df = pd.DataFrame({col: records[COLUMNS[col]] for col in columns})
+            if "time" in df:
+                df["time"] *= S_TO_NS
+            yield df
+
+
+def read_fluka(fluka_file_paths: list[str], columns: list[str] = None, **kwargs) -> pd.DataFrame:
+    n_files = len(fluka_file_paths)
+    dfs = []
+    for i_file, path in enumerate(fluka_file_paths):
+        logger.info(f"Reading FLUKA file {i_file + 1}/{n_files}: {path} ...")
+        dfs.extend(iter_fluka([path], columns=columns, **kwargs))
+    if len(dfs) == 0:
+        return pd.DataFrame(columns=columns or DEFAULT_COLUMNS)
+    return pd.concat(dfs, ignore_index=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,220 @@
+"""
+Export of the tracker barrel surfaces to a versioned geometry table.
+
+The surfaces of the DD4hep SurfaceManager are read once into NumPy arrays
+(origin, u, v, normal, lengths along u and v), and the bounding-box corners of
+every sensor are computed vectorized. The table is written to Parquet and NPZ,
+keyed by geometry tag, so event displays, inside-bounds checks and module maps
+load it instead of re-parsing the compact xml.
+
+Corners follow the convention of write_tgeo_to_dataframe:
+  corner_xy_i: origin -/+ u * length_u / 2 -/+ normal * thickness / 2
+  corner_rz_i: origin -/+ v * length_v / 2 -/+ normal * thickness / 2
+All lengths are in mm.
+
+Usage:
+    python geometry_table.py --tag v07 --compact /path/to/MAIA_v0.xml
+    geo = load_geometry("v07")
+"""
+
+import argparse
+import json
+import os
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from cellid import FIELDS, get_codec
+
+SCHEMA_VERSION = 1
+TAGS = ["v01", "v04", "v05", "v07"]
+DEFAULT_TAG = "v01"
+DEFAULT_DIR = os.environ.get("MAIA_GEOMETRY", os.path.expanduser("~/.cache/maia_noodling/geometry"))
+CODE = "/ceph/users/atuna/work/maia"
+XML = f"{CODE}/k4geo/MuColl/MAIA/compact/MAIA_v0/MAIA_v0.xml"
+DETECTORS = {
+    "InnerTrackerBarrelCollection": "InnerTrackerBarrel",
+    "OuterTrackerBarrelCollection": "OuterTrackerBarrel",
+}
+SENSOR_THICKNESS = 0.1 # mm
+CM_TO_MM = 10.0
+METADATA_KEY = b"maia_geometry"
+FORMATS = ["parquet", "npz"]
+
+# sign of (along, normal) for the four corners of a face
+CORNER_SIGNS = np.array([
+    [-1, -1],
+    [-1, +1],
+    [+1, +1],
+    [+1, -1],
+])
+
+
+def options():
+    parser = argparse.ArgumentParser(usage=__doc__, formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--tag", type=str, default=DEFAULT_TAG, choices=TAGS,
+                        help="Geometry tag, which also selects the CellID encoding")
+    parser.add_argument("--compact", type=str, default=XML,
+                        help="Compact xml of the geometry")
+    parser.add_argument("-o", "--outdir", type=str, default=DEFAULT_DIR,
+                        help="Directory of the geometry tables (env: MAIA_GEOMETRY)")
+    parser.add_argument("--formats", type=str, nargs="+", default=FORMATS, choices=FORMATS,
+                        help="Output formats")
+    return parser.parse_args()
+
+
+def main():
+    ops = options()
+    geo = extract_geometry(ops.compact, tag=ops.tag)
+    print(geo)
+    for path in write_geometry(geo, ops.tag, ops.outdir, compact=ops.compact, formats=ops.formats):
+        print(f"Wrote geometry table to {path}")
+
+
+def extract_geometry(compact: str = XML, tag: str = DEFAULT_TAG, detectors: dict = DETECTORS) -> pd.DataFrame:
+    """Geometry table of all sensitive surfaces of the given detectors."""
+    surfaces = read_surfaces(compact, detectors)
+    return geometry_frame(surfaces, tag)
+
+
+def read_surfaces(compact: str, detectors: dict = DETECTORS) -> dict[str, np.ndarray]:
+    """
+    Surface ids, vectors and lengths as arrays, in the units of DD4hep (cm).
+    The loop over surfaces only calls getters, and fills preallocated arrays.
+    """
+    import dd4hep
+    import DDRec
+
+    detector = dd4hep.Detector.getInstance()
+    detector.fromCompact(compact)
+    surfman = DDRec.SurfaceManager(detector)
+
+    surf_maps = []
+    for name, det_name in detectors.items():
+        surf_map = surfman.map(detector.detector(det_name).name())
+        print(f"Number of surfaces in {name} map:", len(surf_map))
+        surf_maps.append(surf_map)
+
+    n = sum(len(surf_map) for surf_map in surf_maps)
+    ids = np.zeros(n, dtype=np.uint64)
+    vectors = np.zeros((4, n, 3), dtype=np.float64)
+    lengths = np.zeros((2, n), dtype=np.float64)
+    i_surf = 0
+    for surf_map in surf_maps:
+        for surf_pair in surf_map:
+            surf = surf_pair.second
+            ids[i_surf] = surf_pair.first
+            for i_vec, vec in enumerate((surf.origin(), surf.u(), surf.v(), surf.normal())):
+                vectors[i_vec, i_surf] = vec.x(), vec.y(), vec.z()
+            lengths[:, i_surf] = surf.length_along_u(), surf.length_along_v()
+            i_surf += 1
+
+    return {
+        "id": ids,
+        "origin": vectors[0],
+        "u": vectors[1],
+        "v": vectors[2],
+        "normal": vectors[3],
+        "length_u": lengths[0],
+        "length_v": lengths[1],
+    }
+
+
+def face_corners(origin: np.ndarray, along: np.ndarray, normal: np.ndarray, length: np.ndarray, thickness: float) -> np.ndarray:
+    """(n, 4, 3) corners of the faces spanned by `along` and `normal` around each origin."""
+    half_along = along * (length / 2.0)[:, None]
+    half_normal = normal * (thickness / 2.0)
+    return (origin[:, None, :]
+            + CORNER_SIGNS[None, :, 0, None] * half_along[:, None, :]
+            + CORNER_SIGNS[None, :, 1, None] * half_normal[:, None, :])
+
+
+def geometry_frame(surfaces: dict[str, np.ndarray], tag: str = DEFAULT_TAG, thickness: float = SENSOR_THICKNESS) -> pd.DataFrame:
+    """Geometry table in mm from the arrays of read_surfaces, in cm."""
+    origin = surfaces["origin"] * CM_TO_MM
+    length_u = surfaces["length_u"] * CM_TO_MM
+    length_v = surfaces["length_v"] * CM_TO_MM
+    corners = {
+        "xy": face_corners(origin, surfaces["u"], surfaces["normal"], length_u, thickness),
+        "rz": face_corners(origin, surfaces["v"], surfaces["normal"], length_v, thickness),
+    }
+
+    columns = {"id": surfaces["id"]}
+    decoded = get_codec(tag).decode(surfaces["id"], fields=FIELDS)
+    columns.update({name: values.astype(np.int64) for name, values in decoded.items()})
+    for name in ["origin", "u", "v", "normal"]:
+        values = origin if name == "origin" else surfaces[name]
+        for i_dim, dim in enumerate("xyz"):
+            columns[f"{name}_{dim}"] = values[:, i_dim]
+    columns["length_u"] = length_u
+    columns["length_v"] = length_v
+    for face, face_corners_ in corners.items():
+        for i_corner in range(4):
+            for i_dim, dim in enumerate("xyz"):
+                columns[f"corner_{face}_{i_corner}_{dim}"] = face_corners_[:, i_corner, i_dim]
+    return pd.DataFrame(columns)
+
+
+def corners(geo: pd.DataFrame, face: str = "xy") -> np.ndarray:
+    """(n, 4, 3) corners of one face from a geometry table."""
+    cols = [f"corner_{face}_{i_corner}_{dim}" for i_corner in range(4) for dim in "xyz"]
+    return geo[cols].to_numpy(dtype=np.float64).reshape(-1, 4, 3)
+
+
+def geometry_path(tag: str, outdir: str = DEFAULT_DIR, fmt: str = "parquet") -> str:
+    return os.path.join(outdir, f"geometry_{tag}.schema{SCHEMA_VERSION}.{fmt}")
+
+
+def write_geometry(geo: pd.DataFrame, tag: str, outdir: str = DEFAULT_DIR, compact: str = XML, formats: list[str] = FORMATS) -> list[str]:
+    os.makedirs(outdir, exist_ok=True)
+    paths = [geometry_path(tag, outdir, fmt) for fmt in formats]
+    for path in paths:
+        write_geometry_file(geo, path, tag, compact)
+    return paths
+
+
+def write_geometry_file(geo: pd.DataFrame, path: str, tag: str, compact: str = XML):
+    """Write a geometry table to a Parquet or NPZ path, with its tag and schema version."""
+    metadata = json.dumps({"tag": tag, "schema_version": SCHEMA_VERSION, "compact": compact})
+    tmp = f"{path}.{os.getpid()}.tmp"
+    if path.endswith(".npz"):
+        with open(tmp, "wb") as fo:
+            np.savez(fo, __metadata__=np.array(metadata), **{col: geo[col].to_numpy() for col in geo.columns})
+    else:
+        table = pa.Table.from_pandas(geo, preserve_index=False)
+        table = table.replace_schema_metadata({**(table.schema.metadata or {}), METADATA_KEY: metadata.encode()})
+        pq.write_table(table, tmp)
+    os.replace(tmp, path)
+
+
+def load_geometry(tag_or_path: str = DEFAULT_TAG, outdir: str = DEFAULT_DIR, columns: list[str] = None) -> pd.DataFrame:
+    """
+    Geometry table of a tag from the geometry directory, or from a Parquet/NPZ path.
+    Tables written with another schema version are rejected.
+    """
+    path = tag_or_path
+    if not os.path.isfile(path):
+        path = geometry_path(tag_or_path, outdir, "parquet")
+        if not os.path.isfile(path):
+            path = geometry_path(tag_or_path, outdir, "npz")
+    if not os.path.isfile(path):
+        raise FileNotFoundError(f"No geometry table for {tag_or_path} in {outdir}. Write one with geometry_table.py --tag")
+
+    if path.endswith(".npz"):
+        with np.load(path) as npz:
+            metadata = json.loads(str(npz["__metadata__"]))
+            geo = pd.DataFrame({col: npz[col] for col in npz.files if col != "__metadata__" and (columns is None or col in columns)})
+    else:
+        raw = pq.read_schema(path).metadata or {}
+        # tables from write_tgeo_to_dataframe before the schema was versioned have no metadata
+        metadata = json.loads(raw[METADATA_KEY]) if METADATA_KEY in raw else {"schema_version": SCHEMA_VERSION}
+        geo = pd.read_parquet(path, columns=columns)
+
+    if metadata["schema_version"] != SCHEMA_VERSION:
+        raise ValueError(f"Geometry table {path} has schema version {metadata['schema_version']}, expected {SCHEMA_VERSION}")
+    return geo
+
+
+if __name__ == "__main__":
+    main()
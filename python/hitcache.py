@@ -0,0 +1,117 @@
+"""
+Shared on-disk cache of per-file slcio extractions, stored as Parquet.
+
+An entry is keyed by the fingerprint of its slcio file, the extractor (name,
+version, and arguments), and the table name. The fingerprint is (path, size, mtime)
+by default, or a content hash, so a cache survives copies and touches of the inputs.
+Entries are evicted least-recently-used once the cache exceeds its size budget.
+
+Usage:
+    cache = HitCache("/path/to/cache", budget_gb=100)
+    path = cache.entry(file_path, "extract_tables", version=1, table="simhits")
+    if cache.has(path):
+        df = cache.read(path, columns=["x", "y", "z"])
+"""
+
+import hashlib
+import os
+import pandas as pd
+import logging
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_DIR = os.environ.get("MAIA_HIT_CACHE", os.path.expanduser("~/.cache/maia_noodling/slcio"))
+DEFAULT_BUDGET_GB = 100.0
+FINGERPRINTS = ["stat", "content"]
+HASH_BLOCK = 1 << 24
+GB = 1024**3
+SUFFIX = ".parquet"
+
+
+class HitCache:
+
+    def __init__(self, cache_dir: str = DEFAULT_CACHE_DIR, budget_gb: float = DEFAULT_BUDGET_GB, fingerprint: str = "stat"):
+        if fingerprint not in FINGERPRINTS:
+            raise ValueError(f"Unknown cache fingerprint: {fingerprint}. Choose from {FINGERPRINTS}")
+        self.cache_dir = cache_dir
+        self.budget = int(budget_gb * GB)
+        self.fingerprint = fingerprint
+        os.makedirs(cache_dir, exist_ok=True)
+
+
+    def __repr__(self):
+        return f"HitCache('{self.cache_dir}', budget_gb={self.budget / GB:g}, fingerprint='{self.fingerprint}')"
+
+
+    def file_fingerprint(self, file_path: str) -> str:
+        if self.fingerprint == "content":
+            sha = hashlib.sha1()
+            with open(file_path, "rb") as fi:
+                while block := fi.read(HASH_BLOCK):
+                    sha.update(block)
+            return sha.hexdigest()
+        stat = os.stat(file_path)
+        return repr((os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns))
+
+
+    def entry(self, file_path: str, extractor: str, version: int = 0, table: str = None, kwargs: dict = None, fingerprint: str = None) -> str:
+        """Path of the cache entry for one table of one file. Pass the fingerprint of the file to reuse it across tables."""
+        fingerprint = fingerprint or self.file_fingerprint(file_path)
+        key = repr((fingerprint, extractor, version, table, sorted((kwargs or {}).items())))
+        digest = hashlib.sha1(key.encode()).hexdigest()[:20]
+        name = os.path.splitext(os.path.basename(file_path))[0]
+        parts = [name, extractor] + ([table] if table else []) + [digest]
+        return os.path.join(self.cache_dir, ".".join(parts) + SUFFIX)
+
+
+    def has(self, path: str) -> bool:
+        return os.path.isfile(path)
+
+
+    def read(self, path: str, columns: list[str] = None) -> pd.DataFrame:
+        df = pd.read_parquet(path, columns=columns)
+        # mark as recently used
+        os.utime(path)
+        return df
+
+
+    def write(self, path: str, df: pd.DataFrame):
+        tmp = f"{path}.{os.getpid()}.tmp"
+        df.to_parquet(tmp)
+        os.replace(tmp, path)
+
+
+    def size(self) -> int:
+        return sum(size for _, _, size in self.entries())
+
+
+    def entries(self) -> list[tuple[float, str, int]]:
+        """(last use, path, size) of every entry, oldest first."""
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(SUFFIX):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, path, stat.st_size))
+        return sorted(entries)
+
+
+    def evict(self, keep: set[str] = None):
+        """Remove least-recently-used entries until the cache fits in its budget."""
+        keep = keep or set()
+        entries = self.entries()
+        total = sum(size for _, _, size in entries)
+        for _, path, size in entries:
+            if total <= self.budget:
+                break
+            if path in keep:
+                continue
+            logger.info(f"Evicting {path} from the hit cache ...")
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
@@ -0,0 +1,74 @@
+"""
+Lazy loading of hit Parquet files with pyarrow.dataset.
+
+Only the requested columns are read (columns missing from the file are skipped,
+since plotters often compute them after loading), and row filters are pushed down
+to the Parquet reader, so row groups outside the selection are never decoded.
+
+Filters are a dict of column -> selection:
+    (lo, hi): keep lo <= column < hi, with None for an open end
+    [a, b, ...]: keep column in the list
+Filters on columns missing from a file are ignored, so one filter dict
+can be applied to both the mcparticle and the simhit files.
+
+Usage:
+    df = read_parquet("sig.parquet", columns=["i_event", "hit_z"], filters={"i_event": (0, 100), "hit_layer": [0, 1]})
+"""
+
+import pandas as pd
+import pyarrow.dataset as ds
+
+
+def read_parquet(path: str, columns: list[str] = None, filters: dict = None) -> pd.DataFrame:
+    dataset = ds.dataset(path, format="parquet")
+    names = dataset.schema.names
+    if columns is not None:
+        columns = [col for col in dict.fromkeys(columns) if col in names]
+    table = dataset.to_table(columns=columns, filter=make_filter(filters, names))
+    return table.to_pandas().reset_index(drop=True)
+
+
+def make_filter(filters: dict, names: list[str]) -> ds.Expression | None:
+    expression = None
+    for column, selection in (filters or {}).items():
+        if column not in names or selection is None:
+            continue
+        field = ds.field(column)
+        if isinstance(selection, tuple):
+            lo, hi = selection
+            condition = None
+            if lo is not None:
+                condition = field >= lo
+            if hi is not None:
+                condition = (field < hi) if condition is None else condition & (field < hi)
+        else:
+            condition = field.isin(list(selection))
+        if condition is not None:
+            expression = condition if expression is None else expression & condition
+    return expression
+
+
+def add_filter_arguments(parser, separator: str = "-"):
+    """Row selections for loading Parquet files. Scripts with --underscore_options use separator="_"."""
+    parser.add_argument("--events", type=int, nargs=2, default=None, metavar=("LO", "HI"), help="Load only events LO <= i_event < HI")
+    parser.add_argument("--systems", type=int, nargs="+", default=None, help="Load only hits in these systems")
+    parser.add_argument("--layers", type=int, nargs="+", default=None, help="Load only hits in these layers")
+    parser.add_argument(f"--mcp{separator}pt", dest="mcp_pt", type=float, nargs=2, default=None, metavar=("LO", "HI"), help="Load only mcparticles with LO <= pt < HI [GeV]")
+
+
+def filters_from_options(ops, system: str, layer: str, pt: str, event: str = "i_event") -> dict:
+    """Filter dict from add_filter_arguments, with the column names of one dataframe format."""
+    return {
+        event: tuple(ops.events) if ops.events else None,
+        system: ops.systems,
+        layer: ops.layers,
+        pt: tuple(ops.mcp_pt) if ops.mcp_pt else None,
+    }
+
+
+def columns_for(requirements: dict[str, list[str]], names: list[str]) -> list[str]:
+    """Union of the columns declared for each name, in declaration order."""
+    columns = []
+    for name in names:
+        columns.extend(requirements.get(name, []))
+    return list(dict.fromkeys(columns))
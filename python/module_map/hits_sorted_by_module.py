@@ -5,6 +5,20 @@ from constants import MINIMUM_PT, MINIMUM_TIME, MAXIMUM_TIME
 
 class GetNextHitAndSort:
 
+    NEXT_COLUMNS = [
+        "i_event",
+        "i_sim",
+        "hit_system",
+        "hit_side",
+        "hit_layer",
+        "hit_module",
+        "hit_sensor",
+        "hit_theta",
+        "hit_phi",
+        "hit_t",
+        "hit_t_corrected",
+    ]
+    COLUMNS = NEXT_COLUMNS + ["sim_pt"]
 
     def __init__(self,
                  barrel_only: bool,
@@ -23,20 +37,10 @@ class GetNextHitAndSort:
 
     def get_next_row(self):
         print("Getting next row ...")
-        for col in [
-            "i_event",
-            "i_sim",
-            "hit_system",
-            "hit_side",
-            "hit_layer",
-            "hit_module",
-            "hit_sensor",
-            "hit_theta",
-            "hit_phi",
-            "hit_t",
-            "hit_t_corrected",
-            ]:
-            self.hits_df[f"next_{col}"] = self.hits_df[col].shift(-1).fillna(-1).astype(self.hits_df[col].dtype)
+        for col in self.NEXT_COLUMNS:
+            # widen unsigned CellID fields so that the -1 of the last row does not wrap
+            values = self.hits_df[col]
+            self.hits_df[f"next_{col}"] = values.astype(np.promote_types(values.dtype, np.int8)).shift(-1, fill_value=-1)
         print(self.hits_df)
 
 
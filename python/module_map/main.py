@@ -1,5 +1,6 @@
 import argparse
-import pandas as pd
+import os
+import sys
 from glob import glob
 
 from slcio_to_hits_dataframe import SlcioToHitsDataFrame
@@ -7,6 +8,10 @@ from hits_sorted_by_module import GetNextHitAndSort
 from hits_to_module_map import HitsToModuleMap
 from plotter import Plotter
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from lazy_parquet import add_filter_arguments, filters_from_options, read_parquet
+from slcio_reader import add_cache_arguments, cache_from_options
+
 # FNAME = "/ceph/users/atuna/work/maia/maia_noodling/samples/v00/muonGun_pT_0_10_nobib/muonGun_pT_0_10_digi_0.slcio"
 FNAME = "/ceph/users/atuna/work/maia/maia_noodling/experiments/simulate_muonGun.2025_11_06_21h31m00s/muonGun_pT_0_10_digi_0.slcio"
 
@@ -22,6 +27,10 @@ def options():
                         help="Load hits dataframe from parquet file")
     parser.add_argument("--barrel_only", action="store_true",
                         help="Consider only barrel hits for module mapping")
+    parser.add_argument("--all_columns", action="store_true",
+                        help="Load every column from parquet, instead of only those the module map and plots need")
+    add_filter_arguments(parser, separator="_")
+    add_cache_arguments(parser, separator="_")
     return parser.parse_args()
 
 
@@ -32,9 +41,11 @@ def main():
         print(f"Input file: {fpath}")
 
     if ops.load_parquet:
-        hits_df = pd.read_parquet(ops.parquet)
+        columns = None if ops.all_columns else list(dict.fromkeys(GetNextHitAndSort.COLUMNS + Plotter.columns()))
+        filters = filters_from_options(ops, system="hit_system", layer="hit_layer", pt="sim_pt")
+        hits_df = read_parquet(ops.parquet, columns=columns, filters=filters)
     else:
-        converter = SlcioToHitsDataFrame(file_paths, barrel_only=ops.barrel_only)
+        converter = SlcioToHitsDataFrame(file_paths, barrel_only=ops.barrel_only, cache=cache_from_options(ops))
         hits_df = converter.convert()
         print(f"Writing hits to {ops.parquet} ...")
         hits_df.to_parquet(ops.parquet)
@@ -1,3 +1,5 @@
+import os
+import sys
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
@@ -6,10 +8,44 @@ from matplotlib import rcParams
 rcParams.update({"font.size": 16})
 
 from constants import DET_IDS, DET_NAMES
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from lazy_parquet import columns_for
 EPSILON = 1e-3
 
 class Plotter:
 
+    # plots made by plot(), in order
+    PLOTS = [
+        #### "plot_hit_eta_phi",
+        #### "plot_hit_z",
+        "plot_hit_t",
+        "plot_hit_t_R",
+        "plot_hit_quality",
+        #### "plot_hit_sensor",
+        #### "plot_hit_z_sensor",
+        "plot_hit_module_layer",
+        "plot_hit_sensor_layer",
+        # "plot_module_counts",
+        "plot_module_position",
+    ]
+
+    # hit columns which each method needs
+    COLUMNS = {
+        "__init__": ["hit_theta"],
+        "plot_hit_eta_phi": ["hit_phi", "hit_system"],
+        "plot_hit_z": ["hit_z"],
+        "plot_hit_t": ["hit_t", "hit_t_corrected"],
+        "plot_hit_t_R": ["hit_t", "hit_R"],
+        "plot_hit_quality": ["hit_quality"],
+        "plot_hit_sensor": ["hit_sensor"],
+        "plot_hit_z_sensor": ["hit_z", "hit_sensor"],
+        "plot_hit_cellid1": ["hit_cellid1"],
+        "plot_hit_module_layer": ["hit_system", "hit_layer", "hit_module"],
+        "plot_hit_sensor_layer": ["hit_system", "hit_layer", "hit_sensor"],
+        "plot_module_position": ["hit_system", "hit_side", "hit_layer", "hit_module", "hit_sensor", "hit_theta", "hit_phi", "hit_t"],
+    }
+
     def __init__(self,
                  df: pd.DataFrame,
                  sorted_df: pd.DataFrame,
@@ -24,17 +60,14 @@ class Plotter:
     def plot(self, pdf_name: str) -> None:
         print(f"Saving plots to {pdf_name} ...")
         with PdfPages(pdf_name) as pdf:
-            #### self.plot_hit_eta_phi(pdf)
-            #### self.plot_hit_z(pdf)
-            self.plot_hit_t(pdf)
-            self.plot_hit_t_R(pdf)
-            self.plot_hit_quality(pdf)
-            #### self.plot_hit_sensor(pdf)
-            #### self.plot_hit_z_sensor(pdf)
-            self.plot_hit_module_layer(pdf)
-            self.plot_hit_sensor_layer(pdf)
-            # self.plot_module_counts(pdf)
-            self.plot_module_position(pdf)
+            for name in self.PLOTS:
+                getattr(self, name)(pdf)
+
+
+    @classmethod
+    def columns(cls, plots: list[str] = None) -> list[str]:
+        """Hit columns needed by the given (default: enabled) plots."""
+        return columns_for(cls.COLUMNS, ["__init__"] + list(plots or cls.PLOTS))
 
 
     def plot_hit_eta_phi(self, pdf: PdfPages) -> None:
@@ -10,18 +10,27 @@ import numpy as np
 import pandas as pd
 from tqdm import tqdm
 import os
+import sys
 import multiprocessing as mp
 
 from constants import MINIMUM_PT, SPEED_OF_LIGHT
 from constants import MCPARTICLES, TRACKER_RELATIONS, SIM_TRACKER_COLLECTIONS
 from constants import IT_BARREL, OT_BARREL
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from cellid import FIELDS, codec_from_collection, get_codec
+from slcio_reader import convert_cached
+
+# bump when the conversion changes, to invalidate the cached hits
+CACHE_VERSION = 1
+
 
 class SlcioToHitsDataFrame:
 
-    def __init__(self, slcio_file_paths, barrel_only):
+    def __init__(self, slcio_file_paths, barrel_only, cache=None):
         self.slcio_file_paths = slcio_file_paths
         self.barrel_only = barrel_only
+        self.cache = cache
         self.systems = [] # [IT_BARREL]
         self.layers = [] # [1, 2]
 
@@ -36,9 +45,30 @@ class SlcioToHitsDataFrame:
 
     def convert_all_files(self) -> pd.DataFrame:
         with mp.Pool(processes=mp.cpu_count()) as pool:
-            all_hits_dfs = pool.map(self.convert_one_file, self.slcio_file_paths)
+            results = pool.map(self.convert_cached_file, self.slcio_file_paths)
+        if self.cache is not None:
+            self.cache.evict(keep={path for (df, paths) in results for path in paths})
         print("Merging DataFrames ...")
-        return pd.concat(all_hits_dfs, ignore_index=True)
+        return pd.concat([df for (df, paths) in results], ignore_index=True)
+
+
+    def convert_cached_file(self, slcio_file_path: str) -> tuple[pd.DataFrame, list[str]]:
+        # cached per file, keyed by the hit selection and the fallback CellID encoding
+        kwargs = {
+            "systems": self.systems,
+            "layers": self.layers,
+            "encoding": get_codec().encoding,
+            "digi": "_digi_" in slcio_file_path,
+        }
+        tables, paths = convert_cached(slcio_file_path,
+                                       lambda: {"hits": self.convert_one_file(slcio_file_path)},
+                                       self.cache,
+                                       "module_map_hits",
+                                       version=CACHE_VERSION,
+                                       tables=["hits"],
+                                       kwargs=kwargs,
+                                       file=os.path.basename(slcio_file_path))
+        return tables["hits"], paths
 
 
     def convert_one_file(self, slcio_file_path: str) -> pd.DataFrame:
@@ -56,6 +86,7 @@ class SlcioToHitsDataFrame:
 
         # list for holding all hits
         rows = []
+        codec = get_codec()
 
         # loop over all events in the slcio file
         for i_event, event in enumerate(reader):
@@ -81,6 +112,8 @@ class SlcioToHitsDataFrame:
             for collection in collections:
 
                 col = event.getCollection(collection)
+                # relations carry no CellIDEncoding, their hit collection does
+                codec = codec_from_collection(event.getCollection(collection.removesuffix("Relations")), codec)
 
                 for obj in col:
 
@@ -106,9 +139,9 @@ class SlcioToHitsDataFrame:
                         continue
 
                     # skip if trying to speed up
-                    if self.systems and (np.right_shift(hit.getCellID0(), 0) & 0b1_1111) not in self.systems:
+                    if self.systems and codec.get(hit.getCellID0(), "system") not in self.systems:
                         continue
-                    if self.layers and (np.right_shift(hit.getCellID0(), 7) & 0b11_1111) not in self.layers:
+                    if self.layers and codec.get(hit.getCellID0(), "layer") not in self.layers:
                         continue
 
                     # record the hit info
@@ -138,7 +171,11 @@ class SlcioToHitsDataFrame:
 
         # Convert the list of hits to a pandas DataFrame
         print("Converting hits to DataFrame ...")
-        return pd.DataFrame(rows)
+        df = pd.DataFrame(rows)
+        if len(df) > 0:
+            for name, values in codec.decode(df['hit_cellid0'], fields=FIELDS, prefix='hit_').items():
+                df[name] = values
+        return df
 
 
     def postprocess_dataframe(self, df: pd.DataFrame) -> pd.DataFrame:
@@ -151,11 +188,6 @@ class SlcioToHitsDataFrame:
         df['hit_r'] = np.sqrt(df['hit_x']**2 + df['hit_y']**2)
         df['hit_R'] = np.sqrt(df['hit_x']**2 + df['hit_y']**2 + df['hit_z']**2)
         df['hit_t_corrected'] = df['hit_t'] - (df['hit_R'] / SPEED_OF_LIGHT * ~df['hit_is_digi'])
-        df['hit_system'] = np.right_shift(df['hit_cellid0'], 0) & 0b1_1111
-        df['hit_side'] = np.right_shift(df['hit_cellid0'], 5) & 0b11
-        df['hit_layer'] = np.right_shift(df['hit_cellid0'], 7) & 0b11_1111
-        df['hit_module'] = np.right_shift(df['hit_cellid0'], 13) & 0b111_1111_1111
-        df['hit_sensor'] = np.right_shift(df['hit_cellid0'], 24) & 0b1111_1111
         df['hit_theta'] = np.arctan2(df['hit_r'], df['hit_z'])
         df['hit_phi'] = np.arctan2(df['hit_y'], df['hit_x'])
 
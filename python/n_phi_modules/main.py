@@ -9,6 +9,8 @@ A configuration can then be described by:
 Module thickness isnt considered.
 """
 
+import os
+import sys
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
@@ -34,7 +36,11 @@ rcParams.update({
     "figure.subplot.top": 0.95,
 })
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from barrel_geometry import BarrelGeometry, INNER_TRACKER_BARREL, doublet, hermeticity
+
 TWOPI = 2.0 * np.pi
+N_RAYS = 100_000
 SPACING_V0 = 12.0
 SPACING_V1 = 4.0
 SPACING_V6 = 8.0
@@ -97,6 +103,8 @@ def main():
     with PdfPages(PDF) as pdf:
         for (nphi, inner_radius, outer_radius, module_width, text) in zip(NPHIS, INNER_RADII, OUTER_RADII, MODULE_WIDTHS, TEXTS):
             df = make_modules(nphi, inner_radius, outer_radius, module_width)
+            herm = ray_hermeticity(layer_geometry(nphi, inner_radius, outer_radius, module_width))
+            print(f"{text} hermeticity: {herm:.4f}")
             plot_modules(df, pdf, nphi, inner_radius, outer_radius, module_width, text, zoom=True)
 
 
@@ -107,32 +115,41 @@ def make_modules(
         module_width: float,
     ) -> pd.DataFrame:
 
-    dphi = TWOPI / nphi
-    module_half_width = module_width / 2.0
-
-    modules = []
-    for i_mod in range(nphi):
-        inner_phi = i_mod * dphi
-        modules.append({
-            "x0": inner_radius * np.cos(inner_phi) - module_half_width * np.sin(inner_phi),
-            "y0": inner_radius * np.sin(inner_phi) + module_half_width * np.cos(inner_phi),
-            "x1": inner_radius * np.cos(inner_phi) + module_half_width * np.sin(inner_phi),
-            "y1": inner_radius * np.sin(inner_phi) - module_half_width * np.cos(inner_phi),
-            "dphi": module_width / inner_radius, # small angle approximation: dl = r * dphi
-        })
-
-        outer_phi = inner_phi + (dphi / 2.0)
-        modules.append({
-            "x0": outer_radius * np.cos(outer_phi) - module_half_width * np.sin(outer_phi),
-            "y0": outer_radius * np.sin(outer_phi) + module_half_width * np.cos(outer_phi),
-            "x1": outer_radius * np.cos(outer_phi) + module_half_width * np.sin(outer_phi),
-            "y1": outer_radius * np.sin(outer_phi) - module_half_width * np.cos(outer_phi),
-            "dphi": module_width / outer_radius, # small angle approximation: dl = r * dphi
-        })
-    df = pd.DataFrame(modules)
+    geo = layer_geometry(nphi, inner_radius, outer_radius, module_width)
+    first = geo.layer == 0
+    origin = geo.origin[first]
+    half_width = geo.u[first] * (module_width / 2.0)
+    radius = np.hypot(origin[:, 0], origin[:, 1])
+    df = pd.DataFrame({
+        "x0": origin[:, 0] + half_width[:, 0],
+        "y0": origin[:, 1] + half_width[:, 1],
+        "x1": origin[:, 0] - half_width[:, 0],
+        "y1": origin[:, 1] - half_width[:, 1],
+        "dphi": module_width / radius, # small angle approximation: dl = r * dphi
+    })
     return df
 
 
+def layer_geometry(
+        nphi: int,
+        inner_radius: float,
+        outer_radius: float,
+        module_width: float,
+    ) -> BarrelGeometry:
+    return BarrelGeometry([doublet(INNER_TRACKER_BARREL, inner_radius, nphi, outer_radius - inner_radius, module_width)])
+
+
+def ray_hermeticity(geo: BarrelGeometry, n_rays: int = N_RAYS) -> float:
+    """Fraction of straight rays from the origin at eta = 0 which hit the first layer."""
+    rays = {
+        "pt": np.ones(n_rays),
+        "eta": np.zeros(n_rays),
+        "phi": np.linspace(0, TWOPI, n_rays, endpoint=False),
+        "charge": np.zeros(n_rays),
+    }
+    return hermeticity(geo.intersect(rays), n_rays).loc[(INNER_TRACKER_BARREL, 0)]
+
+
 def plot_modules(
         df: pd.DataFrame,
         pdf: PdfPages,
@@ -2,6 +2,7 @@
 Plot the raw time and speed-of-light-corrected time for sim hits in BIB
 """
 
+import argparse
 from glob import glob
 import numpy as np
 import pandas as pd
@@ -32,7 +33,11 @@ rcParams.update({
 import logging
 logger = logging.getLogger(__name__)
 
-import pyLCIO
+from cellid import FIELDS
+from fluka import read_fluka
+from hitcache import HitCache
+from slcio_reader import add_reader_arguments, cache_from_options
+from slcio_tables import decode_cellids, read_table
 
 FLUKA_FILE_PATHS = [
     "/ceph/users/atuna/work/maia/data/FLUKA/summary10*_DET_IP.dat",
@@ -71,15 +76,18 @@ def main():
     logging.basicConfig(level=logging.INFO,
                         format="%(asctime)s [%(levelname)s] %(message)s")
 
+    ops = options()
+    cache = cache_from_options(ops)
+
     fluka_file_paths = parse_filepaths(FLUKA_FILE_PATHS)
     slcio_file_paths = parse_filepaths(SLCIO_FILE_PATHS)
     neutrino_file_paths = parse_filepaths(NEUTRINO_FILE_PATHS)
     official_file_paths = parse_filepaths(OFFICIAL_FILE_PATHS)
 
     # particles = parse_fluka(fluka_file_paths)
-    # bibsim_hits = parse_slcio(slcio_file_paths)
-    # neutrino_hits = parse_slcio(neutrino_file_paths)
-    official_hits = parse_slcio(official_file_paths)
+    # bibsim_hits = parse_slcio(slcio_file_paths, ops.jobs, cache)
+    # neutrino_hits = parse_slcio(neutrino_file_paths, ops.jobs, cache)
+    official_hits = parse_slcio(official_file_paths, ops.jobs, cache)
 
     with PdfPages("bib_time.pdf") as pdf:
         # plot_fluka(particles, pdf)
@@ -90,6 +98,12 @@ def main():
         plot_slcio(official_hits, pdf, tag="muonGun")
 
 
+def options():
+    parser = argparse.ArgumentParser(usage=__doc__, formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    add_reader_arguments(parser)
+    return parser.parse_args()
+
+
 def plot_fluka(particles: pd.DataFrame, pdf: PdfPages):
     
     fig, ax = plt.subplots()
@@ -180,116 +194,31 @@ def parse_filepaths(
     return names
 
 
-def parse_slcio(slcio_file_paths: list[str]) -> pd.DataFrame:
-
-    rows = []
-
-    n_files = len(slcio_file_paths)
-
-    for i_file, file_path in enumerate(slcio_file_paths):
-        logger.info(f"Processing file {i_file + 1}/{n_files}: {file_path} ...")
+def parse_slcio(slcio_file_paths: list[str], jobs: int = None, cache: HitCache = None) -> pd.DataFrame:
 
-        reader = pyLCIO.IOIMPL.LCFactory.getInstance().createLCReader()
-        reader.open(file_path)
-
-        for event in reader:
-            for collection in TRACKER_COLLECTIONS:
-                hits = event.getCollection(collection)
-                n_hit = len(hits)
-                for i_hit, hit in enumerate(hits):
-                    if i_hit > 0 and i_hit % 1e6 == 0:
-                        logger.info(f"{collection} hit {i_hit}/{n_hit-1} ...")
-                    cellid = hit.getCellID0()
-                    time = hit.getTime()
-                    position = hit.getPosition()
-                    correction = (np.sqrt(position[0]**2 + position[1]**2 + position[2]**2) / SPEED_OF_LIGHT)
-                    rows.append({
-                        'simhit_x': position[0],
-                        'simhit_y': position[1],
-                        'simhit_z': position[2],
-                        'simhit_cellid0': cellid,
-                        'simhit_t': time,
-                        'simhit_t_corrected': time - correction,
-                    })
-
-    logger.info("Merge hits into dataframe ...")
-    df = pd.DataFrame(rows)
+    hits = read_table(slcio_file_paths, "digihits", jobs=jobs, cache=cache,
+                      columns=["collection", "x", "y", "z", "t", "cellid0", "cellid_encoding"])
+    hits = hits[hits["collection"].isin(TRACKER_COLLECTIONS)].reset_index(drop=True)
 
     logger.info("Post-processing hits ...")
-    df["simhit_system"] = np.right_shift(df["simhit_cellid0"], 0) & 0b1_1111
-    df["simhit_side"] = np.right_shift(df["simhit_cellid0"], 5) & 0b11
-    df["simhit_layer"] = np.right_shift(df["simhit_cellid0"], 7) & 0b11_1111
-    df["simhit_module"] = np.right_shift(df["simhit_cellid0"], 13) & 0b111_1111_1111
-    df["simhit_sensor"] = np.right_shift(df["simhit_cellid0"], 24) & 0b1111_1111
+    correction = np.sqrt(hits["x"]**2 + hits["y"]**2 + hits["z"]**2) / SPEED_OF_LIGHT
+    df = pd.DataFrame({
+        'simhit_x': hits["x"],
+        'simhit_y': hits["y"],
+        'simhit_z': hits["z"],
+        'simhit_cellid0': hits["cellid0"],
+        'simhit_t': hits["t"],
+        'simhit_t_corrected': hits["t"] - correction,
+    })
+    decoded = decode_cellids(hits[["cellid0", "cellid_encoding"]].copy(), prefix="simhit_")
+    for name in FIELDS:
+        df[f"simhit_{name}"] = decoded[f"simhit_{name}"]
 
     return df
 
 
-def bytes_from_file(filename: str):
-    """
-    Taken from:
-    https://github.com/madbaron/detector-simulation/blob/KITP_10TeV/utils/fluka_remix.py
-    """
-    line_dt=np.dtype([
-        ('fid',  np.int32),
-        ('fid_mo',  np.int32),
-        ('E', np.float64),
-        ('x', np.float64),
-        ('y', np.float64),
-        ('z', np.float64),
-        ('cx', np.float64),
-        ('cy', np.float64),
-        ('cz', np.float64),
-        ('time', np.float64),
-        ('x_mu', np.float64),
-        ('y_mu', np.float64),
-        ('z_mu', np.float64)
-    ])
-    with open(filename, 'rb') as f:
-        while True:
-            chunk = np.fromfile(f, dtype=line_dt, count=1)
-            if not len(chunk):
-                return
-            yield chunk
-
-
 def parse_fluka(fluka_file_paths: list[str]) -> pd.DataFrame:
-    """
-    Taken from:
-    https://github.com/madbaron/detector-simulation/blob/KITP_10TeV/utils/fluka_remix.py
-    """
-    rows = []
-    s_to_ns = 1e9
-    n_files = len(fluka_file_paths)
-
-    for i_file, file_in in enumerate(fluka_file_paths):
-
-        logger.info(f"Processing FLUKA file {i_file + 1}/{n_files}: {file_in} ...")
-
-        for iL, data in enumerate(bytes_from_file(file_in)):
-
-            fid,e_kin, x,y,z, cx,cy,cz, time ,z_mu = (data[n][0] for n in [
-                'fid', 'E',
-                'x', 'y', 'z',
-                'cx', 'cy', 'cz', 'time', 'z_mu'
-            ])
-            time *= s_to_ns
-
-            rows.append({
-                'fid': fid,
-                'e_kin': e_kin,
-                'x': x,
-                'y': y,
-                'z': z,
-                'cx': cx,
-                'cy': cy,
-                'cz': cz,
-                'time': time,
-                'z_mu': z_mu,
-            })
-
-    df = pd.DataFrame(rows)
-    return df
+    return read_fluka(fluka_file_paths)
 
 
 if __name__ == "__main__":
@@ -1,9 +1,7 @@
 import argparse
 import glob
-import pickle
 import numpy as np
 import pandas as pd
-import warnings
 import matplotlib.pyplot as plt
 from matplotlib.backends.backend_pdf import PdfPages
 from matplotlib import rcParams
@@ -30,13 +28,9 @@ rcParams.update({
 import logging
 logger = logging.getLogger(__name__)
 
-try:
-    import pyLCIO
-except ImportError:
-    warnings.warn("pyLCIO not found")
-
-PKLNAME = "hits.pkl"
-
+from hitcache import HitCache
+from slcio_reader import add_reader_arguments, cache_from_options
+from slcio_tables import decode_cellids, read_table
 
 TRACKER = "OuterTrackerBarrelCollection"
 ELECTRON = 11
@@ -61,8 +55,7 @@ def options():
     parser.add_argument("--edep1kev", action="store_true", help="Filter for hits with energy deposition > 1 keV")
     parser.add_argument("--muons", action="store_true", help="Filter for muon hits only")
     parser.add_argument("--no-muons", action="store_true", help="Exclude muon hits")
-    parser.add_argument("--write-to-pkl", action="store_true", help="Write hits to a pickle file")
-    parser.add_argument("--read-from-pkl", action="store_true", help="Read hits from a pickle file")
+    add_reader_arguments(parser)
     return parser.parse_args()
 
 
@@ -72,21 +65,13 @@ def main():
     ops = options()
     fnames = sorted(get_inputs(ops.i))
 
-    if not ops.read_from_pkl:
-        hits = get_hits(fnames,
-                        only_muons=ops.muons,
-                        exclude_muons=ops.no_muons,
-                        edep1kev=ops.edep1kev,
-                        )
-    else:
-        logger.info(f"Reading hits from {PKLNAME} ...")
-        with open(PKLNAME, "rb") as fi:
-            hits = pickle.load(fi)
-
-    if ops.write_to_pkl:
-        logger.info(f"Writing hits to {PKLNAME} ...")
-        with open(PKLNAME, "wb") as fi:
-            pickle.dump(hits, fi)
+    hits = get_hits(fnames,
+                    only_muons=ops.muons,
+                    exclude_muons=ops.no_muons,
+                    edep1kev=ops.edep1kev,
+                    jobs=ops.jobs,
+                    cache=cache_from_options(ops),
+                    )
 
     # if ops.muons:
     #     logger.info("Filtering for muon hits only ...")
@@ -113,6 +98,8 @@ def get_hits(
     only_muons: bool = False,
     exclude_muons: bool = False,
     edep1kev: bool = False,
+    jobs: int = None,
+    cache: HitCache = None,
 ) -> pd.DataFrame:
 
     if only_muons:
@@ -122,79 +109,35 @@ def get_hits(
     if only_muons and exclude_muons:
         raise ValueError("Cannot specify both --muons and --no-muons")
 
-    hits = []
-
-    for i_fname, fname in enumerate(fnames):
-
-        logger.info(f"Reading {fname} ...")
-        reader = pyLCIO.IOIMPL.LCFactory.getInstance().createLCReader()
-        reader.open(fname)
-    
-        for i_event, event in enumerate(reader):
-
-            # if i_event % 1000 == 0:
-            #     logger.info(f"Processing event {i_event}")
-
-            col = event.getCollection(TRACKER)
-            for i_hit, hit in enumerate(col):
-
-                if only_muons and np.abs(hit.getMCParticle().getPDG()) != MUON:
-                    continue
-                if exclude_muons and np.abs(hit.getMCParticle().getPDG()) == MUON:
-                    continue
-                if edep1kev and hit.getEDep() * GEV_TO_KEV < 1.0:
-                    continue
-
-                hits.append({
-                    "file": i_fname,
-                    "event": i_event,
-                    "hit": i_hit,
-                    "x": hit.getPositionVec().X(),
-                    "y": hit.getPositionVec().Y(),
-                    "z": hit.getPositionVec().Z(),
-                    "t": hit.getTime(),
-                    "t_corrected": hit.getTime() - (np.sqrt(hit.getPositionVec().X()**2 + \
-                                                            hit.getPositionVec().Y()**2 + \
-                                                            hit.getPositionVec().Z()**2) / SPEED_OF_LIGHT),
-                    "e": hit.getEDep(),
-                    "cellid0": hit.getCellID0(),
-                    "pdg": hit.getMCParticle().getPDG(),
-                    "vx": hit.getMCParticle().getVertexVec().X(),
-                    "vy": hit.getMCParticle().getVertexVec().Y(),
-                    "vz": hit.getMCParticle().getVertexVec().Z(),
-                })
+    hits = read_table(fnames, "simhits", jobs=jobs, cache=cache, columns=[
+        "i_event", "collection", "i_hit", "x", "y", "z", "t", "e", "cellid0", "cellid_encoding", "i_mcp",
+    ])
+    mcps = read_table(fnames, "mcparticles", jobs=jobs, cache=cache, columns=[
+        "i_event", "i_mcp", "pdg", "vx", "vy", "vz",
+    ])
+    hits = hits[hits["collection"] == TRACKER]
+    hits = hits.merge(mcps, on=["file", "i_event", "i_mcp"], how="left")
+    hits = hits.rename(columns={"i_event": "event", "i_hit": "hit"})
+    hits = hits.drop(columns=["collection", "i_mcp"])
+    hits["pdg"] = hits["pdg"].fillna(0).astype(int)
+
+    if only_muons:
+        hits = hits[np.abs(hits["pdg"]) == MUON]
+    if exclude_muons:
+        hits = hits[np.abs(hits["pdg"]) != MUON]
+    if edep1kev:
+        hits = hits[hits["e"] * GEV_TO_KEV >= 1.0]
+    hits = hits.reset_index(drop=True)
 
     if len(hits) == 0:
         raise Exception("No hits found!")
-
-    logger.info("Making hits dataframe ...")
-    dtypes = {
-        "file": int,
-        "event": int,
-        "hit": int,
-        "x": float,
-        "y": float,
-        "z": float,
-        "t": float,
-        "t_corrected": float,
-        "e": float,
-        "cellid0": int,
-        "pdg": int,
-        "vx": float,
-        "vy": float,
-        "vz": float,
-    }
-    hits = pd.DataFrame(hits).astype(dtypes)
     logger.info(f"\n{hits}")
 
     logger.info("Adding features ...")
     hits["r"] = np.sqrt(hits["x"]**2 + hits["y"]**2)
     hits["vr"] = np.sqrt(hits["vx"]**2 + hits["vy"]**2)
-    hits["system"] = np.right_shift(hits["cellid0"], 0) & 0b1_1111
-    hits["side"] = np.right_shift(hits["cellid0"], 5) & 0b11
-    hits["layer"] = np.right_shift(hits["cellid0"], 7) & 0b11_1111
-    hits["module"] = np.right_shift(hits["cellid0"], 13) & 0b111_1111_1111
-    hits["sensor"] = np.right_shift(hits["cellid0"], 24) & 0b1111_1111
+    hits["t_corrected"] = hits["t"] - np.sqrt(hits["x"]**2 + hits["y"]**2 + hits["z"]**2) / SPEED_OF_LIGHT
+    hits = decode_cellids(hits)
 
     OTL01 = N_MODULES[OUTER_TRACKER_BARREL][0]
     rotation = 2 * np.pi / OTL01
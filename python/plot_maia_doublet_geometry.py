@@ -11,6 +11,8 @@ from matplotlib import rcParams
 import xml.etree.ElementTree as ET
 rcParams.update({'font.size': 16})
 
+from cellid import get_codec
+
 VERSION = "v07"
 FNAME = f"/ceph/users/atuna/work/maia/maia_noodling/samples/{VERSION}/muonGun_pT_2p0_2p1/10um/muonGun_pT_2p0_2p1_digi_30*.slcio"
 
@@ -121,25 +123,11 @@ def post_process(df: pd.DataFrame) -> pd.DataFrame:
     print("Post-processing hits ...")
     df["cellid0"] = df["cellid0"].astype(np.int64)
     df["r"] = np.sqrt(df["x"]**2 + df["y"]**2)
-    if VERSION in ["v01", "v05"]:
-        # GlobalTrackerReadoutID: system:5,side:-2,layer:6,module:11,sensor:8"
-        df["system"] = np.right_shift(df["cellid0"], 0) & 0b1_1111
-        df["side"] = np.right_shift(df["cellid0"], 5) & 0b11
-        df["layer"] = np.right_shift(df["cellid0"], 7) & 0b11_1111
-        df["module"] = np.right_shift(df["cellid0"], 13) & 0b111_1111_1111
-        df["sensor"] = np.right_shift(df["cellid0"], 24) & 0b1111_1111
-    elif VERSION in ["v06", "v07"]:
-        #### Actual StaggeredTrackerReadoutID: system:5,side:-2,layer:13,module:11,sensor:1
-        # Effective StaggeredTrackerReadoutID: system:5,side:-2,sensor:8,layer:5,module:11,ignore:1
-        df["system"] = np.right_shift(df["cellid0"], 0) & 0b1_1111
-        df["side"] = np.right_shift(df["cellid0"], 5) & 0b11
-        df["sensor"] = np.right_shift(df["cellid0"], 7) & 0b1111_1111
-        df["layer"] = np.right_shift(df["cellid0"], 15) & 0b1_1111
-        df["module"] = np.right_shift(df["cellid0"], 20) & 0b111_1111_1111
-        df["ignore"] = np.right_shift(df["cellid0"], 31) & 0b1
+    codec = get_codec(VERSION)
+    for name, values in codec.decode(df["cellid0"]).items():
+        df[name] = values
+    if "ignore" in df:
         assert df["ignore"].sum() == 0, "Hits with ignore=1 should not happen!"
-    else:
-        raise Exception(f"Unknown version: {VERSION}")
     df["module_mod_2"] = df["module"] % 2
     return df
 
@@ -1,42 +1,56 @@
 """
-694 2025_10_08_15h19m46s
-700 2025_10_08_15h20m46s
-702 2025_10_08_15h21m46s
-708 2025_10_08_15h22m46s
-718 2025_10_08_15h23m46s
+Plot the number of completed Condor jobs versus time, from the Condor logs of a production.
+
+Usage:
+    python plot_progress_condor_jobs.py /path/to/experiment/logs
+    python plot_progress_condor_jobs.py /path/to/experiment/logs --total 13332
 """
 
-import pandas as pd
+import argparse
+import os
+import numpy as np
 import matplotlib.pyplot as plt
 from matplotlib.backends.backend_pdf import PdfPages
 from matplotlib import rcParams
 rcParams.update({'font.size': 16})
 
-FNAME = "/ceph/users/atuna/work/maia/maia_noodling/experiments/simulate_bib.2025_10_08_09h35m49s/progress.txt"
-TOTAL = 6666 * 2
+import condor_monitor
+
+def options():
+    parser = argparse.ArgumentParser(usage=__doc__, formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("logs", type=str, help="Directory of the Condor logs")
+    parser.add_argument("--store", type=str, default=None, help=f"SQLite store of condor_monitor.py. Default: <logs>/{condor_monitor.DEFAULT_STORE}")
+    parser.add_argument("--total", type=int, default=None, help="Total number of jobs. Default: number of submitted jobs")
+    parser.add_argument("-o", "--output", type=str, default="progress_condor_jobs.pdf", help="Output pdf")
+    return parser.parse_args()
 
 def main():
-    data = pd.read_csv(FNAME, sep=" ", header=None, names=["id", "timestamp"])
-    # data["timestamp"] = pd.to_datetime(data["timestamp"])
-    print(data)
-    with PdfPages("progress_condor_jobs.pdf") as pdf:
+    ops = options()
+    store = ops.store or os.path.join(ops.logs, condor_monitor.DEFAULT_STORE)
+    with condor_monitor.connect(store) as con:
+        condor_monitor.update(con, ops.logs)
+        df = condor_monitor.jobs(condor_monitor.read_events(con))
+        print(condor_monitor.report(con, total=ops.total))
+    if len(df) == 0:
+        print(f"No Condor jobs in {ops.logs}")
+        return
+
+    total = ops.total or len(df)
+    start = df["submitted"].min()
+    ended = np.sort(df["ended"][df["status"] == "done"].to_numpy())
+    minutes = (ended - start) / 60
+    with PdfPages(ops.output) as pdf:
         fig, ax = plt.subplots(figsize=(8, 8))
-        ax.plot(data["id"])
+        ax.step(np.concatenate([[0], minutes]), np.arange(len(ended) + 1), where="post")
         ax.set_xlabel("Minutes since start")
         ax.set_ylabel("Number of completed Condor jobs")
-        ax.set_ylim(0, TOTAL*1.05)
-        ax.axhline(TOTAL, color="gray", linestyle="--")
+        ax.set_ylim(0, total*1.05)
+        ax.axhline(total, color="gray", linestyle="--")
         ax.grid()
         ax.tick_params(right=True, top=True, direction="in")
         fig.subplots_adjust(left=0.15, bottom=0.08, right=0.95, top=0.95)
         pdf.savefig()
         plt.close()
 
-    # plt.plot(data["timestamp"], data["id"])
-    # plt.xlabel("Time")
-    # plt.ylabel("Job ID")
-    # plt.title("Progress of Condor Jobs")
-    # plt.show()
-
 if __name__ == "__main__":
     main()
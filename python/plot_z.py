@@ -5,6 +5,7 @@ import pandas as pd
 import matplotlib.pyplot as plt
 from matplotlib.backends.backend_pdf import PdfPages
 plt.rcParams.update({"font.size": 16})
+from cellid import codec_from_collection, get_codec
 
 COLL = "OuterTrackerBarrelCollection"
 FILE_0 = "/ceph/users/atuna/work/maia/maia_noodling/samples/v00/neutrinoGun/neutrinoGun_digi_3.slcio"
@@ -27,16 +28,19 @@ def get_dataframe(fname: str, collection: str) -> pd.DataFrame:
     reader = pyLCIO.IOIMPL.LCFactory.getInstance().createLCReader()
     reader.open(fname)
     rows = []
+    codec = get_codec()
     for event in reader:
-        n_hit = len(event.getCollection(collection))
-        for i_hit, hit in enumerate(event.getCollection(collection)):
+        col = event.getCollection(collection)
+        codec = codec_from_collection(col, codec)
+        n_hit = len(col)
+        for i_hit, hit in enumerate(col):
             if i_hit % 1e6 == 0:
                 print(f"  Processing hit {i_hit} / {n_hit} ...")
             row = {
                 "hit_x": hit.getPosition()[0],
                 "hit_y": hit.getPosition()[1],
                 "hit_z": hit.getPosition()[2],
-                "hit_layer": (hit.getCellID0() >> 7) & 0b11_1111,
+                "hit_layer": codec.get(hit.getCellID0(), "layer"),
             }
             rows.append(row)
     df = pd.DataFrame(rows)
@@ -1,6 +1,7 @@
 import argparse
+import os
+import sys
 from glob import glob
-import pandas as pd
 
 INNER_BARREL_SIM = "InnerTrackerBarrelCollection"
 INNER_BARREL_REL = "IBTrackerHitsRelations" # digi
@@ -9,6 +10,10 @@ from slcio_to_hits_dataframe import SlcioToHitsDataFrame
 from plot import Plotter
 from constants import SIDE, LAYERS, SENSORS, MODULES
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from lazy_parquet import add_filter_arguments, filters_from_options, read_parquet
+from slcio_reader import add_cache_arguments, cache_from_options
+
 
 def options():
     parser = argparse.ArgumentParser(usage=__doc__, formatter_class=argparse.ArgumentDefaultsHelpFormatter)
@@ -22,6 +27,10 @@ def options():
                         help="Output parquet file for background hits dataframe")
     parser.add_argument("--load_parquet", action="store_true",
                         help="Load from parquet files instead of slcio files")
+    parser.add_argument("--all_columns", action="store_true",
+                        help="Load every column from parquet, instead of only those the plots need")
+    add_filter_arguments(parser, separator="_")
+    add_cache_arguments(parser, separator="_")
     return parser.parse_args()
 
 
@@ -44,8 +53,9 @@ def main():
             print(f"Input background file: {path}")
 
         # convert slcio to hits dataframe
-        sig_df = SlcioToHitsDataFrame(sig_paths, [INNER_BARREL_SIM], LAYERS, SENSORS, signal=True).convert()
-        bkg_df = SlcioToHitsDataFrame(bkg_paths, [INNER_BARREL_REL], LAYERS, SENSORS, signal=False).convert()
+        cache = cache_from_options(ops)
+        sig_df = SlcioToHitsDataFrame(sig_paths, [INNER_BARREL_SIM], LAYERS, SENSORS, signal=True, cache=cache).convert()
+        bkg_df = SlcioToHitsDataFrame(bkg_paths, [INNER_BARREL_REL], LAYERS, SENSORS, signal=False, cache=cache).convert()
 
         # write to parquet
         sig_df.to_parquet(ops.signal_parquet)
@@ -53,8 +63,11 @@ def main():
 
     else:
         print("Loading from parquet files ...")
-        sig_df = pd.read_parquet(ops.signal_parquet)
-        bkg_df = pd.read_parquet(ops.background_parquet)
+        columns = None if ops.all_columns else Plotter.columns()
+        filters = filters_from_options(ops, system="hit_system", layer="hit_layer", pt="sim_pt")
+        sig_df = read_parquet(ops.signal_parquet, columns=columns, filters=filters)
+        # background hits have no mcparticle (sim_pt = 0), so --mcp_pt only selects signal
+        bkg_df = read_parquet(ops.background_parquet, columns=columns, filters={**filters, "sim_pt": None})
 
     print(sig_df)
     print(bkg_df)
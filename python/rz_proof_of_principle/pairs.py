@@ -0,0 +1,198 @@
+"""
+Block-sparse enumeration of hit pairs between two layers.
+
+Hits are sorted once by (group key, layer), so each group is a contiguous block
+of N0 inner-layer hits followed by N1 outer-layer hits. Pair p of the whole sample
+belongs to the group g with pair_offsets[g] <= p < pair_offsets[g + 1], and is
+(inner hit local // N1, outer hit local % N1) of that group, with local = p - pair_offsets[g].
+Pairs are therefore computed in fixed-size chunks, and pair quantities are streamed
+into preallocated histograms instead of being collected per group.
+
+Usage:
+    engine = PairEngine(df)
+    hists = PairHistograms()
+    hists.add("rzangle", ["rzangle"], [(320, -1.6, 1.6)])
+    hists.fill(lambda: engine.quantities(df))
+    counts, edges = hists["rzangle"]
+"""
+
+import numpy as np
+import pandas as pd
+
+from constants import LAYERS
+
+PAIR_KEYS = ["hit_sensor", "hit_module", "file", "i_event", "i_sim"]
+CHUNK_SIZE = 1 << 20
+AUTO = None
+
+
+class PairEngine:
+
+    def __init__(self, df: pd.DataFrame, keys: list[str] = PAIR_KEYS, layers: list[int] = LAYERS[:2], chunk_size: int = CHUNK_SIZE):
+        self.chunk_size = chunk_size
+
+        layer = df["hit_layer"].to_numpy()
+        outer = layer == layers[1]
+        codes = [pd.factorize(df[key], sort=True)[0] for key in keys]
+        valid = ((layer == layers[0]) | outer) & np.all([code >= 0 for code in codes], axis=0)
+
+        # sort by group, then inner before outer layer, keeping the order of hits within a layer
+        rows = np.flatnonzero(valid)
+        order = np.lexsort([outer[rows]] + [code[rows] for code in reversed(codes)])
+        self.rows = rows[order]
+        n_hits = len(self.rows)
+
+        new_group = np.zeros(n_hits, dtype=bool)
+        new_group[:1] = True
+        for code in codes:
+            sorted_code = code[self.rows]
+            new_group[1:] |= sorted_code[1:] != sorted_code[:-1]
+        starts = np.flatnonzero(new_group)
+        sizes = np.diff(np.append(starts, n_hits))
+        self.n1 = np.add.reduceat(outer[self.rows].astype(np.int64), starts) if n_hits else np.zeros(0, dtype=np.int64)
+        self.n0 = sizes - self.n1
+        self.start0 = starts
+        self.start1 = starts + self.n0
+        self.pair_offsets = np.concatenate([[0], np.cumsum(self.n0 * self.n1)])
+        self.n_pairs = int(self.pair_offsets[-1])
+
+
+    def __len__(self):
+        return self.n_pairs
+
+
+    def groups_with_pairs(self) -> np.ndarray:
+        return np.flatnonzero(self.n0 * self.n1 > 0)
+
+
+    def chunks(self):
+        """(group, inner row, outer row) of the pairs, chunk_size pairs at a time. Rows index the input dataframe."""
+        for lo in range(0, self.n_pairs, self.chunk_size):
+            pair = np.arange(lo, min(lo + self.chunk_size, self.n_pairs), dtype=np.int64)
+            group = np.searchsorted(self.pair_offsets, pair, side="right") - 1
+            local = pair - self.pair_offsets[group]
+            n1 = self.n1[group]
+            yield group, self.rows[self.start0[group] + local // n1], self.rows[self.start1[group] + local % n1]
+
+
+    def check_unique(self, values: np.ndarray, name: str):
+        """Raise if a column is not constant within each group which has pairs."""
+        groups = self.groups_with_pairs()
+        if len(groups) == 0:
+            return
+        hits = values[self.rows]
+        lo = np.minimum.reduceat(hits, self.start0)[groups]
+        hi = np.maximum.reduceat(hits, self.start0)[groups]
+        if np.any(lo != hi):
+            raise Exception(f"Expected unique {name} per group")
+
+
+    def quantities(self, df: pd.DataFrame, signal: bool = False):
+        """Angles and projections of each pair, chunk by chunk."""
+        xp = df["hit_xp"].to_numpy()
+        yp = df["hit_yp"].to_numpy()
+        z = df["hit_z"].to_numpy()
+        r = df["hit_r"].to_numpy()
+        pt = df["sim_pt"].to_numpy() if signal else None
+        if signal:
+            self.check_unique(pt, "sim_pt")
+        for i_chunk, (_, i0, i1) in enumerate(self.chunks()):
+            if i_chunk % 100 == 0:
+                print(f"Processing pairs {i_chunk * self.chunk_size} / {self.n_pairs} ...")
+            x0, y0, z0, r0 = xp[i0], yp[i0], z[i0], r[i0]
+            dx = xp[i1] - x0
+            dz = z[i1] - z0
+            xyangle = np.arctan2(yp[i1] - y0, dx)
+            rzangle = np.arctan2(dz, r[i1] - r0)
+            xpzangle = np.arctan2(dz, dx)
+            yield {
+                "xyangle": xyangle,
+                "rzangle": rzangle,
+                "xpzangle": xpzangle,
+                "xpzproj": z0 - x0 * np.tan(xpzangle),
+                "rzproj": z0 - r0 * np.tan(rzangle),
+                "yproj": y0 - x0 * np.tan(xyangle),
+                "pt": pt[i0] if signal else np.zeros(len(i0)),
+            }
+
+
+class PairHistograms:
+    """
+    1D and 2D histograms of pair quantities, filled chunk by chunk.
+    Binnings are (n_bins, lo, hi), or (n_bins, AUTO, AUTO) for the range of the data,
+    like np.histogram(values, bins=n_bins). Automatic ranges take an extra pass over the pairs.
+    """
+
+    def __init__(self):
+        self.specs = {}
+        self.counts = {}
+        self.edges = {}
+        self.selected = {}
+
+
+    def add(self, name: str, quantities: list[str], binnings: list[tuple], pt: tuple[float, float] = None):
+        self.specs[name] = (quantities, binnings, pt)
+
+
+    def count(self, name: str, quantities: list[str], lo: float, hi: float):
+        """Number of pairs with lo < quantity < hi for all the quantities."""
+        self.selected[name] = (quantities, lo, hi, 0)
+
+
+    def __getitem__(self, name: str):
+        return self.counts[name], self.edges[name]
+
+
+    def n_selected(self, name: str) -> int:
+        return self.selected[name][3]
+
+
+    def fill(self, chunks):
+        """chunks: callable returning an iterator over dicts of pair quantity arrays."""
+        ranges = self.auto_ranges(chunks)
+        for name, (quantities, binnings, _) in self.specs.items():
+            self.edges[name] = [np.linspace(*ranges.get(q, (lo, hi)), n + 1) if lo is AUTO else np.linspace(lo, hi, n + 1)
+                                for q, (n, lo, hi) in zip(quantities, binnings)]
+            self.counts[name] = np.zeros([n for n, _, _ in binnings], dtype=np.int64)
+
+        for values in chunks():
+            for name, (quantities, binnings, pt) in self.specs.items():
+                data = [values[q] for q in quantities]
+                if pt is not None:
+                    mask = (values["pt"] >= pt[0]) & (values["pt"] < pt[1])
+                    data = [d[mask] for d in data]
+                ranges = [(edges[0], edges[-1]) for edges in self.edges[name]]
+                bins = [n for n, _, _ in binnings]
+                if len(data) == 1:
+                    counts, _ = np.histogram(data[0], bins=bins[0], range=ranges[0])
+                else:
+                    counts, _, _ = np.histogram2d(data[0], data[1], bins=bins, range=ranges)
+                self.counts[name] += counts.astype(np.int64)
+            for name, (quantities, lo, hi, n) in self.selected.items():
+                mask = np.ones(len(values[quantities[0]]), dtype=bool)
+                for q in quantities:
+                    mask &= (values[q] > lo) & (values[q] < hi)
+                self.selected[name] = (quantities, lo, hi, n + int(np.sum(mask)))
+
+
+    def auto_ranges(self, chunks) -> dict[str, tuple[float, float]]:
+        auto = {q for quantities, binnings, _ in self.specs.values()
+                for q, (_, lo, _) in zip(quantities, binnings) if lo is AUTO}
+        if not auto:
+            return {}
+        lo = {q: np.inf for q in auto}
+        hi = {q: -np.inf for q in auto}
+        for values in chunks():
+            for q in auto:
+                if len(values[q]):
+                    lo[q] = min(lo[q], values[q].min())
+                    hi[q] = max(hi[q], values[q].max())
+        ranges = {}
+        for q in auto:
+            if lo[q] > hi[q]:
+                ranges[q] = (0.0, 1.0)
+            elif lo[q] == hi[q]:
+                ranges[q] = (lo[q] - 0.5, hi[q] + 0.5)
+            else:
+                ranges[q] = (lo[q], hi[q])
+        return ranges
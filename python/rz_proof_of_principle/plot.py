@@ -1,3 +1,5 @@
+import os
+import sys
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
@@ -7,9 +9,37 @@ rcParams.update({"font.size": 16})
 
 from constants import BARREL_RADII
 from constants import SIDE, LAYERS, SENSORS, MODULES
+from pairs import PairEngine, PairHistograms, AUTO
+
+PT_SLICES = [
+    (3, 4),
+    (2, 3),
+    (1, 2),
+    (0, 1),
+]
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from lazy_parquet import columns_for
 
 class Plotter:
 
+    # plots made by plot(), in order
+    PLOTS = [
+        # "plot_xy",
+        # "plot_rz",
+        "plot_hit_time",
+        "plot_rz_events",
+    ]
+
+    # columns which each method needs
+    COLUMNS = {
+        "__init__": ["hit_module", "hit_x", "hit_y"],
+        "plot_xy": ["file", "i_event", "hit_module", "hit_x", "hit_y"],
+        "plot_rz": ["file", "i_event", "hit_module", "hit_sensor", "hit_z"],
+        "plot_hit_time": ["hit_t", "hit_t_corrected"],
+        "plot_rz_events": ["file", "i_event", "i_sim", "sim_pt", "hit_layer", "hit_module", "hit_sensor", "hit_r", "hit_z"],
+    }
+
     def __init__(self, df: pd.DataFrame, pdf_path: str):
         self.df = df
         self.pdf_path = pdf_path
@@ -22,12 +52,19 @@ class Plotter:
 
     def plot(self):
         with PdfPages(self.pdf_path) as pdf:
-            # self.plot_xy(pdf)
-            # self.plot_rz(pdf, first_event=True)
-            # if self.signal:
-            #     self.plot_rz(pdf, first_event=False)
-            self.plot_hit_time(pdf)
-            self.plot_rz_events(pdf)
+            for name in self.PLOTS:
+                if name == "plot_rz":
+                    self.plot_rz(pdf, first_event=True)
+                    if self.signal:
+                        self.plot_rz(pdf, first_event=False)
+                else:
+                    getattr(self, name)(pdf)
+
+
+    @classmethod
+    def columns(cls, plots: list[str] = None) -> list[str]:
+        """Columns needed by the given (default: enabled) plots."""
+        return columns_for(cls.COLUMNS, ["__init__"] + list(plots or cls.PLOTS))
 
 
     def plot_xy(self, pdf: PdfPages, first_event: bool = False):
@@ -119,118 +156,61 @@ class Plotter:
 
     def plot_rz_events(self, pdf: PdfPages):
 
-        rzangles = []
-        xpzangles = []
-        xyangles = []
-        ptvalues = []
-        rzprojs = []
-        xpzprojs = []
-        yprojs = []
-        n_debug = 0
-
         print("Finding rz, xy angles and projections ...")
-        for i_group, ((sensor, module, filename, i_event, i_sim), group) in enumerate(self.df.groupby(["hit_sensor",
-                                                                                                       "hit_module",
-                                                                                                        "file",
-                                                                                                        "i_event",
-                                                                                                        "i_sim",
-                                                                                                        ])):
-
-            if len(group) == 0:
-                continue
-            if i_group % 100 == 0:
-                print(f"Processing module {module}, sensor {sensor}, file {filename}, event {i_event} ...")
-            # print(f"Plotting module {module}, sensor {sensor}, file {filename}, event {i_event} ...")
-
-            # fig, ax = plt.subplots(figsize=(8, 8))
-            # ax.scatter(group["hit_z"], group["hit_xp"], s=50)
-            # ax.set_xlabel("z (mm)")
-            # ax.set_ylabel("y (local) (mm)")
-            # # ax.set_xlim([-825, -770])
-            # # ax.set_ylim([816, 840])
-            # ax.set_title(f"Hits on module {module}, sensor {sensor}")
-            # ax.tick_params(direction="in", which="both", top=True, right=True)
-            # fig.subplots_adjust(left=0.15, right=0.95, top=0.94, bottom=0.1)
-            # pdf.savefig()
-            # plt.close()
-
-            # keep track of angles between layer 0 and layer 1
-            df_0 = group[group["hit_layer"] == LAYERS[0]]
-            df_1 = group[group["hit_layer"] == LAYERS[1]]
-            if len(df_0) == 0 or len(df_1) == 0:
-                continue
+        engine = PairEngine(self.df)
+        # title of the plots, from the last (sensor, module, file, event, sim) group
+        sensor = self.df["hit_sensor"].max()
+
+        angle_bins = (320, -1.6, 1.6)
+        zproj_bins = [(100, AUTO, AUTO), (440, -2200, 2200), (120, -60, 60), (120, -2, 2)]
+        yproj_bins = [(100, AUTO, AUTO), (440, -2200, 2200), (200, -200, 200), (120, -60, 60)]
+        hists = PairHistograms()
+        for quantity in ["rzangle", "xpzangle", "xyangle"]:
+            hists.add(quantity, [quantity], [angle_bins])
+        for quantity, binnings in [("xpzproj", zproj_bins), ("rzproj", zproj_bins), ("yproj", yproj_bins)]:
+            for i_bins, bins in enumerate(binnings):
+                hists.add(f"{quantity}_{i_bins}", [quantity], [bins])
+        if self.signal:
+            for pt in PT_SLICES:
+                hists.add(f"xpzangle_pt{pt}", ["xpzangle"], [(200, -1.0, 1.0)], pt=pt)
+                hists.add(f"rzangle_pt{pt}", ["rzangle"], [(200, -1.0, 1.0)], pt=pt)
+                hists.add(f"xyangle_pt{pt}", ["xyangle"], [(160, -1.6, 1.6)], pt=pt)
+                hists.add(f"xpzproj_pt{pt}", ["xpzproj"], [(200, -50, 50)], pt=pt)
+                hists.add(f"yproj_0_pt{pt}", ["yproj"], [(200, -500, 500)], pt=pt)
+                hists.add(f"yproj_1_pt{pt}", ["yproj"], [(200, -50, 50)], pt=pt)
+        hists.add("xpzangle_xyangle", ["xpzangle", "xyangle"], [(100, AUTO, AUTO), (100, AUTO, AUTO)])
+        for i_bins, bins in enumerate([
+            [(100, AUTO, AUTO), (100, AUTO, AUTO)],
+            [(160, -1.6, 1.6), (120, -60, 60)],
+            [(100, -0.5, 0.5), (100, -2, 2)],
+        ]):
+            hists.add(f"xpzangle_xpzproj_{i_bins}", ["xpzangle", "xpzproj"], bins)
+        for i_bins, bins in enumerate([
+            [(100, AUTO, AUTO), (100, AUTO, AUTO)],
+            [(105, -2100, 2100), (105, -2100, 2100)],
+            [(120, -60, 60), (120, -60, 60)],
+            [(120, -10, 10), (120, -10, 10)],
+        ]):
+            hists.add(f"yproj_xpzproj_{i_bins}", ["yproj", "xpzproj"], bins)
 
-            # vectorized computation of angles
-            x0 = df_0["hit_xp"].values[:, None]      # shape (N0, 1)
-            x1 = df_1["hit_xp"].values[None, :]      # shape (1, N1)
-            y0 = df_0["hit_yp"].values[:, None]      # shape (N0, 1)
-            y1 = df_1["hit_yp"].values[None, :]      # shape (1, N1)
-            z0 = df_0["hit_z"].values[:, None]       # shape (N0, 1)
-            z1 = df_1["hit_z"].values[None, :]       # shape (1, N1)
-            r0 = df_0["hit_r"].values[:, None]       # shape (N0, 1)
-            r1 = df_1["hit_r"].values[None, :]       # shape (1, N1)
-            dx = x1 - x0                             # shape (N0, N1)
-            dy = y1 - y0                             # shape (N0, N1)
-            dz = z1 - z0                             # shape (N0, N1)
-            dr = r1 - r0                             # shape (N0, N1)
-            xyangs = np.arctan2(dy, dx)              # shape (N0, N1)
-            rzangs = np.arctan2(dz, dr)              # shape (N0, N1)
-            xpzangs = np.arctan2(dz, dx)             # shape (N0, N1)
-            xpzproj = z0 - x0 * np.tan(xpzangs)      # shape (N0, N1)
-            rzproj = z0 - r0 * np.tan(rzangs)        # shape (N0, N1)
-            yproj = y0 - x0 * np.tan(xyangs)         # shape (N0, N1)
-            if self.signal:
-                if len(group["sim_pt"].unique()) != 1:
-                    raise Exception("Expected unique sim_pt per group")
-                pts = group["sim_pt"].unique()[0]
-                pts = pts * np.ones_like(rzangs)
-            else:
-                pts = np.zeros_like(rzangs)
-
-            # print("len(angles):", len(angles))
-            # number of angles with angle > 1.4 and angle < 1.9
-            lo, hi = -0.2, 0.2
-            arr = np.array(rzangs)
-            n_selected_rz = np.sum((arr > lo) & (arr < hi))
-
-            lo, hi = -0.2, 0.2
-            arr_xy = np.array(xyangs)
-            n_selected_xy = np.sum((arr_xy > lo) & (arr_xy < hi))
-
-            xpzangles.extend(xpzangs.ravel())
-            rzangles.extend(rzangs.ravel())
-            xyangles.extend(xyangs.ravel())
-            xpzprojs.extend(xpzproj.ravel())
-            rzprojs.extend(rzproj.ravel())
-            yprojs.extend(yproj.ravel())
-            ptvalues.extend(pts.ravel())
-
-
-        # numpify
-        xpzangles = np.array(xpzangles)
-        rzangles = np.array(rzangles)
-        xyangles = np.array(xyangles)
-        ptvalues = np.array(ptvalues)
-        xpzprojs = np.array(xpzprojs)
-        rzprojs = np.array(rzprojs)
-        yprojs = np.array(yprojs)
         lo, hi = -0.3, 0.3
-        n_selected_xpz = np.sum((xpzangles > lo) & (xpzangles < hi))
-        n_selected_xy = np.sum((xyangles > lo) & (xyangles < hi))
-        n_selected_xpzxy = np.sum((xpzangles > lo) & (xpzangles < hi) & (xyangles > lo) & (xyangles < hi))
-        print(f"Total number of xp-z angles: {len(xpzangles)}")
-        print(f"Total number of x-y angles: {len(xyangles)}")
-        print(f"Total number of xp-z angles with angle > {lo} and angle < {hi}: {n_selected_xpz}")
-        print(f"Total number of x-y angles with angle > {lo} and angle < {hi}: {n_selected_xy}")
-        print(f"Total number of angles with both xp-z and x-y angle > {lo} and < {hi}: {n_selected_xpzxy}")
+        hists.count("xpz", ["xpzangle"], lo, hi)
+        hists.count("xy", ["xyangle"], lo, hi)
+        hists.count("xpzxy", ["xpzangle", "xyangle"], lo, hi)
+        hists.fill(lambda: engine.quantities(self.df, signal=self.signal))
+
+        print(f"Total number of xp-z angles: {len(engine)}")
+        print(f"Total number of x-y angles: {len(engine)}")
+        print(f"Total number of xp-z angles with angle > {lo} and angle < {hi}: {hists.n_selected('xpz')}")
+        print(f"Total number of x-y angles with angle > {lo} and angle < {hi}: {hists.n_selected('xy')}")
+        print(f"Total number of angles with both xp-z and x-y angle > {lo} and < {hi}: {hists.n_selected('xpzxy')}")
 
 
         # plot r-z angle distribution
         print("Plotting r-z angle distribution ...")
         color = "blue" if self.signal else "red"
         fig, ax = plt.subplots(figsize=(8, 8))
-        bins = np.linspace(-1.6, 1.6, 321)
-        ax.hist(rzangles, bins=bins, color=color)
+        draw_hist(ax, *hists["rzangle"], color=color)
         ax.set_xlabel("r-z angle (rad)")
         ax.set_ylabel("Counts")
         ax.set_title(f"Angle between hits in layer {LAYERS[0]} and {LAYERS[1]}, sensor {sensor}")
@@ -252,8 +232,7 @@ class Plotter:
         print("Plotting xp-z angle distribution ...")
         color = "blue" if self.signal else "red"
         fig, ax = plt.subplots(figsize=(8, 8))
-        bins = np.linspace(-1.6, 1.6, 321)
-        ax.hist(xpzangles, bins=bins, color=color)
+        draw_hist(ax, *hists["xpzangle"], color=color)
         ax.set_xlabel("xp-z angle (rad)")
         ax.set_ylabel("Counts")
         ax.set_title(f"Angle between hits in layer {LAYERS[0]} and {LAYERS[1]}, sensor {sensor}")
@@ -275,17 +254,8 @@ class Plotter:
             print("Plotting xp-z angle distribution in slices of pt ...")
             color = "blue" if self.signal else "red"
             fig, ax = plt.subplots(figsize=(8, 8))
-            bins = np.linspace(-1.0, 1.0, 201)
-            for pt_lo, pt_hi in [
-                (3, 4),
-                (2, 3),
-                (1, 2),
-                (0, 1),
-            ]:
-                mask = (ptvalues >= pt_lo) & (ptvalues < pt_hi)
-                xpzangles_pt = xpzangles[mask]
-                ax.hist(xpzangles_pt, bins=bins, linewidth=2, histtype="step", label=f"pt {pt_lo}-{pt_hi} GeV")
-            # ax.hist(xyangles, bins=bins, color=color)
+            for pt_lo, pt_hi in PT_SLICES:
+                draw_hist(ax, *hists[f"xpzangle_pt{(pt_lo, pt_hi)}"], linewidth=2, histtype="step", label=f"pt {pt_lo}-{pt_hi} GeV")
             ax.set_xlabel("xp-z angle (rad)")
             ax.set_ylabel("Counts")
             ax.set_title(f"Angle between hits in layer {LAYERS[0]} and {LAYERS[1]}, sensor {sensor}")
@@ -303,17 +273,8 @@ class Plotter:
             print("Plotting r-z angle distribution in slices of pt ...")
             color = "blue" if self.signal else "red"
             fig, ax = plt.subplots(figsize=(8, 8))
-            bins = np.linspace(-1.0, 1.0, 201)
-            for pt_lo, pt_hi in [
-                (3, 4),
-                (2, 3),
-                (1, 2),
-                (0, 1),
-            ]:
-                mask = (ptvalues >= pt_lo) & (ptvalues < pt_hi)
-                rzangles_pt = rzangles[mask]
-                ax.hist(rzangles_pt, bins=bins, linewidth=2, histtype="step", label=f"pt {pt_lo}-{pt_hi} GeV")
-            # ax.hist(xyangles, bins=bins, color=color)
+            for pt_lo, pt_hi in PT_SLICES:
+                draw_hist(ax, *hists[f"rzangle_pt{(pt_lo, pt_hi)}"], linewidth=2, histtype="step", label=f"pt {pt_lo}-{pt_hi} GeV")
             ax.set_xlabel("r-z angle (rad)")
             ax.set_ylabel("Counts")
             ax.set_title(f"Angle between hits in layer {LAYERS[0]} and {LAYERS[1]}, sensor {sensor}")
@@ -330,8 +291,7 @@ class Plotter:
         print("Plotting x-y angle distribution ...")
         color = "blue" if self.signal else "red"
         fig, ax = plt.subplots(figsize=(8, 8))
-        bins = np.linspace(-1.6, 1.6, 321)
-        ax.hist(xyangles, bins=bins, color=color)
+        draw_hist(ax, *hists["xyangle"], color=color)
         ax.set_xlabel("x-y angle (rad)")
         ax.set_ylabel("Counts")
         ax.set_title(f"Angle between hits in layer {LAYERS[0]} and {LAYERS[1]}, sensor {sensor}")
@@ -353,17 +313,8 @@ class Plotter:
             print("Plotting x-y angle distribution in slices of pt ...")
             color = "blue" if self.signal else "red"
             fig, ax = plt.subplots(figsize=(8, 8))
-            bins = np.linspace(-1.6, 1.6, 161)
-            for pt_lo, pt_hi in [
-                (3, 4),
-                (2, 3),
-                (1, 2),
-                (0, 1),
-            ]:
-                mask = (ptvalues >= pt_lo) & (ptvalues < pt_hi)
-                xyangles_pt = xyangles[mask]
-                ax.hist(xyangles_pt, bins=bins, linewidth=2, histtype="step", label=f"pt {pt_lo}-{pt_hi} GeV")
-            # ax.hist(xyangles, bins=bins, color=color)
+            for pt_lo, pt_hi in PT_SLICES:
+                draw_hist(ax, *hists[f"xyangle_pt{(pt_lo, pt_hi)}"], linewidth=2, histtype="step", label=f"pt {pt_lo}-{pt_hi} GeV")
             ax.set_xlabel("x-y angle (rad)")
             ax.set_ylabel("Counts")
             ax.set_title(f"Angle between hits in layer {LAYERS[0]} and {LAYERS[1]}, sensor {sensor}")
@@ -378,16 +329,11 @@ class Plotter:
 
         # z-projection
         print("Plotting z-projection distribution ...")
-        for bins in [
-            100,
-            np.linspace(-2200, 2200, 441),
-            np.linspace(-60, 60, 121),
-            np.linspace(-2, 2, 121),
-        ]:
+        for i_bins in range(len(zproj_bins)):
             # plot xpzproj distribution
             color = "blue" if self.signal else "red"
             fig, ax = plt.subplots(figsize=(8, 8))
-            ax.hist(xpzprojs, bins=bins, color=color)
+            draw_hist(ax, *hists[f"xpzproj_{i_bins}"], color=color)
             ax.set_xlabel("(x') z projection (mm)")
             ax.set_ylabel("Counts")
             ax.set_title(f"(x') z-proj. for hits in layers {LAYERS[0]} and {LAYERS[1]}, sensor {sensor}")
@@ -399,16 +345,11 @@ class Plotter:
 
         # z-projection
         print("Plotting rz-projection distribution ...")
-        for bins in [
-            100,
-            np.linspace(-2200, 2200, 441),
-            np.linspace(-60, 60, 121),
-            np.linspace(-2, 2, 121),
-        ]:
+        for i_bins in range(len(zproj_bins)):
             # plot zproj distribution
             color = "blue" if self.signal else "red"
             fig, ax = plt.subplots(figsize=(8, 8))
-            ax.hist(rzprojs, bins=bins, color=color)
+            draw_hist(ax, *hists[f"rzproj_{i_bins}"], color=color)
             ax.set_xlabel("(r) z-projection (mm)")
             ax.set_ylabel("Counts")
             ax.set_title(f"z-proj. for hits in layers {LAYERS[0]} and {LAYERS[1]}, sensor {sensor}")
@@ -423,16 +364,8 @@ class Plotter:
             print("Plotting z projection distribution in slices of pt ...")
             color = "blue" if self.signal else "red"
             fig, ax = plt.subplots(figsize=(8, 8))
-            bins = np.linspace(-50, 50, 201)
-            for pt_lo, pt_hi in [
-                (3, 4),
-                (2, 3),
-                (1, 2),
-                (0, 1),
-            ]:
-                mask = (ptvalues >= pt_lo) & (ptvalues < pt_hi)
-                xpzprojs_pt = xpzprojs[mask]
-                ax.hist(xpzprojs_pt, bins=bins, linewidth=2, histtype="step", label=f"pt {pt_lo}-{pt_hi} GeV")
+            for pt_lo, pt_hi in PT_SLICES:
+                draw_hist(ax, *hists[f"xpzproj_pt{(pt_lo, pt_hi)}"], linewidth=2, histtype="step", label=f"pt {pt_lo}-{pt_hi} GeV")
             ax.set_xlabel("(x') z projection (mm)")
             ax.set_ylabel("Counts")
             ax.set_title(f"(x') z-proj. for hits in layer {LAYERS[0]} and {LAYERS[1]}, sensor {sensor}")
@@ -447,16 +380,11 @@ class Plotter:
 
         # y-projection
         print("Plotting y-projection distribution ...")
-        for bins in [
-            100,
-            np.linspace(-2200, 2200, 441),
-            np.linspace(-200, 200, 201),
-            np.linspace(-60, 60, 121),
-        ]:
+        for i_bins in range(len(yproj_bins)):
             # plot yproj distribution
             color = "blue" if self.signal else "red"
             fig, ax = plt.subplots(figsize=(8, 8))
-            ax.hist(yprojs, bins=bins, color=color)
+            draw_hist(ax, *hists[f"yproj_{i_bins}"], color=color)
             ax.set_xlabel("y projection (mm)")
             ax.set_ylabel("Counts")
             ax.set_title(f"y-proj. for hits in layers {LAYERS[0]} and {LAYERS[1]}, sensor {sensor}")
@@ -467,23 +395,12 @@ class Plotter:
 
         # plot y projection in slices of pt
         if self.signal:
-            for bins in [
-                np.linspace(-500, 500, 201),
-                np.linspace(-50, 50, 201),
-            ]:
+            for i_bins in range(2):
                 print("Plotting y projection distribution in slices of pt ...")
                 color = "blue" if self.signal else "red"
                 fig, ax = plt.subplots(figsize=(8, 8))
-                for pt_lo, pt_hi in [
-                    (3, 4),
-                    (2, 3),
-                    (1, 2),
-                    (0, 1),
-                ]:
-                    mask = (ptvalues >= pt_lo) & (ptvalues < pt_hi)
-                    yprojs_pt = yprojs[mask]
-                    ax.hist(yprojs_pt, bins=bins, linewidth=2, histtype="step", label=f"pt {pt_lo}-{pt_hi} GeV")
-                # ax.hist(xyangles, bins=bins, color=color)
+                for pt_lo, pt_hi in PT_SLICES:
+                    draw_hist(ax, *hists[f"yproj_{i_bins}_pt{(pt_lo, pt_hi)}"], linewidth=2, histtype="step", label=f"pt {pt_lo}-{pt_hi} GeV")
                 ax.set_xlabel("y projection (mm)")
                 ax.set_ylabel("Counts")
                 ax.set_title(f"y-proj. for hits in layer {LAYERS[0]} and {LAYERS[1]}, sensor {sensor}")
@@ -498,36 +415,26 @@ class Plotter:
 
         # xp-z vs xy hist2d
         print("Plotting xp-z vs xy distribution ...")
-        for bins in [
-            100,
-        ]:
-            # plot xp-z vs xy distribution
-            color = "blue" if self.signal else "red"
-            fig, ax = plt.subplots(figsize=(8, 8))
-            _, _, _, im = ax.hist2d(xpzangles, xyangles, bins=bins, cmap="gist_rainbow", cmin=0.5)
-            ax.set_xlabel("xp-z angle (rad)")
-            ax.set_ylabel("x-y angle (rad)")
-            ax.set_title(f"xp-z vs xy angles for hits in layers {LAYERS[0]} and {LAYERS[1]}, sensor {sensor}")
-            ax.tick_params(direction="in", which="both", top=True, right=True)
-            fig.colorbar(im, ax=ax, pad=0.01, label="Hit pairs")
-            fig.subplots_adjust(left=0.15, right=0.95, top=0.94, bottom=0.1)
-            pdf.savefig()
-            plt.close()
+        color = "blue" if self.signal else "red"
+        fig, ax = plt.subplots(figsize=(8, 8))
+        im = draw_hist2d(ax, *hists["xpzangle_xyangle"], cmap="gist_rainbow", cmin=0.5)
+        ax.set_xlabel("xp-z angle (rad)")
+        ax.set_ylabel("x-y angle (rad)")
+        ax.set_title(f"xp-z vs xy angles for hits in layers {LAYERS[0]} and {LAYERS[1]}, sensor {sensor}")
+        ax.tick_params(direction="in", which="both", top=True, right=True)
+        fig.colorbar(im, ax=ax, pad=0.01, label="Hit pairs")
+        fig.subplots_adjust(left=0.15, right=0.95, top=0.94, bottom=0.1)
+        pdf.savefig()
+        plt.close()
 
 
         # rz vs zproj hist2d
         print("Plotting z-projection distribution ...")
-        for bins in [
-            100,
-             [np.linspace(-1.6, 1.6, 161),
-              np.linspace(-60, 60, 121)],
-             [np.linspace(-0.5, 0.5, 101),
-              np.linspace(-2, 2, 101)],
-        ]:
+        for i_bins in range(3):
             # plot zproj distribution
             color = "blue" if self.signal else "red"
             fig, ax = plt.subplots(figsize=(8, 8))
-            _, _, _, im = ax.hist2d(xpzangles, xpzprojs, bins=bins, cmap="gist_rainbow", cmin=0.5)
+            im = draw_hist2d(ax, *hists[f"xpzangle_xpzproj_{i_bins}"], cmap="gist_rainbow", cmin=0.5)
             ax.set_xlabel("xp-z angle (rad)")
             ax.set_ylabel("(xp) z projection (mm)")
             ax.set_title(f"xp-z vs (xp) z projection for hits in layers {LAYERS[0]} and {LAYERS[1]}, sensor {sensor}")
@@ -540,18 +447,10 @@ class Plotter:
 
         # yproj vs zproj hist2d
         print("Plotting y-projection vs z-projection distribution ...")
-        for bins in [
-            100,
-             [np.linspace(-2100, 2100, 106),
-              np.linspace(-2100, 2100, 106)],
-             [np.linspace(-60, 60, 121),
-              np.linspace(-60, 60, 121)],
-             [np.linspace(-10, 10, 121),
-              np.linspace(-10, 10, 121)],
-        ]:
+        for i_bins in range(4):
             color = "blue" if self.signal else "red"
             fig, ax = plt.subplots(figsize=(8, 8))
-            _, _, _, im = ax.hist2d(yprojs, xpzprojs, bins=bins, cmap="gist_rainbow", cmin=0.5)
+            im = draw_hist2d(ax, *hists[f"yproj_xpzproj_{i_bins}"], cmap="gist_rainbow", cmin=0.5)
             ax.set_xlabel("y projection (mm)")
             ax.set_ylabel("(xp) z projection (mm)")
             ax.set_title(f"y vs (xp) z projection for hits in layers {LAYERS[0]} and {LAYERS[1]}, sensor {sensor}")
@@ -562,6 +461,17 @@ class Plotter:
             plt.close()
 
 
+def draw_hist(ax, counts: np.ndarray, edges: list[np.ndarray], **kwargs):
+    """ax.hist of pre-binned counts."""
+    return ax.hist(edges[0][:-1], bins=edges[0], weights=counts, **kwargs)
+
+
+def draw_hist2d(ax, counts: np.ndarray, edges: list[np.ndarray], **kwargs):
+    """ax.hist2d of pre-binned counts, returning the image."""
+    x, y = np.meshgrid(edges[0][:-1], edges[1][:-1], indexing="ij")
+    _, _, _, im = ax.hist2d(x.ravel(), y.ravel(), bins=edges, weights=counts.ravel(), **kwargs)
+    return im
+
 
 if __name__ == "__main__":
     main()
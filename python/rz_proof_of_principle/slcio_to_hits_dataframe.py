@@ -8,11 +8,19 @@ CellID encoding for OETrackerHits: system:5,side:-2,layer:6,module:11,sensor:8
 import numpy as np
 import pandas as pd
 import os
+import sys
 import multiprocessing as mp
 
 from constants import MCPARTICLES, SPEED_OF_LIGHT, MUON
 from constants import MINIMUM_TIME, MAXIMUM_TIME
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from cellid import FIELDS, codec_from_collection, get_codec
+from slcio_reader import convert_cached
+
+# bump when the conversion changes, to invalidate the cached hits
+CACHE_VERSION = 1
+
 try:
     import pyLCIO
 except ImportError as e:
@@ -20,12 +28,13 @@ except ImportError as e:
 
 class SlcioToHitsDataFrame:
 
-    def __init__(self, slcio_file_paths, collections, layers, sensors, signal):
+    def __init__(self, slcio_file_paths, collections, layers, sensors, signal, cache=None):
         self.slcio_file_paths = slcio_file_paths
         self.collections = collections
         self.layers = layers
         self.sensors = sensors
         self.signal = signal
+        self.cache = cache
 
 
     def convert(self) -> pd.DataFrame:
@@ -37,9 +46,32 @@ class SlcioToHitsDataFrame:
 
     def convert_all_files(self) -> pd.DataFrame:
         with mp.Pool(processes=mp.cpu_count()) as pool:
-            all_hits_dfs = pool.map(self.convert_one_file, self.slcio_file_paths)
+            results = pool.map(self.convert_cached_file, self.slcio_file_paths)
+        if self.cache is not None:
+            self.cache.evict(keep={path for (df, paths) in results for path in paths})
         print("Merging DataFrames ...")
-        return pd.concat(all_hits_dfs, ignore_index=True)
+        return pd.concat([df for (df, paths) in results], ignore_index=True)
+
+
+    def convert_cached_file(self, slcio_file_path: str) -> tuple[pd.DataFrame, list[str]]:
+        # cached per file, keyed by the hit selection and the fallback CellID encoding
+        kwargs = {
+            "collections": self.collections,
+            "layers": self.layers,
+            "sensors": self.sensors,
+            "signal": self.signal,
+            "encoding": get_codec().encoding,
+            "digi": "_digi_" in slcio_file_path,
+        }
+        tables, paths = convert_cached(slcio_file_path,
+                                       lambda: {"hits": self.convert_one_file(slcio_file_path)},
+                                       self.cache,
+                                       "rz_proof_of_principle_hits",
+                                       version=CACHE_VERSION,
+                                       tables=["hits"],
+                                       kwargs=kwargs,
+                                       file=os.path.basename(slcio_file_path))
+        return tables["hits"], paths
 
 
     def convert_one_file(self, slcio_file_path: str) -> pd.DataFrame:
@@ -57,6 +89,7 @@ class SlcioToHitsDataFrame:
 
         # list for holding all hits
         rows = []
+        codec = get_codec()
 
         # loop over all events in the slcio file
         for i_event, event in enumerate(reader):
@@ -75,6 +108,8 @@ class SlcioToHitsDataFrame:
             for collection in self.collections:
 
                 col = event.getCollection(collection)
+                # relations carry no CellIDEncoding, their hit collection does
+                codec = codec_from_collection(event.getCollection(collection.removesuffix("Relations")), codec)
 
                 for obj in col:
 
@@ -105,9 +140,9 @@ class SlcioToHitsDataFrame:
                         continue
 
                     # skip if trying to speed up
-                    if self.layers and (np.right_shift(hit.getCellID0(), 7) & 0b11_1111) not in self.layers:
+                    if self.layers and codec.get(hit.getCellID0(), "layer") not in self.layers:
                         continue
-                    if self.sensors and (np.right_shift(hit.getCellID0(), 24) & 0b1111_1111) not in self.sensors:
+                    if self.sensors and codec.get(hit.getCellID0(), "sensor") not in self.sensors:
                         continue
 
                     # record the hit info
@@ -138,7 +173,11 @@ class SlcioToHitsDataFrame:
 
         # Convert the list of hits to a pandas DataFrame
         print("Converting hits to DataFrame ...")
-        return pd.DataFrame(rows)
+        df = pd.DataFrame(rows)
+        if len(df) > 0:
+            for name, values in codec.decode(df['hit_cellid0'], fields=FIELDS, prefix='hit_').items():
+                df[name] = values
+        return df
 
 
     def postprocess_dataframe(self, df: pd.DataFrame) -> pd.DataFrame:
@@ -152,11 +191,6 @@ class SlcioToHitsDataFrame:
         df['hit_r'] = np.sqrt(df['hit_x']**2 + df['hit_y']**2)
         df['hit_R'] = np.sqrt(df['hit_x']**2 + df['hit_y']**2 + df['hit_z']**2)
         df['hit_t_corrected'] = df['hit_t'] - (df['hit_R'] / SPEED_OF_LIGHT * ~df['hit_is_digi'])
-        df['hit_system'] = np.right_shift(df['hit_cellid0'], 0) & 0b1_1111
-        df['hit_side'] = np.right_shift(df['hit_cellid0'], 5) & 0b11
-        df['hit_layer'] = np.right_shift(df['hit_cellid0'], 7) & 0b11_1111
-        df['hit_module'] = np.right_shift(df['hit_cellid0'], 13) & 0b111_1111_1111
-        df['hit_sensor'] = np.right_shift(df['hit_cellid0'], 24) & 0b1111_1111
         df['hit_theta'] = np.arctan2(df['hit_r'], df['hit_z'])
         df['hit_phi'] = np.arctan2(df['hit_y'], df['hit_x'])
 
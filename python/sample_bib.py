@@ -0,0 +1,205 @@
+"""
+Pre-filter FLUKA BIB particles before simulation.
+
+A particle created at position P and time t cannot produce a hit with
+speed-of-light-corrected time t_hit - |H|/c earlier than t - |P|/c
+(since |H| <= |H - P| + |P| and nothing travels faster than c).
+Particles with t - |P|/c >= MAX_TIME therefore never contribute to the
+downstream time window, and are dropped without changing the occupancy.
+
+Optional kinematic cuts (energy, |z|, |z_mu|) are not lossless. Particles failing
+them can be prescaled instead: one in N is kept and written to separate shards
+with weight N, so occupancy studies can reweight the simulated hits.
+
+The surviving particles are written in the FLUKA binary format, in shards of
+--shard-size particles, together with a manifest.json of retained fractions and weights.
+
+Run like:
+> python sample_bib.py -i "summary1*_DET_IP.dat" -o bib_prefiltered --min-energy 1e-4 --prescale 10
+"""
+
+import argparse
+import json
+import os
+import numpy as np
+import logging
+logger = logging.getLogger(__name__)
+
+from fluka import LINE_DT, S_TO_NS, open_fluka, iter_records, parse_filepaths
+
+SPEED_OF_LIGHT = 299.792458  # mm/ns
+FLUKA_CM_TO_MM = 10.0
+MAX_TIME = 3.0 # ns
+SHARD_SIZE = 1_000_000
+MANIFEST = "manifest.json"
+
+
+def main():
+    logging.basicConfig(level=logging.INFO,
+                        format="%(asctime)s [%(levelname)s] %(message)s")
+    ops = options()
+    cuts = Cuts(
+        max_time=ops.max_time,
+        min_energy=ops.min_energy,
+        max_abs_z=ops.max_abs_z,
+        max_abs_z_mu=ops.max_abs_z_mu,
+    )
+    sample(
+        fluka_file_paths=parse_filepaths(ops.i),
+        outdir=ops.o,
+        cuts=cuts,
+        prescale=ops.prescale,
+        shard_size=ops.shard_size,
+        seed=ops.seed,
+    )
+
+
+def options():
+    parser = argparse.ArgumentParser(usage=__doc__, formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("-i", required=True, nargs="+", help="Input FLUKA file(s) or glob pattern(s)")
+    parser.add_argument("-o", required=True, help="Output directory for shards and manifest")
+    parser.add_argument("--max-time", type=float, default=MAX_TIME, help="Drop particles with t - |P|/c >= this [ns]")
+    parser.add_argument("--min-energy", type=float, default=None, help="Kinematic cut: E >= this [GeV]")
+    parser.add_argument("--max-abs-z", type=float, default=None, help="Kinematic cut: |z| < this [mm]")
+    parser.add_argument("--max-abs-z-mu", type=float, default=None, help="Kinematic cut: |z_mu| < this [mm]")
+    parser.add_argument("--prescale", type=int, default=0, help="Keep 1 in N particles failing the kinematic cuts, with weight N (0: drop them)")
+    parser.add_argument("--shard-size", type=int, default=SHARD_SIZE, help="Particles per output shard (0: one shard per weight)")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed for prescaling")
+    return parser.parse_args()
+
+
+class Cuts:
+
+    def __init__(self, max_time: float, min_energy: float = None, max_abs_z: float = None, max_abs_z_mu: float = None):
+        self.max_time = max_time
+        self.min_energy = min_energy
+        self.max_abs_z = max_abs_z
+        self.max_abs_z_mu = max_abs_z_mu
+
+
+    def in_time(self, records: np.ndarray) -> np.ndarray:
+        distance = np.sqrt(records["x"]**2 + records["y"]**2 + records["z"]**2) * FLUKA_CM_TO_MM
+        return records["time"] * S_TO_NS - distance / SPEED_OF_LIGHT < self.max_time
+
+
+    def kinematic(self, records: np.ndarray) -> np.ndarray:
+        mask = np.ones(len(records), dtype=bool)
+        if self.min_energy is not None:
+            mask &= records["E"] >= self.min_energy
+        if self.max_abs_z is not None:
+            mask &= np.abs(records["z"]) * FLUKA_CM_TO_MM < self.max_abs_z
+        if self.max_abs_z_mu is not None:
+            mask &= np.abs(records["z_mu"]) * FLUKA_CM_TO_MM < self.max_abs_z_mu
+        return mask
+
+
+    def to_dict(self) -> dict:
+        return dict(vars(self))
+
+
+class ShardWriter:
+    """Buffer records of one weight and write them out in fixed-size shards."""
+
+    def __init__(self, outdir: str, tag: str, weight: int, shard_size: int):
+        self.outdir = outdir
+        self.tag = tag
+        self.weight = weight
+        self.shard_size = shard_size
+        self.buffer = []
+        self.n_buffered = 0
+        self.shards = []
+        self.sources = set()
+
+
+    def add(self, records: np.ndarray, source: str):
+        if len(records) == 0:
+            return
+        self.buffer.append(records)
+        self.n_buffered += len(records)
+        self.sources.add(os.path.basename(source))
+        while self.shard_size and self.n_buffered >= self.shard_size:
+            records = np.concatenate(self.buffer)
+            self.write(records[:self.shard_size])
+            self.buffer = [records[self.shard_size:]]
+            self.n_buffered = len(self.buffer[0])
+
+
+    def close(self):
+        if self.n_buffered:
+            self.write(np.concatenate(self.buffer))
+        self.buffer, self.n_buffered = [], 0
+
+
+    def write(self, records: np.ndarray):
+        name = f"{self.tag}_{len(self.shards):04d}.dat"
+        records.tofile(os.path.join(self.outdir, name))
+        self.shards.append({
+            "file": name,
+            "n_particles": len(records),
+            "weight": self.weight,
+            "sources": sorted(self.sources),
+        })
+        self.sources = set()
+
+
+def sample(
+        fluka_file_paths: list[str],
+        outdir: str,
+        cuts: Cuts,
+        prescale: int = 0,
+        shard_size: int = SHARD_SIZE,
+        seed: int = 0,
+    ) -> dict:
+    os.makedirs(outdir, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    kept = ShardWriter(outdir, "shard", 1, shard_size)
+    prescaled = ShardWriter(outdir, f"shard_prescaled{prescale}", prescale, shard_size)
+    inputs = []
+
+    for i_file, path in enumerate(fluka_file_paths):
+        logger.info(f"Sampling FLUKA file {i_file + 1}/{len(fluka_file_paths)}: {path} ...")
+        all_records = open_fluka(path)
+        n_input, n_in_time, n_kept, n_prescaled = len(all_records), 0, 0, 0
+        for records in iter_records(all_records):
+            records = records[cuts.in_time(records)]
+            n_in_time += len(records)
+            kinematic = cuts.kinematic(records)
+            kept.add(records[kinematic], path)
+            n_kept += kinematic.sum()
+            if prescale:
+                lucky = ~kinematic & (rng.integers(0, prescale, size=len(records)) == 0)
+                prescaled.add(records[lucky], path)
+                n_prescaled += lucky.sum()
+        inputs.append({
+            "file": path,
+            "n_input": n_input,
+            "n_in_time": int(n_in_time),
+            "n_kept": int(n_kept),
+            "n_prescaled": int(n_prescaled),
+            "retained_fraction": (n_kept + n_prescaled) / n_input if n_input else 0.0,
+        })
+        logger.info(f"Kept {n_kept} + {n_prescaled} prescaled / {n_input} particles")
+
+    kept.close()
+    prescaled.close()
+    n_input = sum(inp["n_input"] for inp in inputs)
+    n_output = sum(shard["n_particles"] for shard in kept.shards + prescaled.shards)
+    manifest = {
+        "record_dtype": LINE_DT.descr,
+        "cuts": cuts.to_dict(),
+        "prescale": prescale,
+        "seed": seed,
+        "n_input": n_input,
+        "n_output": n_output,
+        "retained_fraction": n_output / n_input if n_input else 0.0,
+        "inputs": inputs,
+        "shards": kept.shards + prescaled.shards,
+    }
+    with open(os.path.join(outdir, MANIFEST), "w") as fi:
+        json.dump(manifest, fi, indent=2)
+    logger.info(f"Wrote {len(manifest['shards'])} shards with {n_output} / {n_input} particles to {outdir}")
+    return manifest
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,276 @@
+"""
+Registry of slcio samples, from manifests next to the files of each production.
+
+A production directory (e.g. experiments/simulate_muonGun.2026_08_07_19h00m00s)
+carries a manifest.json with its geometry tag, smear and BIB fraction, and for each
+slcio file its path relative to the directory, stage (gen/sim/digi), event type,
+number of events, size and mtime. Manifests are built once by `scan`, which reads
+the LCIO headers of the files in parallel, and only re-reads files which changed.
+
+The registry loads every manifest under its roots into one table, so queries like
+geometry=v05, stage=digi, smear=10um, kind=signal are a pandas selection, and
+event-range shards balance work by events instead of by files.
+
+Usage:
+    python samples.py scan /path/to/experiments/simulate_muonGun.2026_08_07_19h00m00s --geometry v06 -j 16
+    python samples.py list --geometry v05 --stage digi --smear 10um --kind signal
+    python samples.py shard --geometry v05 --stage sim --kind signal --shards 10
+    files = Registry().files(geometry="v05", stage="digi", smear="10um", kind="signal")
+"""
+
+import argparse
+import glob
+import json
+import multiprocessing as mp
+import os
+import re
+import numpy as np
+import pandas as pd
+import logging
+logger = logging.getLogger(__name__)
+
+SCHEMA_VERSION = 1
+MANIFEST = "manifest.json"
+PATTERN = "*.slcio"
+# particle guns (muonGun, pionGun, ...) are signal, except the neutrinoGun of the BIB overlay
+SIGNAL = re.compile(r"Gun")
+BACKGROUND = re.compile(r"^(?:neutrinoGun|BIB)")
+BASE = "/ceph/users/atuna/work/maia/maia_noodling"
+DEFAULT_ROOTS = os.environ.get("MAIA_SAMPLES", f"{BASE}/experiments:{BASE}/samples").split(":")
+FILENAME = re.compile(r"^(?P<typeevent>.+?)_(?P<stage>gen|sim|digi)_(?P<num>\d+)\.slcio$")
+QUERY_FIELDS = ["production", "geometry", "stage", "smear", "bib_fraction", "kind", "typeevent"]
+
+
+def options():
+    parser = argparse.ArgumentParser(usage=__doc__, formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    scan = subparsers.add_parser("scan", help="Write or update the manifest of production directories")
+    scan.add_argument("directories", nargs="+", help="Production directories")
+    scan.add_argument("--pattern", default=PATTERN, help="Glob of the slcio files in each directory")
+    scan.add_argument("--geometry", default=None, help="Geometry tag of the production (e.g. v05)")
+    scan.add_argument("--smear", default=None, help="Smear of the digi hits (e.g. 10um)")
+    scan.add_argument("--bib-fraction", type=float, default=None, help="Fraction of the BIB in the production (e.g. 0.1)")
+    scan.add_argument("--kind", default=None, choices=["signal", "background"], help="Default: from the event type")
+    scan.add_argument("-j", "--jobs", type=int, default=None, help="Number of processes for reading headers (None: all cores)")
+
+    for name in ["list", "shard"]:
+        sub = subparsers.add_parser(name)
+        add_sample_arguments(sub, prefix="")
+        if name == "shard":
+            sub.add_argument("--shards", type=int, default=None, help="Number of shards")
+            sub.add_argument("--events-per-shard", type=int, default=None, help="Events per shard")
+    return parser.parse_args()
+
+
+def main():
+    logging.basicConfig(level=logging.INFO,
+                        format="%(asctime)s [%(levelname)s] %(message)s")
+    ops = options()
+    if ops.command == "scan":
+        for directory in ops.directories:
+            manifest = scan(directory,
+                            pattern=ops.pattern,
+                            jobs=ops.jobs,
+                            geometry=ops.geometry,
+                            smear=ops.smear,
+                            bib_fraction=ops.bib_fraction,
+                            kind=ops.kind,
+                            )
+            n_events = sum(entry["events"] for entry in manifest["files"])
+            logger.info(f"Wrote {os.path.join(directory, MANIFEST)} with {len(manifest['files'])} files and {n_events} events")
+        return
+
+    registry = Registry(ops.roots)
+    df = registry.query(**query_from_options(ops, prefix=""))
+    if ops.command == "list":
+        print(df.to_string(index=False))
+        print(f"{len(df)} files, {df['events'].sum()} events")
+    else:
+        for i_shard, shard in enumerate(shard_events(df, n_shards=ops.shards, events_per_shard=ops.events_per_shard)):
+            print(f"Shard {i_shard}: " + ", ".join(f"{path}[{first}:{first + count}]" for path, first, count in shard))
+
+
+def add_sample_arguments(parser, prefix: str = "sample-"):
+    """Options to select files from the registry. Scripts with their own --geo etc. use the sample- prefix."""
+    parser.add_argument(f"--{prefix}roots", dest=f"{prefix.replace('-', '_')}roots", nargs="+", default=DEFAULT_ROOTS,
+                        help="Directories with production directories (env: MAIA_SAMPLES, colon-separated)")
+    for field in QUERY_FIELDS:
+        dest = f"{prefix.replace('-', '_')}{field}"
+        kwargs = {"type": float} if field == "bib_fraction" else {}
+        parser.add_argument(f"--{prefix}{field.replace('_', '-')}", dest=dest, default=None, help=f"Select files by {field}", **kwargs)
+
+
+def query_from_options(ops, prefix: str = "sample-") -> dict:
+    prefix = prefix.replace("-", "_")
+    return {field: getattr(ops, f"{prefix}{field}") for field in QUERY_FIELDS}
+
+
+def files_from_options(ops, prefix: str = "sample-") -> list[str] | None:
+    """Files of the sample options, or None if no sample option was given."""
+    query = query_from_options(ops, prefix)
+    if all(value is None for value in query.values()):
+        return None
+    return Registry(getattr(ops, f"{prefix.replace('-', '_')}roots")).files(**query)
+
+
+def read_header(path: str) -> dict:
+    """Number of events and detector name of an slcio file, without reading its events."""
+    # import here, like the converters, to keep pyLCIO out of the parents of worker pools
+    import pyLCIO
+    reader = pyLCIO.IOIMPL.LCFactory.getInstance().createLCReader()
+    reader.open(path)
+    n_events = reader.getNumberOfEvents()
+    run = reader.readNextRunHeader()
+    detector = run.getDetectorName() if run else None
+    reader.close()
+    return {"events": int(n_events), "detector": detector}
+
+
+def scan_file(directory: str, name: str) -> dict:
+    path = os.path.join(directory, name)
+    stat = os.stat(path)
+    entry = {"path": name, "size": stat.st_size, "mtime": stat.st_mtime}
+    match = FILENAME.match(name)
+    entry["typeevent"] = match["typeevent"] if match else None
+    entry["stage"] = match["stage"] if match else None
+    entry.update(read_header(path))
+    return entry
+
+
+def scan(
+        directory: str,
+        pattern: str = PATTERN,
+        jobs: int = None,
+        geometry: str = None,
+        smear: str = None,
+        bib_fraction: float = None,
+        kind: str = None,
+    ) -> dict:
+    """
+    Write the manifest of a production directory. Files whose size and mtime did not change
+    keep their entries, and settings which are not given keep their values from the old manifest.
+    """
+    old = read_manifest(directory) or {"files": []}
+    known = {entry["path"]: entry for entry in old["files"]}
+    names = sorted(os.path.relpath(path, directory) for path in glob.glob(os.path.join(directory, pattern)))
+
+    unchanged, changed = [], []
+    for name in names:
+        stat = os.stat(os.path.join(directory, name))
+        entry = known.get(name)
+        if entry and (entry["size"], entry["mtime"]) == (stat.st_size, stat.st_mtime):
+            unchanged.append(entry)
+        else:
+            changed.append(name)
+    logger.info(f"Scanning {len(changed)} new or changed files of {len(names)} in {directory} ...")
+    processes = max(1, min(jobs or mp.cpu_count(), len(changed)))
+    if processes == 1:
+        scanned = [scan_file(directory, name) for name in changed]
+    else:
+        with mp.Pool(processes=processes) as pool:
+            scanned = pool.starmap(scan_file, [(directory, name) for name in changed])
+
+    manifest = {
+        "schema_version": SCHEMA_VERSION,
+        "production": os.path.basename(os.path.normpath(directory)),
+        "geometry": geometry if geometry is not None else old.get("geometry"),
+        "smear": smear if smear is not None else old.get("smear"),
+        "bib_fraction": bib_fraction if bib_fraction is not None else old.get("bib_fraction"),
+        "kind": kind if kind is not None else old.get("kind"),
+        "files": sorted(unchanged + scanned, key=lambda entry: entry["path"]),
+    }
+    path = os.path.join(directory, MANIFEST)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w") as fo:
+        json.dump(manifest, fo, indent=1)
+    os.replace(tmp, path)
+    return manifest
+
+
+def read_manifest(directory: str) -> dict | None:
+    path = os.path.join(directory, MANIFEST)
+    if not os.path.isfile(path):
+        return None
+    with open(path) as fi:
+        manifest = json.load(fi)
+    if manifest["schema_version"] != SCHEMA_VERSION:
+        raise ValueError(f"Manifest {path} has schema version {manifest['schema_version']}, expected {SCHEMA_VERSION}")
+    return manifest
+
+
+class Registry:
+    """All files of the manifests under some roots, as one table."""
+
+    def __init__(self, roots: list[str] = DEFAULT_ROOTS):
+        frames = []
+        for root in roots:
+            for path in sorted(glob.glob(os.path.join(root, "*", MANIFEST))):
+                directory = os.path.dirname(path)
+                manifest = read_manifest(directory)
+                df = pd.DataFrame(manifest["files"], columns=["path", "typeevent", "stage", "events", "size", "mtime", "detector"])
+                df["path"] = [os.path.join(directory, name) for name in df["path"]]
+                kind = manifest.get("kind")
+                df["kind"] = kind if kind else default_kind(df["typeevent"])
+                for field in ["production", "geometry", "smear", "bib_fraction"]:
+                    df[field] = manifest.get(field)
+                frames.append(df)
+        self.df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=["path", "events", "size", "mtime"] + QUERY_FIELDS)
+        logger.info(f"Loaded {len(self.df)} files from {len(frames)} manifests")
+
+
+    def query(self, **selection) -> pd.DataFrame:
+        """Files matching every given field. A value may be a list of alternatives, and None selects everything."""
+        mask = np.ones(len(self.df), dtype=bool)
+        for field, value in selection.items():
+            if value is None:
+                continue
+            if field not in QUERY_FIELDS:
+                raise ValueError(f"Unknown sample field: {field}. Choose from {QUERY_FIELDS}")
+            values = value if isinstance(value, (list, tuple)) else [value]
+            mask &= self.df[field].isin(values).to_numpy()
+        return self.df[mask].reset_index(drop=True)
+
+
+    def files(self, **selection) -> list[str]:
+        return self.query(**selection)["path"].tolist()
+
+
+def default_kind(typeevent: pd.Series) -> np.ndarray:
+    typeevent = typeevent.fillna("")
+    is_signal = typeevent.str.contains(SIGNAL) & ~typeevent.str.contains(BACKGROUND)
+    return np.where(is_signal, "signal", "background")
+
+
+def shard_events(files: pd.DataFrame, n_shards: int = None, events_per_shard: int = None) -> list[list[tuple[str, int, int]]]:
+    """
+    Contiguous shards of the events of some files, as lists of (path, first event, number of events),
+    with the same number of events per shard up to rounding.
+    """
+    if (n_shards is None) == (events_per_shard is None):
+        raise ValueError("Specify one of n_shards or events_per_shard")
+    events = files["events"].to_numpy(dtype=np.int64)
+    paths = files["path"].to_numpy()
+    offsets = np.concatenate([[0], np.cumsum(events)])
+    total = int(offsets[-1])
+    if n_shards is not None:
+        edges = np.round(np.linspace(0, total, n_shards + 1)).astype(np.int64)
+    else:
+        edges = np.append(np.arange(0, total, events_per_shard), total)
+
+    shards = []
+    for lo, hi in zip(edges[:-1], edges[1:]):
+        shard = []
+        first_file = np.searchsorted(offsets, lo, side="right") - 1
+        last_file = np.searchsorted(offsets, hi, side="left") - 1
+        for i_file in range(first_file, last_file + 1):
+            start = max(lo, offsets[i_file])
+            stop = min(hi, offsets[i_file + 1])
+            if stop > start:
+                shard.append((paths[i_file], int(start - offsets[i_file]), int(stop - start)))
+        shards.append(shard)
+    return shards
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,26 @@
+import itertools
+import multiprocessing as mp
+import os
+import sys
 import numpy as np
 import pandas as pd
 
 import matplotlib.pyplot as plt
 from matplotlib.backends.backend_pdf import PdfPages
+from matplotlib.collections import PolyCollection
 from matplotlib import rcParams
 rcParams.update({"font.size": 16})
 
+# the circle fits are shared with counting_doublets
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "counting_doublets"))
+from circlefit import fit_circles
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from geometry_table import load_geometry
+
+# geometry table from write_tgeo_to_dataframe.py, or a tag of geometry_table.py
 PARQUET = "geometry.parquet"
-NEARBY = 200 # mm
-NEARBY2 = NEARBY**2
+GRID_CELL = 200 # mm
 PADDING = 100 # mm
-SQUARED_DISTANCE = False
 MAX_TIME_CORRECTED = 3.0 # ns
 MIN_HITS_FOR_CIRCLE = 3
 TOTAL_LAYERS = 16
@@ -31,12 +41,13 @@ N_LAYERS = {
 class EventDisplays:
 
 
-    def __init__(self, df, pdf):
-        self.df = df
+    def __init__(self, mcps, simhits, pdf):
+        self.mcps = mcps.set_index(["file", "i_event", "i_mcp"])
+        self.df = simhits
         self.pdf = pdf
         self.plot_if_missing_a_layer = True
         self.n_displays = 10
-        self.geo = pd.read_parquet(PARQUET)
+        self.geo = ModuleIndex(load_geometry(PARQUET, columns=ModuleIndex.COLUMNS))
 
 
     def make_event_displays(self):
@@ -49,171 +60,277 @@ class EventDisplays:
                 if self.plot_if_missing_a_layer and not self.missing_a_layer(group):
                     print(f"Skipping mcparticle {i_group} because it has hits in all layers")
                     continue
-                self.make_one_event_display(i_group, group, pdf)
+                self.make_one_event_display(i_group, group, self.mcps.loc[cols], pdf)
                 i_display += 1
 
 
+    def make_event_displays_batch(self, outdir, select=None, max_displays=None, fmt="png", processes=None):
+        """
+        Render every mcparticle passing `select(group, mcp)` to its own file
+        in `outdir` with a process pool, and write index.csv/index.html.
+        max_displays counts rendered displays: skipped ones are replaced by the next candidates.
+        The module index is handed to each worker once, at startup.
+        """
+        os.makedirs(outdir, exist_ok=True)
+        group_cols = ["file", "i_event", "i_mcp"]
+
+        def candidates():
+            for i_group, (cols, group) in enumerate(self.df.groupby(group_cols)):
+                mcp = self.mcps.loc[cols]
+                if select is not None and not select(group, mcp):
+                    continue
+                row = dict(zip(group_cols, cols), mcp_pt=mcp["mcp_pt"], mcp_eta=mcp["mcp_eta"])
+                yield (i_group, group, mcp, os.path.join(outdir, f"event_display_{i_group:06d}.{fmt}")), row
+
+        remaining = candidates()
+        rows, paths = [], []
+        with mp.Pool(processes=processes, initializer=init_worker, initargs=(self.geo,)) as pool:
+            while True:
+                n_rendered = sum(path is not None for path in paths)
+                n_jobs = None if max_displays is None else max_displays - n_rendered
+                batch = list(itertools.islice(remaining, n_jobs))
+                if not batch:
+                    break
+                jobs = [job for job, _ in batch]
+                print(f"Rendering {len(jobs)} event displays to {outdir} ...")
+
+                # fit all circles of the batch in one call
+                circles = fit_event_circles([group for (_, group, _, _) in jobs])
+                paths.extend(pool.starmap(render_one_event_display, [job + (circle,) for job, circle in zip(jobs, circles)]))
+                rows.extend(row for _, row in batch)
+                if max_displays is None:
+                    break
+
+        index = pd.DataFrame(rows).assign(path=paths).dropna(subset=["path"])
+        write_index(index, outdir)
+        return index
+
+
     def missing_a_layer(self, group) -> bool:
-        cols = ["simhit_system", "simhit_layer"]
-        for tracker in TRACKERS:
-            tracker_group = group[group["simhit_system"] == tracker]
-            n_layers = len(tracker_group[cols].drop_duplicates())
-            if n_layers < N_LAYERS[tracker]:
-                return True
-        return False
-
-
-    def make_one_event_display(self, i_group, group, pdf):
-        mask = group["simhit"] & (group["simhit_t_corrected"] < MAX_TIME_CORRECTED)
-        if mask.sum() < MIN_HITS_FOR_CIRCLE:
-            raise ValueError("Not enough simhits to make an event display.")
-
-        # get x, y for convenience
-        group["simhit_x"] = group["simhit_r"] * np.cos(group["simhit_phi"])
-        group["simhit_y"] = group["simhit_r"] * np.sin(group["simhit_phi"])
-
-        # fit a circle
-        x_center, y_center, radius = fit_circle(group[mask]["simhit_x"],
-                                                group[mask]["simhit_y"])
-        thetas = np.linspace(0, 2*np.pi, 360)
-        circle_x = x_center + radius * np.cos(thetas)
-        circle_y = y_center + radius * np.sin(thetas)
-
-        # find nearby modules
-        hits = group[mask][["simhit_x", "simhit_y"]].to_numpy(dtype=np.float64)
-        orig = self.geo[["origin_x", "origin_y"]].to_numpy(dtype=np.float64)
-        if SQUARED_DISTANCE:
-            d2 = ((hits[:, None, :] - orig[None, :, :]) ** 2).sum(axis=2)
-            min_d2 = d2.min(axis=0)
-            geomask = min_d2 <= NEARBY2
-        else:
-            diff = np.abs(hits[:, None, :] - orig[None, :, :])
-            within_box = (diff <= NEARBY).all(axis=2)
-            geomask = within_box.any(axis=0)
-        cornercols = [
-            "corner_xy_0_x", "corner_xy_0_y",
-            "corner_xy_1_x", "corner_xy_1_y",
-            "corner_xy_2_x", "corner_xy_2_y",
-            "corner_xy_3_x", "corner_xy_3_y",
-        ]
-        modules = self.geo[geomask][cornercols].drop_duplicates()
-        print(f"Event display mcparticle {i_group}: found {len(modules)} unique nearby modules ({geomask.sum()} total)")
-
-        # annotations
-        if len(group["mcp_pt"].unique()) > 1:
-            raise ValueError("Multiple mcparticle pT values found.")
-        mc_pt = group["mcp_pt"].unique()[0]
-        mc_eta = group["mcp_eta"].unique()[0]
-
-        # one plot for IT and one plot for OT
-        fig, axs = plt.subplots(ncols=2, figsize=(16, 8))
-
-        for (ax, tracker) in zip(axs, TRACKERS):
-
-            trackermask = mask & (group["simhit_system"] == tracker)
-            layers = sorted(list(group[trackermask]["simhit_layer"].unique()))
-
-            xlo = group[trackermask]["simhit_x"].min() - PADDING
-            xhi = group[trackermask]["simhit_x"].max() + PADDING
-            ylo = group[trackermask]["simhit_y"].min() - PADDING
-            yhi = group[trackermask]["simhit_y"].max() + PADDING * 1.5
-            cornermask = (
-                ((self.geo["corner_xy_0_x"] > xlo) & (self.geo["corner_xy_0_x"] < xhi)) |
-                ((self.geo["corner_xy_1_x"] > xlo) & (self.geo["corner_xy_1_x"] < xhi)) |
-                ((self.geo["corner_xy_2_x"] > xlo) & (self.geo["corner_xy_2_x"] < xhi)) |
-                ((self.geo["corner_xy_3_x"] > xlo) & (self.geo["corner_xy_3_x"] < xhi))
-            ) & (
-                ((self.geo["corner_xy_0_y"] > ylo) & (self.geo["corner_xy_0_y"] < yhi)) |
-                ((self.geo["corner_xy_1_y"] > ylo) & (self.geo["corner_xy_1_y"] < yhi)) |
-                ((self.geo["corner_xy_2_y"] > ylo) & (self.geo["corner_xy_2_y"] < yhi)) |
-                ((self.geo["corner_xy_3_y"] > ylo) & (self.geo["corner_xy_3_y"] < yhi))
-            )
-            smarter_modules = self.geo[cornermask][cornercols].drop_duplicates()
-            print(f"Event display mcparticle {i_group}: found {len(modules)} unique nearby modules ({cornermask.sum()} total), len(smarter) = {len(smarter_modules)}")
-            xlims = [xlo, xhi]
-            ylims = [ylo, yhi]
-
-            # for _, row in modules.iterrows():
-            for _, row in smarter_modules.iterrows():
-                corner_xs = [row["corner_xy_0_x"],
-                             row["corner_xy_1_x"],
-                             row["corner_xy_2_x"],
-                             row["corner_xy_3_x"],
-                             row["corner_xy_0_x"]
-                            ]
-                corner_ys = [row["corner_xy_0_y"],
-                             row["corner_xy_1_y"],
-                             row["corner_xy_2_y"],
-                             row["corner_xy_3_y"],
-                             row["corner_xy_0_y"]
-                            ]
-                ax.plot(corner_xs, corner_ys, c="black", marker="none", linewidth=0.5, zorder=1)
-            ax.plot(
-                circle_x,
-                circle_y,
-                c="red",
-                linestyle="--",
-                linewidth=0.5,
-                zorder=2,
-            )
-            mask_even = trackermask & (group["simhit_layer"] % 2 == 0)
-            mask_odd = trackermask & (group["simhit_layer"] % 2 == 1)
-            ops = dict(facecolors="none", edgecolors="dodgerblue", s=20, zorder=3)
-            ax.scatter(
-                group[mask_even]["simhit_x"],
-                group[mask_even]["simhit_y"],
-                marker="o",
-                label="Even (inner) layers",
-                **ops,
-            )
-            ax.scatter(
-                group[mask_odd]["simhit_x"],
-                group[mask_odd]["simhit_y"],
-                marker="s",
-                label="Odd (outer) layers",
-                **ops,
-            )
-            # ax.legend(loc="upper left")
-            ax.set_xlim(xlims)
-            ax.set_ylim(ylims)
-            ax.set_xlabel("x [mm]")
-            ax.set_ylabel("y [mm]")
-            ax.set_title(f"{TRACKERNAME[tracker]}, MC {i_group}, $p_T$ = {mc_pt:.1f} GeV, eta = {mc_eta:.2f}")
-            ax.minorticks_on()
-            ax.grid(which="both", alpha=0.5)
-            ax.set_axisbelow(True)
-            if len(layers) < N_LAYERS[tracker]:
-                missing_layers = sorted(list(set(range(N_LAYERS[tracker])) - set(layers)))
-                missing_layers = ", ".join([str(ml) for ml in missing_layers])
-                ax.text(0.35, 0.50, f"Missing layers: {missing_layers}", transform=ax.transAxes,
-                        bbox=dict(facecolor="white", edgecolor="black", alpha=0.8))
-
-        fig.subplots_adjust(left=0.07, right=0.97, top=0.95, bottom=0.09)
-        pdf.savefig()
-        plt.close()
-
-
-def fit_circle(
-        x,
-        y,
-    ):
-    """
-    Fit a circle in the least-squares sense to points (x, y).
+        return missing_a_layer(group)
+
+
+    def make_one_event_display(self, i_group, group, mcp, pdf):
+        fig = draw_event_display(self.geo, i_group, group, mcp)
+        pdf.savefig(fig)
+        plt.close(fig)
+
+
+def missing_a_layer(group, mcp=None) -> bool:
+    cols = ["simhit_system", "simhit_layer"]
+    for tracker in TRACKERS:
+        tracker_group = group[group["simhit_system"] == tracker]
+        n_layers = len(tracker_group[cols].drop_duplicates())
+        if n_layers < N_LAYERS[tracker]:
+            return True
+    return False
+
+
+def pt_range(lo, hi):
+    return lambda group, mcp: lo <= mcp["mcp_pt"] < hi
+
+
+def eta_range(lo, hi):
+    return lambda group, mcp: lo <= mcp["mcp_eta"] < hi
+
+
+def all_of(*predicates):
+    return lambda group, mcp: all(predicate(group, mcp) for predicate in predicates)
+
+
+_WORKER_GEO = None
+
+
+def init_worker(geo):
+    global _WORKER_GEO
+    _WORKER_GEO = geo
+
 
-    Returns:
-        xc, yc, R  (center and radius)
+def render_one_event_display(i_group, group, mcp, path, circle):
+    try:
+        fig = draw_event_display(_WORKER_GEO, i_group, group, mcp, circle)
+    except ValueError as err:
+        print(f"Skipping mcparticle {i_group}: {err}")
+        return None
+    fig.savefig(path)
+    plt.close(fig)
+    return path
+
+
+def write_index(index, outdir):
+    index.to_csv(os.path.join(outdir, "index.csv"), index=False)
+    with open(os.path.join(outdir, "index.html"), "w") as fi:
+        fi.write("<html><body><table>\n")
+        fi.write("<tr><th>file</th><th>i_event</th><th>i_mcp</th><th>pT [GeV]</th><th>eta</th><th>display</th></tr>\n")
+        for row in index.itertuples():
+            name = os.path.basename(row.path)
+            fi.write(f"<tr><td>{row.file}</td><td>{row.i_event}</td><td>{row.i_mcp}</td>"
+                     f"<td>{row.mcp_pt:.2f}</td><td>{row.mcp_eta:.3f}</td>"
+                     f"<td><a href=\"{name}\">{name}</a></td></tr>\n")
+        fi.write("</table></body></html>\n")
+
+
+def fit_event_circles(groups):
+    """Circle (x_center, y_center, radius) through the in-time simhits of each group."""
+    if len(groups) == 0:
+        return []
+    hits = [group[group["simhit_t_corrected"] < MAX_TIME_CORRECTED] for group in groups]
+    offsets = np.concatenate([[0], np.cumsum([len(hit) for hit in hits])])
+    hits = pd.concat(hits)
+    x = hits["simhit_r"] * np.cos(hits["simhit_phi"])
+    y = hits["simhit_r"] * np.sin(hits["simhit_phi"])
+    x_center, y_center, radius, _, _ = fit_circles(x, y, offsets)
+    return list(zip(x_center, y_center, radius))
+
+
+def draw_event_display(geo, i_group, group, mcp, circle=None):
+    mask = group["simhit_t_corrected"] < MAX_TIME_CORRECTED
+    if mask.sum() < MIN_HITS_FOR_CIRCLE:
+        raise ValueError("Not enough simhits to make an event display.")
+
+    # get x, y for convenience
+    group = group.assign(
+        simhit_x=group["simhit_r"] * np.cos(group["simhit_phi"]),
+        simhit_y=group["simhit_r"] * np.sin(group["simhit_phi"]),
+    )
+
+    # fit a circle
+    if circle is None:
+        (circle,) = fit_event_circles([group])
+    x_center, y_center, radius = circle
+    thetas = np.linspace(0, 2*np.pi, 360)
+    circle_x = x_center + radius * np.cos(thetas)
+    circle_y = y_center + radius * np.sin(thetas)
+
+    # annotations
+    mc_pt = mcp["mcp_pt"]
+    mc_eta = mcp["mcp_eta"]
+
+    # one plot for IT and one plot for OT
+    fig, axs = plt.subplots(ncols=2, figsize=(16, 8))
+
+    for (ax, tracker) in zip(axs, TRACKERS):
+
+        trackermask = mask & (group["simhit_system"] == tracker)
+        layers = sorted(list(group[trackermask]["simhit_layer"].unique()))
+
+        xlo = group[trackermask]["simhit_x"].min() - PADDING
+        xhi = group[trackermask]["simhit_x"].max() + PADDING
+        ylo = group[trackermask]["simhit_y"].min() - PADDING
+        yhi = group[trackermask]["simhit_y"].max() + PADDING * 1.5
+        modules = geo.query(xlo, xhi, ylo, yhi)
+        print(f"Event display mcparticle {i_group}: found {len(modules)} unique nearby modules")
+        xlims = [xlo, xhi]
+        ylims = [ylo, yhi]
+
+        ax.add_collection(PolyCollection(
+            modules,
+            closed=True,
+            facecolors="none",
+            edgecolors="black",
+            linewidths=0.5,
+            zorder=1,
+        ))
+        ax.plot(
+            circle_x,
+            circle_y,
+            c="red",
+            linestyle="--",
+            linewidth=0.5,
+            zorder=2,
+        )
+        mask_even = trackermask & (group["simhit_layer"] % 2 == 0)
+        mask_odd = trackermask & (group["simhit_layer"] % 2 == 1)
+        ops = dict(facecolors="none", edgecolors="dodgerblue", s=20, zorder=3)
+        ax.scatter(
+            group[mask_even]["simhit_x"],
+            group[mask_even]["simhit_y"],
+            marker="o",
+            label="Even (inner) layers",
+            **ops,
+        )
+        ax.scatter(
+            group[mask_odd]["simhit_x"],
+            group[mask_odd]["simhit_y"],
+            marker="s",
+            label="Odd (outer) layers",
+            **ops,
+        )
+        # ax.legend(loc="upper left")
+        ax.set_xlim(xlims)
+        ax.set_ylim(ylims)
+        ax.set_xlabel("x [mm]")
+        ax.set_ylabel("y [mm]")
+        ax.set_title(f"{TRACKERNAME[tracker]}, MC {i_group}, $p_T$ = {mc_pt:.1f} GeV, eta = {mc_eta:.2f}")
+        ax.minorticks_on()
+        ax.grid(which="both", alpha=0.5)
+        ax.set_axisbelow(True)
+        if len(layers) < N_LAYERS[tracker]:
+            missing_layers = sorted(list(set(range(N_LAYERS[tracker])) - set(layers)))
+            missing_layers = ", ".join([str(ml) for ml in missing_layers])
+            ax.text(0.35, 0.50, f"Missing layers: {missing_layers}", transform=ax.transAxes,
+                    bbox=dict(facecolor="white", edgecolor="black", alpha=0.8))
+
+    fig.subplots_adjust(left=0.07, right=0.97, top=0.95, bottom=0.09)
+    return fig
+
+
+class ModuleIndex:
     """
-    x = np.asarray(x)
-    y = np.asarray(y)
+    Uniform x/y grid over the module corners, built once per geometry.
+    Each module is registered in every cell its bounding box overlaps,
+    and the cell contents are stored CSR-style (offsets into one array).
+    """
+
+    COLUMNS = [f"corner_xy_{i}_{dim}" for i in range(4) for dim in "xy"]
+
+    def __init__(self, geo, cell=GRID_CELL):
+        corners = geo[self.COLUMNS].drop_duplicates().to_numpy(dtype=np.float64)
+        self.corners = corners.reshape(-1, 4, 2)
+        self.cell = cell
+
+        lo = self.corners.min(axis=1)
+        hi = self.corners.max(axis=1)
+        self.origin = lo.min(axis=0)
+        self.shape = ((hi.max(axis=0) - self.origin) // cell).astype(int) + 1
+        ix0, iy0 = self.cell_of(lo).T
+        ix1, iy1 = self.cell_of(hi).T
+
+        # expand every module to the cells it covers
+        nx = ix1 - ix0 + 1
+        n = nx * (iy1 - iy0 + 1)
+        module = np.repeat(np.arange(len(n)), n)
+        k = np.arange(n.sum()) - np.repeat(np.cumsum(n) - n, n)
+        ix = ix0[module] + k % nx[module]
+        iy = iy0[module] + k // nx[module]
+        cells = ix * self.shape[1] + iy
+
+        order = np.argsort(cells, kind="stable")
+        self.modules = module[order]
+        self.offsets = np.searchsorted(cells[order], np.arange(self.shape.prod() + 1))
+
+
+    def __len__(self):
+        return len(self.corners)
+
 
-    # Build the system: [x y 1] [D E F]^T = -(x^2 + y^2)
-    A = np.column_stack([x, y, np.ones_like(x)])
-    b = -(x**2 + y**2)
+    def cell_of(self, xy):
+        return np.clip(((xy - self.origin) // self.cell).astype(int), 0, self.shape - 1)
 
-    D, E, F = np.linalg.lstsq(A, b, rcond=None)[0]
 
-    xc = -D / 2.0
-    yc = -E / 2.0
-    R = np.sqrt((D**2 + E**2) / 4.0 - F)
+    def query(self, xlo, xhi, ylo, yhi):
+        """
+        Return the corners (N x 4 x 2) of modules with at least one corner
+        x in (xlo, xhi) and at least one corner y in (ylo, yhi).
+        """
+        (ix0, iy0), (ix1, iy1) = self.cell_of(np.array([[xlo, ylo], [xhi, yhi]]))
+        rows = np.arange(ix0, ix1 + 1) * self.shape[1]
+        candidates = np.unique(np.concatenate([
+            self.modules[self.offsets[row + iy0] : self.offsets[row + iy1 + 1]]
+            for row in rows
+        ]))
+        corners = self.corners[candidates]
+        x, y = corners[..., 0], corners[..., 1]
+        inside = ((x > xlo) & (x < xhi)).any(axis=1) & ((y > ylo) & (y < yhi)).any(axis=1)
+        return corners[inside]
 
-    return xc, yc, R
\ No newline at end of file
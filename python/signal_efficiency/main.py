@@ -1,11 +1,18 @@
 import argparse
 from glob import glob
+import os
+import sys
 import pandas as pd
 import time
 
-from slcio_to_hits import SlcioToHitsDataFrame
-from event_displays import EventDisplays
-from plot import Plotter
+from slcio_to_hits import SlcioToHitsDataFrame, filter_simhits, join_mcps
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from lazy_parquet import add_filter_arguments, filters_from_options, read_parquet
+from samples import add_sample_arguments, files_from_options
+from slcio_reader import add_cache_arguments, cache_from_options
+from event_displays import EventDisplays, missing_a_layer, pt_range, eta_range, all_of
+from plot import Plotter, summarize_mcps, SUMMARY_HIT_COLUMNS
 
 FNAMES = [
     # v01
@@ -29,33 +36,45 @@ PRINT_GROUPS = 0
 
 def main():
     ops = options()
-    fnames = get_filenames(FNAMES)
+    fnames = files_from_options(ops) or get_filenames(FNAMES)
     geometry = ops.geometry
     parquet = ops.parquet
+    mcp_parquet = ops.mcp_parquet
     pdf = ops.pdf
 
-    # convert slcio files to dataframe
+    # convert slcio files to dataframes
+    filters = filters_from_options(ops, system="simhit_system", layer="simhit_layer", pt="mcp_pt")
+    filtered = any(selection is not None for selection in filters.values())
+    summary_parquet = summary_path(ops.summary_parquet, filters if ops.load_from_parquet else {})
     if ops.load_from_parquet:
-        print(f"Loading data frame from {parquet}...")
-        df = pd.read_parquet(parquet)
-        print(f"Loaded data frame with {len(df)} rows.")
+        if filtered and ops.write_to_parquet:
+            raise ValueError("Do not overwrite the parquet files with a filtered selection")
+        print(f"Loading data frames from {mcp_parquet} and {parquet}...")
+        mcps = read_parquet(mcp_parquet, filters=filters)
+        columns = simhit_columns(ops, summary_parquet, [parquet, mcp_parquet])
+        simhits = read_parquet(parquet, columns=columns, filters=filters)
+        if ops.mcp_pt:
+            simhits = filter_simhits(simhits, mcps)
+        print(f"Loaded data frames with {len(mcps)} mcparticles and {len(simhits)} simhits.")
     else:
-        print(f"Converting {len(fnames)} slcio files to data frame...")
+        print(f"Converting {len(fnames)} slcio files to data frames...")
         converter = SlcioToHitsDataFrame(slcio_file_paths=fnames,
-                                        load_geometry=geometry)
-        df = converter.convert()
+                                        load_geometry=geometry,
+                                        cache=cache_from_options(ops))
+        mcps, simhits = converter.convert()
 
-    # write df to file
+    # write dfs to file
     if ops.write_to_parquet:
-        print(f"Writing data frame to {parquet}...")
-        df.to_parquet(parquet)
+        print(f"Writing data frames to {mcp_parquet} and {parquet}...")
+        mcps.to_parquet(mcp_parquet)
+        simhits.to_parquet(parquet)
 
     # show some info
     group_cols = ["file", "i_event", "i_mcp"]
-    for i_group, (cols, group) in enumerate(df.groupby(group_cols)):
+    for i_group, (cols, group) in enumerate(simhits.groupby(group_cols)):
         if i_group >= PRINT_GROUPS:
             break
-        mask = group["simhit"]
+        group = join_mcps(group, mcps)
         cols = ["i_event",
                 "i_mcp",
                 "mcp_pt",
@@ -78,12 +97,19 @@ def main():
                                "display.width", None,
                                "display.max_colwidth", None,
                             ):
-            print(group[mask][cols].to_string(index=False))
+            print(group[cols].to_string(index=False))
 
     # make event displays
-    if ops.event_displays:
+    if ops.event_displays and ops.display_dir:
+        displays = EventDisplays(mcps, simhits, DISPLAYS)
+        displays.make_event_displays_batch(ops.display_dir,
+                                           select=display_selection(ops),
+                                           max_displays=ops.display_max,
+                                           fmt=ops.display_format,
+                                           processes=ops.display_jobs)
+    elif ops.event_displays:
         print(f"Making event displays to {DISPLAYS}...")
-        displays = EventDisplays(df, DISPLAYS)
+        displays = EventDisplays(mcps, simhits, DISPLAYS)
         displays.make_event_displays()
 
     # show the dataframe
@@ -92,7 +118,17 @@ def main():
     #                       ):
     #     print(df)
 
-    plotter = Plotter(df, pdf)
+    # per-mcparticle summary, cached next to the simhits parquet
+    if ops.load_from_parquet and is_up_to_date(summary_parquet, [parquet, mcp_parquet]):
+        print(f"Loading mcparticle summary from {summary_parquet}...")
+        summary = read_parquet(summary_parquet)
+    else:
+        summary = summarize_mcps(mcps, simhits)
+        if ops.load_from_parquet or ops.write_to_parquet:
+            print(f"Writing mcparticle summary to {summary_parquet}...")
+            summary.to_parquet(summary_parquet)
+
+    plotter = Plotter(mcps, simhits, summary, pdf)
     plotter.plot()
 
 
@@ -102,11 +138,66 @@ def options():
     parser.add_argument("--event-displays", action="store_true", help="Make event displays")
     parser.add_argument("--write-to-parquet", action="store_true", help="Write dataframe to parquet file")
     parser.add_argument("--load-from-parquet", action="store_true", help="Load dataframe from parquet file")
-    parser.add_argument("--parquet", default="detector_efficiency.parquet", help="Parquet file path")
+    parser.add_argument("--parquet", default="detector_efficiency.parquet", help="Parquet file path for simhits")
+    parser.add_argument("--mcp-parquet", default="detector_efficiency_mcps.parquet", help="Parquet file path for mcparticles")
+    parser.add_argument("--summary-parquet", default="detector_efficiency_summary.parquet", help="Parquet file path for the cached per-mcparticle summary")
     parser.add_argument("--pdf", default="detector_efficiency.pdf", help="PDF file path")
+    parser.add_argument("--display-dir", default=None, help="Render event displays in batch mode, one file per mcparticle, into this directory")
+    parser.add_argument("--display-format", default="png", choices=["png", "pdf"], help="File format of batch event displays")
+    parser.add_argument("--display-max", type=int, default=None, help="Maximum number of batch event displays")
+    parser.add_argument("--display-jobs", type=int, default=None, help="Number of processes for batch event displays (None: all cores)")
+    parser.add_argument("--display-missing-layer", action="store_true", help="Only display mcparticles missing a barrel layer")
+    parser.add_argument("--display-pt", type=float, nargs=2, default=None, metavar=("LO", "HI"), help="Only display mcparticles with LO <= pT < HI [GeV]")
+    parser.add_argument("--display-eta", type=float, nargs=2, default=None, metavar=("LO", "HI"), help="Only display mcparticles with LO <= eta < HI")
+    parser.add_argument("--all-columns", action="store_true", help="Load every simhit column from parquet, instead of only those the plots need")
+    add_filter_arguments(parser)
+    add_sample_arguments(parser)
+    add_cache_arguments(parser)
     return parser.parse_args()
 
 
+def summary_path(summary_parquet: str, filters: dict) -> str:
+    """The summary of a filtered selection has its own file, named after the filters"""
+    tags = [
+        f"{column}_" + "_".join(str(value) for value in selection)
+        for column, selection in filters.items()
+        if selection is not None
+    ]
+    base, ext = os.path.splitext(summary_parquet)
+    return ".".join([base] + tags) + ext
+
+
+def is_up_to_date(summary_parquet: str, inputs: list[str]) -> bool:
+    """The cached summary exists and is newer than the parquet files it was made from"""
+    if not os.path.exists(summary_parquet):
+        return False
+    if any(os.path.getmtime(path) > os.path.getmtime(summary_parquet) for path in inputs if os.path.exists(path)):
+        print(f"Mcparticle summary {summary_parquet} is older than {inputs}, recomputing it...")
+        return False
+    return True
+
+
+def simhit_columns(ops, summary_parquet: str, inputs: list[str]) -> list[str] | None:
+    """Simhit columns to load from parquet, or None for all of them."""
+    if ops.all_columns or ops.event_displays or ops.write_to_parquet:
+        return None
+    columns = Plotter.simhit_columns()
+    if not is_up_to_date(summary_parquet, inputs):
+        columns += SUMMARY_HIT_COLUMNS
+    return columns
+
+
+def display_selection(ops):
+    predicates = []
+    if ops.display_missing_layer:
+        predicates.append(missing_a_layer)
+    if ops.display_pt:
+        predicates.append(pt_range(*ops.display_pt))
+    if ops.display_eta:
+        predicates.append(eta_range(*ops.display_eta))
+    return all_of(*predicates)
+
+
 def get_filenames(fnames):
     names = []
     for fname in fnames:
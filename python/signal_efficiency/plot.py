@@ -1,6 +1,9 @@
 import inspect
+import os
+import sys
 import textwrap
 import warnings
+from functools import cached_property
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
@@ -34,7 +37,10 @@ from constants import BARREL_TRACKER_MAX_RADIUS
 from constants import ONE_GEV, ONE_MM
 from constants import INSIDE_BOUNDS, UNDEFINED_BOUNDS, POSSIBLE_BOUNDS
 from constants import MIN_SIMHIT_PT_FRACTION, MAX_TIME, MIN_COSTHETA
-from slcio_to_hits import filter_dataframe
+from slcio_to_hits import filter_mcps, join_mcps, MCP_KEYS
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from lazy_parquet import columns_for
 
 INNER_TRACKER_BARREL = 3
 OUTER_TRACKER_BARREL = 5
@@ -59,6 +65,21 @@ N_MODULES = {
     INNER_TRACKER_BARREL: [15*2, 15*2, 20*2, 20*2, 58*2, 58*2, 62*2, 62*2],
     OUTER_TRACKER_BARREL: [48*2, 48*2, 52*2, 52*2, 80*2, 80*2, 84*2, 84*2],
 }
+# simhit columns of numerator_mask and first_exit_mask
+MASK_COLUMNS = [
+    "simhit_system",
+    "simhit_layer",
+    "simhit_inside_bounds",
+    "simhit_costheta",
+    "simhit_p",
+    "simhit_t_corrected",
+]
+SUMMARY_HIT_COLUMNS = MASK_COLUMNS + [
+    "simhit_layer_div_2",
+    "simhit_layer_mod_2",
+    "simhit_module",
+    "simhit_sensor",
+]
 SYSTEM_ABBREV = {
     INNER_TRACKER_BARREL: "ITB",
     OUTER_TRACKER_BARREL: "OTB",
@@ -67,14 +88,86 @@ SYSTEM_ABBREV = {
 
 class Plotter:
 
-
-    def __init__(self, df: pd.DataFrame, pdf: str):
-        self.df = df
+    # plots made by plot(), in order
+    PLOTS = [
+        "data_format",
+        "efficiency_denominator",
+        "efficiency_numerator",
+        "plot_mcp_pt",
+        # "plot_mcp_eta",
+        # "plot_mcp_phi",
+        # "plot_simhit_time",
+        # "plot_simhit_time_corrected",
+        # # "plot_simhit_distance",
+        # "plot_simhit_xy",
+        # "plot_simhit_rz",
+        # "plot_simhit_p",
+        # "plot_simhit_pt",
+        # "plot_simhit_costheta",
+        # "plot_simhit_costheta_vs_time",
+        # "plot_simhit_p_vs_time",
+        # "plot_simhit_p_vs_costheta",
+        # "plot_layer_efficiency_vs_sim",
+        # "plot_weird_radius_hits",
+        # "plot_doublet_efficiency_vs_sim",
+        # "plot_r_phi_mod",
+        # "plot_doublet_rz",
+        # "plot_doublet_xy",
+        "plot_doublet_xy_vs_pt",
+        "plot_doublet_rzangle_vs_deltaz",
+    ]
+
+    # columns of simhits joined with mcparticles which each method needs
+    DOUBLET_COLUMNS = [
+        "simhit_system",
+        "simhit_layer_div_2",
+        "simhit_layer_mod_2",
+        "simhit_module",
+        "simhit_sensor",
+    ]
+    COLUMNS = {
+        "post_process": ["simhit_system", "simhit_layer", "simhit_phi"],
+        "data_format": ["mcp_pt", "mcp_eta", "mcp_phi", "mcp_pdg", "simhit_system", "simhit_layer", "simhit_module"],
+        "plot_weird_radius_hits": ["simhit_r", "simhit_pathlength"],
+        "plot_mcp_pt": ["mcp_pt"],
+        "plot_mcp_eta": ["mcp_eta"],
+        "plot_mcp_phi": ["mcp_phi"],
+        "plot_simhit_time": ["simhit_t"],
+        "plot_simhit_time_corrected": ["simhit_t_corrected"],
+        "plot_simhit_distance": ["simhit_distance"],
+        "plot_simhit_xy": ["simhit_r", "simhit_phi"],
+        "plot_simhit_rz": ["simhit_r", "simhit_z"],
+        "plot_simhit_p": ["simhit_p", "mcp_p"],
+        "plot_simhit_pt": ["simhit_pt", "mcp_pt"],
+        "plot_simhit_costheta": ["simhit_costheta"],
+        "plot_simhit_costheta_vs_time": ["simhit_costheta", "simhit_t", "simhit_t_corrected"],
+        "plot_simhit_p_vs_time": ["simhit_p", "mcp_p", "simhit_t", "simhit_t_corrected"],
+        "plot_simhit_p_vs_costheta": ["simhit_p", "mcp_p", "simhit_costheta"],
+        "plot_layer_efficiency_vs_sim": MASK_COLUMNS,
+        "plot_r_phi_mod": MASK_COLUMNS + ["simhit_layer_div_2", "simhit_r", "simhit_phi_mod"],
+        "plot_doublet_rz": MASK_COLUMNS + DOUBLET_COLUMNS + ["simhit_r", "simhit_z"],
+        "plot_doublet_xy": MASK_COLUMNS + DOUBLET_COLUMNS + ["simhit_x", "simhit_y"],
+        "plot_doublet_xy_vs_pt": MASK_COLUMNS + DOUBLET_COLUMNS + ["simhit_x", "simhit_y"],
+        "plot_doublet_rzangle_vs_deltaz": MASK_COLUMNS + DOUBLET_COLUMNS + ["simhit_r", "simhit_z"],
+    }
+
+
+    def __init__(self, mcps: pd.DataFrame, simhits: pd.DataFrame, summary: pd.DataFrame, pdf: str):
+        self.mcps = mcps
+        self.simhits = simhits
+        self.summary = summary
         self.pdf = pdf
         self.n_phi_for_modulo = 4
         self.post_process()
 
 
+    @cached_property
+    def hits(self) -> pd.DataFrame:
+        # simhits with their mcp columns attached, joined on first use
+        print("Joining simhits with mcparticles ...")
+        return join_mcps(self.simhits, self.mcps)
+
+
     def post_process(self):
 
         # phi_mod for plotting wrapped-around phi modules
@@ -84,7 +177,7 @@ class Plotter:
                 abbrev = SYSTEM_ABBREV[system]
                 n_modules = N_MODULES[system][layer]
                 period = (2 * np.pi) / (n_modules / self.n_phi_for_modulo)
-                self.df[f"mcp_phi_mod_{abbrev}_{layer}"] = (self.df["mcp_phi"] + 2 * np.pi) % period
+                self.summary[f"mcp_phi_mod_{abbrev}_{layer}"] = (self.summary["mcp_phi"] + 2 * np.pi) % period
 
         # phi_mod for plotting wrapped-around phi modules
         print("Post-processing dataframe: adding simhit_phi_mod ...")
@@ -98,50 +191,34 @@ class Plotter:
         )
         relevant_cols = ["simhit_system", "simhit_layer"]
         n_modules = (
-            self.df[relevant_cols]
+            self.simhits[relevant_cols]
+            .astype(int)
             .merge(lookup, on=relevant_cols, how="left")["n_modules"]
         )
         period = (2 * np.pi) / (n_modules / self.n_phi_for_modulo)
-        self.df[f"simhit_phi_mod"] = (self.df["simhit_phi"] + 2*np.pi) % period
+        self.simhits[f"simhit_phi_mod"] = (self.simhits["simhit_phi"] + 2*np.pi) % period
 
 
     def plot(self):
         print(f"Writing plots to {self.pdf} ...")
         with PdfPages(self.pdf) as pdf:
-            self.data_format(pdf)
-            self.efficiency_denominator(pdf)
-            self.efficiency_numerator(pdf)
-            self.plot_mcp_pt(pdf)
-            # self.plot_mcp_eta(pdf)
-            # self.plot_mcp_phi(pdf)
-            # self.plot_simhit_time(pdf)
-            # self.plot_simhit_time_corrected(pdf)
-            # # self.plot_simhit_distance(pdf)
-            # self.plot_simhit_xy(pdf)
-            # self.plot_simhit_rz(pdf)
-            # self.plot_simhit_p(pdf)
-            # self.plot_simhit_pt(pdf)
-            # self.plot_simhit_costheta(pdf)
-            # self.plot_simhit_costheta_vs_time(pdf)
-            # self.plot_simhit_p_vs_time(pdf)
-            # self.plot_simhit_p_vs_costheta(pdf)
-            # self.plot_layer_efficiency_vs_sim(pdf)
-            # self.plot_weird_radius_hits(pdf)
-            # self.plot_doublet_efficiency_vs_sim(pdf)
-            # self.plot_r_phi_mod(pdf)
-            # self.plot_doublet_rz(pdf)
-            # self.plot_doublet_xy(pdf)
-            self.plot_doublet_xy_vs_pt(pdf)
-            self.plot_doublet_rzangle_vs_deltaz(pdf)
+            for name in self.PLOTS:
+                getattr(self, name)(pdf)
+
+
+    @classmethod
+    def simhit_columns(cls, plots: list[str] = None) -> list[str]:
+        """Simhit columns needed by post_process and the given (default: enabled) plots."""
+        columns = columns_for(cls.COLUMNS, ["post_process"] + list(plots or cls.PLOTS))
+        return MCP_KEYS + [col for col in columns if col.startswith("simhit_")]
 
 
     def data_format(self, pdf: PdfPages):
-        text = "Data format: Pandas DataFrame"
+        text = "Data format: Pandas DataFrame (simhits joined with mcparticles)"
         columns = [
             "file",
             "i_event",
             "i_mcp",
-            "simhit",
             "mcp_pt",
             "mcp_eta",
             "mcp_phi",
@@ -150,11 +227,11 @@ class Plotter:
             "simhit_layer",
             "simhit_module",
         ]
-        dstr = self.df.to_string(
+        dstr = self.hits.to_string(
             columns=columns,
             max_rows=50,
         )
-        cols = "All columns: " + ", ".join([str(col) for col in self.df.columns.tolist()])
+        cols = "All columns: " + ", ".join([str(col) for col in self.hits.columns.tolist()])
         cols = textwrap.fill(cols, width=150)
         fig, ax = plt.subplots(figsize=(8, 8))
         ax.text(-0.12, 0.95, text, ha="left")
@@ -167,7 +244,7 @@ class Plotter:
 
     def efficiency_denominator(self, pdf: PdfPages):
         text = "Efficiency denominator"
-        code = inspect.getsource(filter_dataframe)
+        code = inspect.getsource(filter_mcps)
         code = textwrap.dedent(code)
         texts = [
             f" * Simulated muon gun, $p_T$ 0-10 GeV, $|\\eta| < {BARREL_TRACKER_MAX_ETA}$",
@@ -212,9 +289,8 @@ class Plotter:
             (520.0, 540.0),
         ]:
             mask = (
-                self.df["simhit"].astype(bool) &
-                (self.df["simhit_r"] > r_lo) &
-                (self.df["simhit_r"] < r_hi)
+                (self.hits["simhit_r"] > r_lo) &
+                (self.hits["simhit_r"] < r_hi)
             )
             feats = [
                 "simhit_r",
@@ -230,7 +306,7 @@ class Plotter:
             }
             fig, axs = plt.subplots(figsize=(16, 8), ncols=2)
             for ax, feat in zip(axs, feats):
-                ax.hist(self.df[mask][feat],
+                ax.hist(self.hits[mask][feat],
                         bins=bins[feat],
                         histtype="stepfilled",
                         color="dodgerblue",
@@ -246,10 +322,9 @@ class Plotter:
 
 
     def plot_mcp_pt(self, pdf: PdfPages):
-        mask = ~(self.df["simhit"].astype(bool))
         bins = np.linspace(0, 10, 101)
         fig, ax = plt.subplots(figsize=(8,8))
-        ax.hist(self.df[mask]["mcp_pt"],
+        ax.hist(self.mcps["mcp_pt"],
                 bins=bins,
                 histtype="stepfilled",
                 color="dodgerblue",
@@ -264,10 +339,9 @@ class Plotter:
 
 
     def plot_mcp_eta(self, pdf: PdfPages):
-        mask = ~(self.df["simhit"].astype(bool))
         bins = np.linspace(-0.9, 0.9, 181)
         fig, ax = plt.subplots(figsize=(8,8))
-        ax.hist(self.df[mask]["mcp_eta"],
+        ax.hist(self.mcps["mcp_eta"],
                 bins=bins,
                 histtype="stepfilled",
                 color="dodgerblue",
@@ -282,10 +356,9 @@ class Plotter:
 
 
     def plot_mcp_phi(self, pdf: PdfPages):
-        mask = ~(self.df["simhit"].astype(bool))
         bins = np.linspace(-3.2, 3.2, 161)
         fig, ax = plt.subplots(figsize=(8,8))
-        ax.hist(self.df[mask]["mcp_phi"],
+        ax.hist(self.mcps["mcp_phi"],
                 bins=bins,
                 histtype="stepfilled",
                 color="dodgerblue",
@@ -300,10 +373,9 @@ class Plotter:
 
 
     def plot_simhit_time(self, pdf: PdfPages):
-        mask = self.df["simhit"].astype(bool)
         bins = np.linspace(0, 40, 201)
         fig, ax = plt.subplots(figsize=(8,8))
-        ax.hist(self.df[mask]["simhit_t"],
+        ax.hist(self.hits["simhit_t"],
                 bins=bins,
                 histtype="stepfilled",
                 color="dodgerblue",
@@ -320,10 +392,9 @@ class Plotter:
 
 
     def plot_simhit_time_corrected(self, pdf: PdfPages):
-        mask = self.df["simhit"].astype(bool)
         bins = np.linspace(0, 40, 201)
         fig, ax = plt.subplots(figsize=(8,8))
-        ax.hist(self.df[mask]["simhit_t_corrected"],
+        ax.hist(self.hits["simhit_t_corrected"],
                 bins=bins,
                 histtype="stepfilled",
                 color="dodgerblue",
@@ -343,10 +414,9 @@ class Plotter:
 
 
     def plot_simhit_distance(self, pdf: PdfPages):
-        mask = self.df["simhit"].astype(bool)
         bins = np.linspace(-300, 300, 301)
         fig, ax = plt.subplots(figsize=(8,8))
-        ax.hist(self.df[mask]["simhit_distance"],
+        ax.hist(self.hits["simhit_distance"],
                 bins=bins,
                 histtype="stepfilled",
                 color="dodgerblue",
@@ -362,15 +432,14 @@ class Plotter:
 
 
     def plot_simhit_xy(self, pdf: PdfPages):
-        mask = self.df["simhit"].astype(bool)
         bins = [
             np.linspace(-1500, 1500, 451),
             np.linspace(-1500, 1500, 451),
         ]
         fig, ax = plt.subplots(figsize=(8,8))
         _, _, _, im = ax.hist2d(
-            self.df[mask]["simhit_r"] * np.cos(self.df[mask]["simhit_phi"]),
-            self.df[mask]["simhit_r"] * np.sin(self.df[mask]["simhit_phi"]),
+            self.hits["simhit_r"] * np.cos(self.hits["simhit_phi"]),
+            self.hits["simhit_r"] * np.sin(self.hits["simhit_phi"]),
             bins=bins,
             cmap="gist_rainbow",
             cmin=0.5,
@@ -384,15 +453,14 @@ class Plotter:
 
 
     def plot_simhit_rz(self, pdf: PdfPages):
-        mask = self.df["simhit"].astype(bool)
         bins = [
             np.linspace(-2000, 2000, 401),
             np.linspace(0, 1500, 451),
         ]
         fig, ax = plt.subplots(figsize=(8,8))
         _, _, _, im = ax.hist2d(
-            self.df[mask]["simhit_z"],
-            self.df[mask]["simhit_r"],
+            self.hits["simhit_z"],
+            self.hits["simhit_r"],
             bins=bins,
             cmap="gist_rainbow",
             cmin=0.5,
@@ -407,10 +475,9 @@ class Plotter:
 
     def plot_simhit_p(self, pdf: PdfPages):
         print("Plotting sim hit p / mcp p...")
-        mask = self.df["simhit"].astype(bool)
         bins = np.linspace(-0.05, 1.05, 111)
         fig, ax = plt.subplots(figsize=(8,8))
-        ax.hist(self.df[mask]["simhit_p"] / self.df[mask]["mcp_p"],
+        ax.hist(self.hits["simhit_p"] / self.hits["mcp_p"],
                 bins=bins,
                 histtype="stepfilled",
                 color="dodgerblue",
@@ -426,10 +493,9 @@ class Plotter:
 
     def plot_simhit_pt(self, pdf: PdfPages):
         print("Plotting sim hit pt / mcp pt...")
-        mask = self.df["simhit"].astype(bool)
         bins = np.linspace(-0.05, 1.05, 111)
         fig, ax = plt.subplots(figsize=(8,8))
-        ax.hist(self.df[mask]["simhit_pt"] / self.df[mask]["mcp_pt"],
+        ax.hist(self.hits["simhit_pt"] / self.hits["mcp_pt"],
                 bins=bins,
                 histtype="stepfilled",
                 color="dodgerblue",
@@ -445,10 +511,9 @@ class Plotter:
 
     def plot_simhit_costheta(self, pdf: PdfPages):
         print("Plotting sim hit costheta ...")
-        mask = self.df["simhit"].astype(bool)
         bins = np.linspace(-1, 1, 101)
         fig, ax = plt.subplots(figsize=(8,8))
-        ax.hist(self.df[mask]["simhit_costheta"],
+        ax.hist(self.hits["simhit_costheta"],
                 bins=bins,
                 histtype="stepfilled",
                 color="dodgerblue",
@@ -464,7 +529,6 @@ class Plotter:
 
     def plot_simhit_costheta_vs_time(self, pdf: PdfPages):
         print("Plotting sim hit costheta vs time ...")
-        mask = self.df["simhit"].astype(bool)
         bins = [
             np.linspace(0, 40, 121),
             np.linspace(-1.05, 1.05, 111),
@@ -472,8 +536,8 @@ class Plotter:
         for simhit_t in ["simhit_t", "simhit_t_corrected"]:
             fig, ax = plt.subplots(figsize=(8,8))
             _, _, _, im = ax.hist2d(
-                self.df[mask][simhit_t],
-                self.df[mask]["simhit_costheta"],
+                self.hits[simhit_t],
+                self.hits["simhit_costheta"],
                 bins=bins,
                 cmap="gist_rainbow",
                 cmin=0.5,
@@ -490,7 +554,6 @@ class Plotter:
 
     def plot_simhit_p_vs_time(self, pdf: PdfPages):
         print("Plotting sim hit p vs time ...")
-        mask = self.df["simhit"].astype(bool)
         bins = [
             np.linspace(0, 40, 121),
             np.linspace(-0.05, 1.05, 111),
@@ -498,8 +561,8 @@ class Plotter:
         for simhit_t in ["simhit_t", "simhit_t_corrected"]:
             fig, ax = plt.subplots(figsize=(8,8))
             _, _, _, im = ax.hist2d(
-                self.df[mask][simhit_t],
-                self.df[mask]["simhit_p"] / self.df[mask]["mcp_p"],
+                self.hits[simhit_t],
+                self.hits["simhit_p"] / self.hits["mcp_p"],
                 bins=bins,
                 cmap="gist_rainbow",
                 cmin=0.5,
@@ -516,15 +579,14 @@ class Plotter:
 
     def plot_simhit_p_vs_costheta(self, pdf: PdfPages):
         print("Plotting sim hit p vs costheta ...")
-        mask = self.df["simhit"].astype(bool)
         bins = [
             np.linspace(-1.05, 1.05, 111),
             np.linspace(-0.05, 1.05, 111),
         ]
         fig, ax = plt.subplots(figsize=(8,8))
         _, _, _, im = ax.hist2d(
-            self.df[mask]["simhit_costheta"],
-            self.df[mask]["simhit_p"] / self.df[mask]["mcp_p"],
+            self.hits["simhit_costheta"],
+            self.hits["simhit_p"] / self.hits["mcp_p"],
             bins=bins,
             cmap="gist_rainbow",
             cmin=0.5,
@@ -559,15 +621,15 @@ class Plotter:
         }
 
         # mask for first exit / arc / path
-        first_exit = first_exit_mask(self.df)
+        first_exit = first_exit_mask(self.hits)
 
         # 1d plots showing cut values
-        mask = numerator_mask(self.df, SYSTEMS, LAYERS) & first_exit
+        mask = numerator_mask(self.hits, SYSTEMS, LAYERS) & first_exit
         fig, ax = plt.subplots(figsize=(8,8), ncols=2, nrows=2)
-        ax[0, 0].hist(self.df[mask]["simhit_t_corrected"], bins=np.linspace(0, 10, 101))
-        ax[0, 1].hist(self.df[mask]["simhit_costheta"], bins=np.linspace(-1, 1, 101))
-        ax[1, 0].hist(self.df[mask]["simhit_p"] / self.df[mask]["mcp_p"], bins=np.linspace(0, 1, 101))
-        ax[1, 1].hist(self.df[mask]["simhit_inside_bounds"], bins=np.linspace(min(POSSIBLE_BOUNDS) - 0.5,
+        ax[0, 0].hist(self.hits[mask]["simhit_t_corrected"], bins=np.linspace(0, 10, 101))
+        ax[0, 1].hist(self.hits[mask]["simhit_costheta"], bins=np.linspace(-1, 1, 101))
+        ax[1, 0].hist(self.hits[mask]["simhit_p"] / self.hits[mask]["mcp_p"], bins=np.linspace(0, 1, 101))
+        ax[1, 1].hist(self.hits[mask]["simhit_inside_bounds"], bins=np.linspace(min(POSSIBLE_BOUNDS) - 0.5,
                                                                               max(POSSIBLE_BOUNDS) + 0.5,
                                                                               len(POSSIBLE_BOUNDS) + 1))
         ax[0, 0].set_ylabel("Counts")
@@ -593,9 +655,8 @@ class Plotter:
         plt.close()
 
         # denominator of efficiency
-        mask_denom = ~(self.df["simhit"].astype(bool))
-        df_denom = self.df[mask_denom]
-        if df_denom.duplicated().any():
+        df_denom = self.summary
+        if df_denom.duplicated(subset=MCP_KEYS).any():
             warnings.warn("Warning: duplicates found in denominator dataframe!")
 
         for kinematic in [
@@ -607,29 +668,23 @@ class Plotter:
         ]:
 
             print(f"Plotting sim hit efficiency vs {kinematic}...")
+            is2d = isinstance(kinematic, tuple) and len(kinematic) == 2
+
+            # bin each mcparticle once, then count per layer
+            idx, shape = bin_indices(df_denom, kinematic, bins[kinematic])
+            counts_denom = bincount(idx, shape)
+
             for system in SYSTEMS:
 
+                layers_hit = df_denom[f"layers_{SYSTEM_ABBREV[system]}"].to_numpy()
+
                 for layer in LAYERS:
 
-                    # nb: dont double-count if >1 hits on a layer
-                    mask_numer = numerator_mask(self.df, [system], [layer]) & first_exit
-                    subset = ["file", "i_event", "i_mcp", "simhit_system", "simhit_layer"]
-                    df_numer = self.df[mask_numer].drop_duplicates(subset=subset)
-
-                    is2d = isinstance(kinematic, tuple) and len(kinematic) == 2
+                    # nb: the bitmask doesnt double-count if >1 hits on a layer
+                    counts_numer = bincount(idx, shape, weights=(layers_hit >> layer) & 1)
 
                     # calculate efficiency
                     if is2d:
-                        counts_denom, _, _ = np.histogram2d(
-                            df_denom[kinematic[0]],
-                            df_denom[kinematic[1]],
-                            bins=bins[kinematic],
-                        )
-                        counts_numer, _, _ = np.histogram2d(
-                            df_numer[kinematic[0]],
-                            df_numer[kinematic[1]],
-                            bins=bins[kinematic],
-                        )
                         efficiency = np.divide(
                             counts_numer,
                             counts_denom,
@@ -655,8 +710,6 @@ class Plotter:
                         plt.close()
 
                     else:
-                        counts_denom, _ = np.histogram(df_denom[kinematic], bins=bins[kinematic])
-                        counts_numer, _ = np.histogram(df_numer[kinematic], bins=bins[kinematic])
                         efficiency = np.divide(
                             counts_numer,
                             counts_denom,
@@ -686,7 +739,7 @@ class Plotter:
 
     def plot_r_phi_mod(self, pdf: PdfPages):
 
-        first_exit = first_exit_mask(self.df)
+        first_exit = first_exit_mask(self.hits)
 
         for system in SYSTEMS:
 
@@ -702,16 +755,15 @@ class Plotter:
 
                 print("Plotting sim hit rphi when modding ...")
                 layer_mask = (
-                    (self.df["simhit"].astype(bool)) &
-                    (self.df["simhit_inside_bounds"].isin([INSIDE_BOUNDS, UNDEFINED_BOUNDS])) &
-                    (self.df["simhit_system"] == system) &
-                    (self.df["simhit_layer_div_2"].isin([dl // 2 for dl in double_layers]))
+                    (self.hits["simhit_inside_bounds"].isin([INSIDE_BOUNDS, UNDEFINED_BOUNDS])) &
+                    (self.hits["simhit_system"] == system) &
+                    (self.hits["simhit_layer_div_2"].isin([dl // 2 for dl in double_layers]))
                 )
                 mask = layer_mask & first_exit
                 fig, ax = plt.subplots(figsize=(8, 8))
                 _, _, _, im = ax.hist2d(
-                    self.df[mask][f"simhit_phi_mod"],
-                    self.df[mask][f"simhit_r"],
+                    self.hits[mask][f"simhit_phi_mod"],
+                    self.hits[mask][f"simhit_r"],
                     bins=[200, 200],
                     cmap="gist_rainbow",
                     cmin=0.5,
@@ -761,13 +813,9 @@ class Plotter:
                 bins[ ("mcp_eta", expectation) ] = [np.linspace(-0.7, 0.7, 281), the_bins]
                 xlabel[expectation] = f"Simulated phi mod {phi_interval:.4f} [rad]"
 
-        # mask for first exit / arc / path
-        first_exit = first_exit_mask(self.df)
-
         # denominator of efficiency
-        mask_denom = ~(self.df["simhit"].astype(bool))
-        df_denom = self.df[mask_denom]
-        if df_denom.duplicated().any():
+        df_denom = self.summary
+        if df_denom.duplicated(subset=MCP_KEYS).any():
             warnings.warn("Warning: duplicates found in denominator dataframe!")
 
         debug = False
@@ -820,67 +868,17 @@ class Plotter:
                     # announcement
                     print(f"Plotting sim hit doublet efficiency vs {kinematic} for system={system} double_layers={double_layers} ...")
 
-                    # numerator
-                    mask_numer = numerator_mask(self.df, [system], double_layers) & first_exit
+                    # numerator: mcparticles with at least one valid doublet in this double layer
+                    doublelayers_hit = df_denom[f"doublelayers_{abbrev}"].to_numpy()
+                    passed = (doublelayers_hit >> (double_layers[0] // 2)) & 1
 
-                    # calculate doublet efficiency
-                    # this is a lot of vectorized algebra
-                    two_layers = 2
-                    doublet_cols = [
-                        "file",
-                        "i_event", # the event
-                        "i_mcp", # the MC particle
-                        "simhit_system", # the system (IT, OT)
-                        "simhit_layer_div_2", # the double layer
-                        "simhit_module", # the phi-module
-                        "simhit_sensor", # the z-sensor
-                    ]
-                    doublet_groups = self.df[mask_numer].groupby(doublet_cols)
-                    valid_doublets = doublet_groups["simhit_layer"].nunique().ge(two_layers).reset_index(name="valid_doublet")
-
-                    # determine if there is at least one valid doublet per group
-                    doublet_layer_cols = [
-                        "file",
-                        "i_event",
-                        "i_mcp",
-                        "simhit_system",
-                        "simhit_layer_div_2",
-                    ]
-                    at_least_one_doublet = (
-                        valid_doublets
-                        .groupby(doublet_layer_cols)["valid_doublet"]
-                        .any()
-                        .reset_index(name="at_least_one_doublet")
-                    )
-
-                    # get kinematic info of the first row in doublet
-                    mcp_kin = (
-                        self.df[mask_numer]
-                        .groupby(doublet_layer_cols)[kinematic if not is2d else list(kinematic)]
-                        .first()
-                        .reset_index()
-                    )
-
-                    # merge kinematic info
-                    at_least_one_doublet = at_least_one_doublet.merge(
-                        mcp_kin,
-                        on=doublet_layer_cols,
-                        how="left",
-                    )
-                    df_numer = at_least_one_doublet[at_least_one_doublet["at_least_one_doublet"].astype(bool)]
+                    # bin each mcparticle and count
+                    idx, shape = bin_indices(df_denom, kinematic, bins[kinematic])
+                    counts_denom = bincount(idx, shape)
+                    counts_numer = bincount(idx, shape, weights=passed)
 
                     # calculate efficiency
                     if is2d:
-                        counts_denom, _, _ = np.histogram2d(
-                            df_denom[kinematic[0]],
-                            df_denom[kinematic[1]],
-                            bins=bins[kinematic],
-                        )
-                        counts_numer, _, _ = np.histogram2d(
-                            df_numer[kinematic[0]],
-                            df_numer[kinematic[1]],
-                            bins=bins[kinematic],
-                        )
                         efficiency = np.divide(
                             counts_numer,
                             counts_denom,
@@ -908,8 +906,6 @@ class Plotter:
                     else:
 
                         # efficiency plots
-                        counts_denom, _ = np.histogram(df_denom[kinematic], bins=bins[kinematic])
-                        counts_numer, _ = np.histogram(df_numer[kinematic], bins=bins[kinematic])
                         efficiency = np.divide(
                             counts_numer,
                             counts_denom,
@@ -966,7 +962,7 @@ class Plotter:
         }
 
         # mask for first exit / arc / path
-        first_exit = first_exit_mask(self.df)
+        first_exit = first_exit_mask(self.hits)
 
         for semilogy in [False, True]:
 
@@ -980,7 +976,7 @@ class Plotter:
                 ]:
 
                     print(f"Plotting sim hit delta z for system={system} double_layers={double_layers} ...")
-                    mask = numerator_mask(self.df, [system], double_layers) & first_exit
+                    mask = numerator_mask(self.hits, [system], double_layers) & first_exit
 
                     # this is a lot of vectorized algebra
                     doublet_cols = [
@@ -994,7 +990,7 @@ class Plotter:
                     ]
 
                     # calculating dz
-                    df = self.df[mask].copy()
+                    df = self.hits[mask].copy()
                     lower_cols = doublet_cols + ["simhit_r_lower", "simhit_z_lower"]
                     upper_cols = doublet_cols + ["simhit_r_upper", "simhit_z_upper"]
                     lower = (df[df["simhit_layer_mod_2"] == 0]
@@ -1063,7 +1059,7 @@ class Plotter:
         }
 
         # mask for first exit / arc / path
-        first_exit = first_exit_mask(self.df)
+        first_exit = first_exit_mask(self.hits)
 
         for semilogy in [False, True]:
 
@@ -1077,7 +1073,7 @@ class Plotter:
                 ]:
 
                     print(f"Plotting sim hit delta phi for system={system} double_layers={double_layers} ...")
-                    mask = numerator_mask(self.df, [system], double_layers) & first_exit
+                    mask = numerator_mask(self.hits, [system], double_layers) & first_exit
 
                     # this is a lot of vectorized algebra
                     doublet_cols = [
@@ -1091,7 +1087,7 @@ class Plotter:
                     ]
 
                     # calculating dphi (phi local minus phi global)
-                    df = self.df[mask].copy()
+                    df = self.hits[mask].copy()
                     lower_cols = doublet_cols + ["simhit_x_lower", "simhit_y_lower"]
                     upper_cols = doublet_cols + ["simhit_x_upper", "simhit_y_upper"]
                     lower = (df[df["simhit_layer_mod_2"] == 0]
@@ -1151,7 +1147,7 @@ class Plotter:
     def plot_doublet_xy_vs_pt(self, pdf: PdfPages):
 
         # mask for first exit / arc / path
-        first_exit = first_exit_mask(self.df)
+        first_exit = first_exit_mask(self.hits)
 
         bins = [
             np.linspace(0, 10, 201),  # pt bins
@@ -1170,7 +1166,7 @@ class Plotter:
                 ]:
 
                     print(f"Plotting sim hit delta phi vs pt for system={system} double_layers={double_layers} ...")
-                    mask = numerator_mask(self.df, [system], double_layers) & first_exit
+                    mask = numerator_mask(self.hits, [system], double_layers) & first_exit
 
                     # this is a lot of vectorized algebra
                     doublet_cols = [
@@ -1185,7 +1181,7 @@ class Plotter:
                     ]
 
                     # calculating dphi (phi local minus phi global)
-                    df = self.df[mask].copy()
+                    df = self.hits[mask].copy()
                     lower_cols = doublet_cols + ["simhit_x_lower", "simhit_y_lower"]
                     upper_cols = doublet_cols + ["simhit_x_upper", "simhit_y_upper"]
                     lower = (df[df["simhit_layer_mod_2"] == 0]
@@ -1224,7 +1220,7 @@ class Plotter:
     def plot_doublet_rzangle_vs_deltaz(self, pdf: PdfPages):
 
         # mask for first exit / arc / path
-        first_exit = first_exit_mask(self.df)
+        first_exit = first_exit_mask(self.hits)
 
         bins = {
             INNER_TRACKER_BARREL: {
@@ -1253,7 +1249,7 @@ class Plotter:
                 ]:
 
                     print(f"Plotting sim hit delta theta vs delta z for system={system} double_layers={double_layers} ...")
-                    mask = numerator_mask(self.df, [system], double_layers) & first_exit
+                    mask = numerator_mask(self.hits, [system], double_layers) & first_exit
 
                     # this is a lot of vectorized algebra
                     doublet_cols = [
@@ -1267,7 +1263,7 @@ class Plotter:
                     ]
 
                     # calculating dtheta (theta local minus theta global)
-                    df = self.df[mask].copy()
+                    df = self.hits[mask].copy()
                     lower_cols = doublet_cols + ["simhit_z_lower", "simhit_r_lower"]
                     upper_cols = doublet_cols + ["simhit_z_upper", "simhit_r_upper"]
                     lower = (df[df["simhit_layer_mod_2"] == 0]
@@ -1313,7 +1309,6 @@ def numerator_mask(
 ) -> pd.Series:
     return (
         (df["i_mcp"] >= 0) &
-        (df["simhit"].astype(bool)) &
         (df["simhit_system"].isin(systems)) &
         (df["simhit_layer"].isin(layers)) &
         (df["simhit_inside_bounds"].isin([INSIDE_BOUNDS,
@@ -1329,6 +1324,84 @@ def first_exit_mask(df: pd.DataFrame) -> pd.Series:
     )
 
 
+def summarize_mcps(mcps: pd.DataFrame, simhits: pd.DataFrame) -> pd.DataFrame:
+    """
+    One row per mcparticle with its kinematics and, per system, two bitmasks:
+      layers_{ITB,OTB}: bit i is set if layer i has a first-exit numerator hit
+      doublelayers_{ITB,OTB}: bit i is set if double layer i has a valid doublet,
+        i.e. first-exit numerator hits on both layers of the same module and sensor
+    """
+    print("Summarizing mcparticles ...")
+    kinematic_cols = [col for col in mcps.columns if col.startswith("mcp_")]
+    summary = mcps[MCP_KEYS + kinematic_cols].reset_index(drop=True)
+    summary["i_row"] = np.arange(len(summary), dtype=np.int64)
+
+    # attach only what the masks need
+    hits = simhits[MCP_KEYS + SUMMARY_HIT_COLUMNS].merge(summary[MCP_KEYS + ["i_row", "mcp_p"]], on=MCP_KEYS, how="inner")
+    hits = hits[numerator_mask(hits, SYSTEMS, LAYERS) & first_exit_mask(hits)]
+
+    for system in SYSTEMS:
+        abbrev = SYSTEM_ABBREV[system]
+        sys_hits = hits[hits["simhit_system"] == system]
+
+        # layers
+        layers = np.zeros(len(summary), dtype=np.uint8)
+        np.bitwise_or.at(layers,
+                         sys_hits["i_row"].to_numpy(),
+                         np.left_shift(1, sys_hits["simhit_layer"].to_numpy()).astype(np.uint8))
+        summary[f"layers_{abbrev}"] = layers
+
+        # double layers: both parities present on one (module, sensor)
+        doublet_cols = ["i_row", "simhit_layer_div_2", "simhit_module", "simhit_sensor"]
+        parities = sys_hits.drop_duplicates(subset=doublet_cols + ["simhit_layer_mod_2"])
+        n_parities = parities.groupby(doublet_cols).size()
+        valid = n_parities[n_parities >= 2].reset_index()
+        doublelayers = np.zeros(len(summary), dtype=np.uint8)
+        np.bitwise_or.at(doublelayers,
+                         valid["i_row"].to_numpy(),
+                         np.left_shift(1, valid["simhit_layer_div_2"].to_numpy()).astype(np.uint8))
+        summary[f"doublelayers_{abbrev}"] = doublelayers
+
+    return summary.drop(columns=["i_row"])
+
+
+def bin_indices(
+    df: pd.DataFrame,
+    kinematic: str | tuple[str, str],
+    bins: np.ndarray | list[np.ndarray],
+) -> tuple[np.ndarray, tuple[int, ...]]:
+    """
+    Flattened histogram bin index for each row (-1 if out of range),
+    matching np.histogram/np.histogram2d conventions for the last edge.
+    """
+    kinematics = list(kinematic) if isinstance(kinematic, tuple) else [kinematic]
+    edges_list = list(bins) if isinstance(kinematic, tuple) else [bins]
+    flat = np.zeros(len(df), dtype=np.int64)
+    ok = np.ones(len(df), dtype=bool)
+    shape = []
+    for kin, edges in zip(kinematics, edges_list):
+        values = df[kin].to_numpy()
+        n_bins = len(edges) - 1
+        idx = np.searchsorted(edges, values, side="right") - 1
+        idx[values == edges[-1]] = n_bins - 1
+        ok &= (idx >= 0) & (idx < n_bins)
+        flat = flat * n_bins + idx
+        shape.append(n_bins)
+    flat[~ok] = -1
+    return flat, tuple(shape)
+
+
+def bincount(
+    idx: np.ndarray,
+    shape: tuple[int, ...],
+    weights: np.ndarray | None = None,
+) -> np.ndarray:
+    ok = idx >= 0
+    weights = None if weights is None else np.asarray(weights)[ok]
+    counts = np.bincount(idx[ok], weights=weights, minlength=int(np.prod(shape)))
+    return counts.astype(float).reshape(shape)
+
+
 def get_boundaries(kinematic: str, systems: list[int], layers: list[int]) -> np.ndarray:
     if kinematic == "mcp_eta":
         return get_eta_boundaries(systems, layers)
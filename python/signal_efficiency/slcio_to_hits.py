@@ -1,4 +1,5 @@
 import os
+import sys
 import numpy as np
 import pandas as pd
 import multiprocessing as mp
@@ -8,6 +9,11 @@ from constants import BARREL_TRACKER_MAX_RADIUS
 from constants import ONE_GEV, ONE_MM
 from constants import OUTSIDE_BOUNDS, INSIDE_BOUNDS, UNDEFINED_BOUNDS
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from cellid import FIELDS, codec_from_collection, get_codec
+from hitcache import HitCache
+from slcio_reader import convert_cached
+
 _detector = None
 _surfman = None
 _maps = None
@@ -23,6 +29,26 @@ COLLECTIONS = [
     "OuterTrackerBarrelCollection",
 ]
 PARTICLES_OF_INTEREST = [MUON]
+MCP_KEYS = ["file", "i_event", "i_mcp"]
+# bump when the conversion changes, to invalidate the cached tables
+CACHE_VERSION = 1
+CACHE_TABLES = ["mcps", "simhits"]
+
+# dtypes of the raw tables, for files without any mcparticle or simhit of interest
+MCP_DTYPES = {
+    **{key: np.int64 for key in MCP_KEYS},
+    **{col: np.float64 for col in ["mcp_px", "mcp_py", "mcp_pz", "mcp_m", "mcp_q"]},
+    "mcp_pdg": np.int64,
+    **{f"mcp_{point}_{axis}": np.float64 for point in ["vertex", "endpoint"] for axis in "xyz"},
+}
+SIMHIT_DTYPES = {
+    **{key: np.int64 for key in MCP_KEYS},
+    **{f"simhit_{col}": np.float64 for col in ["x", "y", "z", "px", "py", "pz", "e", "t"]},
+    "simhit_cellid0": np.int64,
+    "simhit_pathlength": np.float64,
+    "simhit_inside_bounds": np.int64,
+    "simhit_distance": np.float64,
+}
 print("BARREL_TRACKER_MAX_ETA", BARREL_TRACKER_MAX_ETA)
 
 MM_TO_CM = 0.1
@@ -34,36 +60,57 @@ XML = f"{CODE}/k4geo/MuColl/MAIA/compact/MAIA_v0/MAIA_v0.xml"
 
 class SlcioToHitsDataFrame:
 
+    #
+    # The output is normalized into two tables:
+    #  mcps: one row per MCParticle of interest
+    #  simhits: one row per simhit, referencing its MCParticle by (file, i_event, i_mcp)
+    # The file is stored as an integer ID. The file names live in mcps["file_name"] as a categorical.
+    #
+
     def __init__(
             self,
             slcio_file_paths: list[str],
             load_geometry: bool,
+            cache: HitCache = None,
         ):
         self.slcio_file_paths = slcio_file_paths
         self.load_geometry = load_geometry
+        self.cache = cache
 
 
-    def convert(self) -> pd.DataFrame:
-        df = self.convert_all_files()
-        df = filter_dataframe(df)
-        df = sort_dataframe(df)
-        return df
+    def convert(self) -> tuple[pd.DataFrame, pd.DataFrame]:
+        mcps, simhits = self.convert_all_files()
+        mcps = filter_mcps(mcps)
+        simhits = filter_simhits(simhits, mcps)
+        mcps = sort_mcps(mcps)
+        simhits = sort_simhits(simhits)
+        return mcps, simhits
 
 
-    def convert_all_files(self) -> pd.DataFrame:
+    def convert_all_files(self) -> tuple[pd.DataFrame, pd.DataFrame]:
         print(f"Converting {len(self.slcio_file_paths)} slcio files to a DataFrame ...")
         init_function = init_worker if self.load_geometry else init_dummy
         with mp.Pool(initializer=init_function) as pool:
             n_map = len(self.slcio_file_paths)
+            file_numbers = list(range(n_map))
             load_geometry = [self.load_geometry]*n_map
-            all_hits_dfs = pool.starmap(
-                convert_one_file,
+            cache = [self.cache]*n_map
+            results = pool.starmap(
+                convert_cached_file,
                 zip(self.slcio_file_paths,
+                    file_numbers,
                     load_geometry,
+                    cache,
                 )
             )
+        if self.cache is not None:
+            self.cache.evict(keep={path for (tables, paths) in results for path in paths})
         print("Merging DataFrames ...")
-        return pd.concat(all_hits_dfs, ignore_index=True)
+        mcps = pd.concat([tables["mcps"] for (tables, paths) in results], ignore_index=True)
+        simhits = pd.concat([tables["simhits"] for (tables, paths) in results], ignore_index=True)
+        file_names = [os.path.basename(path) for path in self.slcio_file_paths]
+        mcps["file_name"] = pd.Categorical.from_codes(mcps["file"], categories=file_names)
+        return mcps, simhits
 
 
 def init_dummy():
@@ -83,10 +130,31 @@ def init_worker():
     _maps = {name: _surfman.map(det.name()) for name, det in dets.items()}
 
 
+def convert_cached_file(
+        slcio_file_path: str,
+        file_number: int,
+        load_geometry: bool,
+        cache: HitCache,
+    ) -> tuple[dict[str, pd.DataFrame], list[str]]:
+    # cached per file, keyed by the geometry and the fallback CellID encoding
+    kwargs = {
+        "load_geometry": load_geometry,
+        "xml": XML if load_geometry else None,
+        "encoding": get_codec().encoding,
+    }
+
+    def convert():
+        return dict(zip(CACHE_TABLES, convert_one_file(slcio_file_path, file_number, load_geometry)))
+
+    return convert_cached(slcio_file_path, convert, cache, "signal_efficiency_hits", version=CACHE_VERSION,
+                          tables=CACHE_TABLES, kwargs=kwargs, file=file_number)
+
+
 def convert_one_file(
         slcio_file_path: str,
+        file_number: int,
         load_geometry: bool,
-    ) -> pd.DataFrame:
+    ) -> tuple[pd.DataFrame, pd.DataFrame]:
 
     # import here to avoid:
     #  - unnecessary imports if not used
@@ -100,62 +168,47 @@ def convert_one_file(
     reader = pyLCIO.IOIMPL.LCFactory.getInstance().createLCReader()
     reader.open(slcio_file_path)
 
-    # list for holding all hits
-    rows = []
+    # lists for holding all mcparticles and hits
+    mcps = []
+    simhits = []
+    codec = get_codec()
 
     # loop over all events in the slcio file
     for i_event, event in enumerate(reader):
 
         # inspect mcparticles
         mcparticles = list(event.getCollection(MCPARTICLE))
-        mcp_px = [mcp.getMomentum()[0] for mcp in mcparticles]
-        mcp_py = [mcp.getMomentum()[1] for mcp in mcparticles]
-        mcp_pz = [mcp.getMomentum()[2] for mcp in mcparticles]
-        mcp_m = [mcp.getMass() for mcp in mcparticles]
-        mcp_q = [mcp.getCharge() for mcp in mcparticles]
         mcp_pdg = [mcp.getPDG() for mcp in mcparticles]
-        mcp_vertex_x = [mcp.getVertex()[0] for mcp in mcparticles]
-        mcp_vertex_y = [mcp.getVertex()[1] for mcp in mcparticles]
-        mcp_vertex_z = [mcp.getVertex()[2] for mcp in mcparticles]
-        mcp_endpoint_x = [mcp.getEndpoint()[0] for mcp in mcparticles]
-        mcp_endpoint_y = [mcp.getEndpoint()[1] for mcp in mcparticles]
-        mcp_endpoint_z = [mcp.getEndpoint()[2] for mcp in mcparticles]
-        for i_mcp in range(len(mcparticles)):
+        for i_mcp, mcp in enumerate(mcparticles):
             # big speedup by skipping unwanted particles early
             if abs(mcp_pdg[i_mcp]) not in PARTICLES_OF_INTEREST:
                 continue
-            rows.append({
-                'simhit': False,
-                'file': os.path.basename(slcio_file_path),
+            momentum = mcp.getMomentum()
+            vertex = mcp.getVertex()
+            endpoint = mcp.getEndpoint()
+            mcps.append({
+                'file': file_number,
                 'i_event': i_event,
-                'simhit_x': 0,
-                'simhit_y': 0,
-                'simhit_z': 0,
-                'simhit_e': 0,
-                'simhit_t': 0,
-                'simhit_cellid0': 0,
-                'simhit_pathlength': 0,
-                'simhit_inside_bounds': UNDEFINED_BOUNDS,
-                'simhit_distance': 0,
                 'i_mcp': i_mcp,
-                'mcp_px': mcp_px[i_mcp],
-                'mcp_py': mcp_py[i_mcp],
-                'mcp_pz': mcp_pz[i_mcp],
-                'mcp_m': mcp_m[i_mcp],
-                'mcp_q': mcp_q[i_mcp],
+                'mcp_px': momentum[0],
+                'mcp_py': momentum[1],
+                'mcp_pz': momentum[2],
+                'mcp_m': mcp.getMass(),
+                'mcp_q': mcp.getCharge(),
                 'mcp_pdg': mcp_pdg[i_mcp],
-                'mcp_vertex_x': mcp_vertex_x[i_mcp],
-                'mcp_vertex_y': mcp_vertex_y[i_mcp],
-                'mcp_vertex_z': mcp_vertex_z[i_mcp],
-                'mcp_endpoint_x': mcp_endpoint_x[i_mcp],
-                'mcp_endpoint_y': mcp_endpoint_y[i_mcp],
-                'mcp_endpoint_z': mcp_endpoint_z[i_mcp],
+                'mcp_vertex_x': vertex[0],
+                'mcp_vertex_y': vertex[1],
+                'mcp_vertex_z': vertex[2],
+                'mcp_endpoint_x': endpoint[0],
+                'mcp_endpoint_y': endpoint[1],
+                'mcp_endpoint_z': endpoint[2],
             })
 
         # inspect tracking detectors
         for collection in COLLECTIONS:
 
             col = event.getCollection(collection)
+            codec = codec_from_collection(col, codec)
 
             for hit in col:
 
@@ -172,12 +225,17 @@ def convert_one_file(
                 if abs(mcp_pdg[i_mcp]) not in PARTICLES_OF_INTEREST:
                     continue
 
+                # query pyLCIO once per hit
+                position = hit.getPosition()
+                momentum = hit.getMomentum()
+                cellid0 = hit.getCellID0()
+
                 # hit/surface relations
                 if load_geometry:
-                    surf = _maps[collection].find(hit.getCellID0()).second
-                    pos = dd4hep.rec.Vector3D(hit.getPosition()[0] * MM_TO_CM,
-                                              hit.getPosition()[1] * MM_TO_CM,
-                                              hit.getPosition()[2] * MM_TO_CM)
+                    surf = _maps[collection].find(cellid0).second
+                    pos = dd4hep.rec.Vector3D(position[0] * MM_TO_CM,
+                                              position[1] * MM_TO_CM,
+                                              position[2] * MM_TO_CM)
                     inside_bounds = INSIDE_BOUNDS if surf.insideBounds(pos) else OUTSIDE_BOUNDS
                     distance = surf.distance(pos) * CM_TO_MM
                 else:
@@ -185,47 +243,42 @@ def convert_one_file(
                     distance = -1
 
                 # record the hit info
-                rows.append({
-                    'simhit': True,
-                    'file': os.path.basename(slcio_file_path),
+                simhits.append({
+                    'file': file_number,
                     'i_event': i_event,
-                    'simhit_x': hit.getPosition()[0],
-                    'simhit_y': hit.getPosition()[1],
-                    'simhit_z': hit.getPosition()[2],
-                    'simhit_px': hit.getMomentum()[0],
-                    'simhit_py': hit.getMomentum()[1],
-                    'simhit_pz': hit.getMomentum()[2],
+                    'i_mcp': i_mcp,
+                    'simhit_x': position[0],
+                    'simhit_y': position[1],
+                    'simhit_z': position[2],
+                    'simhit_px': momentum[0],
+                    'simhit_py': momentum[1],
+                    'simhit_pz': momentum[2],
                     'simhit_e': hit.getEDep(),
                     'simhit_t': hit.getTime(),
-                    'simhit_cellid0': hit.getCellID0(),
+                    'simhit_cellid0': cellid0,
                     'simhit_pathlength': hit.getPathLength(),
                     'simhit_inside_bounds': inside_bounds,
                     'simhit_distance': distance,
-                    'i_mcp': i_mcp,
-                    'mcp_px': mcp_px[i_mcp],
-                    'mcp_py': mcp_py[i_mcp],
-                    'mcp_pz': mcp_pz[i_mcp],
-                    'mcp_m': mcp_m[i_mcp],
-                    'mcp_q': mcp_q[i_mcp],
-                    'mcp_pdg': mcp_pdg[i_mcp],
-                    'mcp_vertex_x': mcp_vertex_x[i_mcp],
-                    'mcp_vertex_y': mcp_vertex_y[i_mcp],
-                    'mcp_vertex_z': mcp_vertex_z[i_mcp],
-                    'mcp_endpoint_x': mcp_endpoint_x[i_mcp],
-                    'mcp_endpoint_y': mcp_endpoint_y[i_mcp],
-                    'mcp_endpoint_z': mcp_endpoint_z[i_mcp],
                 })
 
     # Close the reader
     reader.close()
 
-    # Convert the list of hits to a pandas DataFrame and postprocess
-    df = pd.DataFrame(rows)
-    return postprocess_dataframe(df)
+    # Convert the lists to pandas DataFrames and postprocess
+    mcps = to_dataframe(mcps, MCP_DTYPES)
+    simhits = to_dataframe(simhits, SIMHIT_DTYPES)
+    return postprocess_mcps(mcps), postprocess_simhits(simhits, codec)
 
 
-def postprocess_dataframe(df: pd.DataFrame) -> pd.DataFrame:
-    # print("Postprocessing DataFrame ...")
+def to_dataframe(rows: list[dict], dtypes: dict) -> pd.DataFrame:
+    """DataFrame of the rows, or an empty one with the columns and dtypes of the table."""
+    if not rows:
+        return pd.DataFrame({col: pd.Series(dtype=dtype) for col, dtype in dtypes.items()})
+    return pd.DataFrame(rows)
+
+
+def postprocess_mcps(df: pd.DataFrame) -> pd.DataFrame:
+    # print("Postprocessing MCParticle DataFrame ...")
     df["mcp_p"] = np.sqrt(df["mcp_px"]**2 + df["mcp_py"]**2 + df["mcp_pz"]**2)
     df["mcp_pt"] = np.sqrt(df["mcp_px"]**2 + df["mcp_py"]**2)
     df["mcp_theta"] = np.arctan2(df["mcp_pt"], df["mcp_pz"])
@@ -234,14 +287,36 @@ def postprocess_dataframe(df: pd.DataFrame) -> pd.DataFrame:
     df["mcp_q_over_pt"] = df["mcp_q"] / df["mcp_pt"]
     df["mcp_vertex_r"] = np.sqrt(df["mcp_vertex_x"]**2 + df["mcp_vertex_y"]**2)
     df["mcp_endpoint_r"] = np.sqrt(df["mcp_endpoint_x"]**2 + df["mcp_endpoint_y"]**2)
+
+    # remove redundant columns
+    df.drop(columns=[
+        "mcp_px",
+        "mcp_py",
+        "mcp_theta",
+        "mcp_vertex_x",
+        "mcp_vertex_y",
+        "mcp_endpoint_x",
+        "mcp_endpoint_y",
+    ], inplace=True)
+
+    # downcast to save memory
+    df["file"] = df["file"].astype(np.uint32)
+    df["i_event"] = df["i_event"].astype(np.uint32)
+    df["i_mcp"] = df["i_mcp"].astype(np.uint32)
+    df["mcp_pdg"] = df["mcp_pdg"].astype(np.int32)
+
+    # sort columns alphabetically
+    return df[sorted(df.columns)]
+
+
+def postprocess_simhits(df: pd.DataFrame, codec=None) -> pd.DataFrame:
+    # print("Postprocessing simhit DataFrame ...")
     df["simhit_r"] = np.sqrt(df["simhit_x"]**2 + df["simhit_y"]**2)
     df["simhit_R"] = np.sqrt(df["simhit_x"]**2 + df["simhit_y"]**2 + df["simhit_z"]**2)
     df["simhit_t_corrected"] = df["simhit_t"] - (df["simhit_R"] / SPEED_OF_LIGHT)
-    df["simhit_system"] = np.right_shift(df["simhit_cellid0"], 0) & 0b1_1111
-    df["simhit_side"] = np.right_shift(df["simhit_cellid0"], 5) & 0b11
-    df["simhit_layer"] = np.right_shift(df["simhit_cellid0"], 7) & 0b11_1111
-    df["simhit_module"] = np.right_shift(df["simhit_cellid0"], 13) & 0b111_1111_1111
-    df["simhit_sensor"] = np.right_shift(df["simhit_cellid0"], 24) & 0b1111_1111
+    codec = codec or get_codec()
+    for name, values in codec.decode(df["simhit_cellid0"], fields=FIELDS, prefix="simhit_").items():
+        df[name] = values
     df["simhit_phi"] = np.arctan2(df["simhit_y"], df["simhit_x"])
     df["simhit_theta"] = np.maximum(np.arctan2(df["simhit_r"], df["simhit_z"]), EPSILON)
     df["simhit_eta"] = -np.log(np.tan(df["simhit_theta"] / 2))
@@ -253,13 +328,6 @@ def postprocess_dataframe(df: pd.DataFrame) -> pd.DataFrame:
 
     # remove redundant columns
     df.drop(columns=[
-        "mcp_px",
-        "mcp_py",
-        "mcp_theta",
-        "mcp_vertex_x",
-        "mcp_vertex_y",
-        "mcp_endpoint_x",
-        "mcp_endpoint_y",
         # "simhit_x",
         # "simhit_y",
         "simhit_R",
@@ -267,11 +335,24 @@ def postprocess_dataframe(df: pd.DataFrame) -> pd.DataFrame:
         # "simhit_cellid0",
     ], inplace=True)
 
+    # downcast to save memory
+    df["file"] = df["file"].astype(np.uint32)
+    df["i_event"] = df["i_event"].astype(np.uint32)
+    df["i_mcp"] = df["i_mcp"].astype(np.uint32)
+    df["simhit_inside_bounds"] = df["simhit_inside_bounds"].astype(np.uint8)
+    df["simhit_system"] = df["simhit_system"].astype(np.uint8)
+    df["simhit_side"] = df["simhit_side"].astype(np.uint8)
+    df["simhit_layer"] = df["simhit_layer"].astype(np.uint8)
+    df["simhit_layer_div_2"] = df["simhit_layer_div_2"].astype(np.uint8)
+    df["simhit_layer_mod_2"] = df["simhit_layer_mod_2"].astype(np.uint8)
+    df["simhit_module"] = df["simhit_module"].astype(np.uint16)
+    df["simhit_sensor"] = df["simhit_sensor"].astype(np.uint16)
+
     # sort columns alphabetically
     return df[sorted(df.columns)]
 
 
-def filter_dataframe(df: pd.DataFrame) -> pd.DataFrame:
+def filter_mcps(df: pd.DataFrame) -> pd.DataFrame:
     mask = (
         (abs(df["mcp_pdg"]).isin(PARTICLES_OF_INTEREST)) &
         (df["mcp_q"] != 0) &
@@ -282,19 +363,34 @@ def filter_dataframe(df: pd.DataFrame) -> pd.DataFrame:
         (np.abs(df["mcp_eta"]) < BARREL_TRACKER_MAX_ETA)
     )
     n_pass, n_total = mask.sum(), len(mask)
-    print(f"Keeping {n_pass} / {n_total} rows when filtering")
+    print(f"Keeping {n_pass} / {n_total} MCParticles when filtering")
     return df[mask].reset_index(drop=True)
 
 
-def sort_dataframe(df: pd.DataFrame) -> pd.DataFrame:
-    print("Sorting DataFrame ...")
-    columns = [
-        "file",
-        "i_event",
-        "i_mcp",
-        "simhit",
+def filter_simhits(simhits: pd.DataFrame, mcps: pd.DataFrame) -> pd.DataFrame:
+    # keep simhits whose MCParticle survived filter_mcps
+    keys = pd.MultiIndex.from_frame(mcps[MCP_KEYS])
+    mask = pd.MultiIndex.from_frame(simhits[MCP_KEYS]).isin(keys)
+    n_pass, n_total = mask.sum(), len(mask)
+    print(f"Keeping {n_pass} / {n_total} simhits when filtering")
+    return simhits[mask].reset_index(drop=True)
+
+
+def join_mcps(simhits: pd.DataFrame, mcps: pd.DataFrame) -> pd.DataFrame:
+    # attach the MCParticle columns to each simhit
+    cols = [col for col in mcps.columns if col.startswith("mcp_")]
+    return simhits.merge(mcps[MCP_KEYS + cols], on=MCP_KEYS, how="left")
+
+
+def sort_mcps(df: pd.DataFrame) -> pd.DataFrame:
+    print("Sorting MCParticle DataFrame ...")
+    return df.sort_values(by=MCP_KEYS).reset_index(drop=True)
+
+
+def sort_simhits(df: pd.DataFrame) -> pd.DataFrame:
+    print("Sorting simhit DataFrame ...")
+    columns = MCP_KEYS + [
         "simhit_system",
         "simhit_layer",
     ]
     return df.sort_values(by=columns).reset_index(drop=True)
-
@@ -1,4 +1,3 @@
-import pyLCIO
 import argparse
 import os
 import glob
@@ -9,6 +8,10 @@ from matplotlib.backends.backend_pdf import PdfPages
 from matplotlib import rcParams
 rcParams.update({'font.size': 16})
 
+from hitcache import HitCache
+from slcio_reader import add_reader_arguments, cache_from_options
+from slcio_tables import read_table
+
 
 TRACKERS = [
     # "VertexBarrelCollection",
@@ -24,6 +27,7 @@ def options():
     parser = argparse.ArgumentParser(usage=__doc__, formatter_class=argparse.ArgumentDefaultsHelpFormatter)
     parser.add_argument("-i", type=str, default="output_sim.slcio",
                         help="Path to the input slcio file")
+    add_reader_arguments(parser)
     return parser.parse_args()
 
 
@@ -32,7 +36,7 @@ def main():
     ops = options()
     fnames = get_inputs(ops.i)
 
-    hits = get_hits(fnames)
+    hits = get_hits(fnames, jobs=ops.jobs, cache=cache_from_options(ops))
     with pd.option_context("display.min_rows", 100,
                            "display.max_rows", 100,
                            ):
@@ -51,46 +55,14 @@ def get_inputs(fpath: str) -> list[str]:
     return inputs
 
 
-def get_hits(fnames: list[str]) -> pd.DataFrame:
-
-    hits = []
-
-    for fname in fnames:
-
-        print(f"Reading {fname} ...")
-        reader = pyLCIO.IOIMPL.LCFactory.getInstance().createLCReader()
-        reader.open(fname)
-    
-        for i_event, event in enumerate(reader):
-
-            print(f"Processing event {i_event}")
-            # event_of_interest = 1
-            # if i_event > event_of_interest:
-            #     break
-            # elif i_event < event_of_interest:
-            #     continue
-
-            # print(i_event, event.getCollectionNames())
-            for colname in TRACKERS:
-
-                col = event.getCollection(colname)
-
-                for i_hit, hit in enumerate(col):
-                    # if i_hit > 1e6:
-                    #     break
-
-                    hits.append( [
-                        i_event,
-                        hit.getPositionVec().X(),
-                        hit.getPositionVec().Y(),
-                        hit.getPositionVec().Z(),
-                        hit.getEDep(),
-                    ] )
+def get_hits(fnames: list[str], jobs: int = None, cache: HitCache = None) -> pd.DataFrame:
 
+    hits = read_table(fnames, "simhits", jobs=jobs, cache=cache, columns=["i_event", "collection", "x", "y", "z", "e"])
+    hits = hits[hits["collection"].isin(TRACKERS)]
+    hits = hits.drop(columns=["file", "collection"]).rename(columns={"i_event": "event"}).reset_index(drop=True)
     if len(hits) == 0:
         raise Exception("No hits found!")
 
-    hits = pd.DataFrame(np.array(hits), columns=["event", "x", "y", "z", "e"])
     hits["r"] = np.sqrt(hits["x"]**2 + hits["y"]**2)
 
     return hits
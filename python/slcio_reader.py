@@ -0,0 +1,174 @@
+"""
+Parallel reading of many slcio files into one DataFrame.
+
+Each file is converted by its own worker with a module-level function
+    read_one(file_path, **kwargs) -> pd.DataFrame, or a dict of table name -> pd.DataFrame
+and the per-file results are merged in file order, with a "file" column holding
+the index of the file. The output does not depend on the number of workers.
+
+Per-file results go through the shared HitCache, keyed by the file fingerprint and
+the reader name, version, and arguments. Once a file has been read, later runs of any
+script with the same reader only read the requested columns from Parquet.
+Converters which run their own pool (with the geometry loaded in the workers, or
+event ranges of a file) go through the same cache one file at a time with convert_cached,
+or with cache_entries, read_cached_tables and write_cached_tables if a file is split over tasks.
+
+Usage:
+    hits = read_slcio_files(file_paths, read_one, jobs=8, cache=HitCache(), columns=["x", "y"])
+    tables, paths = convert_cached(file_path, convert, cache, "my_converter", tables=["hits"], kwargs={"layers": [0, 1]})
+"""
+
+import multiprocessing as mp
+import pandas as pd
+import logging
+logger = logging.getLogger(__name__)
+
+from hitcache import HitCache, DEFAULT_CACHE_DIR, DEFAULT_BUDGET_GB, FINGERPRINTS
+
+
+def add_reader_arguments(parser):
+    """The -j/--jobs and cache options shared by the scripts which read slcio files."""
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="Number of processes for reading slcio files (None: all cores)")
+    add_cache_arguments(parser)
+
+
+def add_cache_arguments(parser, separator: str = "-"):
+    """The options of the shared hit cache. Scripts with --underscore_options use separator="_"."""
+    parser.add_argument(f"--cache{separator}dir", dest="cache_dir", default=DEFAULT_CACHE_DIR, help="Directory of the shared hit cache (env: MAIA_HIT_CACHE)")
+    parser.add_argument(f"--cache{separator}budget{separator}gb", dest="cache_budget_gb", type=float, default=DEFAULT_BUDGET_GB, help="Size of the hit cache before evicting least-recently-used entries")
+    parser.add_argument(f"--cache{separator}fingerprint", dest="cache_fingerprint", default="stat", choices=FINGERPRINTS, help="Identify slcio files by (path, size, mtime) or by content hash")
+    parser.add_argument(f"--no{separator}cache", dest="no_cache", action="store_true", help="Always re-read slcio files, and do not write caches")
+
+
+def cache_from_options(ops) -> HitCache | None:
+    if ops.no_cache:
+        return None
+    return HitCache(ops.cache_dir, budget_gb=ops.cache_budget_gb, fingerprint=ops.cache_fingerprint)
+
+
+def read_slcio_files(
+        file_paths: list[str],
+        read_one,
+        jobs: int = None,
+        cache: HitCache = None,
+        version: int = 0,
+        table: str = None,
+        columns: list[str] = None,
+        **kwargs,
+    ) -> pd.DataFrame:
+    """
+    Convert every file with read_one in a pool of workers, and concatenate the results in file order.
+    If read_one returns several tables, all of them are cached, and `table` selects the one to return.
+    kwargs are passed to read_one, and are part of the cache key.
+    """
+    if len(file_paths) == 0:
+        raise ValueError("No slcio files to read")
+    tasks = [(file_path, i_file, read_one, cache, version, table, columns, kwargs)
+             for i_file, file_path in enumerate(file_paths)]
+    processes = n_processes(jobs, len(tasks))
+    logger.info(f"Reading {len(tasks)} slcio files with {processes} processes ...")
+    if processes == 1:
+        results = [read_cached(*task) for task in tasks]
+    else:
+        with mp.Pool(processes=processes) as pool:
+            results = pool.starmap(read_cached, tasks)
+    if cache is not None:
+        cache.evict(keep={path for _, paths in results for path in paths})
+    logger.info("Merging per-file dataframes ...")
+    return pd.concat([df for df, _ in results], ignore_index=True)
+
+
+def n_processes(jobs: int, n_tasks: int) -> int:
+    if jobs is None or jobs <= 0:
+        jobs = mp.cpu_count()
+    return max(1, min(jobs, n_tasks))
+
+
+def read_cached(
+        file_path: str,
+        i_file: int,
+        read_one,
+        cache: HitCache,
+        version: int,
+        table: str,
+        columns: list[str],
+        kwargs: dict,
+    ) -> tuple[pd.DataFrame, list[str]]:
+    """The table of one file, and the cache entries it read or wrote"""
+    fingerprint = cache.file_fingerprint(file_path) if cache is not None else None
+
+    def entry(name):
+        return cache.entry(file_path, read_one.__name__, version=version, table=name, kwargs=kwargs, fingerprint=fingerprint)
+
+    paths = []
+    if cache is not None and cache.has(path := entry(table)):
+        logger.info(f"Reading cached {path} for {file_path} ...")
+        df = cache.read(path, columns=columns)
+        paths.append(path)
+    else:
+        result = read_one(file_path, **kwargs)
+        tables = result if isinstance(result, dict) else {None: result}
+        if cache is not None:
+            for name, table_df in tables.items():
+                paths.append(entry(name))
+                cache.write(paths[-1], table_df)
+        df = tables[table]
+        if columns is not None:
+            df = df[columns]
+    df.insert(0, "file", i_file)
+    return df, paths
+
+
+def convert_cached(
+        file_path: str,
+        convert,
+        cache: HitCache,
+        extractor: str,
+        version: int = 0,
+        tables: list[str] = None,
+        kwargs: dict = None,
+        file=None,
+    ) -> tuple[dict[str, pd.DataFrame] | None, list[str]]:
+    """
+    The tables of one file from the cache, or else from convert(), which are then cached, and the cache entries.
+    convert() returns a dict of table name -> pd.DataFrame, or None, which is not cached.
+    kwargs are the settings which change the output of convert (geometry, codec, collections, ...),
+    and are part of the cache key.
+    """
+    if cache is None:
+        return convert(), []
+    paths = cache_entries(cache, file_path, extractor, version, tables, kwargs)
+    if (result := read_cached_tables(cache, paths, file=file)) is not None:
+        logger.info(f"Reading cached {extractor} tables for {file_path} ...")
+        return result, list(paths.values())
+    result = convert()
+    if result is None:
+        return None, []
+    write_cached_tables(cache, paths, result)
+    return result, list(paths.values())
+
+
+def cache_entries(cache: HitCache, file_path: str, extractor: str, version: int, tables: list[str], kwargs: dict) -> dict[str, str]:
+    """Cache entry of each table of one file"""
+    fingerprint = cache.file_fingerprint(file_path)
+    return {table: cache.entry(file_path, extractor, version=version, table=table, kwargs=kwargs, fingerprint=fingerprint)
+            for table in tables}
+
+
+def read_cached_tables(cache: HitCache, paths: dict[str, str], file=None) -> dict[str, pd.DataFrame] | None:
+    """
+    The cached tables, or None unless all of them are cached. If file is given, it replaces
+    the "file" column of the tables, so one entry serves any file list.
+    """
+    if not all(cache.has(path) for path in paths.values()):
+        return None
+    result = {table: cache.read(path) for table, path in paths.items()}
+    for df in result.values():
+        if file is not None and "file" in df:
+            df["file"] = pd.Series(file, index=df.index, dtype=df["file"].dtype)
+    return result
+
+
+def write_cached_tables(cache: HitCache, paths: dict[str, str], tables: dict[str, pd.DataFrame]):
+    for table, path in paths.items():
+        cache.write(path, tables[table])
@@ -0,0 +1,219 @@
+"""
+Canonical columnar extraction of one slcio file.
+
+One pass over the file produces three tables, which are cached together in the shared HitCache:
+  mcparticles: one row per MCParticle, keyed by (i_event, i_mcp)
+  simhits: one row per tracker sim hit, referencing its MCParticle by i_mcp
+  digihits: one row per tracker digi hit, referencing its first related sim hit by
+            i_simhit, the row of the sim hit in the simhits table of the same file
+Missing references are -1. Hit tables keep the CellIDEncoding of their collection,
+so decode_cellids works for any geometry. Scripts request projections of these tables
+instead of re-reading slcio with their own converters.
+
+Usage:
+    simhits = read_table(file_paths, "simhits", columns=["i_event", "x", "y", "z"], cache=HitCache())
+"""
+
+import numpy as np
+import pandas as pd
+import warnings
+import logging
+logger = logging.getLogger(__name__)
+
+try:
+    import pyLCIO
+except ImportError:
+    warnings.warn("pyLCIO not found")
+
+from cellid import DEFAULT_CODEC, FIELDS, get_codec
+from slcio_reader import read_slcio_files
+
+EXTRACTOR_VERSION = 1
+TABLES = ["mcparticles", "simhits", "digihits"]
+MCPARTICLE = "MCParticle"
+SIM_COLLECTIONS = [
+    "VertexBarrelCollection",
+    "VertexEndcapCollection",
+    "InnerTrackerBarrelCollection",
+    "InnerTrackerEndcapCollection",
+    "OuterTrackerBarrelCollection",
+    "OuterTrackerEndcapCollection",
+]
+DIGI_COLLECTIONS = [
+    "VBTrackerHits",
+    "VETrackerHits",
+    "IBTrackerHits",
+    "IETrackerHits",
+    "OBTrackerHits",
+    "OETrackerHits",
+]
+DIGI_RELATIONS = [f"{collection}Relations" for collection in DIGI_COLLECTIONS]
+
+
+def read_table(
+        file_paths: list[str],
+        table: str,
+        columns: list[str] = None,
+        jobs: int = None,
+        cache=None,
+    ) -> pd.DataFrame:
+    """One canonical table of many files, with a "file" column holding the index of the file."""
+    if table not in TABLES:
+        raise ValueError(f"Unknown table: {table}. Choose from {TABLES}")
+    return read_slcio_files(file_paths, extract_tables, jobs=jobs, cache=cache,
+                            version=EXTRACTOR_VERSION, table=table, columns=columns)
+
+
+def extract_tables(file_path: str) -> dict[str, pd.DataFrame]:
+    logger.info(f"Extracting tables from {file_path} ...")
+    mcparticles, simhits, digihits = [], [], []
+    n_simhits = 0
+
+    reader = pyLCIO.IOIMPL.LCFactory.getInstance().createLCReader()
+    reader.open(file_path)
+
+    for i_event, event in enumerate(reader):
+
+        names = set(event.getCollectionNames())
+
+        mcp_index = {}
+        if MCPARTICLE in names:
+            mcps = list(event.getCollection(MCPARTICLE))
+            mcp_index = {mcp.id(): i_mcp for i_mcp, mcp in enumerate(mcps)}
+            mcparticles.append(mcparticle_frame(i_event, mcps, mcp_index))
+
+        simhit_index = {}
+        for collection in SIM_COLLECTIONS:
+            if collection not in names:
+                continue
+            col = event.getCollection(collection)
+            hits = list(col)
+            frame = simhit_frame(i_event, collection, hits, mcp_index, encoding(col))
+            simhit_index.update({hit.id(): n_simhits + i_hit for i_hit, hit in enumerate(hits)})
+            n_simhits += len(hits)
+            simhits.append(frame)
+
+        for collection, relation in zip(DIGI_COLLECTIONS, DIGI_RELATIONS):
+            if collection not in names:
+                continue
+            col = event.getCollection(collection)
+            hits = list(col)
+            related = {}
+            if relation in names:
+                for link in reversed(list(event.getCollection(relation))):
+                    if link.getTo():
+                        related[link.getFrom().id()] = simhit_index.get(link.getTo().id(), -1)
+            i_simhit = [related.get(hit.id(), -1) for hit in hits]
+            digihits.append(digihit_frame(i_event, collection, hits, i_simhit, encoding(col)))
+
+    reader.close()
+
+    return {
+        "mcparticles": concat(mcparticles, mcparticle_frame(0, [], {})),
+        "simhits": concat(simhits, simhit_frame(0, "", [], {}, "")),
+        "digihits": concat(digihits, digihit_frame(0, "", [], [], "")),
+    }
+
+
+def decode_cellids(df: pd.DataFrame, fields: list[str] = FIELDS, prefix: str = "") -> pd.DataFrame:
+    """Add the decoded CellID fields of a hit table, using the encoding of each row."""
+    decoded = {f"{prefix}{field}": np.zeros(len(df), dtype=np.int64) for field in fields}
+    cellids = df["cellid0"].to_numpy()
+    for enc, index in df.groupby("cellid_encoding", observed=True).indices.items():
+        for name, values in get_codec(encoding=enc).decode(cellids[index], fields=fields, prefix=prefix).items():
+            decoded[name][index] = values
+    for name, values in decoded.items():
+        df[name] = values
+    return df
+
+
+def encoding(collection) -> str:
+    return collection.getParameters().getStringVal("CellIDEncoding") or DEFAULT_CODEC.encoding
+
+
+def concat(frames: list[pd.DataFrame], empty: pd.DataFrame) -> pd.DataFrame:
+    return pd.concat(frames, ignore_index=True) if frames else empty
+
+
+def vectors(values, n: int) -> np.ndarray:
+    """(n, 3) array from 3-vector getters like getPosition()."""
+    return np.fromiter((v for value in values for v in tuple(value)[:3]), dtype=np.float64, count=3 * n).reshape(n, 3)
+
+
+def scalars(values, dtype=np.float64) -> np.ndarray:
+    return np.array(list(values), dtype=dtype)
+
+
+def mcparticle_frame(i_event: int, mcps: list, mcp_index: dict) -> pd.DataFrame:
+    n = len(mcps)
+    vertex = vectors((mcp.getVertex() for mcp in mcps), n)
+    endpoint = vectors((mcp.getEndpoint() for mcp in mcps), n)
+    momentum = vectors((mcp.getMomentum() for mcp in mcps), n)
+    parents = [mcp.getParents() for mcp in mcps]
+    return pd.DataFrame({
+        "i_event": np.full(n, i_event, dtype=np.int32),
+        "i_mcp": np.arange(n, dtype=np.int32),
+        "pdg": scalars((mcp.getPDG() for mcp in mcps), np.int32),
+        "generator_status": scalars((mcp.getGeneratorStatus() for mcp in mcps), np.int16),
+        "simulator_status": scalars((mcp.getSimulatorStatus() for mcp in mcps), np.int32),
+        "charge": scalars((mcp.getCharge() for mcp in mcps), np.float32),
+        "mass": scalars(mcp.getMass() for mcp in mcps),
+        "energy": scalars(mcp.getEnergy() for mcp in mcps),
+        "time": scalars(mcp.getTime() for mcp in mcps),
+        "vx": vertex[:, 0],
+        "vy": vertex[:, 1],
+        "vz": vertex[:, 2],
+        "ex": endpoint[:, 0],
+        "ey": endpoint[:, 1],
+        "ez": endpoint[:, 2],
+        "px": momentum[:, 0],
+        "py": momentum[:, 1],
+        "pz": momentum[:, 2],
+        "i_parent": scalars((mcp_index.get(p[0].id(), -1) if len(p) else -1 for p in parents), np.int32),
+        "n_parents": scalars((len(p) for p in parents), np.int32),
+        "n_daughters": scalars((len(mcp.getDaughters()) for mcp in mcps), np.int32),
+    })
+
+
+def simhit_frame(i_event: int, collection: str, hits: list, mcp_index: dict, cellid_encoding: str) -> pd.DataFrame:
+    n = len(hits)
+    position = vectors((hit.getPosition() for hit in hits), n)
+    momentum = vectors((hit.getMomentum() for hit in hits), n)
+    mcps = [hit.getMCParticle() for hit in hits]
+    return pd.DataFrame({
+        "i_event": np.full(n, i_event, dtype=np.int32),
+        "collection": pd.Categorical([collection] * n, categories=SIM_COLLECTIONS),
+        "i_hit": np.arange(n, dtype=np.int32),
+        "cellid0": scalars((hit.getCellID0() for hit in hits), np.int64),
+        "cellid_encoding": pd.Categorical([cellid_encoding] * n),
+        "x": position[:, 0],
+        "y": position[:, 1],
+        "z": position[:, 2],
+        "t": scalars(hit.getTime() for hit in hits),
+        "e": scalars(hit.getEDep() for hit in hits),
+        "path_length": scalars(hit.getPathLength() for hit in hits),
+        "px": momentum[:, 0],
+        "py": momentum[:, 1],
+        "pz": momentum[:, 2],
+        "quality": scalars((hit.getQuality() for hit in hits), np.int32),
+        "i_mcp": scalars((mcp_index.get(mcp.id(), -1) if mcp else -1 for mcp in mcps), np.int32),
+    })
+
+
+def digihit_frame(i_event: int, collection: str, hits: list, i_simhit: list[int], cellid_encoding: str) -> pd.DataFrame:
+    n = len(hits)
+    position = vectors((hit.getPosition() for hit in hits), n)
+    return pd.DataFrame({
+        "i_event": np.full(n, i_event, dtype=np.int32),
+        "collection": pd.Categorical([collection] * n, categories=DIGI_COLLECTIONS),
+        "i_hit": np.arange(n, dtype=np.int32),
+        "cellid0": scalars((hit.getCellID0() for hit in hits), np.int64),
+        "cellid_encoding": pd.Categorical([cellid_encoding] * n),
+        "x": position[:, 0],
+        "y": position[:, 1],
+        "z": position[:, 2],
+        "t": scalars(hit.getTime() for hit in hits),
+        "e": scalars(hit.getEDep() for hit in hits),
+        "quality": scalars((hit.getQuality() for hit in hits), np.int32),
+        "i_simhit": scalars(i_simhit, np.int64),
+    })
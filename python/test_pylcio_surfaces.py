@@ -12,6 +12,7 @@ import matplotlib.pyplot as plt
 from matplotlib.backends.backend_pdf import PdfPages
 from matplotlib import colors
 from matplotlib import rcParams
+from cellid import FIELDS, codec_from_collection, get_codec
 rcParams.update({
     "font.size": 16,
     "figure.figsize": (8, 8),
@@ -42,8 +43,8 @@ EPSILON = 1e-4
 
 
 def main():
-    df = slcio_df()
-    df = post_process(df)
+    df, codec = slcio_df()
+    df = post_process(df, codec)
     plot(df)
 
 
@@ -61,6 +62,7 @@ def slcio_df():
     hits = []
     total_hits = 0
     inside, outside = 0, 0
+    codec = get_codec()
 
     reader = pyLCIO.IOIMPL.LCFactory.getInstance().createLCReader()
     reader.open(SLCIO)
@@ -75,6 +77,7 @@ def slcio_df():
                 print(name)
 
         collection = event.getCollection(COLLECTION)
+        codec = codec_from_collection(collection, codec)
         mcps = [mcp for mcp in event.getCollection(MCPARTICLE)]
         print(f"Collection: {COLLECTION}, Number of elements: {len(collection)}")
         total_hits += len(collection)
@@ -242,18 +245,15 @@ def slcio_df():
 
     # create dataframe
     print("Creating dataframe ...")
-    return pd.DataFrame(hits)
+    return pd.DataFrame(hits), codec
 
 
-def post_process(df):
+def post_process(df, codec):
 
     # add some columns
     print("Adding columns to dataframe ...")
-    df["system"] = np.right_shift(df["cellid0"], 0) & 0b1_1111
-    df["side"] = np.right_shift(df["cellid0"], 5) & 0b11
-    df["layer"] = np.right_shift(df["cellid0"], 7) & 0b11_1111
-    df["module"] = np.right_shift(df["cellid0"], 13) & 0b111_1111_1111
-    df["sensor"] = np.right_shift(df["cellid0"], 24) & 0b1111_1111
+    for name, values in codec.decode(df["cellid0"], fields=FIELDS).items():
+        df[name] = values
     df["mc_pt"] = np.sqrt(df["mc_px"]**2 + df["mc_py"]**2)
 
     # sort dataframe
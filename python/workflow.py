@@ -0,0 +1,228 @@
+"""
+A small make-like workflow engine for chains of shell commands.
+
+A Task is a shell command with the files it reads and writes. A task is skipped
+when all its outputs exist and are newer than all its inputs, so settings which
+should trigger a rerun are written to stamp files with write_if_changed and
+listed as inputs. Tasks of independent chains run concurrently, as long as the
+sum of their requested CPUs and memory fits on the node.
+
+The same chains can be submitted to Condor instead, with write_condor_submit.
+
+Usage:
+    gen = Task("gen_0", "python gen.py -o gen_0.slcio", inputs=[], outputs=["gen_0.slcio"])
+    sim = Task("sim_0", "ddsim ...", inputs=["gen_0.slcio"], outputs=["sim_0.slcio"], deps=[gen], memory_gb=3)
+    Scheduler(cpus=8, memory_gb=16).run([gen, sim])
+"""
+
+import math
+import os
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from pathlib import Path
+import logging
+logger = logging.getLogger(__name__)
+
+GB = 1024**3
+SINGULARITY_IMAGE = "/cvmfs/unpacked.cern.ch/ghcr.io/muoncollidersoft/mucoll-sim-alma9:v2.9.8-amd64"
+DESIRED_SITES = "T2_US_UCSD"
+
+# task states
+PENDING = "pending"
+SKIPPED = "skipped"
+DONE = "done"
+FAILED = "failed"
+
+
+class Task:
+
+    def __init__(
+            self,
+            name: str,
+            cmd: str,
+            inputs: list[str],
+            outputs: list[str],
+            deps: list["Task"] = None,
+            cpus: int = 1,
+            memory_gb: float = 1.0,
+        ):
+        self.name = name
+        self.cmd = cmd
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.deps = list(deps or [])
+        self.cpus = cpus
+        self.memory_gb = memory_gb
+        self.state = PENDING
+
+
+    def __repr__(self):
+        return f"Task({self.name}, {self.state})"
+
+
+    def is_up_to_date(self) -> bool:
+        """All outputs exist, and the oldest output is newer than the newest input."""
+        if not self.outputs or not all(os.path.exists(path) for path in self.outputs):
+            return False
+        if not all(os.path.exists(path) for path in self.inputs):
+            return False
+        oldest_output = min(os.path.getmtime(path) for path in self.outputs)
+        newest_input = max((os.path.getmtime(path) for path in self.inputs), default=-float("inf"))
+        return oldest_output >= newest_input
+
+
+    def remove_outputs(self):
+        for path in self.outputs:
+            if os.path.exists(path):
+                os.remove(path)
+
+
+class Scheduler:
+    """
+    Runs tasks once their dependencies are done, within a budget of CPUs and memory.
+    A task which is larger than the whole budget runs alone.
+    """
+
+    def __init__(self, cpus: int = None, memory_gb: float = None, force: bool = False, dry_run: bool = False):
+        self.cpus = cpus or os.cpu_count()
+        self.memory_gb = memory_gb or total_memory_gb()
+        self.force = force
+        self.dry_run = dry_run
+
+
+    def run(self, tasks: list[Task]) -> bool:
+        """Run the tasks, in order of the list where possible. Returns whether all of them succeeded."""
+        pending = list(tasks)
+        for task in tasks:
+            if any(dep not in tasks for dep in task.deps):
+                raise ValueError(f"Dependencies of {task.name} are not in the list of tasks")
+        running = {}
+        free_cpus, free_memory = self.cpus, self.memory_gb
+        logger.info(f"Running {len(tasks)} tasks with {self.cpus} CPUs and {self.memory_gb:.1f} GB")
+        with ThreadPoolExecutor(max_workers=max(len(tasks), 1)) as pool:
+            while pending or running:
+                for task in list(pending):
+                    if any(dep.state == FAILED for dep in task.deps):
+                        logger.warning(f"Not running {task.name}: a dependency failed")
+                        task.state = FAILED
+                        pending.remove(task)
+                        continue
+                    if any(dep.state == PENDING for dep in task.deps):
+                        continue
+                    if not self.is_stale(task):
+                        logger.info(f"Skipping {task.name}: up to date")
+                        task.state = SKIPPED
+                        pending.remove(task)
+                        continue
+                    fits = task.cpus <= free_cpus and task.memory_gb <= free_memory
+                    if not fits and running:
+                        continue
+                    pending.remove(task)
+                    if self.dry_run:
+                        logger.info(f"Would run {task.name}: {task.cmd}")
+                        task.state = DONE
+                        continue
+                    free_cpus -= task.cpus
+                    free_memory -= task.memory_gb
+                    running[pool.submit(execute, task)] = task
+
+                if not running:
+                    continue
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    task = running.pop(future)
+                    free_cpus += task.cpus
+                    free_memory += task.memory_gb
+                    task.state = DONE if future.result() == 0 else FAILED
+
+        failed = [task.name for task in tasks if task.state == FAILED]
+        if failed:
+            logger.error(f"Failed tasks: {failed}")
+        return not failed
+
+
+    def is_stale(self, task: Task) -> bool:
+        if self.force:
+            return True
+        # in a dry run, nothing is written, so a rerun upstream has to be propagated by hand
+        if self.dry_run and any(dep.state == DONE for dep in task.deps):
+            return True
+        return not task.is_up_to_date()
+
+
+def execute(task: Task) -> int:
+    """Run the command of a task, and remove its outputs if it fails, so a rerun does not skip it."""
+    logger.info(f"Running {task.name}: {task.cmd}")
+    start = time.time()
+    returncode = subprocess.run(task.cmd, shell=True).returncode
+    if returncode != 0 or not all(os.path.exists(path) for path in task.outputs):
+        logger.error(f"Task {task.name} failed with return code {returncode} after {time.time() - start:.0f}s")
+        task.remove_outputs()
+        return returncode or 1
+    logger.info(f"Task {task.name} finished after {time.time() - start:.0f}s")
+    return 0
+
+
+def write_if_changed(path: str, text: str) -> bool:
+    """Write a file only if its content changes, so that its mtime tracks its content."""
+    local_path = Path(path)
+    if local_path.is_file() and local_path.read_text() == text:
+        return False
+    local_path.write_text(text)
+    return True
+
+
+def total_memory_gb() -> float:
+    return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") / GB
+
+
+def write_condor_submit(
+        path: str,
+        executable: str,
+        nums: list[int],
+        cpus: int,
+        memory_gb: float,
+        disk_gb: float = 5,
+        pack: int = 1,
+        image: str = SINGULARITY_IMAGE,
+        sites: str = DESIRED_SITES,
+    ) -> tuple[str, str]:
+    """
+    Condor submit file like the files in condor/, and the list of indices it queues.
+    With pack > 1, each Condor job gets `pack` indices as arguments, and the CPUs and
+    memory of its slot in MAIA_CPUS and MAIA_MEMORY_GB, which digitize_muons.py uses
+    as the budget of its scheduler. Returns the paths of both files.
+    """
+    name = Path(path).stem
+    queue = Path(path).with_suffix(".txt")
+    memory_mb = int(round(memory_gb * 1024))
+    if pack > 1:
+        job, arguments, items = "JOB", "$(FILENUMS)", "JOB, FILENUMS"
+        environment = f'environment = "MAIA_CPUS={cpus} MAIA_MEMORY_GB={memory_mb / 1024:g}"\n'
+        lines = [f"{i_job}, {' '.join(str(num) for num in nums[lo:lo + pack])}\n"
+                 for i_job, lo in enumerate(range(0, len(nums), pack))]
+    else:
+        job, arguments, items, environment = "FILENUM", "$(FILENUM)", "FILENUM", ""
+        lines = [f"{num}\n" for num in nums]
+    text = f"""# container
++SingularityImage = "{image}"
+
+executable = {executable}
+arguments  = {arguments}
+{environment}output     = logs/{name}_$({job}).$(ClusterId).$(ProcId).out
+error      = logs/{name}_$({job}).$(ClusterId).$(ProcId).err
+log        = logs/condor.$(ClusterId).$(ProcId).log
+
+# resources
+request_cpus   = {cpus}
+request_memory = {memory_mb}MB
+request_disk   = {int(math.ceil(disk_gb))}GB
++DESIRED_Sites = "{sites}"
+
+# launch
+queue {items} from {queue.name}
+"""
+    write_if_changed(path, text)
+    write_if_changed(str(queue), "".join(lines))
+    return str(path), str(queue)
@@ -2,11 +2,20 @@ import argparse
 from array import array
 import os
 from typing import TextIO
+import numpy as np
 
 import ROOT
 TGEOMANAGER_NAME = "default"
 WORLD = "world_volume_1"
 
+# local (x, y) of the sensor corners, in units of the half-lengths
+LOCAL_CORNERS = np.array([
+    [ 1,  1, 0],
+    [ 1, -1, 0],
+    [-1,  1, 0],
+    [-1, -1, 0],
+], dtype=np.float64)
+
 def options():
     parser = argparse.ArgumentParser(usage=__doc__, formatter_class=argparse.ArgumentDefaultsHelpFormatter)
     parser.add_argument("-i", type=str, default="MAIA_LST_v0.root",
@@ -36,6 +45,7 @@ def write_module_id_and_corners(fname: str, output: TextIO) -> None:
 
     world_volume = geo.GetTopNode()
     print("World volume:", world_volume.GetName())
+    world_matrix = child_matrix(ROOT.TGeoHMatrix(), world_volume)
 
     detectors = world_volume.GetNdaughters()
     for i_detector in range(detectors):
@@ -44,6 +54,7 @@ def write_module_id_and_corners(fname: str, output: TextIO) -> None:
         print(f"Detector {i_detector}/{detectors-1}: {detector_name}")
         if not any(trk in detector_name for trk in TRACKERS):
             continue
+        detector_matrix = child_matrix(world_matrix, detector)
 
         assemblies = detector.GetNdaughters()
         for i_assembly in range(assemblies):
@@ -52,6 +63,7 @@ def write_module_id_and_corners(fname: str, output: TextIO) -> None:
             print(f" Assembly {i_assembly}/{assemblies-1}: {assembly_name}")
             if not any(assem in assembly_name for assem in [ITB, OTB]):
                 continue
+            assembly_matrix = child_matrix(detector_matrix, assembly)
 
             layers = assembly.GetNdaughters()
             for i_layer in range(layers):
@@ -60,6 +72,7 @@ def write_module_id_and_corners(fname: str, output: TextIO) -> None:
                 layer = assembly.GetDaughter(i_layer)
                 layer_name = layer.GetName()
                 print(f"  Layer {i_layer}/{layers-1}: {layer_name}")
+                layer_matrix = child_matrix(assembly_matrix, layer)
 
                 modules = layer.GetNdaughters()
                 for i_module in range(modules):
@@ -68,6 +81,7 @@ def write_module_id_and_corners(fname: str, output: TextIO) -> None:
                     module_id = int(module_name.split("_")[-1])
                     if i_module != module_id:
                         raise Exception(f"Module id mismatch: {i_module} vs {module_id}")
+                    module_matrix = child_matrix(layer_matrix, module)
 
                     # # get the volume and shape
                     # vol = module.GetVolume()
@@ -106,32 +120,14 @@ def write_module_id_and_corners(fname: str, output: TextIO) -> None:
                             continue
                         # print(f"    Sensor {i_sensor}/{sensors-1}: {sensor.GetName()}")
 
-#    sensor_path = "world_volume_1/OuterTrackers_9/OuterTrackerBarrel_assembly_0/layer0_0/OuterTrackerBarrelModule_In_2/sensor8_8"
-
-
-                        sensor_path = f"{WORLD}/{detector_name}/{assembly_name}/{layer_name}/{module_name}/{sensor_name}"
-                        # print(sensor_path)
-                        assert geo.CheckPath(sensor_path)
-                        assert geo.cd(sensor_path)
-
+                        # global placement from the matrices of the parents,
+                        # instead of navigating to every sensor with geo.cd
                         vol = sensor.GetVolume()
                         shape = vol.GetShape()
                         if shape.ClassName() != "TGeoBBox":
                             raise Exception(f"Unexpected shape class: {shape.ClassName()} in {sensor_name}")
                         dx, dy = shape.GetDX(), shape.GetDY()
-                        local_corners = [
-                            array("d", [ dx,  dy, 0]),
-                            array("d", [ dx, -dy, 0]),
-                            array("d", [-dx,  dy, 0]),
-                            array("d", [-dx, -dy, 0]),
-                        ]
-
-                        # get global corners
-                        global_corners = []
-                        for local in local_corners:
-                            globl = array("d", [0.0, 0.0, 0.0])
-                            geo.LocalToMaster(local, globl)
-                            global_corners.append(globl)
+                        global_corners = local_to_master(child_matrix(module_matrix, sensor), LOCAL_CORNERS * [dx, dy, 0])
 
                         # write to output
                         line = f"{assembly_name} {layer_name} {module_id:>6}"
@@ -151,6 +147,22 @@ def write_module_id_and_corners(fname: str, output: TextIO) -> None:
                     # print("    Global center (x, y, z):", globl[0], globl[1], globl[2])
 
 
+def child_matrix(parent, node):
+    """Global matrix of a node, from the global matrix of its parent."""
+    matrix = ROOT.TGeoHMatrix(parent)
+    matrix.Multiply(node.GetMatrix())
+    return matrix
+
+
+def local_to_master(matrix, points: np.ndarray) -> np.ndarray:
+    """Vectorized matrix.LocalToMaster for (n, 3) points."""
+    rotation = matrix.GetRotationMatrix()
+    translation = matrix.GetTranslation()
+    rotation = np.array([rotation[i] for i in range(9)]).reshape(3, 3)
+    translation = np.array([translation[i] for i in range(3)])
+    return points @ rotation.T + translation
+
+
 def old():
 
     sensor_path = "world_volume_1/OuterTrackers_9/OuterTrackerBarrel_assembly_0"
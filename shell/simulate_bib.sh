@@ -22,12 +22,39 @@ echo "CODE=${CODE}"
 echo "DATAMUC=${DATAMUC}"
 echo "COMPACT=${COMPACT}"
 
+# optional pre-filter of FLUKA particles which cannot reach the downstream time window
+# e.g. PREFILTER=1 PREFILTER_ARGS="--max-time 3.0 --min-energy 1e-4"
+FLUKA=${DATAMUC}/FLUKA/summary${1}_DET_IP.dat
+PREFILTER=${PREFILTER:-0}
+PREFILTER_ARGS=${PREFILTER_ARGS:-}
+
 # env
 # it would be cool if setup_mucoll existed out-of-the-box
 # setup_mucoll
 source /opt/spack/opt/spack/__spack_path_placeholder__/__spack_path_placeholder__/__spack_path_placeholder__/__spack_path_placeholder__/linux-x86_64/mucoll-stack-master-2wtmg3ohr26uckseodhqjfjaw7mijwil/setup.sh
 export MARLIN_DLL=$(readlink -e ${CODE}/MyBIBUtils/build/lib/libMyBIBUtils.so):${MARLIN_DLL}
 
+if (( PREFILTER == 1 )); then
+    # fluka_remix.py cannot apply shard weights, so prescaled shards would be simulated unweighted
+    if [[ " ${PREFILTER_ARGS} " == *" --prescale"* ]]; then
+        echo "PREFILTER_ARGS must not contain --prescale: fluka_remix.py ignores shard weights" >&2
+        exit 1
+    fi
+    time python3 ${CODE}/maia_noodling/python/sample_bib.py -i ${FLUKA} -o prefilter_${1} --shard-size 0 ${PREFILTER_ARGS}
+    cp prefilter_${1}/manifest.json prefilter_manifest_${1}.json
+    shopt -s nullglob
+    SHARDS=(prefilter_${1}/shard_[0-9]*.dat)
+    shopt -u nullglob
+    if (( ${#SHARDS[@]} == 0 )); then
+        echo "No pre-filtered shards in prefilter_${1}: no particles of ${FLUKA} passed the pre-filter" >&2
+        exit 1
+    fi
+    # shards are fixed-size FLUKA records, so they concatenate into one input
+    FLUKA=prefilter_${1}/prefiltered.dat
+    cat "${SHARDS[@]}" > ${FLUKA}
+    echo "Pre-filtered FLUKA input: ${FLUKA} from ${#SHARDS[@]} shards"
+fi
+
 # process
 for INVERT_Z in 0 1; do
 
@@ -40,7 +67,7 @@ for INVERT_Z in 0 1; do
     echo "Processing ${1} with INVERT_Z=${INVERT_Z} -> LABEL=${LABEL}"
 
     BIBINPUT=bibinput_${1}.slcio
-    time python3 ${CODE}/detector-simulation/utils/fluka_remix.py -i ${INVERT_Z} -n ${TWO} ${DATAMUC}/FLUKA/summary${1}_DET_IP.dat ${BIBINPUT}
+    time python3 ${CODE}/detector-simulation/utils/fluka_remix.py -i ${INVERT_Z} -n ${TWO} ${FLUKA} ${BIBINPUT}
 
     cp ${CODE}/SteeringMacros/Sim/sim_steer_BIB_CONDOR.py ./sim_EVENT.py
     sed -i 's/OUTFILENAME/"BIB_sim.slcio"/g' sim_EVENT.py
@@ -50,3 +77,4 @@ for INVERT_Z in 0 1; do
     mv -f BIB_sim.slcio ${LABEL}_BIB_sim_${1}.slcio
 
 done
+rm -rf prefilter_${1}